@@ -0,0 +1,176 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Tuple
+
+import httpx
+from anthropic import AsyncAnthropic
+from google import genai
+from openai import AsyncOpenAI
+
+from config import (
+    ANTHROPIC_API_KEY,
+    CLIENT_POOL_IDLE_SECONDS,
+    CLIENT_POOL_MAX_CLIENTS,
+    GEMINI_API_KEY,
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+)
+
+# (provider, api_key, base_url)
+ClientKey = Tuple[str, str | None, str | None]
+
+
+class _PooledClient:
+    def __init__(self, client: Any):
+        self.client = client
+        self.active = 0
+        self.last_used = time.monotonic()
+
+
+async def _close_client(provider: str, client: Any) -> None:
+    try:
+        if provider == "gemini":
+            aclose = getattr(client.aio, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        elif provider == "http":
+            await client.aclose()
+        else:
+            await client.close()
+    except Exception as e:
+        print(f"[CLIENT POOL] Error closing {provider} client: {e}")
+
+
+class ClientRegistry:
+    """Provider API clients shared across calls.
+
+    Each client keeps its own keep-alive connection pool, so reusing it saves
+    the TCP/TLS handshake on every variant. Clients are leased so that one
+    with streams in flight is never closed.
+    """
+
+    def __init__(
+        self,
+        max_clients: int = CLIENT_POOL_MAX_CLIENTS,
+        idle_seconds: float = CLIENT_POOL_IDLE_SECONDS,
+    ):
+        self.max_clients = max_clients
+        self.idle_seconds = idle_seconds
+        self._clients: "OrderedDict[ClientKey, _PooledClient]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    @asynccontextmanager
+    async def lease(
+        self, key: ClientKey, factory: Callable[[], Any]
+    ) -> AsyncIterator[Any]:
+        # No awaits until the entry is in the pool and leased, so concurrent
+        # leases of a key share one client and eviction can't close it
+        entry = self._clients.get(key)
+        if entry is None:
+            self.misses += 1
+            entry = _PooledClient(factory())
+            self._clients[key] = entry
+        else:
+            self.hits += 1
+        self._clients.move_to_end(key)
+
+        entry.active += 1
+        try:
+            await self._evict()
+            yield entry.client
+        finally:
+            entry.active -= 1
+            entry.last_used = time.monotonic()
+            await self._evict()
+
+    async def _evict(self) -> None:
+        """Close idle clients and the least recently used ones beyond the max"""
+        now = time.monotonic()
+        evictable = [key for key, entry in self._clients.items() if entry.active == 0]
+        to_close: list[ClientKey] = [
+            key
+            for key in evictable
+            if now - self._clients[key].last_used > self.idle_seconds
+        ]
+        excess = len(self._clients) - len(to_close) - self.max_clients
+        for key in evictable:
+            if excess <= 0:
+                break
+            if key not in to_close:
+                to_close.append(key)
+                excess -= 1
+
+        # Removed before closing any, so overlapping evictions don't pick them
+        closing = [(key, self._clients.pop(key)) for key in to_close]
+        for key, entry in closing:
+            await _close_client(key[0], entry.client)
+
+    async def close_all(self) -> None:
+        clients = list(self._clients.items())
+        self._clients.clear()
+        for key, entry in clients:
+            await _close_client(key[0], entry.client)
+
+    def openai(
+        self, api_key: str, base_url: str | None = None
+    ) -> AbstractAsyncContextManager[AsyncOpenAI]:
+        return self.lease(
+            ("openai", api_key, base_url),
+            lambda: AsyncOpenAI(api_key=api_key, base_url=base_url),
+        )
+
+    def anthropic(self, api_key: str) -> AbstractAsyncContextManager[AsyncAnthropic]:
+        return self.lease(
+            ("anthropic", api_key, None), lambda: AsyncAnthropic(api_key=api_key)
+        )
+
+    def gemini(self, api_key: str) -> AbstractAsyncContextManager[genai.Client]:
+        return self.lease(("gemini", api_key, None), lambda: genai.Client(api_key=api_key))
+
+    def http(self) -> AbstractAsyncContextManager[httpx.AsyncClient]:
+        return self.lease(("http", None, None), lambda: httpx.AsyncClient())
+
+
+client_registry = ClientRegistry()
+
+
+async def _warm(name: str, request: Awaitable[None]) -> None:
+    start = time.perf_counter()
+    try:
+        await request
+        print(f"[CLIENT POOL] Warmed {name} in {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        print(f"[CLIENT POOL] Could not warm {name}: {e}")
+
+
+async def _warm_openai(api_key: str, base_url: str | None) -> None:
+    async with client_registry.openai(api_key, base_url) as client:
+        await client.models.list()
+
+
+async def _warm_anthropic(api_key: str) -> None:
+    async with client_registry.anthropic(api_key) as client:
+        await client.models.list(limit=1)
+
+
+async def _warm_gemini(api_key: str) -> None:
+    async with client_registry.gemini(api_key) as client:
+        await client.aio.models.list(config={"page_size": 1})
+
+
+async def warm_client_pools() -> None:
+    """Open connections for the API keys in config.py with a cheap request each"""
+    tasks: List[Awaitable[None]] = []
+    if OPENAI_API_KEY:
+        tasks.append(_warm("openai", _warm_openai(OPENAI_API_KEY, OPENAI_BASE_URL)))
+    if ANTHROPIC_API_KEY:
+        tasks.append(_warm("anthropic", _warm_anthropic(ANTHROPIC_API_KEY)))
+    if GEMINI_API_KEY:
+        tasks.append(_warm("gemini", _warm_gemini(GEMINI_API_KEY)))
+    await asyncio.gather(*tasks)
@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+from openai.types.chat import ChatCompletionMessageParam
+
+from config import (
+    COMPLETION_CACHE_DIR,
+    COMPLETION_CACHE_ENABLED,
+    COMPLETION_CACHE_MAX_BYTES,
+    COMPLETION_CACHE_REPLAY_CHARS_PER_SECOND,
+)
+from llm import Llm
+
+# Size of the chunks a cached completion is replayed in
+REPLAY_CHUNK_CHARS = 512
+
+
+@dataclass
+class CompletionCacheStats:
+    hits: int = 0
+    misses: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def prompt_digest(prompt_messages: List[ChatCompletionMessageParam]) -> str:
+    """Stable hash of the assembled prompt, including image data URLs"""
+    encoded = json.dumps(
+        prompt_messages, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def completion_cache_key(digest: str, model: Llm, attempt: int = 0) -> str:
+    """Cache key for one model's completion of a prompt.
+
+    attempt distinguishes repeated generations of the same prompt and model in
+    one request (or eval run), so they don't all replay the same completion.
+    """
+    return hashlib.sha256(f"{digest}:{model.value}:{attempt}".encode()).hexdigest()
+
+
+class CompletionCache:
+    """Completions stored on local disk, one JSON file per key.
+
+    Least recently used entries (by file mtime, bumped on every hit) are
+    removed once the total size exceeds max_bytes.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = CompletionCacheStats()
+        self._lock = threading.Lock()
+        self._sizes: Dict[str, int] | None = None
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _load_sizes(self) -> Dict[str, int]:
+        if self._sizes is None:
+            self._sizes = {}
+            if self.directory.exists():
+                for path in self.directory.glob("*.json"):
+                    self._sizes[path.stem] = path.stat().st_size
+            self._update_stats()
+        return self._sizes
+
+    def _update_stats(self) -> None:
+        sizes = self._sizes or {}
+        self.stats.entries = len(sizes)
+        self.stats.bytes = sum(sizes.values())
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            sizes = self._load_sizes()
+            path = self._path(key)
+            try:
+                entry: Dict[str, Any] = json.loads(path.read_text())
+                os.utime(path)
+            except (OSError, ValueError):
+                sizes.pop(key, None)
+                self._update_stats()
+                self.stats.misses += 1
+                return None
+
+            self.stats.hits += 1
+            return entry["code"]
+
+    def put(self, key: str, model: Llm, code: str) -> None:
+        with self._lock:
+            sizes = self._load_sizes()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._path(key)
+            data = json.dumps(
+                {"model": model.value, "code": code, "created_at": time.time()}
+            )
+            # Write to a temp file first so readers never see a partial entry
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_text(data)
+            tmp_path.replace(path)
+            sizes[key] = path.stat().st_size
+            self._evict()
+            self._update_stats()
+
+    def _evict(self) -> None:
+        sizes = self._load_sizes()
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return
+
+        def last_used(key: str) -> float:
+            try:
+                return self._path(key).stat().st_mtime
+            except OSError:
+                return 0.0
+
+        for key in sorted(sizes, key=last_used):
+            if total <= self.max_bytes:
+                break
+            total -= sizes.pop(key)
+            self._path(key).unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._load_sizes()):
+                self._path(key).unlink(missing_ok=True)
+            self._sizes = {}
+            self._update_stats()
+
+
+completion_cache = CompletionCache(Path(COMPLETION_CACHE_DIR), COMPLETION_CACHE_MAX_BYTES)
+
+
+async def get_cached_completion(key: str) -> str | None:
+    if not COMPLETION_CACHE_ENABLED:
+        return None
+    code = await asyncio.to_thread(completion_cache.get, key)
+    stats = completion_cache.stats
+    print(
+        f"[COMPLETION CACHE] {'hit' if code is not None else 'miss'} "
+        f"(hit rate {stats.hit_rate:.0%} over {stats.hits + stats.misses} lookups)"
+    )
+    return code
+
+
+async def cache_completion(key: str, model: Llm, code: str) -> None:
+    if not COMPLETION_CACHE_ENABLED or not code:
+        return
+    try:
+        await asyncio.to_thread(completion_cache.put, key, model, code)
+    except OSError as e:
+        print(f"[COMPLETION CACHE] Failed to store completion: {e}")
+
+
+async def replay_completion(
+    code: str,
+    callback: Callable[[str], Awaitable[None]],
+    chars_per_second: float = COMPLETION_CACHE_REPLAY_CHARS_PER_SECOND,
+) -> None:
+    """Stream a cached completion through callback like a live response.
+    A rate of 0 sends it all at once."""
+    if chars_per_second <= 0:
+        await callback(code)
+        return
+
+    delay = REPLAY_CHUNK_CHARS / chars_per_second
+    for start in range(0, len(code), REPLAY_CHUNK_CHARS):
+        if start > 0:
+            await asyncio.sleep(delay)
+        await callback(code[start : start + REPLAY_CHUNK_CHARS])
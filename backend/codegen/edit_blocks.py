@@ -0,0 +1,196 @@
+import difflib
+import re
+from dataclasses import dataclass
+from typing import List, Tuple
+
+from codegen.utils import extract_html_content
+from config import EDIT_FUZZY_MATCH_MIN_RATIO
+
+SEARCH_MARKER = "<<<<<<< SEARCH"
+DIVIDER_MARKER = "======="
+REPLACE_MARKER = ">>>>>>> REPLACE"
+
+EDIT_BLOCK_PATTERN = re.compile(
+    r"^<{7} SEARCH[ \t]*\n(.*?)^={7}[ \t]*\n(.*?)^>{7} REPLACE[ \t]*$",
+    re.MULTILINE | re.DOTALL,
+)
+FULL_DOCUMENT_PATTERN = re.compile(r"<!DOCTYPE\s+html|<html[\s>]", re.IGNORECASE)
+
+# Tags whose opening and closing tags must stay balanced after editing
+BALANCED_TAGS = ("html", "head", "body", "style", "script")
+
+
+class EditApplyError(Exception):
+    """Edit blocks that can't be applied to the code, or that break it"""
+
+
+@dataclass
+class EditBlock:
+    search: str
+    replace: str
+
+
+def _section(text: str) -> str:
+    # Each section ends with the newline before the next marker
+    return text[:-1] if text.endswith("\n") else text
+
+
+def _block(match: re.Match[str]) -> EditBlock:
+    return EditBlock(search=_section(match.group(1)), replace=_section(match.group(2)))
+
+
+def parse_edit_blocks(text: str) -> List[EditBlock]:
+    """The complete edit blocks in a model response"""
+    return [_block(match) for match in EDIT_BLOCK_PATTERN.finditer(text)]
+
+
+def _line_spans(code: str) -> List[Tuple[int, int]]:
+    """(start, end) of each line in code, excluding its newline"""
+    spans: List[Tuple[int, int]] = []
+    start = 0
+    for line in code.splitlines(keepends=True):
+        spans.append((start, start + len(line.rstrip("\r\n"))))
+        start += len(line)
+    return spans
+
+
+def _ambiguous(count: int, search: str) -> EditApplyError:
+    first_line = search.strip().splitlines()[0]
+    return EditApplyError(
+        f"SEARCH matches {count} places in the code: {first_line[:80]!r}"
+    )
+
+
+def _unique(matches: List[Tuple[int, int]], search: str) -> Tuple[int, int]:
+    if len(matches) > 1:
+        raise _ambiguous(len(matches), search)
+    return matches[0]
+
+
+def find_anchor(
+    code: str, search: str, min_ratio: float = EDIT_FUZZY_MATCH_MIN_RATIO
+) -> Tuple[int, int]:
+    """(start, end) of the text in code that search refers to.
+
+    search is matched verbatim first, then line by line ignoring leading and
+    trailing whitespace, then to the run of lines most similar to it (if at
+    least min_ratio similar). A search matching more than one place raises
+    EditApplyError, as does one matching none.
+    """
+    if not search.strip():
+        raise EditApplyError("Empty SEARCH section")
+
+    count = code.count(search)
+    if count == 1:
+        start = code.index(search)
+        return start, start + len(search)
+    if count > 1:
+        raise _ambiguous(count, search)
+
+    search_lines = [line.strip() for line in search.strip().splitlines()]
+    spans = _line_spans(code)
+    lines = [code[start:end].strip() for start, end in spans]
+    size = len(search_lines)
+    windows = range(len(lines) - size + 1)
+
+    def span(index: int) -> Tuple[int, int]:
+        return spans[index][0], spans[index + size - 1][1]
+
+    matches = [span(i) for i in windows if lines[i : i + size] == search_lines]
+    if matches:
+        return _unique(matches, search)
+
+    wanted = "\n".join(search_lines)
+    best_ratio, best = 0.0, []
+    for i in windows:
+        matcher = difflib.SequenceMatcher(None, "\n".join(lines[i : i + size]), wanted)
+        if matcher.quick_ratio() < max(min_ratio, best_ratio):
+            continue
+        ratio = matcher.ratio()
+        if ratio > best_ratio:
+            best_ratio, best = ratio, [span(i)]
+        elif ratio == best_ratio:
+            best.append(span(i))
+    if best_ratio < min_ratio:
+        first_line = search_lines[0]
+        raise EditApplyError(f"SEARCH not found in the code: {first_line[:80]!r}")
+    return _unique(best, search)
+
+
+def apply_edit_block(code: str, block: EditBlock) -> str:
+    start, end = find_anchor(code, block.search)
+    return code[:start] + block.replace + code[end:]
+
+
+def apply_edit_blocks(code: str, blocks: List[EditBlock]) -> str:
+    """code with each block applied in turn"""
+    for block in blocks:
+        code = apply_edit_block(code, block)
+    return code
+
+
+def _tag_counts(code: str, tag: str) -> Tuple[int, int]:
+    opening = len(re.findall(rf"<{tag}[\s>]", code, re.IGNORECASE))
+    closing = len(re.findall(rf"</{tag}\s*>", code, re.IGNORECASE))
+    return opening, closing
+
+
+def validate_document(original: str, patched: str) -> None:
+    """Raise EditApplyError if the edits emptied the document or unbalanced
+    tags that were balanced in the original"""
+    if not patched.strip():
+        raise EditApplyError("The edits removed the whole document")
+    for tag in BALANCED_TAGS:
+        opening, closing = _tag_counts(original, tag)
+        if opening == closing:
+            opening, closing = _tag_counts(patched, tag)
+            if opening != closing:
+                raise EditApplyError(
+                    f"The edits left {opening} <{tag}> and {closing} </{tag}> tags"
+                )
+
+
+class EditStream:
+    """Applies edit blocks to code as a model response streams.
+
+    A response that starts with a whole document instead of edit blocks
+    (the model may rewrite the page for large changes) is taken as is.
+    """
+
+    def __init__(self, code: str):
+        self.original = code
+        self.code = code
+        self.text = ""
+        self.blocks = 0
+        self.is_full_document = False
+        self._has_edits = False
+        self._parsed_to = 0
+
+    def feed(self, delta: str) -> bool:
+        """Add a delta of the response, applying any edit blocks it completes.
+        Returns whether the code changed."""
+        self.text += delta
+        if not self._has_edits and not self.is_full_document:
+            self._has_edits = SEARCH_MARKER in self.text
+            self.is_full_document = not self._has_edits and bool(
+                FULL_DOCUMENT_PATTERN.search(self.text)
+            )
+        if self.is_full_document:
+            return False
+
+        changed = False
+        for match in EDIT_BLOCK_PATTERN.finditer(self.text, self._parsed_to):
+            self.code = apply_edit_block(self.code, _block(match))
+            self.blocks += 1
+            self._parsed_to = match.end()
+            changed = True
+        return changed
+
+    def finish(self) -> str:
+        """The edited code (or the whole document the model responded with)"""
+        if self.is_full_document:
+            return extract_html_content(self.text)
+        if not self.blocks:
+            raise EditApplyError("No edit blocks in the response")
+        validate_document(self.original, self.code)
+        return self.code
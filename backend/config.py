@@ -14,6 +14,229 @@ OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", None)
 
 # Image generation (optional)
 REPLICATE_API_KEY = os.environ.get("REPLICATE_API_KEY", None)
+REPLICATE_API_BASE_URL = os.environ.get(
+    "REPLICATE_API_BASE_URL", "https://api.replicate.com/v1"
+)
+# Ask Replicate to hold the create request open until the prediction is done
+# (up to 60s) so usually no polling is needed. 0 disables it.
+REPLICATE_PREFER_WAIT_SECONDS = int(os.environ.get("REPLICATE_PREFER_WAIT_SECONDS", 30))
+# Give up on a prediction after this long. Polling backs off exponentially
+# (with jitter) from the initial to the maximum interval.
+REPLICATE_DEADLINE_SECONDS = float(os.environ.get("REPLICATE_DEADLINE_SECONDS", 60))
+REPLICATE_POLL_INITIAL_SECONDS = float(
+    os.environ.get("REPLICATE_POLL_INITIAL_SECONDS", 0.25)
+)
+REPLICATE_POLL_MAX_SECONDS = float(os.environ.get("REPLICATE_POLL_MAX_SECONDS", 2))
+
+# WebSocket streaming
+# Chunk/thinking deltas are coalesced per variant and flushed as one frame once
+# the window elapses or the buffered text exceeds the byte threshold.
+# Set WS_BATCH_WINDOW_MS=0 to send every delta as its own frame.
+WS_BATCH_WINDOW_MS = float(os.environ.get("WS_BATCH_WINDOW_MS", 30))
+WS_BATCH_MAX_BYTES = int(os.environ.get("WS_BATCH_MAX_BYTES", 16 * 1024))
+# Outbound frames are queued per connection and written by a single writer task
+# so a slow client doesn't stall the provider streams. When the queue is full:
+#   "merge"         - keep merging chunk/thinking deltas until there's room
+#   "drop_thinking" - drop thinking deltas, wait for room for everything else
+#   "abort"         - close the connection
+WS_SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", 256))
+WS_SEND_OVERFLOW_POLICY = os.environ.get("WS_SEND_OVERFLOW_POLICY", "merge")
+
+# Resumable generation sessions
+# Output is kept in memory so a client that reconnects can pick up where it left
+# off. Generation is cancelled if nobody reconnects within the grace period.
+GENERATION_SESSION_TTL_SECONDS = float(
+    os.environ.get("GENERATION_SESSION_TTL_SECONDS", 300)
+)
+SESSION_RESUME_GRACE_SECONDS = float(os.environ.get("SESSION_RESUME_GRACE_SECONDS", 30))
+SESSION_REPLAY_BUFFER_BYTES = int(
+    os.environ.get("SESSION_REPLAY_BUFFER_BYTES", 1024 * 1024)
+)
+
+# Admission control
+# Maximum number of concurrent provider streams across all /generate-code
+# requests. Requests that would exceed a limit wait in a queue, with update
+# generations ahead of new create generations.
+MAX_CONCURRENT_STREAMS_PER_PROVIDER = {
+    "openai": int(os.environ.get("MAX_CONCURRENT_OPENAI_STREAMS", 16)),
+    "anthropic": int(os.environ.get("MAX_CONCURRENT_ANTHROPIC_STREAMS", 16)),
+    "gemini": int(os.environ.get("MAX_CONCURRENT_GEMINI_STREAMS", 16)),
+}
+
+# Provider client pool
+# API clients (and their keep-alive connection pools) are reused across calls,
+# keyed by provider, API key and base URL. Least recently used clients are
+# closed beyond the max, and idle ones after the timeout.
+CLIENT_POOL_MAX_CLIENTS = int(os.environ.get("CLIENT_POOL_MAX_CLIENTS", 32))
+CLIENT_POOL_IDLE_SECONDS = float(os.environ.get("CLIENT_POOL_IDLE_SECONDS", 300))
+
+# First-K-wins variants
+# When a request sets firstK, the generation is complete once that many
+# variants have produced code. Stragglers are either cancelled right away
+# ("cancel") or left running until the deadline ("deadline").
+FIRST_K_STRAGGLER_POLICY = os.environ.get("FIRST_K_STRAGGLER_POLICY", "cancel")
+FIRST_K_STRAGGLER_DEADLINE_SECONDS = float(
+    os.environ.get("FIRST_K_STRAGGLER_DEADLINE_SECONDS", 60)
+)
+
+# Completion cache
+# Completions are cached on disk, keyed by a hash of the assembled prompt
+# (including images and history) and the model. Cache hits are replayed to
+# the client at the given rate (0 sends the whole completion at once).
+COMPLETION_CACHE_ENABLED = os.environ.get("COMPLETION_CACHE_ENABLED", "true") == "true"
+COMPLETION_CACHE_DIR = os.environ.get(
+    "COMPLETION_CACHE_DIR",
+    os.path.join(os.path.dirname(__file__), "data", "completion_cache"),
+)
+COMPLETION_CACHE_MAX_BYTES = int(
+    os.environ.get("COMPLETION_CACHE_MAX_BYTES", 200 * 1024 * 1024)
+)
+COMPLETION_CACHE_REPLAY_CHARS_PER_SECOND = float(
+    os.environ.get("COMPLETION_CACHE_REPLAY_CHARS_PER_SECOND", 20000)
+)
+
+# Worker pool for CPU-bound media work (image re-encoding and decoding,
+# video probing) so it doesn't block the event loop. "thread" or "process".
+MEDIA_WORKER_POOL = os.environ.get("MEDIA_WORKER_POOL", "thread")
+MEDIA_WORKER_POOL_SIZE = int(
+    os.environ.get("MEDIA_WORKER_POOL_SIZE", min(4, os.cpu_count() or 1))
+)
+# How often the event loop lag monitor checks in
+EVENT_LOOP_LAG_INTERVAL_SECONDS = float(
+    os.environ.get("EVENT_LOOP_LAG_INTERVAL_SECONDS", 0.25)
+)
+
+# Uploaded screenshots and videos, stored by content hash and referenced from
+# prompts as "media:<id>" instead of inline base64 data URLs. Least recently
+# used files are removed once the store exceeds MEDIA_STORE_MAX_BYTES.
+MEDIA_STORE_DIR = os.environ.get(
+    "MEDIA_STORE_DIR", os.path.join(os.path.dirname(__file__), "data", "media")
+)
+MEDIA_STORE_MAX_BYTES = int(
+    os.environ.get("MEDIA_STORE_MAX_BYTES", 2 * 1024 * 1024 * 1024)
+)
+MEDIA_UPLOAD_MAX_BYTES = int(
+    os.environ.get("MEDIA_UPLOAD_MAX_BYTES", 200 * 1024 * 1024)
+)
+# Videos at least this large are uploaded to Gemini's Files API once and
+# referenced by URI from every variant and later request, instead of being
+# sent inline with each request. Handles this close to expiring are
+# uploaded again.
+GEMINI_FILE_UPLOAD_MIN_BYTES = int(
+    os.environ.get("GEMINI_FILE_UPLOAD_MIN_BYTES", 1024 * 1024)
+)
+MEDIA_HANDLE_EXPIRY_MARGIN_SECONDS = float(
+    os.environ.get("MEDIA_HANDLE_EXPIRY_MARGIN_SECONDS", 600)
+)
+
+# Generated image URLs cached on local disk by (model, normalized alt text,
+# size), shared across requests and the image generation evals. Provider
+# URLs expire before the providers stop serving them (about an hour).
+# Images in the asset store don't expire, so their entries are kept until
+# they're evicted (or the asset is), unless IMAGE_CACHE_ASSET_TTL_SECONDS is
+# set above 0.
+IMAGE_CACHE_ENABLED = os.environ.get("IMAGE_CACHE_ENABLED", "true") == "true"
+IMAGE_CACHE_DIR = os.environ.get(
+    "IMAGE_CACHE_DIR", os.path.join(os.path.dirname(__file__), "data", "image_cache")
+)
+IMAGE_CACHE_TTL_SECONDS = float(os.environ.get("IMAGE_CACHE_TTL_SECONDS", 50 * 60))
+IMAGE_CACHE_ASSET_TTL_SECONDS = float(
+    os.environ.get("IMAGE_CACHE_ASSET_TTL_SECONDS", 0)
+)
+IMAGE_CACHE_MAX_ENTRIES = int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", 5000))
+# Start generating images for placeholder <img> tags while the completion is
+# still streaming, instead of after it ends
+IMAGE_PREFETCH_ENABLED = os.environ.get("IMAGE_PREFETCH_ENABLED", "true") == "true"
+# Generated images are downloaded once into a local content-addressed store
+# with WebP derivatives at these widths, and served from
+# ASSET_PUBLIC_BASE_URL/assets instead of the providers' expiring URLs.
+# Least recently used images (with their derivatives) are removed once the
+# store exceeds ASSET_STORE_MAX_BYTES.
+ASSET_STORE_ENABLED = os.environ.get("ASSET_STORE_ENABLED", "true") == "true"
+ASSET_STORE_DIR = os.environ.get(
+    "ASSET_STORE_DIR", os.path.join(os.path.dirname(__file__), "data", "assets")
+)
+# ASSET_PUBLIC_BASE_URL is only put in generated code (never cached), and
+# defaults to the origin each request came in on.
+ASSET_PUBLIC_BASE_URL = os.environ.get("ASSET_PUBLIC_BASE_URL", "").rstrip("/")
+ASSET_STORE_MAX_BYTES = int(
+    os.environ.get("ASSET_STORE_MAX_BYTES", 1024 * 1024 * 1024)
+)
+ASSET_DERIVATIVE_WIDTHS = [
+    int(width)
+    for width in os.environ.get("ASSET_DERIVATIVE_WIDTHS", "320,640").split(",")
+    if width.strip()
+]
+# Maximum concurrent image generation provider calls per request, so one
+# large page can't hold up other users' images, and across all requests
+IMAGE_GENERATION_MAX_CONCURRENCY_PER_REQUEST = int(
+    os.environ.get("IMAGE_GENERATION_MAX_CONCURRENCY_PER_REQUEST", 4)
+)
+IMAGE_GENERATION_MAX_CONCURRENCY = int(
+    os.environ.get("IMAGE_GENERATION_MAX_CONCURRENCY", 16)
+)
+# Send Gemini the frames of a video where the UI changes, instead of the
+# whole video at 10fps, when that's estimated to use fewer input tokens.
+# The video is sampled at VIDEO_KEYFRAME_SAMPLE_FPS; a frame counts as a
+# change when at least VIDEO_KEYFRAME_CHANGE_THRESHOLD of it differs
+VIDEO_KEYFRAMES_ENABLED = os.environ.get("VIDEO_KEYFRAMES_ENABLED", "true") == "true"
+VIDEO_KEYFRAME_SAMPLE_FPS = float(os.environ.get("VIDEO_KEYFRAME_SAMPLE_FPS", 5))
+VIDEO_KEYFRAME_CHANGE_THRESHOLD = float(
+    os.environ.get("VIDEO_KEYFRAME_CHANGE_THRESHOLD", 0.005)
+)
+VIDEO_KEYFRAME_MAX_FRAMES = int(os.environ.get("VIDEO_KEYFRAME_MAX_FRAMES", 40))
+
+# Each variant's tokens, cost and time are estimated before it's dispatched
+# and compared with the provider's reported usage. Both are appended to the
+# usage ledger, whose recent records calibrate later estimates.
+USAGE_LEDGER_ENABLED = os.environ.get("USAGE_LEDGER_ENABLED", "true") == "true"
+USAGE_LEDGER_PATH = os.environ.get(
+    "USAGE_LEDGER_PATH",
+    os.path.join(os.path.dirname(__file__), "data", "usage_ledger.jsonl"),
+)
+USAGE_LEDGER_MAX_RECORDS = int(os.environ.get("USAGE_LEDGER_MAX_RECORDS", 20000))
+# Budget guards in USD (0 disables them). Variants estimated to cost more
+# than MAX_VARIANT_COST_USD are dropped, then the most expensive ones until
+# the request's estimate is within MAX_REQUEST_COST_USD (which a request's
+# maxCostUsd param can lower). The cheapest variant is always kept.
+MAX_REQUEST_COST_USD = float(os.environ.get("MAX_REQUEST_COST_USD", 0))
+MAX_VARIANT_COST_USD = float(os.environ.get("MAX_VARIANT_COST_USD", 0))
+
+# Update prompts keep the latest code verbatim. Earlier versions of at
+# least HISTORY_SUMMARY_MIN_CHARS are replaced by their diff from the version
+# before them (truncated to HISTORY_DIFF_MAX_CHARS), and images are only sent
+# the first time. The oldest turns are then dropped until the prompt fits the
+# model's token budget: HISTORY_TOKEN_BUDGETS ("<model>=<tokens>,...")
+# overrides HISTORY_TOKEN_BUDGET per model.
+HISTORY_COMPACTION_ENABLED = (
+    os.environ.get("HISTORY_COMPACTION_ENABLED", "true") == "true"
+)
+HISTORY_SUMMARY_MIN_CHARS = int(os.environ.get("HISTORY_SUMMARY_MIN_CHARS", 4000))
+HISTORY_DIFF_MAX_CHARS = int(os.environ.get("HISTORY_DIFF_MAX_CHARS", 4000))
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", 60000))
+HISTORY_TOKEN_BUDGETS = {
+    model.strip(): int(tokens)
+    for model, tokens in (
+        entry.rsplit("=", 1)
+        for entry in os.environ.get("HISTORY_TOKEN_BUDGETS", "").split(",")
+        if entry.strip()
+    )
+}
+
+# Update generations ("full" or "edit"; edit mode is opt-in, per request with
+# updateMode or for all requests here). In edit mode the model returns
+# search/replace edit blocks against the latest code, which are applied as
+# they stream; if they don't apply (or break the document) the update is
+# regenerated in full. A SEARCH section that isn't in the code verbatim or up
+# to whitespace is matched to the most similar lines, if at least
+# EDIT_FUZZY_MATCH_MIN_RATIO similar. The edited document is sent to the
+# client at most once per EDIT_SET_CODE_INTERVAL_SECONDS while edits stream,
+# and once more when they're done.
+UPDATE_MODE = os.environ.get("UPDATE_MODE", "full")
+EDIT_FUZZY_MATCH_MIN_RATIO = float(os.environ.get("EDIT_FUZZY_MATCH_MIN_RATIO", 0.9))
+EDIT_SET_CODE_INTERVAL_SECONDS = float(
+    os.environ.get("EDIT_SET_CODE_INTERVAL_SECONDS", 0.5)
+)
 
 # Debugging-related
 
@@ -1,3 +1,9 @@
+from codegen.completion_cache import (
+    cache_completion,
+    completion_cache_key,
+    get_cached_completion,
+    prompt_digest,
+)
 from config import ANTHROPIC_API_KEY, GEMINI_API_KEY, OPENAI_API_KEY
 from llm import Llm, ANTHROPIC_MODELS, GEMINI_MODELS
 from models import (
@@ -10,12 +16,37 @@ from prompts.types import Stack
 from openai.types.chat import ChatCompletionMessageParam
 
 
-async def generate_code_for_image(image_url: str, stack: Stack, model: Llm) -> str:
+async def generate_code_for_image(
+    image_url: str, stack: Stack, model: Llm, attempt: int = 0, use_cache: bool = False
+) -> tuple[str, bool]:
     prompt_messages = assemble_prompt([image_url], stack)
-    return await generate_code_core(prompt_messages, model)
+    return await generate_code_core(prompt_messages, model, attempt, use_cache)
 
 
 async def generate_code_core(
+    prompt_messages: list[ChatCompletionMessageParam],
+    model: Llm,
+    attempt: int = 0,
+    use_cache: bool = False,
+) -> tuple[str, bool]:
+    """(code, whether it was replayed from the completion cache). Evals
+    measure the model, so the cache is only used when asked for."""
+    if not use_cache:
+        return await _generate_code(prompt_messages, model), False
+
+    # Each attempt of an eval has its own cache entry so re-runs are cached
+    # without collapsing the attempts into one result
+    cache_key = completion_cache_key(prompt_digest(prompt_messages), model, attempt)
+    cached_code = await get_cached_completion(cache_key)
+    if cached_code is not None:
+        return cached_code, True
+
+    code = await _generate_code(prompt_messages, model)
+    await cache_completion(cache_key, model, code)
+    return code, False
+
+
+async def _generate_code(
     prompt_messages: list[ChatCompletionMessageParam], model: Llm
 ) -> str:
 
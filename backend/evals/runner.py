@@ -5,6 +5,7 @@ from datetime import datetime
 import time
 from llm import Llm
 from prompts.types import Stack
+from codegen.completion_cache import completion_cache
 from .core import generate_code_for_image
 from .utils import image_to_data_url
 from .config import EVALS_DIR
@@ -16,34 +17,44 @@ async def generate_code_and_time(
     model: Llm,
     original_input_filename: str,
     attempt_idx: int,
-) -> Tuple[str, int, Optional[str], Optional[float], Optional[Exception]]:
+    use_cache: bool = False,
+) -> Tuple[str, int, Optional[str], Optional[float], bool, Optional[Exception]]:
     """
     Generates code for an image, measures the time taken, and returns identifiers
     along with success/failure status.
-    Returns a tuple: (original_input_filename, attempt_idx, content, duration, error_object)
-    content and duration are None if an error occurs during generation.
+    Returns a tuple: (original_input_filename, attempt_idx, content, duration, cached, error_object)
+    content and duration are None if an error occurs during generation. cached is
+    True if the content was replayed from the completion cache.
     """
     start_time = time.perf_counter()
     try:
-        content = await generate_code_for_image(
-            image_url=image_url, stack=stack, model=model
+        content, cached = await generate_code_for_image(
+            image_url=image_url,
+            stack=stack,
+            model=model,
+            attempt=attempt_idx,
+            use_cache=use_cache,
         )
         end_time = time.perf_counter()
         duration = end_time - start_time
-        return original_input_filename, attempt_idx, content, duration, None
+        return original_input_filename, attempt_idx, content, duration, cached, None
     except Exception as e:
         print(
             f"Error during code generation for {original_input_filename} (attempt {attempt_idx}): {e}"
         )
-        return original_input_filename, attempt_idx, None, None, e
+        return original_input_filename, attempt_idx, None, None, False, e
 
 
 async def run_image_evals(
     stack: Optional[Stack] = None, 
     model: Optional[str] = None, 
     n: int = 1,
-    input_files: Optional[List[str]] = None
+    input_files: Optional[List[str]] = None,
+    use_cache: bool = False,
 ) -> List[str]:
+    """Generate code for the eval inputs. With use_cache, results of earlier
+    runs are replayed from the completion cache (marked "(cached)" in the
+    timings) instead of calling the model again."""
     INPUT_DIR = EVALS_DIR + "/inputs"
     OUTPUT_DIR = EVALS_DIR + "/outputs"
 
@@ -80,7 +91,7 @@ async def run_image_evals(
         Coroutine[
             Any,
             Any,
-            Tuple[str, int, Optional[str], Optional[float], Optional[Exception]],
+            Tuple[str, int, Optional[str], Optional[float], bool, Optional[Exception]],
         ]
     ] = []
     for original_filename in evals:
@@ -102,6 +113,7 @@ async def run_image_evals(
                 model=current_model_for_task,
                 original_input_filename=original_filename,
                 attempt_idx=n_idx,
+                use_cache=use_cache,
             )
             task_coroutines.append(coro)
 
@@ -113,9 +125,14 @@ async def run_image_evals(
 
     for future in asyncio.as_completed(task_coroutines):
         try:
-            task_orig_fn, task_attempt_idx, generated_content, time_taken, error_obj = (
-                await future
-            )
+            (
+                task_orig_fn,
+                task_attempt_idx,
+                generated_content,
+                time_taken,
+                cached,
+                error_obj,
+            ) = await future
 
             output_html_filename_base = os.path.splitext(task_orig_fn)[0]
             final_output_html_filename = (
@@ -135,6 +152,7 @@ async def run_image_evals(
                         file.write(generated_content)
                     timing_data.append(
                         f"{final_output_html_filename}: {time_taken:.2f} seconds"
+                        + (" (cached)" if cached else "")
                     )
                     output_files.append(final_output_html_filename)
                     print(
@@ -185,4 +203,11 @@ async def run_image_evals(
         except Exception as e:
             print(f"Error writing failed tasks log {failed_log_path}: {e}")
 
+    if use_cache:
+        cache_stats = completion_cache.stats
+        print(
+            f"Completion cache: {cache_stats.hits} hits, {cache_stats.misses} misses "
+            f"({cache_stats.hit_rate:.0%} hit rate)"
+        )
+
     return output_files
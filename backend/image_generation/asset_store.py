@@ -0,0 +1,296 @@
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+
+from PIL import Image
+
+from clients.registry import client_registry
+from config import (
+    ASSET_DERIVATIVE_WIDTHS,
+    ASSET_PUBLIC_BASE_URL,
+    ASSET_STORE_DIR,
+    ASSET_STORE_ENABLED,
+    ASSET_STORE_MAX_BYTES,
+)
+from image_processing.media_registry import detect_mime_type
+from scheduling.worker_pool import run_in_worker
+
+ASSET_ROUTE = "/assets"
+WEBP_QUALITY = 85
+DOWNLOAD_TIMEOUT_SECONDS = 30
+
+# <content hash>[-w<width>].<ext>
+ASSET_NAME_PATTERN = re.compile(r"^([0-9a-f]{64})(?:-w(\d+))?\.(webp|png|jpg|gif)$")
+# An asset URL in code: /assets/<name>, relative or under any origin (the
+# public base URL may have changed since it was generated)
+ASSET_URL_PATTERN = re.compile(
+    r"(?:https?://[^/\s\"'<>]+|(?<![^\s\"'(=]))"
+    + re.escape(ASSET_ROUTE)
+    + r"/([0-9a-f]{64}(?:-w\d+)?\.(?:webp|png|jpg|gif))"
+)
+
+_EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+}
+
+
+def asset_url(name: str, base_url: str = "") -> str:
+    """URL of an asset under base_url; relative to the backend's origin if
+    base_url is empty (as stored in caches)"""
+    return f"{base_url}{ASSET_ROUTE}/{name}"
+
+
+def asset_base_url(request_url: str) -> str:
+    """Base URL of assets in code generated for a request: ASSET_PUBLIC_BASE_URL,
+    or else the origin the request came in on (HTTP for a WebSocket)"""
+    if ASSET_PUBLIC_BASE_URL:
+        return ASSET_PUBLIC_BASE_URL
+    parts = urlsplit(request_url)
+    scheme = {"ws": "http", "wss": "https"}.get(parts.scheme, parts.scheme)
+    return f"{scheme}://{parts.netloc}"
+
+
+def asset_name(url: str) -> str | None:
+    """Name of the asset url points at, or None if it isn't an asset URL"""
+    match = ASSET_URL_PATTERN.fullmatch(url)
+    return match.group(1) if match else None
+
+
+def asset_url_for_width(url: str, display_width: int, base_url: str = "") -> str:
+    """The smallest derivative of a stored asset that's at least twice
+    display_width (for high-DPI screens), or the full-size asset if none is,
+    under base_url. Other URLs are returned as they are."""
+    name = asset_name(url)
+    match = ASSET_NAME_PATTERN.match(name) if name is not None else None
+    if name is None or match is None:
+        return url
+    for width in sorted(ASSET_DERIVATIVE_WIDTHS):
+        if width >= display_width * 2:
+            return asset_url(f"{match.group(1)}-w{width}.webp", base_url)
+    return asset_url(name, base_url)
+
+
+class AssetStore:
+    """Generated images stored by content hash, with WebP derivatives.
+
+    Each image is kept as downloaded plus a full-size WebP and a WebP per
+    derivative width. Names never change meaning,
+    so they can be served with immutable cache headers.
+
+    Least recently used images (by the full-size WebP's mtime, bumped when
+    it's stored again or served) are removed with their derivatives once the
+    total size exceeds max_bytes.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        derivative_widths: List[int],
+        max_bytes: int = ASSET_STORE_MAX_BYTES,
+    ):
+        self.directory = directory
+        self.derivative_widths = derivative_widths
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Content hash -> bytes of all its files
+        self._sizes: Dict[str, int] | None = None
+
+    def path(self, name: str) -> Path | None:
+        """Path of a stored file, or None if the name isn't a valid asset name"""
+        if not ASSET_NAME_PATTERN.match(name):
+            return None
+        return self.directory / name
+
+    def _files(self, content_hash: str) -> List[Path]:
+        return [
+            path
+            for path in self.directory.glob(f"{content_hash}*")
+            if ASSET_NAME_PATTERN.match(path.name)
+        ]
+
+    def _load_sizes(self) -> Dict[str, int]:
+        if self._sizes is None:
+            self._sizes = {}
+            if self.directory.exists():
+                for path in self.directory.iterdir():
+                    match = ASSET_NAME_PATTERN.match(path.name)
+                    if match is None:
+                        continue
+                    try:
+                        size = path.stat().st_size
+                    except OSError:
+                        continue
+                    content_hash = match.group(1)
+                    self._sizes[content_hash] = self._sizes.get(content_hash, 0) + size
+        return self._sizes
+
+    def touch(self, name: str) -> bool:
+        """Mark a stored image as used; returns whether it's still stored"""
+        match = ASSET_NAME_PATTERN.match(name)
+        if match is None:
+            return False
+        try:
+            os.utime(self.directory / f"{match.group(1)}.webp")
+        except OSError:
+            return False
+        return True
+
+    def _evict(self, keep: str) -> None:
+        sizes = self._load_sizes()
+        if sum(sizes.values()) <= self.max_bytes:
+            return
+        # Over budget by this store's tally; recount from disk, since other
+        # worker processes store and evict images in the same directory
+        self._sizes = None
+        sizes = self._load_sizes()
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return
+
+        def last_used(content_hash: str) -> float:
+            try:
+                return (self.directory / f"{content_hash}.webp").stat().st_mtime
+            except OSError:
+                return 0.0
+
+        for content_hash in sorted(sizes, key=last_used):
+            if total <= self.max_bytes:
+                break
+            if content_hash == keep:
+                continue
+            total -= sizes.pop(content_hash)
+            # The full-size WebP goes first, since it marks a complete image
+            (self.directory / f"{content_hash}.webp").unlink(missing_ok=True)
+            for path in self._files(content_hash):
+                path.unlink(missing_ok=True)
+
+    def _write(self, name: str, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.directory / name)
+
+    def put(self, data: bytes) -> str:
+        """Store an image and its derivatives; returns the full-size WebP's name.
+        Runs in the media worker pool."""
+        mime_type = detect_mime_type(data)
+        if mime_type not in _EXTENSIONS:
+            raise ValueError(f"Unsupported image type: {mime_type}")
+        content_hash = hashlib.sha256(data).hexdigest()
+        webp_name = f"{content_hash}.webp"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self.touch(webp_name):
+            return webp_name
+
+        if mime_type != "image/webp":
+            self._write(f"{content_hash}.{_EXTENSIONS[mime_type]}", data)
+        img = Image.open(io.BytesIO(data))
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+        for width in sorted(self.derivative_widths):
+            # Every width is written so URLs can be picked without looking
+            # at the image, but images are never scaled up
+            if width < img.width:
+                height = round(img.height * width / img.width)
+                derivative = img.resize((width, height), Image.Resampling.LANCZOS)
+            else:
+                derivative = img
+            self._write(f"{content_hash}-w{width}.webp", _encode_webp(derivative))
+        # Written last so its existence means all derivatives exist
+        self._write(webp_name, _encode_webp(img))
+
+        with self._lock:
+            sizes = self._load_sizes()
+            sizes[content_hash] = sum(
+                path.stat().st_size for path in self._files(content_hash)
+            )
+            self._evict(keep=content_hash)
+        return webp_name
+
+    def export(self, code: str, target_dir: Path, url_prefix: str) -> Tuple[str, List[str]]:
+        """Copy the assets referenced by code into target_dir and point code
+        at them under url_prefix. Returns (code, names of copied files)."""
+        copied: List[str] = []
+        for name in dict.fromkeys(ASSET_URL_PATTERN.findall(code)):
+            source = self.directory / name
+            if not source.exists():
+                continue
+            target_dir.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(source, target_dir / name)
+            copied.append(name)
+
+        def local_url(match: "re.Match[str]") -> str:
+            name = match.group(1)
+            return f"{url_prefix}{name}" if name in copied else match.group(0)
+
+        return ASSET_URL_PATTERN.sub(local_url, code), copied
+
+
+def _encode_webp(img: Image.Image) -> bytes:
+    output = io.BytesIO()
+    img.save(output, format="WEBP", quality=WEBP_QUALITY, method=4)
+    return output.getvalue()
+
+
+asset_store = AssetStore(Path(ASSET_STORE_DIR), ASSET_DERIVATIVE_WIDTHS)
+
+# Stores used by put_asset, one per configuration in each worker process
+_worker_stores: Dict[Tuple[str, Tuple[int, ...], int], AssetStore] = {}
+_worker_stores_lock = threading.Lock()
+
+
+def put_asset(
+    directory: str,
+    data: bytes,
+    widths: List[int],
+    max_bytes: int = ASSET_STORE_MAX_BYTES,
+) -> str:
+    """AssetStore.put for the worker pool. A store holds a lock, so it can't
+    be sent to a process pool; this takes plain arguments and uses a store
+    kept in the worker instead."""
+    key = (directory, tuple(widths), max_bytes)
+    with _worker_stores_lock:
+        store = _worker_stores.get(key)
+        if store is None:
+            store = _worker_stores[key] = AssetStore(Path(directory), widths, max_bytes)
+    return store.put(data)
+
+
+def asset_available(url: str) -> bool:
+    """Whether url can still be used: it isn't an asset URL, or the asset
+    hasn't been evicted (in which case it's marked as used)"""
+    name = asset_name(url)
+    return name is None or asset_store.touch(name)
+
+
+async def store_generated_image(url: str) -> str:
+    """Download a generated image into the asset store and return its URL,
+    relative to the backend so it can be cached whatever the public base URL.
+    Falls back to the provider URL if that fails."""
+    if not ASSET_STORE_ENABLED:
+        return url
+    try:
+        async with client_registry.http() as client:
+            response = await client.get(url, timeout=DOWNLOAD_TIMEOUT_SECONDS)
+            response.raise_for_status()
+        name = await run_in_worker(
+            put_asset,
+            str(asset_store.directory),
+            response.content,
+            asset_store.derivative_widths,
+            asset_store.max_bytes,
+        )
+    except Exception as e:
+        print(f"[ASSET STORE] Failed to store {url[:80]}: {e}")
+        return url
+    return asset_url(name)
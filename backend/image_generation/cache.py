@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict
+
+from config import (
+    IMAGE_CACHE_ASSET_TTL_SECONDS,
+    IMAGE_CACHE_DIR,
+    IMAGE_CACHE_ENABLED,
+    IMAGE_CACHE_MAX_ENTRIES,
+    IMAGE_CACHE_TTL_SECONDS,
+)
+from image_generation.asset_store import asset_name
+
+
+@dataclass
+class ImageCacheStats:
+    hits: int = 0
+    misses: int = 0
+    # Entries found but older than the TTL (also counted as misses)
+    expired: int = 0
+    entries: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def normalize_alt_text(alt: str) -> str:
+    """Alt text as used in cache keys: Unicode-normalized, case-folded and
+    with whitespace collapsed, so trivially different prompts share images"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", alt)).strip().casefold()
+
+
+def image_cache_key(model: str, alt: str, dimensions: str) -> str:
+    """Cache key for an image generated by model from alt text at the given
+    size (or aspect ratio)"""
+    return hashlib.sha256(
+        f"{model}:{dimensions}:{normalize_alt_text(alt)}".encode()
+    ).hexdigest()
+
+
+class ImageGenerationCache:
+    """Generated image URLs stored on local disk, one JSON file per key.
+
+    Entries for provider URLs expire after ttl_seconds (the URLs stop
+    working after a while). Entries for images in the asset store expire
+    after asset_ttl_seconds, or never if it's 0; a stored image that's been
+    evicted is checked for by the caller. Least recently used entries (by
+    file mtime, bumped on every hit) are removed once there are more than
+    max_entries.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        max_entries: int,
+        ttl_seconds: float,
+        asset_ttl_seconds: float = 0,
+    ):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.asset_ttl_seconds = asset_ttl_seconds
+        self.stats = ImageCacheStats()
+        self._lock = threading.Lock()
+        self._keys: set[str] | None = None
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _load_keys(self) -> set[str]:
+        if self._keys is None:
+            self._keys = set()
+            if self.directory.exists():
+                self._keys = {path.stem for path in self.directory.glob("*.json")}
+            self.stats.entries = len(self._keys)
+        return self._keys
+
+    def _remove(self, key: str) -> None:
+        keys = self._load_keys()
+        keys.discard(key)
+        self._path(key).unlink(missing_ok=True)
+        self.stats.entries = len(keys)
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            self._load_keys()
+            path = self._path(key)
+            try:
+                entry: Dict[str, Any] = json.loads(path.read_text())
+            except (OSError, ValueError):
+                self._remove(key)
+                self.stats.misses += 1
+                return None
+
+            if self._expired(entry):
+                self._remove(key)
+                self.stats.expired += 1
+                self.stats.misses += 1
+                return None
+
+            os.utime(path)
+            self.stats.hits += 1
+            return entry["url"]
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        if asset_name(entry["url"]) is None:
+            ttl_seconds = self.ttl_seconds
+        elif self.asset_ttl_seconds > 0:
+            ttl_seconds = self.asset_ttl_seconds
+        else:
+            return False
+        return time.time() - entry["created_at"] > ttl_seconds
+
+    def put(self, key: str, model: str, alt: str, url: str) -> None:
+        with self._lock:
+            keys = self._load_keys()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._path(key)
+            data = json.dumps(
+                {"model": model, "alt": alt, "url": url, "created_at": time.time()}
+            )
+            # Write to a temp file first so readers never see a partial entry
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_text(data)
+            tmp_path.replace(path)
+            keys.add(key)
+            self._evict()
+            self.stats.entries = len(keys)
+
+    def _evict(self) -> None:
+        keys = self._load_keys()
+        if len(keys) <= self.max_entries:
+            return
+
+        def last_used(key: str) -> float:
+            try:
+                return self._path(key).stat().st_mtime
+            except OSError:
+                return 0.0
+
+        for key in sorted(keys, key=last_used)[: len(keys) - self.max_entries]:
+            keys.discard(key)
+            self._path(key).unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._load_keys()):
+                self._path(key).unlink(missing_ok=True)
+            self._keys = set()
+            self.stats.entries = 0
+
+
+image_generation_cache = ImageGenerationCache(
+    Path(IMAGE_CACHE_DIR),
+    IMAGE_CACHE_MAX_ENTRIES,
+    IMAGE_CACHE_TTL_SECONDS,
+    IMAGE_CACHE_ASSET_TTL_SECONDS,
+)
+
+
+async def get_cached_image(key: str) -> str | None:
+    if not IMAGE_CACHE_ENABLED:
+        return None
+    return await asyncio.to_thread(image_generation_cache.get, key)
+
+
+async def cache_image(key: str, model: str, alt: str, url: str) -> None:
+    if not IMAGE_CACHE_ENABLED:
+        return
+    try:
+        await asyncio.to_thread(image_generation_cache.put, key, model, alt, url)
+    except OSError as e:
+        print(f"[IMAGE CACHE] Failed to store image: {e}")
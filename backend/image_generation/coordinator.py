@@ -0,0 +1,100 @@
+import asyncio
+import weakref
+from typing import Awaitable, Callable, Dict
+
+from config import (
+    IMAGE_GENERATION_MAX_CONCURRENCY,
+    IMAGE_GENERATION_MAX_CONCURRENCY_PER_REQUEST,
+)
+
+# Bounds image generation provider calls across all requests; created in
+# the running loop when first needed
+_global_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _global_generation_slots() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    slots = _global_slots.get(loop)
+    if slots is None:
+        slots = _global_slots[loop] = asyncio.Semaphore(IMAGE_GENERATION_MAX_CONCURRENCY)
+    return slots
+
+
+async def run_with_generation_slot(
+    generate: Callable[[], Awaitable[str | None]],
+    request_slots: asyncio.Semaphore | None = None,
+) -> str | None:
+    """Call an image generation provider within the request's slots (if
+    given) and the global ones"""
+    if request_slots is None:
+        async with _global_generation_slots():
+            return await generate()
+    # The request's slot is taken first, so a request waiting for a global
+    # slot holds at most one of them
+    async with request_slots:
+        async with _global_generation_slots():
+            return await generate()
+
+
+class ImageGenerationCoordinator:
+    """Image generation shared by all variants of one request.
+
+    Variants asking for the same image (same cache key, i.e. model,
+    normalized alt text and size) await a single generation and share its
+    result, whether it's still in flight or already done. At most
+    max_concurrency of the request's images are generated at once.
+    """
+
+    def __init__(
+        self, max_concurrency: int = IMAGE_GENERATION_MAX_CONCURRENCY_PER_REQUEST
+    ):
+        self.max_concurrency = max_concurrency
+        self._slots: asyncio.Semaphore | None = None
+        self._results: Dict[str, "asyncio.Future[str | None]"] = {}
+        # Started while a completion was streaming, not yet asked for
+        self._prefetched: set[str] = set()
+        # Images asked for by variants, and how many of those reused a
+        # generation another variant had asked for
+        self.requested = 0
+        self.calls_saved = 0
+        self.prefetched = 0
+
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        """The request's provider call slots, created in the running loop"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        return self._slots
+
+    def prefetch(self, key: str, generate: Callable[[], Awaitable[str | None]]) -> None:
+        """Start generating an image a variant is about to ask for"""
+        if key in self._results:
+            return
+        future = asyncio.ensure_future(generate())
+        # Don't warn about errors if it ends up never being asked for
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._results[key] = future
+        self._prefetched.add(key)
+        self.prefetched += 1
+
+    async def generate(
+        self, key: str, generate: Callable[[], Awaitable[str | None]]
+    ) -> str | None:
+        self.requested += 1
+        future = self._results.get(key)
+        if future is None:
+            future = asyncio.ensure_future(generate())
+            self._results[key] = future
+        elif key in self._prefetched:
+            self._prefetched.discard(key)
+        else:
+            self.calls_saved += 1
+        # A variant being cancelled mustn't cancel the generation for the others
+        return await asyncio.shield(future)
+
+    def cancel(self) -> None:
+        """Cancel generations no variant is waiting for anymore"""
+        for future in self._results.values():
+            future.cancel()
@@ -1,10 +1,98 @@
 import asyncio
 import re
-from typing import Dict, List, Literal, Union
-from openai import AsyncOpenAI
-from bs4 import BeautifulSoup
-
+from typing import Awaitable, Callable, Dict, List, Literal, Union
+
+from clients.registry import client_registry
+from image_generation.asset_store import (
+    asset_available,
+    asset_url_for_width,
+    store_generated_image,
+)
+from image_generation.cache import (
+    cache_image,
+    get_cached_image,
+    image_cache_key,
+    image_generation_cache,
+)
+from image_generation.coordinator import (
+    ImageGenerationCoordinator,
+    run_with_generation_slot,
+)
+from image_generation.img_tags import ImgTag, find_img_tags, rewrite_img_tags
 from image_generation.replicate import call_replicate
+from image_generation.scanner import PLACEHOLDER_IMAGE_PREFIX
+
+# Size of the generated images, also part of the image cache key
+DALLE_IMAGE_SIZE = "1024x1024"
+FLUX_ASPECT_RATIO = "1:1"
+
+
+def _image_key(prompt: str, model: Literal["dalle3", "flux"]) -> str:
+    dimensions = DALLE_IMAGE_SIZE if model == "dalle3" else FLUX_ASPECT_RATIO
+    return image_cache_key(model, prompt, dimensions)
+
+
+def _image_generator(
+    key: str,
+    prompt: str,
+    api_key: str,
+    base_url: str | None,
+    model: Literal["dalle3", "flux"],
+    request_slots: asyncio.Semaphore | None = None,
+) -> Callable[[], Awaitable[Union[str, None]]]:
+    async def generate() -> Union[str, None]:
+        cached_url = await get_cached_image(key)
+        # The image may have been evicted from the asset store since
+        if cached_url is not None and asset_available(cached_url):
+            return cached_url
+
+        if model == "dalle3":
+            url = await run_with_generation_slot(
+                lambda: generate_image_dalle(prompt, api_key, base_url), request_slots
+            )
+        else:
+            url = await run_with_generation_slot(
+                lambda: generate_image_replicate(prompt, api_key), request_slots
+            )
+        if url:
+            url = await store_generated_image(url)
+            await cache_image(key, model, prompt, url)
+        return url
+
+    return generate
+
+
+async def _generate_image(
+    prompt: str,
+    api_key: str,
+    base_url: str | None,
+    model: Literal["dalle3", "flux"],
+    coordinator: ImageGenerationCoordinator | None = None,
+) -> Union[str, None]:
+    """Generate an image, reusing a cached one for the same prompt and size,
+    or one another variant of the request is already generating"""
+    key = _image_key(prompt, model)
+    if coordinator is None:
+        return await _image_generator(key, prompt, api_key, base_url, model)()
+    generate = _image_generator(
+        key, prompt, api_key, base_url, model, coordinator.slots
+    )
+    return await coordinator.generate(key, generate)
+
+
+def prefetch_image(
+    prompt: str,
+    api_key: str,
+    base_url: str | None,
+    model: Literal["dalle3", "flux"],
+    coordinator: ImageGenerationCoordinator,
+) -> None:
+    """Start generating an image for a placeholder seen in a streaming
+    completion; generate_images picks up the result later"""
+    key = _image_key(prompt, model)
+    coordinator.prefetch(
+        key, _image_generator(key, prompt, api_key, base_url, model, coordinator.slots)
+    )
 
 
 async def process_tasks(
@@ -12,18 +100,25 @@ async def process_tasks(
     api_key: str,
     base_url: str | None,
     model: Literal["dalle3", "flux"],
+    coordinator: ImageGenerationCoordinator | None = None,
 ):
     import time
 
     start_time = time.time()
-    if model == "dalle3":
-        tasks = [generate_image_dalle(prompt, api_key, base_url) for prompt in prompts]
-    else:
-        tasks = [generate_image_replicate(prompt, api_key) for prompt in prompts]
+    stats = image_generation_cache.stats
+    hits_before = stats.hits
+    tasks = [
+        _generate_image(prompt, api_key, base_url, model, coordinator)
+        for prompt in prompts
+    ]
     results = await asyncio.gather(*tasks, return_exceptions=True)
     end_time = time.time()
     generation_time = end_time - start_time
     print(f"Image generation time: {generation_time:.2f} seconds")
+    print(
+        f"[IMAGE CACHE] {stats.hits - hits_before}/{len(prompts)} images cached "
+        f"(hit rate {stats.hit_rate:.0%} over {stats.hits + stats.misses} lookups)"
+    )
 
     processed_results: List[Union[str, None]] = []
     for result in results:
@@ -39,16 +134,15 @@ async def process_tasks(
 async def generate_image_dalle(
     prompt: str, api_key: str, base_url: str | None
 ) -> Union[str, None]:
-    client = AsyncOpenAI(api_key=api_key, base_url=base_url)
-    res = await client.images.generate(
-        model="dall-e-3",
-        quality="standard",
-        style="natural",
-        n=1,
-        size="1024x1024",
-        prompt=prompt,
-    )
-    await client.close()
+    async with client_registry.openai(api_key, base_url) as client:
+        res = await client.images.generate(
+            model="dall-e-3",
+            quality="standard",
+            style="natural",
+            n=1,
+            size=DALLE_IMAGE_SIZE,
+            prompt=prompt,
+        )
     return res.data[0].url
 
 
@@ -58,7 +152,7 @@ async def generate_image_replicate(prompt: str, api_key: str) -> str:
     return await call_replicate(
         {
             "prompt": prompt,
-            "aspect_ratio": "1:1",
+            "aspect_ratio": FLUX_ASPECT_RATIO,
             "output_format": "png",
         },
         api_key,
@@ -79,78 +173,82 @@ def extract_dimensions(url: str):
 
 
 def create_alt_url_mapping(code: str) -> Dict[str, str]:
-    soup = BeautifulSoup(code, "html.parser")
-    images = soup.find_all("img")
-
     mapping: Dict[str, str] = {}
 
-    for image in images:
-        if not image["src"].startswith("https://placehold.co"):
-            mapping[image["alt"]] = image["src"]
+    for image in find_img_tags(code):
+        src = image.attributes.get("src")
+        alt = image.attributes.get("alt")
+        if src is not None and alt is not None and not src.startswith(
+            PLACEHOLDER_IMAGE_PREFIX
+        ):
+            mapping[alt] = src
 
     return mapping
 
 
+def replace_placeholder_images(
+    code: str, image_urls: Dict[str, str | None], asset_base_url: str = ""
+) -> str:
+    """Point placeholder images at their generated URLs (by alt text) and
+    give them the placeholder's width and height. Only those attributes
+    change; the rest of the code is left byte for byte. Stored assets are
+    linked under asset_base_url."""
+
+    def updates_for(img: ImgTag) -> Dict[str, str] | None:
+        src = img.attributes.get("src", "")
+        # Leave images that don't start with https://placehold.co alone
+        if not src.startswith(PLACEHOLDER_IMAGE_PREFIX):
+            return None
+
+        alt = img.attributes.get("alt")
+        new_url = image_urls.get(alt) if alt is not None else None
+        if not new_url:
+            print(f"Image generation failed for alt text: {alt}")
+            return None
+
+        width, height = extract_dimensions(src)
+        return {
+            "src": asset_url_for_width(new_url, width, asset_base_url),
+            "width": str(width),
+            "height": str(height),
+        }
+
+    return rewrite_img_tags(code, updates_for)
+
+
 async def generate_images(
     code: str,
     api_key: str,
     base_url: Union[str, None],
     image_cache: Dict[str, str],
     model: Literal["dalle3", "flux"] = "dalle3",
+    coordinator: ImageGenerationCoordinator | None = None,
+    asset_base_url: str = "",
 ) -> str:
-    # Find all images
-    soup = BeautifulSoup(code, "html.parser")
-    images = soup.find_all("img")
-
-    # Extract alt texts as image prompts
-    alts: List[str | None] = []
-    for img in images:
-        # Only include URL if the image starts with https://placehold.co
-        # and it's not already in the image_cache
+    # Extract alt texts of placeholder images as image prompts, skipping
+    # images with no alt text and those already in the image_cache
+    prompts: List[str] = []
+    for img in find_img_tags(code):
+        alt = img.attributes.get("alt")
         if (
-            img.get("src", None)
-            and img["src"].startswith("https://placehold.co")
-            and image_cache.get(img.get("alt")) is None
+            img.attributes.get("src", "").startswith(PLACEHOLDER_IMAGE_PREFIX)
+            and alt is not None
+            and image_cache.get(alt) is None
+            and alt not in prompts
         ):
-            alts.append(img.get("alt", None))
-
-    # Exclude images with no alt text
-    filtered_alts: List[str] = [alt for alt in alts if alt is not None]
-
-    # Remove duplicates
-    prompts = list(set(filtered_alts))
+            prompts.append(alt)
 
     # Return early if there are no images to replace
     if len(prompts) == 0:
         return code
 
     # Generate images
-    results = await process_tasks(prompts, api_key, base_url, model)
+    results = await process_tasks(prompts, api_key, base_url, model, coordinator)
 
-    # Create a dict mapping alt text to image URL
-    mapped_image_urls = dict(zip(prompts, results))
-
-    # Merge with image_cache
-    mapped_image_urls = {**mapped_image_urls, **image_cache}
-
-    # Replace old image URLs with the generated URLs
-    for img in images:
-        # Skip images that don't start with https://placehold.co (leave them alone)
-        if not img["src"].startswith("https://placehold.co"):
-            continue
-
-        new_url = mapped_image_urls[img.get("alt")]
-
-        if new_url:
-            # Set width and height attributes
-            width, height = extract_dimensions(img["src"])
-            img["width"] = width
-            img["height"] = height
-            # Replace img['src'] with the mapped image URL
-            img["src"] = new_url
-        else:
-            print("Image generation failed for alt text:" + img.get("alt"))
+    # Create a dict mapping alt text to image URL, merged with image_cache
+    mapped_image_urls: Dict[str, str | None] = {
+        **dict(zip(prompts, results)),
+        **image_cache,
+    }
 
-    # Return the modified HTML
-    # (need to prettify it because BeautifulSoup messes up the formatting)
-    return soup.prettify()
+    return replace_placeholder_images(code, mapped_image_urls, asset_base_url)
@@ -0,0 +1,101 @@
+import html
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Tuple
+
+# A whole <img> tag; quoted attribute values may contain ">"
+IMG_TAG = re.compile(r"""<img\b(?:[^>"']|"[^"]*"|'[^']*')*>""", re.IGNORECASE)
+
+_ATTRIBUTE = re.compile(
+    r"""([^\s"'<>/=]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+))"""
+)
+
+# Comments and the raw text of <script> and <style> are skipped, like an HTML
+# parser would; everything else is only scanned for <img> tags
+_TOKEN = re.compile(
+    r"""<!--.*?-->"""
+    r"""|<(script|style)\b(?:[^>"']|"[^"]*"|'[^']*')*>.*?</\1\s*>"""
+    r"""|<img\b(?:[^>"']|"[^"]*"|'[^']*')*>""",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def parse_attributes(tag: str) -> Dict[str, str]:
+    """Attributes of a single HTML start tag, with entities unescaped"""
+    return {name: value for name, (value, _) in _attribute_spans(tag).items()}
+
+
+def _attribute_spans(tag: str) -> Dict[str, Tuple[str, Tuple[int, int]]]:
+    """name -> (unescaped value, span of the whole attribute in tag).
+    The first occurrence of an attribute wins, as in browsers."""
+    attributes: Dict[str, Tuple[str, Tuple[int, int]]] = {}
+    for match in _ATTRIBUTE.finditer(tag):
+        name, double_quoted, single_quoted, unquoted = match.groups()
+        value = next(
+            (v for v in (double_quoted, single_quoted, unquoted) if v is not None), ""
+        )
+        attributes.setdefault(name.lower(), (html.unescape(value), match.span()))
+    return attributes
+
+
+@dataclass
+class ImgTag:
+    # Position of the tag in the document
+    start: int
+    end: int
+    text: str
+    attributes: Dict[str, str]
+
+
+def find_img_tags(code: str) -> Iterator[ImgTag]:
+    """<img> tags in an HTML document, in order, in one linear pass"""
+    for match in _TOKEN.finditer(code):
+        text = match.group(0)
+        if text[:4].lower() == "<img":
+            yield ImgTag(match.start(), match.end(), text, parse_attributes(text))
+
+
+def _set_attributes(tag: str, updates: Dict[str, str]) -> str:
+    """tag with the given attribute values replaced (or added before the end
+    of the tag), leaving everything else as is"""
+    spans = _attribute_spans(tag)
+    replacements: List[Tuple[int, int, str]] = []
+    added: List[str] = []
+    for name, value in updates.items():
+        attribute = f'{name}="{html.escape(value, quote=True)}"'
+        if name in spans:
+            start, end = spans[name][1]
+            replacements.append((start, end, attribute))
+        else:
+            added.append(attribute)
+
+    if added:
+        # After the last attribute, before any whitespace and "/>" or ">"
+        position = len(tag[:-1].rstrip("/").rstrip())
+        replacements.append((position, position, " " + " ".join(added)))
+
+    result = tag
+    for start, end, text in sorted(replacements, reverse=True):
+        result = result[:start] + text + result[end:]
+    return result
+
+
+def rewrite_img_tags(
+    code: str, updates_for: Callable[[ImgTag], Dict[str, str] | None]
+) -> str:
+    """Rewrite attributes of <img> tags. updates_for returns the attributes
+    to set on a tag, or None to leave it alone. Bytes outside the changed
+    attributes are kept exactly."""
+    parts: List[str] = []
+    last = 0
+    for tag in find_img_tags(code):
+        updates = updates_for(tag)
+        if not updates:
+            continue
+        parts.append(code[last : tag.start])
+        parts.append(_set_attributes(tag.text, updates))
+        last = tag.end
+    if not parts:
+        return code
+    parts.append(code[last:])
+    return "".join(parts)
@@ -1,65 +1,139 @@
 import asyncio
+import random
+from typing import Any, Dict
+
 import httpx
 
+from clients.registry import client_registry
+from config import (
+    REPLICATE_API_BASE_URL,
+    REPLICATE_DEADLINE_SECONDS,
+    REPLICATE_POLL_INITIAL_SECONDS,
+    REPLICATE_POLL_MAX_SECONDS,
+    REPLICATE_PREFER_WAIT_SECONDS,
+)
+
+REPLICATE_MODEL = "black-forest-labs/flux-2-klein-4b"
+
+# Extra time allowed on top of the "Prefer: wait" duration for the create call
+WAIT_TIMEOUT_MARGIN_SECONDS = 10
+
+
+def poll_delay(attempt: int, initial: float, maximum: float) -> float:
+    """Exponential backoff with jitter: between half and all of
+    initial * 2^attempt, capped at maximum"""
+    delay = min(initial * 2**attempt, maximum)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _prediction_output(prediction: Dict[str, Any]) -> str:
+    output = prediction.get("output")
+    # Most image models return a list of URLs
+    if isinstance(output, list) and output:
+        return output[0]
+    if isinstance(output, str):
+        return output
+    raise ValueError("Prediction succeeded without an output")
 
-async def call_replicate(input: dict[str, str | int], api_token: str) -> str:
+
+async def _cancel_prediction(
+    client: httpx.AsyncClient, prediction: Dict[str, Any], headers: Dict[str, str]
+) -> None:
+    cancel_url = prediction.get("urls", {}).get("cancel")
+    if not cancel_url:
+        return
+    try:
+        await client.post(cancel_url, headers=headers)
+    except httpx.HTTPError as e:
+        print(f"Failed to cancel Replicate prediction: {e}")
+
+
+async def call_replicate(
+    input: dict[str, str | int],
+    api_token: str,
+    deadline_seconds: float = REPLICATE_DEADLINE_SECONDS,
+    prefer_wait_seconds: int = REPLICATE_PREFER_WAIT_SECONDS,
+    base_url: str = REPLICATE_API_BASE_URL,
+) -> str:
+    """Run a prediction and return its output URL.
+
+    The create request asks Replicate to wait for the result ("Prefer:
+    wait"). If the prediction isn't done by then, it's polled with
+    exponential backoff until it finishes or deadline_seconds have passed,
+    in which case it's cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + deadline_seconds
     headers = {
         "Authorization": f"Bearer {api_token}",
         "Content-Type": "application/json",
     }
+    create_headers = dict(headers)
+    wait_seconds = min(prefer_wait_seconds, 60, int(deadline_seconds))
+    if wait_seconds > 0:
+        create_headers["Prefer"] = f"wait={wait_seconds}"
 
     data = {"input": input}
 
-    async with httpx.AsyncClient() as client:
+    async with client_registry.http() as client:
         try:
             response = await client.post(
-                "https://api.replicate.com/v1/models/black-forest-labs/flux-2-klein-4b/predictions",
-                headers=headers,
+                f"{base_url}/models/{REPLICATE_MODEL}/predictions",
+                headers=create_headers,
                 json=data,
+                timeout=max(wait_seconds, 0) + WAIT_TIMEOUT_MARGIN_SECONDS,
             )
             response.raise_for_status()
-            response_json = response.json()
+            prediction = response.json()
 
-            # Extract the id from the response
-            prediction_id = response_json.get("id")
+            prediction_id = prediction.get("id")
             if not prediction_id:
                 raise ValueError("Prediction ID not found in initial response.")
+            status_check_url = prediction.get("urls", {}).get(
+                "get", f"{base_url}/predictions/{prediction_id}"
+            )
 
-            # Polling every 0.1 seconds until the status is succeeded or error (upto 10s)
-            num_polls = 0
-            max_polls = 100
-            while num_polls < max_polls:
-                num_polls += 1
-
-                await asyncio.sleep(0.1)
-
-                # Check the status
-                status_check_url = (
-                    f"https://api.replicate.com/v1/predictions/{prediction_id}"
-                )
-                status_response = await client.get(status_check_url, headers=headers)
-                status_response.raise_for_status()
-                status_response_json = status_response.json()
-                status = status_response_json.get("status")
-
-                # If status is succeeded or if there's an error, break out of the loop
+            attempt = 0
+            while True:
+                status = prediction.get("status")
                 if status == "succeeded":
-                    return status_response_json["output"][0]
+                    return _prediction_output(prediction)
                 elif status == "error":
                     raise ValueError(
-                        f"Inference errored out: {status_response_json.get('error', 'Unknown error')}"
+                        f"Inference errored out: {prediction.get('error', 'Unknown error')}"
+                    )
+                elif status in ("failed", "canceled"):
+                    raise ValueError(
+                        f"Inference {status}: {prediction.get('error') or 'no details'}"
                     )
-                elif status == "failed":
-                    raise ValueError("Inference failed")
 
-            # If we've reached here, it means we've exceeded the max number of polls
-            raise TimeoutError("Inference timed out")
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    await _cancel_prediction(client, prediction, headers)
+                    raise TimeoutError(
+                        f"Inference timed out after {deadline_seconds:.0f}s"
+                    )
+                await asyncio.sleep(
+                    min(
+                        poll_delay(
+                            attempt,
+                            REPLICATE_POLL_INITIAL_SECONDS,
+                            REPLICATE_POLL_MAX_SECONDS,
+                        ),
+                        remaining,
+                    )
+                )
+                attempt += 1
+
+                status_response = await client.get(status_check_url, headers=headers)
+                status_response.raise_for_status()
+                prediction = status_response.json()
 
         except httpx.HTTPStatusError as e:
             raise ValueError(f"HTTP error occurred: {e}")
         except httpx.RequestError as e:
             raise ValueError(f"An error occurred while requesting: {e}")
-        except asyncio.TimeoutError:
-            raise TimeoutError("Request timed out")
+        except (TimeoutError, ValueError):
+            raise
         except Exception as e:
             raise ValueError(f"An unexpected error occurred: {e}")
@@ -0,0 +1,63 @@
+import re
+from typing import List
+
+from image_generation.img_tags import IMG_TAG, parse_attributes
+
+PLACEHOLDER_IMAGE_PREFIX = "https://placehold.co"
+
+_IMG_START = re.compile(r"<img\b", re.IGNORECASE)
+
+# Give up on a tag that hasn't closed after this many characters
+MAX_TAG_CHARS = 8192
+
+
+class PlaceholderImageScanner:
+    """Finds placeholder <img> tags in a completion while it streams.
+
+    feed() takes each chunk and returns the alt texts of placehold.co images
+    whose tags were completed by it, each alt text once. Scanning resumes
+    where the previous call stopped, so the whole stream is scanned in
+    linear time.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._seen: set[str] = set()
+
+    def feed(self, chunk: str) -> List[str]:
+        self._text += chunk
+        alts: List[str] = []
+        while True:
+            start = _IMG_START.search(self._text, self._pos)
+            if start is None:
+                # Keep the tail in case it's the start of a split "<img"
+                self._pos = max(self._pos, len(self._text) - len("<img"))
+                break
+
+            tag = IMG_TAG.match(self._text, start.start())
+            if tag is None:
+                if len(self._text) - start.start() > MAX_TAG_CHARS:
+                    # Malformed; skip it
+                    self._pos = start.end()
+                    continue
+                # The tag isn't complete yet
+                self._pos = start.start()
+                break
+
+            self._pos = tag.end()
+            attributes = parse_attributes(tag.group(0))
+            alt = attributes.get("alt")
+            if (
+                alt
+                and attributes.get("src", "").startswith(PLACEHOLDER_IMAGE_PREFIX)
+                and alt not in self._seen
+            ):
+                self._seen.add(alt)
+                alts.append(alt)
+
+        # Drop text that has been fully scanned
+        if self._pos > 0:
+            self._text = self._text[self._pos :]
+            self._pos = 0
+        return alts
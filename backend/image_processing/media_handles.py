@@ -0,0 +1,134 @@
+import asyncio
+import itertools
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Tuple
+
+from config import MEDIA_HANDLE_EXPIRY_MARGIN_SECONDS
+
+# How long the local stand-in keeps files, like Gemini's Files API
+LOCAL_HANDLE_TTL_SECONDS = 48 * 60 * 60
+
+# Media to upload: its bytes, or the path of the file holding them (uploaded
+# media is sent from the media store's file rather than copied into memory)
+MediaSource = bytes | str
+
+
+@dataclass
+class MediaHandle:
+    """A reference to media uploaded to a provider, usable in place of its bytes"""
+
+    uri: str
+    mime_type: str
+    expires_at: float  # time.time() timestamp
+
+
+class MediaUploader(ABC):
+    """Uploads media to a provider's file storage"""
+
+    # Handles are only valid for the account they were uploaded with, so
+    # they're cached per uploader key
+    key: str
+
+    @abstractmethod
+    async def upload(self, data: MediaSource, mime_type: str) -> MediaHandle:
+        """Upload data and wait until the provider can use it"""
+
+
+class LocalMediaUploader(MediaUploader):
+    """Stand-in uploader that keeps files in memory, for tests and offline use"""
+
+    def __init__(self, ttl_seconds: float = LOCAL_HANDLE_TTL_SECONDS):
+        self.key = "local"
+        self.ttl_seconds = ttl_seconds
+        self.files: Dict[str, bytes] = {}
+        self._ids = itertools.count()
+
+    async def upload(self, data: MediaSource, mime_type: str) -> MediaHandle:
+        uri = f"local://files/{next(self._ids)}"
+        self.files[uri] = Path(data).read_bytes() if isinstance(data, str) else data
+        return MediaHandle(uri, mime_type, time.time() + self.ttl_seconds)
+
+
+class MediaHandleCache:
+    """Provider handles for uploaded media, by uploader and content hash.
+
+    Shared by all requests, so a video is uploaded once and referenced by
+    every variant and by later requests with the same video until the
+    provider expires it. Concurrent requests for the same media share one
+    upload.
+    """
+
+    def __init__(self, expiry_margin_seconds: float = MEDIA_HANDLE_EXPIRY_MARGIN_SECONDS):
+        # A handle this close to expiring is uploaded again, so it doesn't
+        # expire during a generation
+        self.expiry_margin_seconds = expiry_margin_seconds
+        self._handles: Dict[Tuple[str, str], MediaHandle] = {}
+        self._in_flight: Dict[Tuple[str, str], "asyncio.Future[MediaHandle]"] = {}
+        self.uploads = 0
+        self.hits = 0
+
+    def get(self, uploader_key: str, content_hash: str) -> MediaHandle | None:
+        handle = self._handles.get((uploader_key, content_hash))
+        if handle is None:
+            return None
+        if handle.expires_at - time.time() < self.expiry_margin_seconds:
+            del self._handles[(uploader_key, content_hash)]
+            return None
+        return handle
+
+    def _prune(self) -> None:
+        now = time.time()
+        for key, handle in list(self._handles.items()):
+            if handle.expires_at - now < self.expiry_margin_seconds:
+                del self._handles[key]
+
+    async def get_or_upload(
+        self,
+        uploader: MediaUploader,
+        content_hash: str,
+        data: MediaSource,
+        mime_type: str,
+    ) -> MediaHandle | None:
+        """The handle for the media, uploading it if there isn't one. None
+        if the upload fails, in which case the media should be sent inline."""
+        key = (uploader.key, content_hash)
+        handle = self.get(*key)
+        if handle is not None:
+            self.hits += 1
+            return handle
+
+        future = self._in_flight.get(key)
+        if future is None:
+
+            async def upload() -> MediaHandle:
+                handle = await uploader.upload(data, mime_type)
+                self.uploads += 1
+                self._prune()
+                self._handles[key] = handle
+                return handle
+
+            def done(future: "asyncio.Future[MediaHandle]") -> None:
+                self._in_flight.pop(key, None)
+                # Retrieve the error even if every waiter was cancelled
+                if not future.cancelled():
+                    future.exception()
+
+            future = asyncio.ensure_future(upload())
+            self._in_flight[key] = future
+            future.add_done_callback(done)
+        else:
+            self.hits += 1
+
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[MEDIA] Upload of {content_hash[:12]} failed, sending inline: {e}")
+            return None
+
+
+media_handles = MediaHandleCache()
@@ -0,0 +1,388 @@
+import asyncio
+import base64
+import hashlib
+import io
+import mmap
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, TypeVar, cast
+
+from openai.types.chat import ChatCompletionMessageParam
+from PIL import Image
+
+from image_processing.media_handles import MediaHandle, MediaUploader, media_handles
+from image_processing.media_store import (
+    MediaStore,
+    is_media_ref,
+    media_id_from_ref,
+    media_store,
+)
+from image_processing.utils import process_image_bytes
+from scheduling.worker_pool import run_in_worker
+from video.cost_estimation import (
+    get_video_duration_from_bytes,
+    get_video_duration_from_file,
+)
+from video.keyframes import Keyframe, extract_keyframes
+from video.probe import probe_video_duration
+
+T = TypeVar("T")
+
+
+def detect_mime_type(data: bytes) -> str | None:
+    """Detect the MIME type of image or video bytes from their magic numbers"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:2] == b"\xff\xd8":
+        return "image/jpeg"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp":
+        # MP4/MOV file
+        return "video/mp4"
+    if data[:4] == b"\x1aE\xdf\xa3":
+        # WebM file
+        return "video/webm"
+    return None
+
+
+def decode_data_url(data_url: str) -> Tuple[str, str | None, bytes]:
+    """(content hash, MIME type, bytes) of a base64 data URL.
+    Module-level so it can run in a process pool."""
+    content_hash = hashlib.sha256(data_url.encode("utf-8")).hexdigest()
+    header, base64_data = data_url.split(",", 1)
+    mime_type: str | None = header.split(";")[0].split(":")[1]
+    data = base64.b64decode(base64_data)
+    if mime_type == "application/octet-stream":
+        mime_type = detect_mime_type(data)
+    return content_hash, mime_type, data
+
+
+def image_data_urls(messages: List[ChatCompletionMessageParam]) -> List[str]:
+    """Data URLs and uploaded media references of the images in OpenAI-style
+    messages"""
+    urls: List[str] = []
+    for message in messages:
+        content = message.get("content")
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            part = cast(Dict[str, Any], part)
+            if part.get("type") != "image_url":
+                continue
+            url = part["image_url"]["url"]
+            if (url.startswith("data:") or is_media_ref(url)) and url not in urls:
+                urls.append(url)
+    return urls
+
+
+class MediaNotFoundError(Exception):
+    """A media reference whose upload doesn't exist or has been evicted"""
+
+
+@dataclass
+class DecodedMedia:
+    content_hash: str
+    # None when the data URL is generic and the bytes aren't a known format
+    mime_type: str | None
+    # Memory-mapped for uploaded media; only copied with bytes(data) at an
+    # SDK boundary that needs real bytes
+    data: bytes | mmap.mmap
+    # The data URL's base64 payload, encoded on demand for uploaded media
+    encoded: str | None = None
+    # The media store file that data maps, for uploaded media
+    path: str | None = None
+
+    @property
+    def source(self) -> bytes | str:
+        """The bytes, or for uploaded media the path of their file. Passed to
+        the worker pool and to consumers that open files, so the memory map
+        is neither copied nor pickled."""
+        return self.path if self.path is not None else cast(bytes, self.data)
+
+    @property
+    def base64_data(self) -> str:
+        if self.encoded is None:
+            self.encoded = base64.b64encode(self.data).decode("ascii")
+        return self.encoded
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type or 'application/octet-stream'};base64,{self.base64_data}"
+
+
+class MediaRegistry:
+    """Media in one request's data URLs, decoded once and shared by all variants.
+
+    Provider-specific encodings are cached by content hash, so each variant's
+    message converter references the same strings and bytes instead of
+    copying and re-processing them. The prepare_* methods do the decoding
+    and re-encoding in the media worker pool, off the event loop; the
+    converters then only read from the cache.
+
+    "media:<id>" references to uploaded media are memory-mapped from the
+    media store instead of being decoded. close() unmaps them once the
+    request is done.
+    """
+
+    def __init__(self, store: MediaStore = media_store):
+        self.store = store
+        self._hashes: Dict[str, str] = {}  # data URL -> content hash
+        self._decoded: Dict[str, DecodedMedia] = {}
+        self._claude_images: Dict[str, Tuple[str, str]] = {}
+        self._image_sizes: Dict[str, Tuple[int, int] | None] = {}
+        self._video_durations: Dict[str, float | None] = {}
+        self._video_keyframes: Dict[str, List[Keyframe] | None] = {}
+        # Provider handles for media uploaded during this request
+        self._handles: Dict[str, MediaHandle] = {}
+        # Work in progress in the worker pool, shared by concurrent variants
+        self._in_flight: Dict[Tuple[str, str], "asyncio.Future[Any]"] = {}
+        # Number of data URLs actually decoded, for reporting reuse
+        self.decode_count = 0
+
+    def _store_decoded(
+        self, data_url: str, decoded: Tuple[str, str | None, bytes]
+    ) -> DecodedMedia:
+        content_hash, mime_type, data = decoded
+        self._hashes[data_url] = content_hash
+        if content_hash not in self._decoded:
+            base64_data = data_url.split(",", 1)[1]
+            self._decoded[content_hash] = DecodedMedia(
+                content_hash, mime_type, data, base64_data
+            )
+            self.decode_count += 1
+        return self._decoded[content_hash]
+
+    def _cached(self, data_url: str) -> DecodedMedia | None:
+        content_hash = self._hashes.get(data_url)
+        return self._decoded[content_hash] if content_hash is not None else None
+
+    async def _single_flight(
+        self, key: Tuple[str, str], work: Callable[[], Awaitable[T]]
+    ) -> T:
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(work())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+    def _open_stored(self, ref: str) -> DecodedMedia:
+        media_id = media_id_from_ref(ref)
+        if media_id not in self._decoded:
+            stored = self.store.open(media_id)
+            if stored is None:
+                raise MediaNotFoundError(f"Uploaded media not found: {media_id}")
+            self._decoded[media_id] = DecodedMedia(
+                media_id, stored.mime_type, stored.data, path=stored.path
+            )
+        self._hashes[ref] = media_id
+        return self._decoded[media_id]
+
+    def decode(self, data_url: str) -> DecodedMedia:
+        decoded = self._cached(data_url)
+        if decoded is None:
+            if is_media_ref(data_url):
+                return self._open_stored(data_url)
+            decoded = self._store_decoded(data_url, decode_data_url(data_url))
+        return decoded
+
+    async def decode_async(self, data_url: str) -> DecodedMedia:
+        decoded = self._cached(data_url)
+        if decoded is not None:
+            return decoded
+        if is_media_ref(data_url):
+            # Mapping a file is cheap; nothing to do in the worker pool
+            return self._open_stored(data_url)
+
+        async def work() -> DecodedMedia:
+            result = await run_in_worker(decode_data_url, data_url)
+            return self._store_decoded(data_url, result)
+
+        return await self._single_flight(("decode", data_url), work)
+
+    def claude_image(self, data_url: str) -> Tuple[str, str]:
+        """(media type, base64 data) within Claude's size and dimension limits"""
+        decoded = self.decode(data_url)
+        claude_image = self._claude_images.get(decoded.content_hash)
+        if claude_image is None:
+            claude_image = process_image_bytes(
+                decoded.mime_type or "application/octet-stream",
+                decoded.base64_data,
+                decoded.source,
+            )
+            self._claude_images[decoded.content_hash] = claude_image
+        return claude_image
+
+    def image_size(self, data_url: str) -> Tuple[int, int] | None:
+        """(width, height) of an image that has been decoded, read from its
+        header. None if it hasn't been decoded or isn't an image."""
+        decoded = self._cached(data_url)
+        if decoded is None or not (decoded.mime_type or "").startswith("image/"):
+            return None
+        if decoded.content_hash not in self._image_sizes:
+            try:
+                image = decoded.path or io.BytesIO(cast(bytes, decoded.data))
+                with Image.open(image) as img:
+                    size: Tuple[int, int] | None = img.size
+            except Exception:
+                size = None
+            self._image_sizes[decoded.content_hash] = size
+        return self._image_sizes[decoded.content_hash]
+
+    async def _prepare_claude_image(self, data_url: str) -> None:
+        decoded = await self.decode_async(data_url)
+        if decoded.content_hash in self._claude_images:
+            return
+
+        async def work() -> None:
+            self._claude_images[decoded.content_hash] = await run_in_worker(
+                process_image_bytes,
+                decoded.mime_type or "application/octet-stream",
+                decoded.base64_data,
+                decoded.source,
+            )
+
+        await self._single_flight(("claude", decoded.content_hash), work)
+
+    async def prepare_claude_images(
+        self, messages: List[ChatCompletionMessageParam]
+    ) -> None:
+        """Decode and re-encode the images in messages for Claude in the worker pool"""
+        await asyncio.gather(
+            *(self._prepare_claude_image(url) for url in image_data_urls(messages))
+        )
+
+    async def video_duration(self, data_url: str) -> float | None:
+        """Duration of a video in seconds, computed once for all variants.
+
+        Read from the container headers when possible; other containers
+        are opened with moviepy in the worker pool.
+        """
+        decoded = await self.decode_async(data_url)
+        if decoded.content_hash in self._video_durations:
+            return self._video_durations[decoded.content_hash]
+
+        async def work() -> float | None:
+            duration = probe_video_duration(decoded.data)
+            if duration is None and decoded.path is not None:
+                duration = await run_in_worker(
+                    get_video_duration_from_file, decoded.path
+                )
+            elif duration is None:
+                duration = await run_in_worker(
+                    get_video_duration_from_bytes, decoded.source
+                )
+            self._video_durations[decoded.content_hash] = duration
+            return duration
+
+        return await self._single_flight(("duration", decoded.content_hash), work)
+
+    async def video_keyframes(self, data_url: str) -> List[Keyframe] | None:
+        """The frames of a video where its UI changes, extracted once for all
+        variants in the worker pool. None if the video can't be decoded."""
+        decoded = await self.decode_async(data_url)
+        if decoded.content_hash in self._video_keyframes:
+            return self._video_keyframes[decoded.content_hash]
+
+        async def work() -> List[Keyframe] | None:
+            keyframes = await run_in_worker(extract_keyframes, decoded.source)
+            self._video_keyframes[decoded.content_hash] = keyframes
+            return keyframes
+
+        return await self._single_flight(("keyframes", decoded.content_hash), work)
+
+    async def upload(
+        self, data_url: str, uploader: MediaUploader
+    ) -> MediaHandle | None:
+        """Upload media to a provider, once across variants and requests.
+        None if the upload failed and the media should be sent inline."""
+        decoded = await self.decode_async(data_url)
+        handle = await media_handles.get_or_upload(
+            uploader,
+            decoded.content_hash,
+            decoded.source,
+            decoded.mime_type or "application/octet-stream",
+        )
+        if handle is not None:
+            self._handles[decoded.content_hash] = handle
+        return handle
+
+    def uploaded(self, data_url: str) -> MediaHandle | None:
+        """The handle of media uploaded with upload() during this request"""
+        decoded = self._cached(data_url)
+        if decoded is None:
+            return None
+        return self._handles.get(decoded.content_hash)
+
+    def gemini_image(self, data_url: str) -> Tuple[bytes, str] | None:
+        """(raw bytes, MIME type), or None if the type can't be determined"""
+        decoded = self.decode(data_url)
+        if decoded.mime_type is None:
+            return None
+        # The Gemini SDK only takes inline data as bytes
+        return bytes(decoded.data), decoded.mime_type
+
+    def close(self) -> None:
+        """Unmap the request's uploaded media. Call once no variant needs it."""
+        for decoded in self._decoded.values():
+            if isinstance(decoded.data, mmap.mmap):
+                try:
+                    decoded.data.close()
+                except BufferError:
+                    # Still exported (e.g. by an abandoned worker); it's
+                    # unmapped when that reference is dropped
+                    pass
+        self._decoded.clear()
+        self._hashes.clear()
+
+    async def prepare_gemini_images(
+        self,
+        messages: List[ChatCompletionMessageParam],
+        uploader: MediaUploader | None = None,
+        upload_min_bytes: int = 0,
+    ) -> None:
+        """Decode the images in messages for Gemini in the worker pool. With an
+        uploader, videos of at least upload_min_bytes are uploaded too."""
+        urls = image_data_urls(messages)
+        decoded = await asyncio.gather(*(self.decode_async(url) for url in urls))
+        if uploader is None:
+            return
+        await asyncio.gather(
+            *(
+                self.upload(url, uploader)
+                for url, media in zip(urls, decoded)
+                if (media.mime_type or "").startswith("video/")
+                and len(media.data) >= upload_min_bytes
+            )
+        )
+
+    def inline_media(
+        self, messages: List[ChatCompletionMessageParam]
+    ) -> List[ChatCompletionMessageParam]:
+        """messages with uploaded media references replaced by data URLs, for
+        providers that only accept inline images. Messages without references
+        are returned as is."""
+        result: List[ChatCompletionMessageParam] = []
+        for message in messages:
+            content = message.get("content")
+            if not isinstance(content, list) or not any(
+                part.get("type") == "image_url"
+                and is_media_ref(part["image_url"]["url"])  # type: ignore
+                for part in content
+            ):
+                result.append(message)
+                continue
+
+            parts: List[Any] = []
+            for part in content:
+                part = cast(Dict[str, Any], part)
+                if part.get("type") == "image_url" and is_media_ref(
+                    part["image_url"]["url"]
+                ):
+                    url = self.decode(part["image_url"]["url"]).data_url
+                    part = {**part, "image_url": {**part["image_url"], "url": url}}
+                parts.append(part)
+            result.append(cast(ChatCompletionMessageParam, {**message, "content": parts}))
+        return result
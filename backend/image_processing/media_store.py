@@ -0,0 +1,189 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict
+
+from config import MEDIA_STORE_DIR, MEDIA_STORE_MAX_BYTES
+
+# Prompts reference uploaded media as "media:<id>" in place of a data URL
+MEDIA_REF_PREFIX = "media:"
+_MEDIA_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_media_ref(url: str) -> bool:
+    return url.startswith(MEDIA_REF_PREFIX)
+
+
+def media_ref(media_id: str) -> str:
+    return f"{MEDIA_REF_PREFIX}{media_id}"
+
+
+def media_id_from_ref(ref: str) -> str:
+    media_id = ref[len(MEDIA_REF_PREFIX) :]
+    if not is_media_ref(ref) or not _MEDIA_ID_PATTERN.match(media_id):
+        raise ValueError(f"Invalid media reference: {ref[:80]}")
+    return media_id
+
+
+@dataclass
+class StoredMedia:
+    media_id: str
+    mime_type: str
+    size: int
+    # Read-only memory map of the file; pages are loaded on access
+    data: mmap.mmap
+    # The file itself, for consumers that open it (e.g. ffmpeg) or run in
+    # another process, so the map is never copied
+    path: str
+
+
+class MediaUpload:
+    """An upload being written to the store. Bytes are hashed as they arrive
+    so the content hash is known without reading the file back."""
+
+    def __init__(self, store: "MediaStore"):
+        self.store = store
+        store.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=store.directory, suffix=".tmp")
+        self._file = os.fdopen(fd, "wb")
+        self._tmp_path = Path(tmp_path)
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes) -> None:
+        self._hash.update(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self, mime_type: str) -> str:
+        """Move the upload into the store and return its media id"""
+        self._file.close()
+        media_id = self._hash.hexdigest()
+        self.store._add(media_id, self._tmp_path, mime_type, self.size)
+        return media_id
+
+    def abort(self) -> None:
+        self._file.close()
+        self._tmp_path.unlink(missing_ok=True)
+
+
+class MediaStore:
+    """Uploaded media on local disk, one file per content hash plus a small
+    JSON sidecar with its MIME type.
+
+    Files are memory-mapped when opened, so a video is never held as a
+    Python string or copied just to be referenced. Least recently used files
+    (by mtime, bumped on every open) are removed once the total size exceeds
+    max_bytes.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sizes: Dict[str, int] | None = None
+
+    def _path(self, media_id: str) -> Path:
+        return self.directory / media_id
+
+    def _meta_path(self, media_id: str) -> Path:
+        return self.directory / f"{media_id}.json"
+
+    def _load_sizes(self) -> Dict[str, int]:
+        if self._sizes is None:
+            self._sizes = {}
+            if self.directory.exists():
+                for path in self.directory.glob("*.json"):
+                    try:
+                        self._sizes[path.stem] = self._path(path.stem).stat().st_size
+                    except OSError:
+                        path.unlink(missing_ok=True)
+        return self._sizes
+
+    def begin_upload(self) -> MediaUpload:
+        return MediaUpload(self)
+
+    def put(self, data: bytes, mime_type: str) -> str:
+        upload = self.begin_upload()
+        try:
+            upload.write(data)
+        except BaseException:
+            upload.abort()
+            raise
+        return upload.commit(mime_type)
+
+    def _add(self, media_id: str, tmp_path: Path, mime_type: str, size: int) -> None:
+        with self._lock:
+            sizes = self._load_sizes()
+            # Identical content has the same id, so replacing is harmless
+            tmp_path.replace(self._path(media_id))
+            meta = {"mime_type": mime_type, "size": size, "created_at": time.time()}
+            self._meta_path(media_id).write_text(json.dumps(meta))
+            sizes[media_id] = size
+            self._evict(keep=media_id)
+
+    def _evict(self, keep: str) -> None:
+        sizes = self._load_sizes()
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return
+
+        def last_used(media_id: str) -> float:
+            try:
+                return self._path(media_id).stat().st_mtime
+            except OSError:
+                return 0.0
+
+        for media_id in sorted(sizes, key=last_used):
+            if total <= self.max_bytes:
+                break
+            if media_id == keep:
+                continue
+            total -= sizes.pop(media_id)
+            # Already mapped files stay readable until they're unmapped
+            self._path(media_id).unlink(missing_ok=True)
+            self._meta_path(media_id).unlink(missing_ok=True)
+
+    def open(self, media_id: str) -> StoredMedia | None:
+        """Memory-map a stored file, or None if it doesn't exist (or was evicted)"""
+        if not _MEDIA_ID_PATTERN.match(media_id):
+            return None
+        try:
+            meta = json.loads(self._meta_path(media_id).read_text())
+            with open(self._path(media_id), "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0:
+                    return None
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            os.utime(self._path(media_id))
+        except (OSError, ValueError):
+            return None
+        return StoredMedia(
+            media_id, meta["mime_type"], size, data, str(self._path(media_id))
+        )
+
+    def touch(self, media_id: str) -> bool:
+        """Mark stored media as used, so it's the last to be evicted; returns
+        whether it's still stored"""
+        if media_id not in self:
+            return False
+        try:
+            os.utime(self._path(media_id))
+        except OSError:
+            return False
+        return True
+
+    def __contains__(self, media_id: str) -> bool:
+        return bool(_MEDIA_ID_PATTERN.match(media_id)) and self._meta_path(
+            media_id
+        ).exists()
+
+
+media_store = MediaStore(Path(MEDIA_STORE_DIR), MEDIA_STORE_MAX_BYTES)
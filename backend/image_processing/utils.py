@@ -1,11 +1,126 @@
 import base64
 import io
 import time
+from typing import Tuple
 from PIL import Image
 
 CLAUDE_IMAGE_MAX_SIZE = 5 * 1024 * 1024
 CLAUDE_MAX_IMAGE_DIMENSION = 7990
 
+# JPEG quality bounds. We always compress at 95 first and never go below 10.
+MAX_JPEG_QUALITY = 95
+MIN_JPEG_QUALITY = 10
+# Stop searching once the best fitting quality is known to within this
+# (the step size of the previous fixed-step loop)
+JPEG_QUALITY_TOLERANCE = 5
+# Aim slightly below the limit when predicting so the guess usually fits
+JPEG_SIZE_TARGET_MARGIN = 0.98
+
+# Typical JPEG size at a given quality relative to its size at quality 95,
+# used to predict the quality that fits from an encode at another quality
+JPEG_SIZE_RATIO_BY_QUALITY: Tuple[Tuple[int, float], ...] = (
+    (10, 0.12),
+    (20, 0.18),
+    (30, 0.23),
+    (40, 0.27),
+    (50, 0.31),
+    (60, 0.35),
+    (70, 0.41),
+    (75, 0.45),
+    (80, 0.5),
+    (85, 0.58),
+    (90, 0.72),
+    (95, 1.0),
+)
+
+
+def base64_size(num_bytes: int) -> int:
+    """Length of the base64 encoding of num_bytes bytes, without encoding them"""
+    return 4 * ((num_bytes + 2) // 3)
+
+
+def _typical_size_ratio(quality: int) -> float:
+    points = JPEG_SIZE_RATIO_BY_QUALITY
+    for (q0, r0), (q1, r1) in zip(points, points[1:]):
+        if quality <= q1:
+            return r0 + (r1 - r0) * (max(quality, q0) - q0) / (q1 - q0)
+    return points[-1][1]
+
+
+def predict_jpeg_quality(quality: int, size: int, max_size: int) -> int:
+    """Highest quality expected to fit in max_size, given the size of an
+    encode at quality, assuming the typical size/quality curve"""
+    target = max_size * JPEG_SIZE_TARGET_MARGIN
+    for candidate in range(quality - 1, MIN_JPEG_QUALITY - 1, -1):
+        predicted = size * _typical_size_ratio(candidate) / _typical_size_ratio(quality)
+        if predicted <= target:
+            return candidate
+    return MIN_JPEG_QUALITY
+
+
+def _encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=quality)
+    return output.getvalue()
+
+
+def compress_jpeg(img: Image.Image, max_size: int) -> Tuple[bytes, int, int]:
+    """Encode img as JPEG at the highest quality whose base64 size fits max_size.
+
+    Returns (jpeg bytes, quality, number of encodes). Quality 95 is tried
+    first. If it's too big, the next quality is predicted from the measured
+    sizes: from the typical size/quality curve until something fits, then by
+    interpolating between the closest encodes that do and don't fit. This
+    brackets the answer in a few encodes instead of one per quality step.
+    Falls back to the minimum quality if nothing fits.
+    """
+    encoded = _encode_jpeg(img, MAX_JPEG_QUALITY)
+    encodes = 1
+    size = base64_size(len(encoded))
+    if size <= max_size:
+        return encoded, MAX_JPEG_QUALITY, encodes
+
+    # hi doesn't fit; lo (if any) is the highest quality known to fit
+    hi, hi_size, hi_encoded = MAX_JPEG_QUALITY, size, encoded
+    lo: int | None = None
+    lo_size = 0
+    best = b""
+    guess = predict_jpeg_quality(hi, hi_size, max_size)
+
+    while hi - (lo if lo is not None else MIN_JPEG_QUALITY - 1) > JPEG_QUALITY_TOLERANCE:
+        lower_bound = lo if lo is not None else MIN_JPEG_QUALITY - 1
+        quality = min(max(guess, lower_bound + 1), hi - 1)
+        encoded = _encode_jpeg(img, quality)
+        encodes += 1
+        size = base64_size(len(encoded))
+
+        if size <= max_size:
+            lo, lo_size, best = quality, size, encoded
+        else:
+            hi, hi_size, hi_encoded = quality, size, encoded
+
+        if lo is None:
+            guess = predict_jpeg_quality(hi, hi_size, max_size)
+        else:
+            # Interpolate between the bracketing encodes
+            guess = lo + int((hi - lo) * (max_size - lo_size) / (hi_size - lo_size))
+
+    if lo is None:
+        # Nothing fits; use the minimum quality (the last encode if we tried it)
+        if hi == MIN_JPEG_QUALITY:
+            return hi_encoded, MIN_JPEG_QUALITY, encodes
+        return _encode_jpeg(img, MIN_JPEG_QUALITY), MIN_JPEG_QUALITY, encodes + 1
+    return best, lo, encodes
+
+
+def _fit_dimensions(width: int, height: int) -> Tuple[int, int]:
+    # Calculate the new dimensions while maintaining aspect ratio
+    if width > height:
+        return CLAUDE_MAX_IMAGE_DIMENSION, int(
+            (CLAUDE_MAX_IMAGE_DIMENSION / width) * height
+        )
+    return int((CLAUDE_MAX_IMAGE_DIMENSION / height) * width), CLAUDE_MAX_IMAGE_DIMENSION
+
 
 # Process image so it meets Claude requirements
 def process_image(image_data_url: str) -> tuple[str, str]:
@@ -15,7 +130,18 @@ def process_image(image_data_url: str) -> tuple[str, str]:
     base64_data = image_data_url.split(",")[1]
     image_bytes = base64.b64decode(base64_data)
 
-    img = Image.open(io.BytesIO(image_bytes))
+    return process_image_bytes(media_type, base64_data, image_bytes)
+
+
+def process_image_bytes(
+    media_type: str, base64_data: str, image_bytes: bytes | str
+) -> tuple[str, str]:
+    """process_image for an image that was already decoded, given as its
+    bytes or the path of the file holding them"""
+    # Only reads the header; pixels aren't decoded unless we need to re-encode
+    img = Image.open(
+        image_bytes if isinstance(image_bytes, str) else io.BytesIO(image_bytes)
+    )
 
     # Check if image is under max dimensions and size
     is_under_dimension_limit = (
@@ -35,16 +161,19 @@ def process_image(image_data_url: str) -> tuple[str, str]:
     # Check if either dimension exceeds 7900px (Claude disallows >= 8000px)
     # Resize image if needed
     if not is_under_dimension_limit:
-        # Calculate the new dimensions while maintaining aspect ratio
-        if img.width > img.height:
-            new_width = CLAUDE_MAX_IMAGE_DIMENSION
-            new_height = int((CLAUDE_MAX_IMAGE_DIMENSION / img.width) * img.height)
-        else:
-            new_height = CLAUDE_MAX_IMAGE_DIMENSION
-            new_width = int((CLAUDE_MAX_IMAGE_DIMENSION / img.height) * img.width)
+        new_width, new_height = _fit_dimensions(img.width, img.height)
 
-        # Resize the image
-        img = img.resize((new_width, new_height), Image.DEFAULT_STRATEGY)
+        # For JPEGs, let the decoder downscale by a power of two while
+        # decoding so the full-size image is never materialized
+        img.draft("RGB", (new_width, new_height))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        # Shrink huge screenshots by an integer factor with the fast reduce()
+        # first, then resample the remainder
+        factor = min(img.width // new_width, img.height // new_height)
+        if factor >= 2:
+            img = img.reduce(factor)
+        img = img.resize((new_width, new_height), Image.Resampling.NEAREST)
         print(
             f"[CLAUDE IMAGE PROCESSING] image resized: width = {new_width}, height = {new_height}"
         )
@@ -52,29 +181,20 @@ def process_image(image_data_url: str) -> tuple[str, str]:
     # Convert and compress as JPEG
     # We always compress as JPEG (95% at the least) even when we resize and the original image
     # is under the size limit.
-    quality = 95
-    output = io.BytesIO()
-    img = img.convert("RGB")  # Ensure image is in RGB mode for JPEG conversion
-    img.save(output, format="JPEG", quality=quality)
-
-    # Reduce quality until image is under max size
-    while (
-        len(base64.b64encode(output.getvalue())) > CLAUDE_IMAGE_MAX_SIZE
-        and quality > 10
-    ):
-        output = io.BytesIO()
-        img.save(output, format="JPEG", quality=quality)
-        quality -= 5
+    if img.mode != "RGB":
+        img = img.convert("RGB")  # Ensure image is in RGB mode for JPEG conversion
+    output, quality, encodes = compress_jpeg(img, CLAUDE_IMAGE_MAX_SIZE)
 
     # Log so we know it was modified
     old_size = len(base64_data)
-    new_size = len(base64.b64encode(output.getvalue()))
+    new_size = base64_size(len(output))
     print(
-        f"[CLAUDE IMAGE PROCESSING] image size updated: old size = {old_size} bytes, new size = {new_size} bytes"
+        f"[CLAUDE IMAGE PROCESSING] image size updated: old size = {old_size} bytes, new size = {new_size} bytes "
+        f"(quality {quality}, {encodes} encodes)"
     )
 
     end_time = time.time()
     processing_time = end_time - start_time
     print(f"[CLAUDE IMAGE PROCESSING] processing time: {processing_time:.2f} seconds")
 
-    return ("image/jpeg", base64.b64encode(output.getvalue()).decode("utf-8"))
+    return ("image/jpeg", base64.b64encode(output).decode("utf-8"))
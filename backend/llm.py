@@ -17,11 +17,22 @@ class Llm(Enum):
     GEMINI_3_PRO_PREVIEW_LOW = "gemini-3-pro-preview (low thinking)"
 
 
-class Completion(TypedDict):
+class TokenUsage(TypedDict):
+    input_tokens: int
+    # Including thinking tokens, which are billed as output
+    output_tokens: int
+
+
+class _CompletionFields(TypedDict):
     duration: float
     code: str
 
 
+class Completion(_CompletionFields, total=False):
+    # As reported by the provider, when it does
+    usage: TokenUsage
+
+
 # Explicitly map each model to the provider backing it.  This keeps provider
 # groupings authoritative and avoids relying on name conventions when checking
 # models elsewhere in the codebase.
@@ -4,11 +4,29 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routes import screenshot, generate_code, home, evals, portfolio, theme_save
+from clients.registry import client_registry, warm_client_pools
+from metrics.event_loop import monitor_event_loop_lag
+from routes import screenshot, generate_code, home, evals, portfolio, theme_save, metrics, media, assets
+from scheduling.worker_pool import shutdown_worker_pool
 
-app = FastAPI(openapi_url=None, docs_url=None, redoc_url=None)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open provider connections in the background so startup isn't delayed
+    warm_task = asyncio.create_task(warm_client_pools())
+    lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+    yield
+    warm_task.cancel()
+    lag_monitor.cancel()
+    await client_registry.close_all()
+    shutdown_worker_pool()
+
+
+app = FastAPI(openapi_url=None, docs_url=None, redoc_url=None, lifespan=lifespan)
 
 # Configure CORS settings
 app.add_middleware(
@@ -26,3 +44,6 @@ app.include_router(home.router)
 app.include_router(evals.router)
 app.include_router(portfolio.router)
 app.include_router(theme_save.router)
+app.include_router(metrics.router)
+app.include_router(media.router)
+app.include_router(assets.router)
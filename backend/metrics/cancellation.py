@@ -0,0 +1,64 @@
+from dataclasses import dataclass, replace
+from typing import Dict, Tuple
+
+from llm import Llm
+
+# Rough conversion used to turn streamed characters into tokens
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class CancellationStats:
+    cancelled_variants: int = 0
+    tokens_streamed: int = 0
+    tokens_saved: int = 0
+    seconds_saved: float = 0.0
+
+
+_stats = CancellationStats()
+
+# Totals for completed variants per model: model -> (count, output tokens, seconds).
+# Used to estimate how much of a cancelled stream was still to come.
+_completed: Dict[Llm, Tuple[int, int, float]] = {}
+
+
+def estimate_tokens(num_chars: int) -> int:
+    return num_chars // CHARS_PER_TOKEN
+
+
+def record_completion(model: Llm, output_chars: int, duration: float) -> None:
+    count, tokens, seconds = _completed.get(model, (0, 0, 0.0))
+    _completed[model] = (
+        count + 1,
+        tokens + estimate_tokens(output_chars),
+        seconds + duration,
+    )
+
+
+def record_cancellation(
+    model: Llm, streamed_chars: int, elapsed: float
+) -> Tuple[int, float]:
+    """Record a cancelled variant and return the estimated (tokens, seconds) saved.
+
+    Savings are estimated against the average completed run of the same model,
+    so nothing is counted until that model has completed at least once.
+    """
+    streamed_tokens = estimate_tokens(streamed_chars)
+    tokens_saved = 0
+    seconds_saved = 0.0
+
+    count, tokens, seconds = _completed.get(model, (0, 0, 0.0))
+    if count > 0:
+        tokens_saved = max(0, tokens // count - streamed_tokens)
+        seconds_saved = max(0.0, seconds / count - elapsed)
+
+    _stats.cancelled_variants += 1
+    _stats.tokens_streamed += streamed_tokens
+    _stats.tokens_saved += tokens_saved
+    _stats.seconds_saved += seconds_saved
+
+    return tokens_saved, seconds_saved
+
+
+def get_cancellation_stats() -> CancellationStats:
+    return replace(_stats)
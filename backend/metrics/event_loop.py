@@ -0,0 +1,35 @@
+import asyncio
+import time
+
+from config import EVENT_LOOP_LAG_INTERVAL_SECONDS
+from metrics.prometheus import LATENCY_BUCKETS, gauge, histogram
+
+EVENT_LOOP_LAG_SECONDS = histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop ran a callback that was due (time it was blocked)",
+    LATENCY_BUCKETS,
+)
+
+_max_lag = 0.0
+
+gauge(
+    "event_loop_max_lag_seconds",
+    "Largest event loop lag seen since startup",
+    lambda: [({}, _max_lag)],
+)
+
+
+async def monitor_event_loop_lag(
+    interval: float = EVENT_LOOP_LAG_INTERVAL_SECONDS,
+) -> None:
+    """Sleep for interval in a loop and record how much later than that we woke up"""
+    global _max_lag
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - start - interval)
+        EVENT_LOOP_LAG_SECONDS.observe(lag)
+        if lag > _max_lag:
+            _max_lag = lag
+        if lag > 0.5:
+            print(f"[EVENT LOOP] Blocked for {lag:.2f}s")
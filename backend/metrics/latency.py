@@ -0,0 +1,90 @@
+from metrics.prometheus import TOKEN_BUCKETS, counter, histogram
+
+# Time spent in each pipeline middleware itself, excluding downstream middlewares
+PIPELINE_STAGE_SECONDS = histogram(
+    "pipeline_stage_seconds",
+    "Time spent in a generate-code pipeline middleware, excluding the middlewares after it",
+)
+PIPELINE_REQUEST_SECONDS = histogram(
+    "pipeline_request_seconds",
+    "Total time of a generate-code request",
+)
+
+VARIANT_TIME_TO_FIRST_TOKEN_SECONDS = histogram(
+    "variant_time_to_first_token_seconds",
+    "Time from the start of generation to the first streamed token of a variant",
+)
+VARIANT_INTER_CHUNK_SECONDS = histogram(
+    "variant_inter_chunk_seconds",
+    "Time between consecutive streamed deltas of a variant",
+)
+VARIANT_GENERATION_SECONDS = histogram(
+    "variant_generation_seconds",
+    "Time for a variant's model response to complete",
+)
+VARIANT_OUTPUT_TOKENS = histogram(
+    "variant_output_tokens",
+    "Estimated output tokens (code and thinking) streamed by a variant",
+    TOKEN_BUCKETS,
+)
+IMAGE_GENERATION_SECONDS = histogram(
+    "image_generation_seconds",
+    "Time to generate and insert images into a variant's code",
+)
+VARIANT_FINALIZE_SECONDS = histogram(
+    "variant_finalize_seconds",
+    "Time from a variant's last streamed token to sending its final code (setCode)",
+)
+IMAGE_GENERATION_CALLS_SAVED_TOTAL = counter(
+    "image_generation_calls_saved_total",
+    "Image generations shared between variants of a request instead of repeated",
+)
+VIDEO_INPUT_TOKENS_SAVED_TOTAL = counter(
+    "video_input_tokens_saved_total",
+    "Estimated Gemini input tokens saved by sending video keyframes instead of the whole video",
+)
+LLM_ESTIMATED_COST_USD_TOTAL = counter(
+    "llm_estimated_cost_usd_total",
+    "Pre-flight cost estimates of dispatched variants",
+)
+LLM_COST_USD_TOTAL = counter(
+    "llm_cost_usd_total",
+    "Cost of completed variants, from the token usage reported by providers",
+)
+LLM_TOKENS_TOTAL = counter(
+    "llm_tokens_total",
+    "Input and output (including thinking) tokens reported by providers",
+)
+VARIANTS_OVER_BUDGET_TOTAL = counter(
+    "variants_over_budget_total",
+    "Variants dropped before dispatch because their estimated cost was over budget",
+)
+PROMPT_HISTORY_TOKENS_SAVED_TOTAL = counter(
+    "prompt_history_tokens_saved_total",
+    "Estimated input tokens removed from update prompts by history compaction",
+)
+EDIT_UPDATES_TOTAL = counter(
+    "edit_updates_total",
+    "Update variants generated in edit mode, by result (applied, full_document or fallback)",
+)
+EDIT_UPDATE_OUTPUT_TOKENS_SAVED_TOTAL = counter(
+    "edit_update_output_tokens_saved_total",
+    "Estimated output tokens saved by applying edit blocks instead of regenerating the document",
+)
+EDIT_UPDATE_SECONDS_SAVED_TOTAL = counter(
+    "edit_update_seconds_saved_total",
+    "Estimated generation time saved by applying edit blocks instead of regenerating the document",
+)
+
+WS_MESSAGES_TOTAL = counter(
+    "ws_messages_total", "WebSocket messages sent to clients, before batching"
+)
+WS_FRAMES_TOTAL = counter("ws_frames_total", "WebSocket frames written to clients")
+WS_DROPPED_MESSAGES_TOTAL = counter(
+    "ws_dropped_messages_total",
+    "WebSocket messages dropped because a client's send queue was full",
+)
+WS_SEND_BLOCKED_SECONDS_TOTAL = counter(
+    "ws_send_blocked_seconds_total",
+    "Time generation spent waiting for room in a client's send queue",
+)
@@ -0,0 +1,196 @@
+import bisect
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Sorted (name, value) label pairs
+LabelSet = Tuple[Tuple[str, str], ...]
+
+# Latency buckets in seconds, from sub-millisecond middleware work up to long
+# thinking-model generations
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+TOKEN_BUCKETS: Tuple[float, ...] = (
+    100, 250, 500, 1000, 2500, 5000, 10000, 20000, 40000,
+)
+
+
+def _label_set(labels: Dict[str, str]) -> LabelSet:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in labels]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _HistogramSeries:
+    def __init__(self, num_buckets: int):
+        self.bucket_counts = [0] * num_buckets
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram:
+    """In-process histogram rendered in the Prometheus text format"""
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+        self._series: Dict[LabelSet, _HistogramSeries] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _label_set(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _HistogramSeries(len(self.buckets))
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series.bucket_counts[index] += 1
+        series.count += 1
+        series.sum += value
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(_label_set(labels))
+        return series.count if series else 0
+
+    def quantile(self, q: float, **labels: str) -> float | None:
+        """Upper bound of the bucket holding the q-quantile (e.g. 0.95 for p95)"""
+        series = self._series.get(_label_set(labels))
+        if series is None or series.count == 0:
+            return None
+        rank = q * series.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, series.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, series.bucket_counts):
+                cumulative += bucket_count
+                le = labels + (("le", _format_value(float(bound))),)
+                lines.append(f"{self.name}_bucket{_format_labels(le)} {cumulative}")
+            le = labels + (("le", "+Inf"),)
+            lines.append(f"{self.name}_bucket{_format_labels(le)} {series.count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series.sum}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series.count}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter rendered in the Prometheus text format"""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelSet, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _label_set(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(_label_set(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose samples are read from a callback at scrape time"""
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]],
+    ):
+        self.name = name
+        self.help = help
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for labels, value in self.collect():
+            lines.append(
+                f"{self.name}{_format_labels(_label_set(labels))} {_format_value(value)}"
+            )
+        return lines
+
+
+class CollectedCounter(Gauge):
+    """Counter whose totals are read from a callback at scrape time, for
+    totals kept by another component (e.g. cache hits)"""
+
+    type = "counter"
+
+
+Metric = Histogram | Counter | Gauge
+
+_registry: Dict[str, Metric] = {}
+
+
+def register(metric: Metric) -> Metric:
+    _registry[metric.name] = metric
+    return metric
+
+
+def histogram(name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    metric = Histogram(name, help, buckets)
+    register(metric)
+    return metric
+
+
+def counter(name: str, help: str) -> Counter:
+    metric = Counter(name, help)
+    register(metric)
+    return metric
+
+
+def gauge(
+    name: str,
+    help: str,
+    collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]],
+) -> Gauge:
+    metric = Gauge(name, help, collect)
+    register(metric)
+    return metric
+
+
+def collected_counter(
+    name: str,
+    help: str,
+    collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]],
+) -> CollectedCounter:
+    metric = CollectedCounter(name, help, collect)
+    register(metric)
+    return metric
+
+
+def render_metrics() -> str:
+    """All registered metrics in the Prometheus text exposition format"""
+    lines: List[str] = []
+    for metric in _registry.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
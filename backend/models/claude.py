@@ -1,57 +1,66 @@
-import copy
 import time
 from typing import Any, Awaitable, Callable, Dict, List, Tuple, cast
-from anthropic import AsyncAnthropic
 from openai.types.chat import ChatCompletionMessageParam
+from clients.registry import client_registry
 from config import IS_DEBUG_ENABLED
 from debug.DebugFileWriter import DebugFileWriter
-from image_processing.utils import process_image
+from image_processing.media_registry import MediaRegistry
 from utils import pprint_prompt
-from llm import Completion, Llm
+from llm import Completion, Llm, TokenUsage
 
 
 def convert_openai_messages_to_claude(
     messages: List[ChatCompletionMessageParam],
+    media: MediaRegistry | None = None,
 ) -> Tuple[str, List[Dict[str, Any]]]:
     """
     Convert OpenAI format messages to Claude format, handling image content properly.
 
     Args:
         messages: List of messages in OpenAI format
+        media: Registry shared by the request's variants, so each image is
+            only decoded and processed once
 
     Returns:
         Tuple of (system_prompt, claude_messages)
     """
-    # Deep copy messages to avoid modifying the original list
-    cloned_messages = copy.deepcopy(messages)
-
-    system_prompt = cast(str, cloned_messages[0].get("content"))
-    claude_messages = [dict(message) for message in cloned_messages[1:]]
-
-    for message in claude_messages:
-        if not isinstance(message["content"], list):
+    if media is None:
+        media = MediaRegistry()
+
+    system_prompt = cast(str, messages[0].get("content"))
+
+    # Build new messages instead of modifying the originals. Image data is
+    # referenced from the registry rather than copied.
+    claude_messages: List[Dict[str, Any]] = []
+    for message in messages[1:]:
+        claude_message: Dict[str, Any] = dict(message)
+        claude_messages.append(claude_message)
+        if not isinstance(claude_message["content"], list):
             continue
 
-        for content in message["content"]:  # type: ignore
-            if content["type"] == "image_url":
-                content["type"] = "image"
-
-                # Extract base64 data and media type from data URL
-                # Example base64 data URL: data:image/png;base64,iVBOR...
-                image_data_url = cast(str, content["image_url"]["url"])
-
-                # Process image and split media type and data
-                # so it works with Claude (under 5mb in base64 encoding)
-                (media_type, base64_data) = process_image(image_data_url)
-
-                # Remove OpenAI parameter
-                del content["image_url"]
-
-                content["source"] = {
-                    "type": "base64",
-                    "media_type": media_type,
-                    "data": base64_data,
-                }
+        claude_content: List[Dict[str, Any]] = []
+        for content in cast(List[Dict[str, Any]], claude_message["content"]):
+            if content["type"] != "image_url":
+                claude_content.append(dict(content))
+                continue
+
+            # Split media type and data from the data URL
+            # (e.g. data:image/png;base64,iVBOR...) and process the image
+            # so it works with Claude (under 5mb in base64 encoding)
+            image_data_url = cast(str, content["image_url"]["url"])
+            (media_type, base64_data) = media.claude_image(image_data_url)
+
+            claude_part = {
+                key: value for key, value in content.items() if key != "image_url"
+            }
+            claude_part["type"] = "image"
+            claude_part["source"] = {
+                "type": "base64",
+                "media_type": media_type,
+                "data": base64_data,
+            }
+            claude_content.append(claude_part)
+        claude_message["content"] = claude_content
 
     return system_prompt, claude_messages
 
@@ -62,9 +71,9 @@ async def stream_claude_response(
     callback: Callable[[str], Awaitable[None]],
     model_name: str,
     thinking_callback: Callable[[str], Awaitable[None]] | None = None,
+    media: MediaRegistry | None = None,
 ) -> Completion:
     start_time = time.time()
-    client = AsyncAnthropic(api_key=api_key)
 
     # Base parameters
     max_tokens = 8192
@@ -72,8 +81,12 @@ async def stream_claude_response(
 
     # Translate OpenAI messages to Claude messages
 
-    # Convert OpenAI format messages to Claude format
-    system_prompt, claude_messages = convert_openai_messages_to_claude(messages)
+    # Convert OpenAI format messages to Claude format. Images are processed
+    # in the media worker pool first so the event loop isn't blocked.
+    if media is None:
+        media = MediaRegistry()
+    await media.prepare_claude_images(messages)
+    system_prompt, claude_messages = convert_openai_messages_to_claude(messages, media)
 
     response = ""
 
@@ -83,53 +96,58 @@ async def stream_claude_response(
         Llm.CLAUDE_4_5_OPUS_2025_11_01.value,
     ]
 
-    if model_name in thinking_models:
-        print(f"Using {model_name} with thinking")
-        thinking_started = False
-        # Thinking is not compatible with temperature
-        async with client.messages.stream(
-            model=model_name,
-            thinking={"type": "enabled", "budget_tokens": 10000},
-            max_tokens=30000,
-            system=system_prompt,
-            messages=claude_messages,  # type: ignore
-        ) as stream:
-            async for event in stream:
-                if event.type == "content_block_start":
-                    if event.content_block.type == "thinking":
-                        thinking_started = False
-                elif event.type == "content_block_delta":
-                    if event.delta.type == "thinking_delta":
-                        if not thinking_started:
-                            thinking_started = True
-                        if thinking_callback:
-                            await thinking_callback(event.delta.thinking)
-                    elif event.delta.type == "text_delta":
-                        response += event.delta.text
-                        await callback(event.delta.text)
-                elif event.type == "content_block_stop":
-                    if thinking_started:
-                        thinking_started = False
-
-    else:
-        # Stream Claude response
-        async with client.beta.messages.stream(
-            model=model_name,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            system=system_prompt,
-            messages=claude_messages,  # type: ignore
-            betas=["output-128k-2025-02-19"],
-        ) as stream:
-            async for text in stream.text_stream:
-                response += text
-                await callback(text)
-
-    # Close the Anthropic client
-    await client.close()
-
+    async with client_registry.anthropic(api_key) as client:
+        if model_name in thinking_models:
+            print(f"Using {model_name} with thinking")
+            thinking_started = False
+            # Thinking is not compatible with temperature
+            async with client.messages.stream(
+                model=model_name,
+                thinking={"type": "enabled", "budget_tokens": 10000},
+                max_tokens=30000,
+                system=system_prompt,
+                messages=claude_messages,  # type: ignore
+            ) as stream:
+                async for event in stream:
+                    if event.type == "content_block_start":
+                        if event.content_block.type == "thinking":
+                            thinking_started = False
+                    elif event.type == "content_block_delta":
+                        if event.delta.type == "thinking_delta":
+                            if not thinking_started:
+                                thinking_started = True
+                            if thinking_callback:
+                                await thinking_callback(event.delta.thinking)
+                        elif event.delta.type == "text_delta":
+                            response += event.delta.text
+                            await callback(event.delta.text)
+                    elif event.type == "content_block_stop":
+                        if thinking_started:
+                            thinking_started = False
+                final_message = await stream.get_final_message()
+
+        else:
+            # Stream Claude response
+            async with client.beta.messages.stream(
+                model=model_name,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                system=system_prompt,
+                messages=claude_messages,  # type: ignore
+                betas=["output-128k-2025-02-19"],
+            ) as stream:
+                async for text in stream.text_stream:
+                    response += text
+                    await callback(text)
+                final_message = await stream.get_final_message()
+
+    # Output tokens include thinking
+    usage: TokenUsage = {
+        "input_tokens": final_message.usage.input_tokens,
+        "output_tokens": final_message.usage.output_tokens,
+    }
     completion_time = time.time() - start_time
-    return {"duration": completion_time, "code": response}
+    return {"duration": completion_time, "code": response, "usage": usage}
 
 
 async def stream_claude_response_native(
@@ -141,7 +159,6 @@ async def stream_claude_response_native(
     model_name: str = Llm.CLAUDE_4_5_SONNET_2025_09_29.value,
 ) -> Completion:
     start_time = time.time()
-    client = AsyncAnthropic(api_key=api_key)
 
     # Base model parameters
     max_tokens = 4096
@@ -170,19 +187,20 @@ async def stream_claude_response_native(
 
         pprint_prompt(messages_to_send)
 
-        async with client.messages.stream(
-            model=model_name,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            system=system_prompt,
-            messages=messages_to_send,  # type: ignore
-        ) as stream:
-            async for text in stream.text_stream:
-                print(text, end="", flush=True)
-                full_stream += text
-                await callback(text)
-
-        response = await stream.get_final_message()
+        async with client_registry.anthropic(api_key) as client:
+            async with client.messages.stream(
+                model=model_name,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                system=system_prompt,
+                messages=messages_to_send,  # type: ignore
+            ) as stream:
+                async for text in stream.text_stream:
+                    print(text, end="", flush=True)
+                    full_stream += text
+                    await callback(text)
+
+                response = await stream.get_final_message()
         response_text = response.content[0].text
 
         # Write each pass's code to .html file and thinking to .txt file
@@ -209,9 +227,6 @@ async def stream_claude_response_native(
             f"Token usage: Input Tokens: {response.usage.input_tokens}, Output Tokens: {response.usage.output_tokens}"
         )
 
-    # Close the Anthropic client
-    await client.close()
-
     completion_time = time.time() - start_time
 
     if IS_DEBUG_ENABLED:
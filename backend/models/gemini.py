@@ -1,22 +1,102 @@
-import base64
+import asyncio
+import hashlib
+import io
+import os
 import time
 from typing import Any, Awaitable, Callable, Dict, List
 from openai.types.chat import ChatCompletionMessageParam
-from google import genai
 from google.genai import types
-from llm import Completion, Llm
+from clients.registry import client_registry
+from config import GEMINI_FILE_UPLOAD_MIN_BYTES
+from image_processing.media_handles import MediaHandle, MediaSource, MediaUploader
+from image_processing.media_registry import MediaRegistry
+from image_processing.media_store import is_media_ref
+from llm import Completion, Llm, TokenUsage
+from metrics.latency import VIDEO_INPUT_TOKENS_SAVED_TOTAL
 from video.cost_estimation import (
     calculate_cost,
+    estimate_keyframe_input_tokens,
     estimate_video_generation_cost,
+    estimate_video_input_tokens,
     format_cost_estimate,
     format_detailed_input_estimate,
-    get_video_duration_from_bytes,
+    format_keyframe_savings,
     MediaResolution,
 )
+from video.keyframes import Keyframe
+from video.probe import Buffer
 
 # Set to True to print debug messages for Gemini requests
 DEBUG_GEMINI = False
 
+# Frame rate videos are sent to Gemini at
+VIDEO_FPS = 10
+
+# Uploaded videos are processed by Gemini before they can be used
+GEMINI_FILE_PROCESSING_TIMEOUT_SECONDS = 120
+GEMINI_FILE_POLL_SECONDS = 1.0
+# Gemini keeps uploaded files for 48 hours
+GEMINI_FILE_TTL_SECONDS = 48 * 60 * 60
+
+
+class GeminiFileUploader(MediaUploader):
+    """Uploads media to the Gemini Files API"""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.key = "gemini:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+    async def upload(self, data: MediaSource, mime_type: str) -> MediaHandle:
+        start = time.perf_counter()
+        # A path is streamed from disk by the SDK
+        file_source = data if isinstance(data, str) else io.BytesIO(data)
+        async with client_registry.gemini(self.api_key) as client:
+            file = await client.aio.files.upload(
+                file=file_source, config=types.UploadFileConfig(mime_type=mime_type)
+            )
+            while file.state == types.FileState.PROCESSING:
+                if time.perf_counter() - start > GEMINI_FILE_PROCESSING_TIMEOUT_SECONDS:
+                    raise TimeoutError(f"Gemini file {file.name} is still processing")
+                await asyncio.sleep(GEMINI_FILE_POLL_SECONDS)
+                file = await client.aio.files.get(name=file.name or "")
+        if file.state == types.FileState.FAILED or not file.uri:
+            raise ValueError(f"Gemini file upload failed: {file.error}")
+
+        expires_at = (
+            file.expiration_time.timestamp()
+            if file.expiration_time
+            else time.time() + GEMINI_FILE_TTL_SECONDS
+        )
+        size = os.path.getsize(data) if isinstance(data, str) else len(data)
+        print(
+            f"[MEDIA] Uploaded {size} bytes to Gemini in "
+            f"{time.perf_counter() - start:.2f}s"
+        )
+        return MediaHandle(file.uri, file.mime_type or mime_type, expires_at)
+
+
+def prefers_keyframes(
+    video_duration: float | None, keyframes: List[Keyframe] | None
+) -> bool:
+    """Whether sending a video's keyframes is estimated to use fewer input
+    tokens than sending the video at VIDEO_FPS"""
+    if not keyframes:
+        return False
+    if not video_duration:
+        return True
+    keyframe_tokens = estimate_keyframe_input_tokens(len(keyframes), MediaResolution.HIGH)
+    video_tokens = estimate_video_input_tokens(video_duration, VIDEO_FPS, MediaResolution.HIGH)
+    return keyframe_tokens < video_tokens
+
+
+def token_usage(usage_metadata: types.GenerateContentResponseUsageMetadata) -> TokenUsage:
+    # Thinking tokens are billed at the same rate as output tokens
+    return {
+        "input_tokens": usage_metadata.prompt_token_count or 0,
+        "output_tokens": (usage_metadata.candidates_token_count or 0)
+        + (usage_metadata.thoughts_token_count or 0),
+    }
+
 
 def get_gemini_api_model_name(model: Llm) -> str:
     if model in [Llm.GEMINI_3_FLASH_PREVIEW_HIGH, Llm.GEMINI_3_FLASH_PREVIEW_MINIMAL]:
@@ -51,88 +131,43 @@ def extract_text_from_content(content: str | List[Dict[str, Any]]) -> str:
     return ""
 
 
-def detect_mime_type_from_base64(base64_data: str) -> str | None:
-    """
-    Detect MIME type from base64 data by checking magic bytes.
-    Returns detected MIME type or None if unknown.
-    """
-    try:
-        # Decode first few bytes to check magic numbers
-        decoded = base64.b64decode(base64_data[:32])
-
-        # Check for common image formats
-        if decoded[:8] == b'\x89PNG\r\n\x1a\n':
-            return "image/png"
-        if decoded[:2] == b'\xff\xd8':
-            return "image/jpeg"
-        if decoded[:6] in (b'GIF87a', b'GIF89a'):
-            return "image/gif"
-        if decoded[:4] == b'RIFF' and decoded[8:12] == b'WEBP':
-            return "image/webp"
-
-        # Check for video formats
-        if decoded[4:8] == b'ftyp':
-            # MP4/MOV file
-            return "video/mp4"
-        if decoded[:4] == b'\x1aE\xdf\xa3':
-            # WebM file
-            return "video/webm"
-    except Exception:
-        pass
-
-    return None
-
-
-def extract_images_from_content(
+def extract_image_urls_from_content(
     content: str | List[Dict[str, Any]]
-) -> List[Dict[str, str]]:
+) -> List[str]:
     """
-    Extracts image data from message content.
+    Extracts image URLs (data URLs or regular URLs) from message content.
 
     Args:
         content: Message content (string or list of content parts)
 
     Returns:
-        List of image data dictionaries (mime_type+data or uri).
+        List of image URLs.
     """
     # If content is a string, there's no image
     if isinstance(content, str):
         return []
 
-    # Content is a list of content parts
-    images: List[Dict[str, str]] = []
-    for content_part in content:
-        if content_part.get("type") == "image_url":
-            image_url = content_part["image_url"]["url"]
-            if image_url.startswith("data:"):
-                # Extract base64 data and mime type for data URLs
-                mime_type = image_url.split(";")[0].split(":")[1]
-                base64_data = image_url.split(",")[1]
-
-                # If MIME type is generic, try to detect from data
-                if mime_type == "application/octet-stream":
-                    detected_mime = detect_mime_type_from_base64(base64_data)
-                    if detected_mime:
-                        mime_type = detected_mime
-                    else:
-                        # Skip this content if we can't determine the type
-                        print(f"Warning: Could not detect MIME type for data URL, skipping")
-                        continue
-
-                images.append({"mime_type": mime_type, "data": base64_data})
-            else:
-                # Handle regular URLs
-                images.append({"uri": image_url})
-
-    return images
+    return [
+        content_part["image_url"]["url"]
+        for content_part in content
+        if content_part.get("type") == "image_url"
+    ]
 
 
 def convert_message_to_gemini_content(
     message: ChatCompletionMessageParam,
+    media: MediaRegistry | None = None,
 ) -> types.Content:
     """
     Convert an OpenAI-style message to Gemini Content format.
+
+    Images are decoded through media, which is shared by the request's
+    variants so each data URL is only decoded once. Media uploaded through
+    media is referenced by its file URI instead.
     """
+    if media is None:
+        media = MediaRegistry()
+
     role = message.get("role", "user")
     content = message.get("content", "")
 
@@ -143,21 +178,37 @@ def convert_message_to_gemini_content(
 
     # Extract text and image from content
     text = extract_text_from_content(content)  # type: ignore
-    image_data_list = extract_images_from_content(content)  # type: ignore
+    image_urls = extract_image_urls_from_content(content)  # type: ignore
 
     if text:
         parts.append({"text": text})
-    for image_data in image_data_list:
-        if "data" in image_data:
+    for image_url in image_urls:
+        handle = media.uploaded(image_url)
+        if handle is not None:
+            parts.append(
+                types.Part(
+                    file_data=types.FileData(
+                        file_uri=handle.uri, mime_type=handle.mime_type
+                    )
+                )
+            )
+        elif image_url.startswith("data:") or is_media_ref(image_url):
+            image = media.gemini_image(image_url)
+            if image is None:
+                # Skip this content if we can't determine the type
+                print(f"Warning: Could not detect MIME type for data URL, skipping")
+                continue
+
+            image_bytes, mime_type = image
             parts.append(
                 types.Part.from_bytes(
-                    data=base64.b64decode(image_data["data"]),
-                    mime_type=image_data["mime_type"],
+                    data=image_bytes,
+                    mime_type=mime_type,
                     media_resolution=types.PartMediaResolutionLevel.MEDIA_RESOLUTION_ULTRA_HIGH,
                 )
             )
-        elif "uri" in image_data:
-            parts.append({"file_uri": image_data["uri"]})
+        else:
+            parts.append({"file_uri": image_url})
 
     return types.Content(role=gemini_role, parts=parts)  # type: ignore
 
@@ -168,6 +219,7 @@ async def stream_gemini_response(
     callback: Callable[[str], Awaitable[None]],
     model: Llm,
     thinking_callback: Callable[[str], Awaitable[None]] | None = None,
+    media: MediaRegistry | None = None,
 ) -> Completion:
     """
     Stream a response from Gemini.
@@ -187,9 +239,16 @@ async def stream_gemini_response(
 
     # Convert all messages after the system prompt to Gemini format
     # This includes the full conversation history for edits
+    # Images are decoded in the media worker pool first so the event loop
+    # isn't blocked, and large videos are uploaded once.
+    if media is None:
+        media = MediaRegistry()
+    await media.prepare_gemini_images(
+        messages, GeminiFileUploader(api_key), GEMINI_FILE_UPLOAD_MIN_BYTES
+    )
     gemini_contents: List[types.Content] = []
     for msg in messages[1:]:
-        gemini_contents.append(convert_message_to_gemini_content(msg))
+        gemini_contents.append(convert_message_to_gemini_content(msg, media))
 
     # Debug: print truncated message info
     if DEBUG_GEMINI:
@@ -208,7 +267,6 @@ async def stream_gemini_response(
             print(f"  [{i}] {role}: {text_preview}... (has_image={has_image})")
         print("=" * 50)
 
-    client = genai.Client(api_key=api_key)
     full_response = ""
 
     if model == Llm.GEMINI_3_FLASH_PREVIEW_HIGH:
@@ -261,47 +319,69 @@ async def stream_gemini_response(
     # Map variant model names to actual API model names
     api_model_name = get_gemini_api_model_name(model)
 
-    async for chunk in await client.aio.models.generate_content_stream(
-        model=api_model_name,
-        contents=gemini_contents,
-        config=config,
-    ):
-        if chunk.candidates and len(chunk.candidates) > 0:
-            for part in chunk.candidates[0].content.parts:
-                if not part.text:
-                    continue
-                elif part.thought:
-                    if thinking_callback:
-                        await thinking_callback(part.text)
-                    else:
-                        print(f"\n=== Gemini Thinking Summary ({model.value}) ===")
-                        print(part.text)
-                        print("=" * 50)
-                else:
-                    full_response += part.text
-                    await callback(part.text)
+    usage_metadata = None
+
+    async with client_registry.gemini(api_key) as client:
+        stream = await client.aio.models.generate_content_stream(
+            model=api_model_name,
+            contents=gemini_contents,
+            config=config,
+        )
+        try:
+            async for chunk in stream:
+                # Usage is reported with the final chunks
+                if chunk.usage_metadata:
+                    usage_metadata = chunk.usage_metadata
+
+                if chunk.candidates and len(chunk.candidates) > 0:
+                    for part in chunk.candidates[0].content.parts:
+                        if not part.text:
+                            continue
+                        elif part.thought:
+                            if thinking_callback:
+                                await thinking_callback(part.text)
+                            else:
+                                print(f"\n=== Gemini Thinking Summary ({model.value}) ===")
+                                print(part.text)
+                                print("=" * 50)
+                        else:
+                            full_response += part.text
+                            await callback(part.text)
+        finally:
+            # Closes the HTTP stream when the variant is cancelled
+            await stream.aclose()
 
     completion_time = time.time() - start_time
-    return {"duration": completion_time, "code": full_response}
+    completion: Completion = {"duration": completion_time, "code": full_response}
+    if usage_metadata:
+        completion["usage"] = token_usage(usage_metadata)
+    return completion
 
 
 async def stream_gemini_response_video(
-    video_bytes: bytes,
+    video_bytes: Buffer,
     video_mime_type: str,
+    video_duration: float | None,
     system_prompt: str,
     api_key: str,
     callback: Callable[[str], Awaitable[None]],
     model: Llm,
     thinking_callback: Callable[[str], Awaitable[None]] | None = None,
+    keyframes: List[Keyframe] | None = None,
+    video_handle: MediaHandle | None = None,
 ) -> Completion:
+    """Generate code from a video. If keyframes (the frames where the UI
+    changes) are given and are estimated to use fewer input tokens than the
+    video at VIDEO_FPS, they're sent as timestamped images instead.
+    Otherwise the video is referenced by video_handle if it was uploaded,
+    or sent inline. video_bytes may be a memory map; it's only copied if
+    it's sent inline."""
     start_time = time.time()
 
     # Video generation settings
-    VIDEO_FPS = 10
     MAX_OUTPUT_TOKENS = 50000
 
-    # Get video duration and estimate input tokens
-    video_duration = get_video_duration_from_bytes(video_bytes)
+    # Estimate input tokens from the video duration
     estimated_input_tokens = None
     if video_duration:
         estimated_cost = estimate_video_generation_cost(
@@ -317,21 +397,61 @@ async def stream_gemini_response_video(
     else:
         print("Warning: Could not determine video duration for cost estimation")
 
-    client = genai.Client(api_key=api_key)
+    if keyframes and prefers_keyframes(video_duration, keyframes):
+        keyframe_tokens = estimate_keyframe_input_tokens(len(keyframes), MediaResolution.HIGH)
+        if estimated_input_tokens is not None and video_duration:
+            print(format_keyframe_savings(video_duration, VIDEO_FPS, len(keyframes), MediaResolution.HIGH, model))
+            print("=" * 50)
+            VIDEO_INPUT_TOKENS_SAVED_TOTAL.inc(estimated_input_tokens - keyframe_tokens)
+        estimated_input_tokens = keyframe_tokens
+    else:
+        keyframes = None
+
     full_response = ""
 
-    # Create content with video inline data at specified FPS for better fidelity
-    contents = types.Content(
-        role="user",
-        parts=[
+    if keyframes:
+        # Only the frames where the UI changes, each labeled with its timestamp
+        parts: List[types.Part] = []
+        for keyframe in keyframes:
+            parts.append(types.Part(text=f"Frame at {keyframe.timestamp:.1f}s:"))
+            parts.append(
+                types.Part(
+                    inline_data=types.Blob(data=keyframe.data, mime_type=keyframe.mime_type),
+                    media_resolution=types.PartMediaResolutionLevel.MEDIA_RESOLUTION_HIGH
+                )
+            )
+        parts.append(
             types.Part(
-                inline_data=types.Blob(data=video_bytes, mime_type=video_mime_type),
-                video_metadata=types.VideoMetadata(fps=VIDEO_FPS),
-                media_resolution=types.PartMediaResolutionLevel.MEDIA_RESOLUTION_HIGH
-            ),
-            types.Part(text="Analyze this video and generate the code."),
-        ],
-    )
+                text="These are the frames of the video where the UI changes. Analyze them and generate the code."
+            )
+        )
+        contents = types.Content(role="user", parts=parts)
+    else:
+        # Create content with the video at specified FPS for better fidelity,
+        # referencing the uploaded file if there is one
+        if video_handle is not None:
+            video_source: Dict[str, Any] = {
+                "file_data": types.FileData(
+                    file_uri=video_handle.uri, mime_type=video_handle.mime_type
+                )
+            }
+        else:
+            video_source = {
+                "inline_data": types.Blob(
+                    data=bytes(video_bytes), mime_type=video_mime_type
+                )
+            }
+        contents = types.Content(
+            role="user",
+            parts=[
+                types.Part(
+                    **video_source,
+                    video_metadata=types.VideoMetadata(fps=VIDEO_FPS),
+                    media_resolution=types.PartMediaResolutionLevel.MEDIA_RESOLUTION_HIGH
+                ),
+                types.Part(text="Analyze this video and generate the code."),
+            ],
+        )
 
     # Configure based on model
     if model == Llm.GEMINI_3_FLASH_PREVIEW_HIGH:
@@ -387,6 +507,7 @@ async def stream_gemini_response_video(
         print(f"\n=== Gemini Video Request Debug ({api_model_name}) ===")
         print(f"Video MIME type: {video_mime_type}")
         print(f"Video size: {len(video_bytes)} bytes")
+        print(f"Video file: {video_handle.uri if video_handle else 'inline'}")
         print(f"System prompt (first 200 chars): {system_prompt[:200]}...")
         print("=" * 50)
 
@@ -394,29 +515,35 @@ async def stream_gemini_response_video(
     # usage_metadata fields: prompt_token_count, candidates_token_count, total_token_count
     usage_metadata = None
 
-    async for chunk in await client.aio.models.generate_content_stream(
-        model=api_model_name,
-        contents=contents,
-        config=config,
-    ):
-        # Capture usage metadata (available in final chunks)
-        if chunk.usage_metadata:
-            usage_metadata = chunk.usage_metadata
-
-        if chunk.candidates and len(chunk.candidates) > 0:
-            for part in chunk.candidates[0].content.parts:
-                if not part.text:
-                    continue
-                elif part.thought:
-                    if thinking_callback:
-                        await thinking_callback(part.text)
-                    else:
-                        print(f"\n=== Gemini Video Thinking Summary ({api_model_name}) ===")
-                        print(part.text)
-                        print("=" * 50)
-                else:
-                    full_response += part.text
-                    await callback(part.text)
+    async with client_registry.gemini(api_key) as client:
+        stream = await client.aio.models.generate_content_stream(
+            model=api_model_name,
+            contents=contents,
+            config=config,
+        )
+        try:
+            async for chunk in stream:
+                # Capture usage metadata (available in final chunks)
+                if chunk.usage_metadata:
+                    usage_metadata = chunk.usage_metadata
+
+                if chunk.candidates and len(chunk.candidates) > 0:
+                    for part in chunk.candidates[0].content.parts:
+                        if not part.text:
+                            continue
+                        elif part.thought:
+                            if thinking_callback:
+                                await thinking_callback(part.text)
+                            else:
+                                print(f"\n=== Gemini Video Thinking Summary ({api_model_name}) ===")
+                                print(part.text)
+                                print("=" * 50)
+                        else:
+                            full_response += part.text
+                            await callback(part.text)
+        finally:
+            # Closes the HTTP stream when the variant is cancelled
+            await stream.aclose()
 
     completion_time = time.time() - start_time
 
@@ -446,4 +573,7 @@ async def stream_gemini_response_video(
         print(f"Generation time: {completion_time:.2f} seconds")
         print("=" * 50)
 
-    return {"duration": completion_time, "code": full_response}
+    completion: Completion = {"duration": completion_time, "code": full_response}
+    if usage_metadata:
+        completion["usage"] = token_usage(usage_metadata)
+    return completion
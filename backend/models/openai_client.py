@@ -1,8 +1,8 @@
 import time
 from typing import Awaitable, Callable, List
-from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletionMessageParam, ChatCompletionChunk
-from llm import Completion
+from clients.registry import client_registry
+from llm import Completion, TokenUsage
 
 
 async def stream_openai_response(
@@ -13,7 +13,6 @@ async def stream_openai_response(
     model_name: str,
 ) -> Completion:
     start_time = time.time()
-    client = AsyncOpenAI(api_key=api_key, base_url=base_url)
 
     # Base parameters
     params = {
@@ -24,6 +23,10 @@ async def stream_openai_response(
 
     params["temperature"] = 0
     params["stream"] = True
+    # Report token usage in the last chunk. Only requested from the official
+    # API, since compatible servers may reject the option.
+    if base_url is None:
+        params["stream_options"] = {"include_usage": True}
 
     # 4.1 series
     if model_name in [
@@ -33,21 +36,31 @@ async def stream_openai_response(
         params["stream"] = True
         params["max_tokens"] = 20000
 
-    stream = await client.chat.completions.create(**params)  # type: ignore
     full_response = ""
-    async for chunk in stream:  # type: ignore
-        assert isinstance(chunk, ChatCompletionChunk)
-        if (
-            chunk.choices
-            and len(chunk.choices) > 0
-            and chunk.choices[0].delta
-            and chunk.choices[0].delta.content
-        ):
-            content = chunk.choices[0].delta.content or ""
-            full_response += content
-            await callback(content)
-
-    await client.close()
+    usage: TokenUsage | None = None
+    async with client_registry.openai(api_key, base_url) as client:
+        stream = await client.chat.completions.create(**params)  # type: ignore
+        # Closing the stream (also on cancellation) returns the connection to the pool
+        async with stream:  # type: ignore
+            async for chunk in stream:  # type: ignore
+                assert isinstance(chunk, ChatCompletionChunk)
+                if chunk.usage:
+                    usage = {
+                        "input_tokens": chunk.usage.prompt_tokens,
+                        "output_tokens": chunk.usage.completion_tokens,
+                    }
+                if (
+                    chunk.choices
+                    and len(chunk.choices) > 0
+                    and chunk.choices[0].delta
+                    and chunk.choices[0].delta.content
+                ):
+                    content = chunk.choices[0].delta.content or ""
+                    full_response += content
+                    await callback(content)
 
     completion_time = time.time() - start_time
-    return {"duration": completion_time, "code": full_response}
+    completion: Completion = {"duration": completion_time, "code": full_response}
+    if usage is not None:
+        completion["usage"] = usage
+    return completion
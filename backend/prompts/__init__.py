@@ -2,8 +2,12 @@ import json
 from typing import Any, cast
 from openai.types.chat import ChatCompletionMessageParam, ChatCompletionContentPartParam
 
+from config import HISTORY_COMPACTION_ENABLED
 from custom_types import InputMode
 from image_generation.core import create_alt_url_mapping
+from metrics.cancellation import estimate_tokens
+from metrics.latency import PROMPT_HISTORY_TOKENS_SAVED_TOTAL
+from prompts.history_compaction import compact_history, text_chars
 from prompts.imported_code_prompts import IMPORTED_CODE_SYSTEM_PROMPTS
 from prompts.screenshot_system_prompts import SYSTEM_PROMPTS
 from prompts.text_prompts import SYSTEM_PROMPTS as TEXT_SYSTEM_PROMPTS
@@ -90,6 +94,15 @@ async def create_prompt(
 
             image_cache = create_alt_url_mapping(history[-2]["text"])
 
+    if generation_type == "update" and HISTORY_COMPACTION_ENABLED:
+        # Keep only the latest code verbatim and send each image once
+        compacted = compact_history(prompt_messages)
+        chars_saved = text_chars(prompt_messages) - text_chars(compacted)
+        if chars_saved:
+            print(f"[HISTORY] Compacted update history by {chars_saved:,} characters")
+            PROMPT_HISTORY_TOKENS_SAVED_TOTAL.inc(estimate_tokens(chars_saved))
+        prompt_messages = compacted
+
     return prompt_messages, image_cache
 
 
@@ -0,0 +1,54 @@
+from typing import Any, cast
+
+from openai.types.chat import ChatCompletionMessageParam
+
+from codegen.edit_blocks import DIVIDER_MARKER, REPLACE_MARKER, SEARCH_MARKER
+
+EDIT_BLOCK_INSTRUCTIONS = f"""
+Instead of the whole document, respond with only the changes to the latest
+version of the code, as one or more search/replace blocks:
+
+{SEARCH_MARKER}
+exact lines from the latest code
+{DIVIDER_MARKER}
+the lines to replace them with
+{REPLACE_MARKER}
+
+- Each SEARCH section must match the latest code exactly, including
+  whitespace, and appear in it only once. Include enough surrounding lines to
+  make it unique, but keep it short.
+- Blocks are applied in order; a later block sees the result of the earlier
+  ones.
+- To insert code, include the lines next to it in both SEARCH and REPLACE. To
+  delete code, leave REPLACE empty.
+- Do not wrap the blocks in markdown code fences or explain them.
+- If the change rewrites most of the page, respond with the complete HTML
+  document instead of blocks.
+"""
+
+
+def latest_code(messages: list[ChatCompletionMessageParam]) -> str | None:
+    """The latest code in an update prompt (the last assistant message)"""
+    for message in reversed(messages):
+        if message["role"] == "assistant":
+            content = message.get("content")
+            return content if isinstance(content, str) and content.strip() else None
+    return None
+
+
+def with_edit_instructions(
+    messages: list[ChatCompletionMessageParam],
+) -> list[ChatCompletionMessageParam]:
+    """messages with the edit block instructions added to the last user
+    message. The instructions go last so the rest of the prompt (and any
+    provider prompt cache) is unchanged."""
+    *rest, last = messages
+    content = last.get("content")
+    if isinstance(content, str):
+        content = f"{content}\n{EDIT_BLOCK_INSTRUCTIONS}"
+    else:
+        content = [
+            *cast(list[dict[str, Any]], content or []),
+            {"type": "text", "text": EDIT_BLOCK_INSTRUCTIONS},
+        ]
+    return [*rest, cast(ChatCompletionMessageParam, {**last, "content": content})]
@@ -0,0 +1,183 @@
+import difflib
+import html
+import re
+from typing import Any, Callable, cast
+
+from openai.types.chat import ChatCompletionMessageParam
+
+from config import HISTORY_DIFF_MAX_CHARS, HISTORY_SUMMARY_MIN_CHARS
+
+# Headings listed in the outline of an omitted version without a predecessor
+MAX_OUTLINE_HEADINGS = 8
+
+TITLE_PATTERN = re.compile(r"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+HEADING_PATTERN = re.compile(r"<h[1-3][^>]*>(.*?)</h[1-3]>", re.IGNORECASE | re.DOTALL)
+TAG_PATTERN = re.compile(r"<[^>]+>")
+
+
+def _text(fragment: str) -> str:
+    return " ".join(html.unescape(TAG_PATTERN.sub(" ", fragment)).split())
+
+
+def outline(code: str) -> str:
+    """The title and top-level headings of an HTML document"""
+    parts: list[str] = []
+    title = TITLE_PATTERN.search(code)
+    if title and _text(title.group(1)):
+        parts.append(f"Title: {_text(title.group(1))}.")
+    headings = [_text(h) for h in HEADING_PATTERN.findall(code)]
+    headings = [h for h in headings if h][:MAX_OUTLINE_HEADINGS]
+    if headings:
+        parts.append(f"Headings: {'; '.join(headings)}.")
+    return " ".join(parts)
+
+
+def code_diff(previous: str, code: str, max_chars: int = HISTORY_DIFF_MAX_CHARS) -> str:
+    """The changed lines from previous to code, without context, truncated
+    to about max_chars"""
+    lines = [
+        line
+        for line in difflib.unified_diff(
+            previous.splitlines(), code.splitlines(), lineterm="", n=0
+        )
+        if not line.startswith(("---", "+++"))
+    ]
+    kept: list[str] = []
+    size = 0
+    for line in lines:
+        if size + len(line) > max_chars:
+            kept.append(f"... {len(lines) - len(kept)} more diff lines")
+            break
+        kept.append(line)
+        size += len(line) + 1
+    return "\n".join(kept)
+
+
+def summarize_code(code: str, previous: str | None) -> str:
+    """Stand-in for a version of the code superseded by a later one: its diff
+    from the version before it, or an outline if it's the first version"""
+    header = (
+        f"[An earlier version of the code ({len(code):,} characters) was "
+        "omitted; the latest version is below."
+    )
+    if previous is None:
+        summary = outline(code)
+        return f"{header} {summary}]" if summary else f"{header}]"
+    diff = code_diff(previous, code)
+    if not diff:
+        return f"{header} It was unchanged from the version before it.]"
+    return f"{header} Changes from the version before it:\n```diff\n{diff}\n```]"
+
+
+def text_chars(messages: list[ChatCompletionMessageParam]) -> int:
+    """Characters of text in messages"""
+    chars = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        else:
+            for part in cast(list[dict[str, Any]], content or []):
+                chars += len(part.get("text", ""))
+    return chars
+
+
+def _parts(message: ChatCompletionMessageParam) -> list[dict[str, Any]] | None:
+    content = message.get("content")
+    return cast(list[dict[str, Any]], content) if isinstance(content, list) else None
+
+
+def _without_images(
+    message: ChatCompletionMessageParam, keep: Callable[[str], bool]
+) -> ChatCompletionMessageParam:
+    parts = _parts(message)
+    if parts is None:
+        return message
+    kept = [
+        part
+        for part in parts
+        if part.get("type") != "image_url" or keep(part["image_url"]["url"])
+    ]
+    if len(kept) == len(parts):
+        return message
+    return cast(ChatCompletionMessageParam, {**message, "content": kept})
+
+
+def compact_history(
+    messages: list[ChatCompletionMessageParam],
+    summary_min_chars: int = HISTORY_SUMMARY_MIN_CHARS,
+) -> list[ChatCompletionMessageParam]:
+    """Compact an update prompt. The latest code is kept verbatim; earlier
+    versions of at least summary_min_chars are replaced by summaries, and
+    images that were already sent are removed from later messages.
+
+    The result only depends on messages, so repeated requests produce the
+    same prompt (and hit provider prompt caches).
+    """
+    code_indexes = [
+        index
+        for index, message in enumerate(messages)
+        if message["role"] == "assistant" and isinstance(message.get("content"), str)
+    ]
+    latest = code_indexes[-1] if code_indexes else None
+
+    seen_images: set[str] = set()
+
+    def first_time(url: str) -> bool:
+        if url in seen_images:
+            return False
+        seen_images.add(url)
+        return True
+
+    compacted: list[ChatCompletionMessageParam] = []
+    previous_code: str | None = None
+    for index, message in enumerate(messages):
+        if index in code_indexes:
+            code = cast(str, message.get("content"))
+            if index != latest and len(code) >= summary_min_chars:
+                message = cast(
+                    ChatCompletionMessageParam,
+                    {**message, "content": summarize_code(code, previous_code)},
+                )
+            previous_code = code
+        elif message["role"] == "user":
+            message = _without_images(message, first_time)
+        compacted.append(message)
+    return compacted
+
+
+def fit_to_token_budget(
+    messages: list[ChatCompletionMessageParam],
+    budget: int,
+    count_tokens: Callable[[list[ChatCompletionMessageParam]], int],
+) -> list[ChatCompletionMessageParam]:
+    """Drop the oldest history until messages fit in budget tokens.
+
+    The messages before the first code (the system prompt and the original
+    request), the latest code and the instructions after it are always
+    kept. Images in the older instructions are dropped first, then the
+    oldest (code, instruction) turns. If the kept messages alone are over
+    budget, they're returned as they are.
+    """
+    if count_tokens(messages) <= budget:
+        return messages
+    code_indexes = [
+        index for index, message in enumerate(messages) if message["role"] == "assistant"
+    ]
+    if len(code_indexes) < 2:
+        return messages
+    start, latest = code_indexes[0], code_indexes[-1]
+    prefix, older, rest = messages[:start], messages[start:latest], messages[latest:]
+
+    for index in range(len(older)):
+        if older[index]["role"] == "user":
+            older[index] = _without_images(older[index], lambda _: False)
+            if count_tokens(prefix + older + rest) <= budget:
+                return prefix + older + rest
+
+    # Whole turns, so user and assistant messages still alternate
+    while older:
+        older = older[2:]
+        if count_tokens(prefix + older + rest) <= budget:
+            break
+    return prefix + older + rest
@@ -0,0 +1,18 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+
+from image_generation.asset_store import ASSET_ROUTE, asset_store
+
+router = APIRouter()
+
+# Asset names are content hashes, so a URL's content never changes
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@router.get(ASSET_ROUTE + "/{name}")
+async def get_asset(name: str) -> FileResponse:
+    path = asset_store.path(name)
+    if path is None or not path.is_file():
+        raise HTTPException(status_code=404, detail="Asset not found")
+    asset_store.touch(name)
+    return FileResponse(path, headers={"Cache-Control": IMMUTABLE_CACHE_CONTROL})
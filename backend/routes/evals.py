@@ -177,6 +177,8 @@ class RunEvalsRequest(BaseModel):
     models: List[str]
     stack: Stack
     files: List[str] = []  # Optional list of specific file paths to run evals on
+    # Replay earlier results from the completion cache instead of calling the model
+    use_cache: bool = False
 
 
 @router.post("/run_evals", response_model=List[str])
@@ -186,7 +188,10 @@ async def run_evals(request: RunEvalsRequest) -> List[str]:
 
     for model in request.models:
         output_files = await run_image_evals(
-            model=model, stack=request.stack, input_files=request.files
+            model=model,
+            stack=request.stack,
+            input_files=request.files,
+            use_cache=request.use_cache,
         )
         all_output_files.extend(output_files)
 
@@ -1,4 +1,5 @@
 import asyncio
+import time
 from dataclasses import dataclass, field
 from abc import ABC, abstractmethod
 import traceback
@@ -6,22 +7,47 @@ from typing import Callable, Awaitable
 from fastapi import APIRouter, WebSocket
 import openai
 from websockets.exceptions import ConnectionClosedOK, ConnectionClosedError
+from codegen.completion_cache import (
+    cache_completion,
+    completion_cache_key,
+    get_cached_completion,
+    prompt_digest,
+    replay_completion,
+)
+from codegen.edit_blocks import EditApplyError, EditStream
 from codegen.utils import extract_html_content
 from config import (
     ANTHROPIC_API_KEY,
+    EDIT_SET_CODE_INTERVAL_SECONDS,
+    FIRST_K_STRAGGLER_DEADLINE_SECONDS,
+    FIRST_K_STRAGGLER_POLICY,
     GEMINI_API_KEY,
+    GEMINI_FILE_UPLOAD_MIN_BYTES,
+    HISTORY_COMPACTION_ENABLED,
+    HISTORY_TOKEN_BUDGET,
+    HISTORY_TOKEN_BUDGETS,
+    IMAGE_PREFETCH_ENABLED,
     IS_PROD,
+    MAX_REQUEST_COST_USD,
+    MAX_VARIANT_COST_USD,
     NUM_VARIANTS,
     NUM_VARIANTS_VIDEO,
     OPENAI_API_KEY,
     OPENAI_BASE_URL,
     REPLICATE_API_KEY,
     SHOULD_MOCK_AI_RESPONSE,
+    UPDATE_MODE,
+    VIDEO_KEYFRAMES_ENABLED,
+    WS_BATCH_MAX_BYTES,
+    WS_BATCH_WINDOW_MS,
+    WS_SEND_OVERFLOW_POLICY,
+    WS_SEND_QUEUE_SIZE,
 )
 from custom_types import InputMode
 from llm import (
     Completion,
     Llm,
+    MODEL_PROVIDER,
     OPENAI_MODELS,
     ANTHROPIC_MODELS,
     GEMINI_MODELS,
@@ -32,7 +58,34 @@ from models import (
     stream_gemini_response,
     stream_gemini_response_video,
 )
+from models.gemini import VIDEO_FPS, GeminiFileUploader, prefers_keyframes
 from fs_logging.core import write_logs
+from image_processing.media_registry import MediaRegistry, image_data_urls
+from image_processing.media_store import is_media_ref, media_id_from_ref, media_store
+from metrics.cancellation import estimate_tokens, record_cancellation, record_completion
+from metrics.latency import (
+    EDIT_UPDATE_OUTPUT_TOKENS_SAVED_TOTAL,
+    EDIT_UPDATE_SECONDS_SAVED_TOTAL,
+    EDIT_UPDATES_TOTAL,
+    IMAGE_GENERATION_CALLS_SAVED_TOTAL,
+    IMAGE_GENERATION_SECONDS,
+    LLM_COST_USD_TOTAL,
+    LLM_ESTIMATED_COST_USD_TOTAL,
+    LLM_TOKENS_TOTAL,
+    PROMPT_HISTORY_TOKENS_SAVED_TOTAL,
+    VARIANT_FINALIZE_SECONDS,
+    VARIANTS_OVER_BUDGET_TOTAL,
+    PIPELINE_REQUEST_SECONDS,
+    PIPELINE_STAGE_SECONDS,
+    VARIANT_GENERATION_SECONDS,
+    VARIANT_INTER_CHUNK_SECONDS,
+    VARIANT_OUTPUT_TOKENS,
+    VARIANT_TIME_TO_FIRST_TOKEN_SECONDS,
+    WS_DROPPED_MESSAGES_TOTAL,
+    WS_FRAMES_TOTAL,
+    WS_MESSAGES_TOTAL,
+    WS_SEND_BLOCKED_SECONDS_TOTAL,
+)
 from mock_llm import mock_completion
 from typing import (
     Any,
@@ -41,6 +94,7 @@ from typing import (
     Dict,
     List,
     Literal,
+    Tuple,
     cast,
     get_args,
 )
@@ -58,17 +112,58 @@ MessageType = Literal[
     "variantError",
     "variantCount",
     "thinking",
+    "session",
+    "variantCancelled",
+    "generationComplete",
 ]
-from image_generation.core import generate_images
+
+# Streaming deltas that may be coalesced into a single frame per variant.
+# Every other message type flushes pending deltas and is sent immediately.
+BATCHABLE_MESSAGE_TYPES: set[str] = {"chunk", "thinking"}
+
+# What to do when a connection's send queue is full (see config.py)
+OverflowPolicy = Literal["merge", "drop_thinking", "abort"]
+
+# What to do with the remaining variants once the first K have finished
+StragglerPolicy = Literal["cancel", "deadline"]
+
+# How update generations produce the new code (see config.py)
+UpdateMode = Literal["edit", "full"]
+from image_generation.asset_store import asset_base_url
+from image_generation.coordinator import ImageGenerationCoordinator
+from image_generation.core import generate_images, prefetch_image
+from image_generation.scanner import PlaceholderImageScanner
 from prompts import create_prompt
 from prompts.claude_prompts import GEMINI_VIDEO_PROMPT
+from prompts.edit_prompts import latest_code, with_edit_instructions
+from prompts.history_compaction import fit_to_token_budget
 from portfolio.storage import load_portfolio
 from prompts.types import Stack, PromptContent
-from video.utils import get_video_bytes_and_mime_type
 from usage.daily_attempts import record_daily_attempt
+from usage.estimate import (
+    UsageEstimate,
+    count_input_tokens,
+    estimate_usage,
+    over_budget,
+)
+from usage.ledger import get_calibration, record_usage
+from usage.pricing import MODEL_PROFILES, token_cost
+from video.cost_estimation import (
+    PROMPT_TOKENS_ESTIMATE,
+    MediaResolution,
+    estimate_video_input_tokens,
+)
+from video.keyframes import Keyframe
+from scheduling.admission import (
+    PRIORITY_CREATE,
+    PRIORITY_UPDATE,
+    VariantAdmission,
+    admission_controller,
+)
 
 # from utils import pprint_prompt
 from ws.constants import APP_ERROR_WEB_SOCKET_CODE  # type: ignore
+from ws.sessions import GenerationSession, create_session, get_session
 
 
 router = APIRouter()
@@ -96,17 +191,32 @@ class PipelineContext:
     completions: List[str] = field(default_factory=list)
     variant_completions: Dict[int, str] = field(default_factory=dict)
     metadata: Dict[str, Any] = field(default_factory=dict)
+    session: GenerationSession | None = None
+    admission: VariantAdmission | None = None
 
     @property
     def send_message(self):
+        # Route through the session so output survives reconnects
+        if self.session is not None:
+            return self.session.send_message
         assert self.ws_comm is not None
         return self.ws_comm.send_message
 
     @property
     def throw_error(self):
+        if self.session is not None:
+            return self.session.throw_error
         assert self.ws_comm is not None
         return self.ws_comm.throw_error
 
+    @property
+    def cancel_event(self) -> asyncio.Event:
+        """Set when in-flight generation work should be cancelled"""
+        if self.session is not None:
+            return self.session.abandoned
+        assert self.ws_comm is not None
+        return self.ws_comm.disconnected
+
 
 class Middleware(ABC):
     """Base class for all pipeline middleware"""
@@ -142,17 +252,41 @@ class Pipeline:
         for middleware in reversed(self.middlewares):
             chain = self._wrap_middleware(middleware, chain)
 
-        await chain(context)
+        start_time = time.perf_counter()
+        try:
+            await chain(context)
+        finally:
+            PIPELINE_REQUEST_SECONDS.observe(time.perf_counter() - start_time)
 
     def _wrap_middleware(
         self,
         middleware: Middleware,
         next_func: Callable[[PipelineContext], Awaitable[None]],
     ) -> Callable[[PipelineContext], Awaitable[None]]:
-        """Wrap a middleware with its next function"""
+        """Wrap a middleware with its next function, timing the middleware"""
+        stage = type(middleware).__name__
 
         async def wrapped(context: PipelineContext) -> None:
-            await middleware.process(context, lambda: next_func(context))
+            # Time spent in later middlewares is subtracted so each stage is
+            # only charged for its own work
+            downstream_seconds = 0.0
+
+            async def timed_next() -> None:
+                nonlocal downstream_seconds
+                next_start = time.perf_counter()
+                try:
+                    await next_func(context)
+                finally:
+                    downstream_seconds += time.perf_counter() - next_start
+
+            start_time = time.perf_counter()
+            try:
+                await middleware.process(context, timed_next)
+            finally:
+                PIPELINE_STAGE_SECONDS.observe(
+                    time.perf_counter() - start_time - downstream_seconds,
+                    stage=stage,
+                )
 
         return wrapped
 
@@ -160,14 +294,108 @@ class Pipeline:
 class WebSocketCommunicator:
     """Handles WebSocket communication with consistent error handling"""
 
-    def __init__(self, websocket: WebSocket):
+    def __init__(
+        self,
+        websocket: WebSocket,
+        batch_window_ms: float = WS_BATCH_WINDOW_MS,
+        batch_max_bytes: int = WS_BATCH_MAX_BYTES,
+        queue_size: int = WS_SEND_QUEUE_SIZE,
+        overflow_policy: str = WS_SEND_OVERFLOW_POLICY,
+    ):
         self.websocket = websocket
         self.is_closed = False
+        # Set when the client goes away (as opposed to us closing the socket)
+        self.disconnected = asyncio.Event()
+        self._watcher_task: asyncio.Task[None] | None = None
+
+        # Batching of chunk/thinking deltas (disabled when the window is 0)
+        self.batch_window = batch_window_ms / 1000
+        self.batch_max_bytes = batch_max_bytes
+        # variantIndex -> (message type, buffered parts, buffered bytes)
+        self._pending: Dict[int, tuple[MessageType, List[str], int]] = {}
+        self._flush_task: asyncio.Task[None] | None = None
+
+        # Frames are written by a single writer task draining a bounded queue.
+        # None is the sentinel that stops the writer.
+        if overflow_policy not in get_args(OverflowPolicy):
+            raise ValueError(f"Invalid send queue overflow policy: {overflow_policy}")
+        self.overflow_policy = cast(OverflowPolicy, overflow_policy)
+        self._queue: asyncio.Queue[Dict[str, Any] | None] = asyncio.Queue(
+            maxsize=queue_size
+        )
+        self._writer_task: asyncio.Task[None] | None = None
+        # Serializes producers so frames are queued in the order they were sent
+        self._enqueue_lock = asyncio.Lock()
+
+        # Counters used to report the frame reduction from batching
+        self.messages_sent = 0
+        self.frames_sent = 0
+        # Backpressure stats
+        self.max_queue_depth = 0
+        self.send_blocked_seconds = 0.0
+        self.write_seconds = 0.0
+        self.dropped_messages = 0
+
+    @property
+    def is_batching_enabled(self) -> bool:
+        return self.batch_window > 0
+
+    @property
+    def frame_reduction_ratio(self) -> float:
+        """Logical messages per WebSocket frame (1.0 means no batching happened)"""
+        if self.frames_sent == 0:
+            return 1.0
+        return self.messages_sent / self.frames_sent
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def get_stats(self) -> Dict[str, float]:
+        """Per-connection send statistics"""
+        return {
+            "messages_sent": self.messages_sent,
+            "frames_sent": self.frames_sent,
+            "frame_reduction_ratio": self.frame_reduction_ratio,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "send_blocked_seconds": self.send_blocked_seconds,
+            "write_seconds": self.write_seconds,
+            "dropped_messages": self.dropped_messages,
+        }
 
     async def accept(self) -> None:
         """Accept the WebSocket connection"""
         await self.websocket.accept()
         print("Incoming websocket connection...")
+        self._ensure_writer()
+
+    def watch_for_disconnect(self) -> None:
+        """Start listening for the client closing the socket.
+
+        Must only be called once the request params have been received, since
+        it takes over reading from the socket.
+        """
+        if self._watcher_task is None:
+            self._watcher_task = asyncio.create_task(self._watch_disconnect())
+
+    async def _watch_disconnect(self) -> None:
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+        except Exception:
+            pass  # receive() fails once the socket is gone
+        print("WebSocket closed by client")
+        self._mark_disconnected()
+
+    def _mark_disconnected(self) -> None:
+        self.is_closed = True
+        self.disconnected.set()
+        self._cancel_flush_timer()
+        self._pending = {}
+        self._drain_queue()
 
     async def send_message(
         self,
@@ -179,6 +407,23 @@ class WebSocketCommunicator:
         if self.is_closed:
             return
 
+        self.messages_sent += 1
+
+        if type in BATCHABLE_MESSAGE_TYPES:
+            if (
+                type == "thinking"
+                and self.overflow_policy == "drop_thinking"
+                and self._queue.full()
+            ):
+                self.dropped_messages += 1
+                return
+
+            if self.is_batching_enabled or (
+                self.overflow_policy == "merge" and self._queue.full()
+            ):
+                await self._buffer(type, value, variantIndex)
+                return
+
         # Print for debugging on the backend
         if type == "error":
             print(f"Error (variant {variantIndex + 1}): {value}")
@@ -189,20 +434,189 @@ class WebSocketCommunicator:
         elif type == "variantError":
             print(f"Variant {variantIndex + 1} error: {value}")
 
+        # Pending deltas must reach the client before setCode, variantComplete, etc.
+        await self.flush()
+        await self._enqueue({"type": type, "value": value, "variantIndex": variantIndex})
+
+    async def flush(self, force: bool = True) -> None:
+        """Queue all buffered deltas, one frame per variant.
+
+        A non-forced flush (from the batch timer) leaves the deltas buffered
+        while the send queue is full under the "merge" policy.
+        """
+        if not force and self._should_hold_deltas():
+            self._schedule_flush()
+            return
+
+        pending = self._pending
+        self._pending = {}
+        for variant_index, (type, parts, _) in pending.items():
+            await self._enqueue(
+                {"type": type, "value": "".join(parts), "variantIndex": variant_index}
+            )
+
+    async def _flush_variant(self, variant_index: int) -> None:
+        entry = self._pending.pop(variant_index, None)
+        if entry is not None:
+            type, parts, _ = entry
+            await self._enqueue(
+                {"type": type, "value": "".join(parts), "variantIndex": variant_index}
+            )
+
+    def _should_hold_deltas(self) -> bool:
+        return self.overflow_policy == "merge" and self._queue.full()
+
+    async def _buffer(self, type: MessageType, value: str, variant_index: int) -> None:
+        """Add a delta to the variant's buffer, flushing on type change or size"""
+        entry = self._pending.get(variant_index)
+        if entry is not None and entry[0] != type:
+            # Keep chunk/thinking ordering intact within a variant
+            await self._flush_variant(variant_index)
+            entry = None
+
+        if entry is None:
+            entry = (type, [], 0)
+        parts = entry[1]
+        parts.append(value)
+        size = entry[2] + len(value.encode("utf-8"))
+        self._pending[variant_index] = (type, parts, size)
+
+        if size >= self.batch_max_bytes and not self._should_hold_deltas():
+            await self._flush_variant(variant_index)
+        else:
+            self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_window())
+
+    async def _flush_after_window(self) -> None:
+        try:
+            # Held deltas under backpressure still need a retry interval
+            await asyncio.sleep(self.batch_window or 0.01)
+        finally:
+            self._flush_task = None
+        await self.flush(force=False)
+
+    async def _enqueue(self, frame: Dict[str, Any]) -> None:
+        """Queue a frame for the writer task, applying the overflow policy"""
+        async with self._enqueue_lock:
+            if self.is_closed:
+                return
+            self._ensure_writer()
+
+            if self._queue.full():
+                if self.overflow_policy == "abort":
+                    print("WebSocket send queue full, closing slow connection")
+                    await self._abort()
+                    return
+
+                start = time.perf_counter()
+                await self._queue.put(frame)
+                self.send_blocked_seconds += time.perf_counter() - start
+            else:
+                self._queue.put_nowait(frame)
+
+            self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+
+    def _ensure_writer(self) -> None:
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._writer())
+
+    async def _writer(self) -> None:
+        """Drain the send queue onto the socket"""
+        while True:
+            frame = await self._queue.get()
+            if frame is None:
+                return
+
+            start = time.perf_counter()
+            try:
+                await self.websocket.send_json(frame)
+                self.frames_sent += 1
+            except (ConnectionClosedOK, ConnectionClosedError):
+                print(f"WebSocket closed by client, skipping message: {frame['type']}")
+                self._mark_disconnected()
+                return
+            except Exception as e:
+                # e.g. sending after Starlette saw the close, or an unserializable
+                # frame. Nothing more can be sent, and producers blocked on the
+                # queue must be released.
+                print(f"WebSocket send failed, dropping connection: {e!r}")
+                self._mark_disconnected()
+                return
+            finally:
+                self.write_seconds += time.perf_counter() - start
+
+    def _drain_queue(self) -> None:
+        """Discard queued frames so producers blocked on a full queue are released"""
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    async def _stop_writer(self) -> None:
+        """Let the writer send everything queued so far, then stop it"""
+        if self._writer_task is None:
+            return
+        if not self._writer_task.done():
+            try:
+                self._queue.put_nowait(None)
+            except asyncio.QueueFull:
+                await self._queue.put(None)
+            await self._writer_task
+        self._writer_task = None
+
+    async def _abort(self) -> None:
+        # Dropping a slow client is treated like a disconnect so that its
+        # generation is cancelled too
+        self._mark_disconnected()
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            self._writer_task = None
         try:
-            await self.websocket.send_json(
-                {"type": type, "value": value, "variantIndex": variantIndex}
+            await self.websocket.close(APP_ERROR_WEB_SOCKET_CODE)
+        except (ConnectionClosedOK, ConnectionClosedError, RuntimeError):
+            pass
+
+    def _cancel_watcher(self) -> None:
+        if self._watcher_task is not None:
+            self._watcher_task.cancel()
+            self._watcher_task = None
+
+    def _cancel_flush_timer(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+    def _record_send_metrics(self) -> None:
+        WS_MESSAGES_TOTAL.inc(self.messages_sent)
+        WS_FRAMES_TOTAL.inc(self.frames_sent)
+        WS_DROPPED_MESSAGES_TOTAL.inc(self.dropped_messages)
+        WS_SEND_BLOCKED_SECONDS_TOTAL.inc(self.send_blocked_seconds)
+
+    def _log_send_stats(self) -> None:
+        if self.is_batching_enabled and self.frames_sent > 0:
+            print(
+                f"[WS] {self.messages_sent} messages sent in {self.frames_sent} frames "
+                f"({self.frame_reduction_ratio:.1f}x fewer frames)"
             )
-        except (ConnectionClosedOK, ConnectionClosedError):
-            print(f"WebSocket closed by client, skipping message: {type}")
-            self.is_closed = True
+        print(
+            f"[WS] max queue depth {self.max_queue_depth}, "
+            f"blocked on sends {self.send_blocked_seconds:.2f}s, "
+            f"writing {self.write_seconds:.2f}s, "
+            f"dropped {self.dropped_messages} messages"
+        )
 
     async def throw_error(self, message: str) -> None:
         """Send an error message and close the connection"""
         print(message)
         if not self.is_closed:
+            self._cancel_watcher()
+            self._cancel_flush_timer()
+            await self.flush()
+            await self._enqueue({"type": "error", "value": message})
+            await self._stop_writer()
+            self._record_send_metrics()
             try:
-                await self.websocket.send_json({"type": "error", "value": message})
                 await self.websocket.close(APP_ERROR_WEB_SOCKET_CODE)
             except (ConnectionClosedOK, ConnectionClosedError):
                 print("WebSocket already closed by client")
@@ -216,12 +630,21 @@ class WebSocketCommunicator:
 
     async def close(self) -> None:
         """Close the WebSocket connection"""
+        self._cancel_watcher()
+        self._cancel_flush_timer()
         if not self.is_closed:
+            await self.flush()
+            await self._stop_writer()
+            self._record_send_metrics()
+            self._log_send_stats()
             try:
                 await self.websocket.close()
             except (ConnectionClosedOK, ConnectionClosedError):
                 pass  # Already closed by client
             self.is_closed = True
+        elif self._writer_task is not None:
+            self._writer_task.cancel()
+            self._writer_task = None
 
 
 @dataclass
@@ -237,6 +660,12 @@ class ExtractedParams:
     history: List[Dict[str, Any]]
     is_imported_from_code: bool
     portfolio_data: Dict[str, Any] | None = None
+    # Complete the generation once this many variants have finished
+    first_k: int | None = None
+    straggler_policy: StragglerPolicy = "cancel"
+    # Drop variants until the request's estimated cost is within this (USD)
+    max_cost_usd: float | None = None
+    update_mode: UpdateMode = "full"
 
 
 class ParameterExtractionStage:
@@ -298,6 +727,17 @@ class ParameterExtractionStage:
         # Extract history (default to empty list)
         history = cast(List[Dict[str, Any]], params.get("history", []))
 
+        # Uploaded media must still be in the media store
+        image_urls = list(prompt.get("images", []))
+        for item in history:
+            image_urls.extend(item.get("images", []))
+        for url in image_urls:
+            if is_media_ref(url) and not self._is_uploaded(url):
+                await self.throw_error(
+                    "Uploaded media is no longer available. Please try again."
+                )
+                raise ValueError(f"Unknown media reference: {url[:80]}")
+
         # Extract imported code flag
         is_imported_from_code = cast(bool, params.get("isImportedFromCode", False))
 
@@ -306,6 +746,42 @@ class ParameterExtractionStage:
         if validated_stack == "astro_blog":
             portfolio_data = load_portfolio().model_dump()
 
+        # First-K-wins mode (waits for all variants when not set)
+        first_k_param = params.get("firstK")
+        first_k: int | None = None
+        if first_k_param is not None:
+            try:
+                first_k = int(first_k_param)
+            except (TypeError, ValueError):
+                first_k = 0
+            if first_k < 1:
+                await self.throw_error(f"Invalid firstK: {first_k_param}")
+                raise ValueError(f"Invalid firstK: {first_k_param}")
+
+        # The frontend sends null to use the configured policy
+        straggler_policy = params.get("stragglerPolicy") or FIRST_K_STRAGGLER_POLICY
+        if straggler_policy not in get_args(StragglerPolicy):
+            await self.throw_error(f"Invalid straggler policy: {straggler_policy}")
+            raise ValueError(f"Invalid straggler policy: {straggler_policy}")
+
+        update_mode = params.get("updateMode", UPDATE_MODE)
+        if update_mode not in get_args(UpdateMode):
+            await self.throw_error(f"Invalid update mode: {update_mode}")
+            raise ValueError(f"Invalid update mode: {update_mode}")
+
+        # A request can lower, but not raise, the configured cost limit
+        max_cost_usd = MAX_REQUEST_COST_USD or None
+        max_cost_param = params.get("maxCostUsd")
+        if max_cost_param is not None:
+            try:
+                requested_max_cost = float(max_cost_param)
+            except (TypeError, ValueError):
+                requested_max_cost = 0.0
+            if not requested_max_cost > 0:
+                await self.throw_error(f"Invalid maxCostUsd: {max_cost_param}")
+                raise ValueError(f"Invalid maxCostUsd: {max_cost_param}")
+            max_cost_usd = min(requested_max_cost, max_cost_usd or requested_max_cost)
+
         return ExtractedParams(
             stack=validated_stack,
             input_mode=validated_input_mode,
@@ -318,8 +794,19 @@ class ParameterExtractionStage:
             history=history,
             is_imported_from_code=is_imported_from_code,
             portfolio_data=portfolio_data,
+            first_k=first_k,
+            straggler_policy=cast(StragglerPolicy, straggler_policy),
+            max_cost_usd=max_cost_usd,
+            update_mode=cast(UpdateMode, update_mode),
         )
 
+    @staticmethod
+    def _is_uploaded(ref: str) -> bool:
+        try:
+            return media_id_from_ref(ref) in media_store
+        except ValueError:
+            return False
+
     def _get_from_settings_dialog_or_env(
         self, params: dict[str, str], key: str, env_var: str | None
     ) -> str | None:
@@ -528,6 +1015,15 @@ class ParallelGenerationStage:
         generation_type: Literal["create", "update"],
         prompt: PromptContent,
         stack: Stack = "astro_blog",
+        cancel_event: asyncio.Event | None = None,
+        first_k: int | None = None,
+        straggler_policy: StragglerPolicy = "cancel",
+        straggler_deadline_seconds: float = FIRST_K_STRAGGLER_DEADLINE_SECONDS,
+        max_request_cost_usd: float | None = None,
+        max_variant_cost_usd: float | None = MAX_VARIANT_COST_USD or None,
+        update_mode: UpdateMode = "full",
+        asset_base_url: str = "",
+        admission: VariantAdmission | None = None,
     ):
         self.send_message = send_message
         self.openai_api_key = openai_api_key
@@ -539,6 +1035,38 @@ class ParallelGenerationStage:
         self.generation_type = generation_type
         self.prompt = prompt
         self.stack = stack
+        # When set (e.g. the client disconnected), all in-flight work is cancelled
+        self.cancel_event = cancel_event
+        # First-K-wins: set once first_k variants have sent their code
+        self.first_k = first_k
+        self.straggler_policy = straggler_policy
+        self.straggler_deadline_seconds = straggler_deadline_seconds
+        self.first_k_reached = asyncio.Event()
+        self.finished_variants = 0
+        # Request images decoded once and shared by all variants
+        self.media = MediaRegistry()
+        # Generated images shared by variants using the same alt text
+        self.images = ImageGenerationCoordinator()
+        # Placeholder images found in each variant's stream, generated early
+        self.image_scanners: Dict[int, PlaceholderImageScanner] = {}
+        self.image_cache: Dict[str, str] = {}
+        # Characters streamed per variant, used to estimate the work cancelled
+        self.streamed_chars: Dict[int, int] = {}
+        self.started_at = 0.0
+        # Time of the last streamed delta per variant, for TTFT and inter-chunk latency
+        self.last_delta_at: Dict[int, float] = {}
+        self.variant_models: List[Llm] = []
+        # Budget guards, and each variant's pre-flight estimate
+        self.max_request_cost_usd = max_request_cost_usd
+        self.max_variant_cost_usd = max_variant_cost_usd
+        self.estimates: Dict[int, UsageEstimate] = {}
+        # Update prompts fitted to each model's history token budget
+        self.model_prompts: Dict[Llm, List[ChatCompletionMessageParam]] = {}
+        self.update_mode = update_mode
+        # Origin stored images are linked from in this request's code
+        self.asset_base_url = asset_base_url
+        # Provider stream slots, taken once the variants to run are known
+        self.admission = admission
 
     async def process_variants(
         self,
@@ -548,30 +1076,285 @@ class ParallelGenerationStage:
         params: Dict[str, str],
     ) -> Dict[int, str]:
         """Process all variants in parallel and return completions"""
+        self.variant_models = variant_models
+        self.image_cache = image_cache
         tasks = self._create_generation_tasks(variant_models, prompt_messages, params)
+        self.estimates = await self._estimate_variants(variant_models, prompt_messages)
+        dropped = self._over_budget(variant_models)
+
+        for index, reason in dropped.items():
+            await self.send_message("variantCancelled", reason, index)
+
+        if not await self._admit(variant_models, dropped):
+            for task in tasks:
+                task.close()
+            return {}  # Client left while waiting
+        self.started_at = time.perf_counter()
 
         # Dictionary to track variant tasks and their status
         variant_tasks: Dict[int, asyncio.Task[Completion]] = {}
         variant_completions: Dict[int, str] = {}
 
-        # Create tasks for each variant
+        # Create tasks for each variant within budget
         for index, task in enumerate(tasks):
+            if index in dropped:
+                task.close()
+                continue
             variant_task = asyncio.create_task(task)
             variant_tasks[index] = variant_task
+            if self.admission is not None:
+                # The variant's stream slot is freed once it finishes or is cancelled
+                admission = self.admission
+                variant_task.add_done_callback(
+                    lambda _, index=index: admission.release_variant(index)
+                )
+            if index in self.estimates:
+                LLM_ESTIMATED_COST_USD_TOTAL.inc(
+                    self.estimates[index].cost, model=variant_models[index].value
+                )
 
         # Process each variant independently
-        variant_processors = [
-            self._process_variant_completion(
-                index, task, variant_models[index], image_cache, variant_completions
+        variant_processors = {
+            index: asyncio.create_task(
+                self._process_variant_completion(
+                    index, task, variant_models[index], image_cache, variant_completions
+                )
             )
             for index, task in variant_tasks.items()
-        ]
+        }
 
-        # Wait for all variants to complete
-        await asyncio.gather(*variant_processors, return_exceptions=True)
+        # Wait for all variants to complete, or for the request to be cancelled
+        all_processed = asyncio.gather(
+            *variant_processors.values(), return_exceptions=True
+        )
+        await self._wait_for_variants(all_processed, self.first_k_reached)
+
+        if not all_processed.done() and not self._is_cancelled():
+            # The first K variants are done; the rest are stragglers, which
+            # are cancelled or (under the deadline policy) kept streaming
+            await self.send_message(
+                "generationComplete",
+                f"{self.finished_variants} variants complete",
+                0,
+            )
+            if self.straggler_policy == "deadline":
+                await self._wait_for_variants(
+                    all_processed, timeout=self.straggler_deadline_seconds
+                )
+
+        if not all_processed.done():
+            if self._is_cancelled():
+                reason = "Client disconnected"
+            else:
+                reason = f"First {self.first_k} variants complete"
+            cancelled = self._cancel_variants(
+                variant_tasks, variant_processors, variant_models, reason
+            )
+            await all_processed
+            if not self._is_cancelled():
+                for index in cancelled:
+                    await self.send_message("variantCancelled", reason, index)
+
+        self.images.cancel()
+        if self.images.requested:
+            print(
+                f"[IMAGE GENERATION] {self.images.requested} images requested by "
+                f"variants ({self.images.prefetched} started while streaming), "
+                f"{self.images.calls_saved} provider calls saved by sharing"
+            )
+            IMAGE_GENERATION_CALLS_SAVED_TOTAL.inc(self.images.calls_saved)
 
         return variant_completions
 
+    def _is_cancelled(self) -> bool:
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    async def _admit(self, variant_models: List[Llm], dropped: Dict[int, str]) -> bool:
+        """Wait for stream slots for the variants left after the budget guards.
+        Returns False if the request is cancelled first."""
+        if self.admission is None:
+            return True
+        indexes = [index for index in range(len(variant_models)) if index not in dropped]
+        waited = False
+
+        async def notify_position(position: int) -> None:
+            nonlocal waited
+            waited = True
+            for index in indexes:
+                await self.send_message(
+                    "status", f"Waiting in queue (position {position})...", index
+                )
+
+        admitted = await self.admission.acquire(
+            {index: MODEL_PROVIDER[variant_models[index]] for index in indexes},
+            on_position=notify_position,
+        )
+        if admitted and waited:
+            for index in indexes:
+                await self.send_message("status", "Generating code...", index)
+        return admitted
+
+    async def _wait_for_variants(
+        self,
+        all_processed: "asyncio.Future[Any]",
+        event: asyncio.Event | None = None,
+        timeout: float | None = None,
+    ) -> None:
+        """Wait until all variants are processed, the request is cancelled,
+        event is set or the timeout elapses, whichever comes first"""
+        events = [e for e in (self.cancel_event, event) if e is not None]
+        waiters = [asyncio.create_task(e.wait()) for e in events]
+        try:
+            await asyncio.wait(
+                [all_processed, *waiters],
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    def _cancel_variants(
+        self,
+        variant_tasks: Dict[int, asyncio.Task[Completion]],
+        variant_processors: Dict[int, asyncio.Task[None]],
+        variant_models: List[Llm],
+        reason: str,
+    ) -> List[int]:
+        """Cancel provider streams and image generation that are still running.
+        Returns the indexes of the cancelled variants."""
+        total_tokens_saved = 0
+        total_seconds_saved = 0.0
+        for index, task in variant_tasks.items():
+            if task.done():
+                continue
+            task.cancel()
+            tokens_saved, seconds_saved = record_cancellation(
+                variant_models[index],
+                self.streamed_chars.get(index, 0),
+                time.perf_counter() - self.started_at,
+            )
+            total_tokens_saved += tokens_saved
+            total_seconds_saved += seconds_saved
+
+        # Processors still running are either awaiting a stream or generating images
+        cancelled: List[int] = []
+        for index, processor in variant_processors.items():
+            if not processor.done():
+                processor.cancel()
+                cancelled.append(index)
+
+        print(
+            f"[CANCEL] {reason}, cancelled in-flight variants {cancelled} "
+            f"(~{total_tokens_saved:,} tokens, ~{total_seconds_saved:.1f}s saved)"
+        )
+        return cancelled
+
+    async def _estimate_variants(
+        self,
+        variant_models: List[Llm],
+        prompt_messages: List[ChatCompletionMessageParam],
+    ) -> Dict[int, UsageEstimate]:
+        """Pre-flight token, cost and time estimates of each variant, calibrated
+        by the usage ledger. Empty if the prompt can't be estimated, in which
+        case no budget is enforced."""
+        is_video_create = (
+            self.input_mode == "video" and self.generation_type == "create"
+        )
+        try:
+            video_tokens = None
+            if is_video_create:
+                video_data_url = self.prompt.get("images", [None])[0]
+                duration = (
+                    await self.media.video_duration(video_data_url)
+                    if video_data_url
+                    else None
+                )
+                video_tokens = (
+                    estimate_video_input_tokens(
+                        duration, VIDEO_FPS, MediaResolution.HIGH
+                    )
+                    if duration
+                    else PROMPT_TOKENS_ESTIMATE
+                )
+            else:
+                # Image sizes are read from the decoded images, which the
+                # providers' converters reuse
+                await asyncio.gather(
+                    *(
+                        self.media.decode_async(url)
+                        for url in image_data_urls(prompt_messages)
+                    )
+                )
+            calibrations = await asyncio.to_thread(
+                lambda: [
+                    get_calibration(model, self.input_mode, self.generation_type)
+                    for model in variant_models
+                ]
+            )
+        except Exception as e:
+            print(f"[USAGE] Could not estimate variants: {e}")
+            return {}
+
+        estimates: Dict[int, UsageEstimate] = {}
+        for index, model in enumerate(variant_models):
+            if video_tokens is not None and model in GEMINI_MODELS:
+                counted_input_tokens = video_tokens
+            else:
+                counted_input_tokens = count_input_tokens(
+                    model, self._prompt_for(model, prompt_messages), self.media.image_size
+                )
+            estimate = estimate_usage(model, counted_input_tokens, calibrations[index])
+            estimates[index] = estimate
+            print(
+                f"[USAGE] Variant {index + 1} ({model.value}) estimate: "
+                f"{estimate.input_tokens:,} in / {estimate.output_tokens:,} out tokens, "
+                f"${estimate.cost:.4f} (up to ${estimate.max_cost:.4f}), "
+                f"~{estimate.seconds:.0f}s"
+                + (" (calibrated)" if estimate.calibrated else "")
+            )
+        return estimates
+
+    def _over_budget(self, variant_models: List[Llm]) -> Dict[int, str]:
+        """Variants to drop before dispatch because of the budget guards, with
+        the reason"""
+        if len(self.estimates) != len(variant_models):
+            return {}
+        dropped = over_budget(
+            [self.estimates[index] for index in range(len(variant_models))],
+            self.max_request_cost_usd,
+            self.max_variant_cost_usd,
+        )
+        for index, reason in dropped.items():
+            print(f"[USAGE] Dropping variant {index + 1}: {reason}")
+            VARIANTS_OVER_BUDGET_TOTAL.inc(model=variant_models[index].value)
+        return dropped
+
+    def _prompt_for(
+        self, model: Llm, prompt_messages: List[ChatCompletionMessageParam]
+    ) -> List[ChatCompletionMessageParam]:
+        """prompt_messages within the model's history token budget, for
+        update generations"""
+        if self.generation_type != "update" or not HISTORY_COMPACTION_ENABLED:
+            return prompt_messages
+        if model not in self.model_prompts:
+            budget = HISTORY_TOKEN_BUDGETS.get(model.value, HISTORY_TOKEN_BUDGET)
+            # Images are counted at a fixed size, so the fitted prompt doesn't
+            # depend on whether they've been decoded yet
+            def count_tokens(messages: List[ChatCompletionMessageParam]) -> int:
+                return count_input_tokens(model, messages)
+
+            fitted = fit_to_token_budget(prompt_messages, budget, count_tokens)
+            if fitted is not prompt_messages:
+                tokens_saved = count_tokens(prompt_messages) - count_tokens(fitted)
+                print(
+                    f"[HISTORY] Trimmed ~{tokens_saved:,} tokens of history to fit "
+                    f"{model.value}'s {budget:,} token budget"
+                )
+                PROMPT_HISTORY_TOKENS_SAVED_TOTAL.inc(tokens_saved)
+            self.model_prompts[model] = fitted
+        return self.model_prompts[model]
+
     def _create_generation_tasks(
         self,
         variant_models: List[Llm],
@@ -585,6 +1368,8 @@ class ParallelGenerationStage:
         is_video_create = (
             self.input_mode == "video" and self.generation_type == "create"
         )
+        # Video create prompts aren't part of prompt_messages, so they aren't cached
+        digest = None if is_video_create else prompt_digest(prompt_messages)
 
         for index, model in enumerate(variant_models):
             # Video create mode: use video-specific Gemini streaming
@@ -595,89 +1380,324 @@ class ParallelGenerationStage:
                 if not self.gemini_api_key:
                     raise Exception("Gemini API key is missing.")
 
-                video_bytes, video_mime_type = get_video_bytes_and_mime_type(
-                    video_data_url
-                )
-                print(
-                    f"Using Gemini for video generation (video size: {len(video_bytes)} bytes)"
-                )
-
-                tasks.append(
-                    stream_gemini_response_video(
-                        video_bytes=video_bytes,
-                        video_mime_type=video_mime_type,
-                        system_prompt=GEMINI_VIDEO_PROMPT,
-                        api_key=self.gemini_api_key,
-                        callback=lambda x, i=index: self._process_chunk(x, i),
-                        model=model,
-                        thinking_callback=lambda x, i=index: self._process_thinking(
-                            x, i
-                        ),
-                    )
-                )
+                tasks.append(self._stream_gemini_video(video_data_url, model, index))
             elif model in OPENAI_MODELS:
                 if self.openai_api_key is None:
                     raise Exception("OpenAI API key is missing.")
 
                 tasks.append(
-                    self._stream_openai_with_error_handling(
-                        prompt_messages,
-                        model_name=model.value,
-                        index=index,
-                    )
+                    self._generate(model, index, self._prompt_for(model, prompt_messages))
                 )
             elif self.gemini_api_key and model in GEMINI_MODELS:
                 tasks.append(
-                    stream_gemini_response(
-                        prompt_messages,
-                        api_key=self.gemini_api_key,
-                        callback=lambda x, i=index: self._process_chunk(x, i),
-                        model=model,
-                        thinking_callback=lambda x, i=index: self._process_thinking(
-                            x, i
-                        ),
-                    )
+                    self._generate(model, index, self._prompt_for(model, prompt_messages))
                 )
             elif model in ANTHROPIC_MODELS:
                 if self.anthropic_api_key is None:
                     raise Exception("Anthropic API key is missing.")
 
                 tasks.append(
-                    stream_claude_response(
-                        prompt_messages,
-                        api_key=self.anthropic_api_key,
-                        callback=lambda x, i=index: self._process_chunk(x, i),
-                        model_name=model.value,
-                        thinking_callback=lambda x, i=index: self._process_thinking(
-                            x, i
-                        ),
-                    )
+                    self._generate(model, index, self._prompt_for(model, prompt_messages))
                 )
 
+        if digest is not None:
+            cached_tasks: List[Coroutine[Any, Any, Completion]] = []
+            for index, task in enumerate(tasks):
+                model = variant_models[index]
+                # Variants repeating a model get their own cache entries
+                attempt = variant_models[:index].count(model)
+                cache_key = completion_cache_key(digest, model, attempt)
+                cached_tasks.append(
+                    self._with_completion_cache(task, cache_key, model, index)
+                )
+            tasks = cached_tasks
         return tasks
 
+    async def _with_completion_cache(
+        self,
+        generate: Coroutine[Any, Any, Completion],
+        cache_key: str,
+        model: Llm,
+        index: int,
+    ) -> Completion:
+        """Replay a cached completion, or generate one and cache it"""
+        cached_code = await get_cached_completion(cache_key)
+        if cached_code is not None:
+            generate.close()
+            start_time = time.perf_counter()
+            await self.send_message("status", "Using cached result...", index)
+            await replay_completion(
+                cached_code, lambda x: self._process_chunk(x, index)
+            )
+            return {"duration": time.perf_counter() - start_time, "code": cached_code}
+
+        completion = await generate
+        await cache_completion(cache_key, model, completion["code"])
+        return completion
+
+    def _generate(
+        self, model: Llm, index: int, prompt_messages: List[ChatCompletionMessageParam]
+    ) -> Coroutine[Any, Any, Completion]:
+        """Generate a variant's code, as edits to the latest code for updates
+        in edit mode"""
+        if self.generation_type == "update" and self.update_mode == "edit":
+            previous_code = latest_code(prompt_messages)
+            if previous_code is not None:
+                return self._generate_with_edits(
+                    model, index, prompt_messages, previous_code
+                )
+        return self._stream_model(
+            model, index, prompt_messages, lambda x: self._process_chunk(x, index)
+        )
+
+    def _stream_model(
+        self,
+        model: Llm,
+        index: int,
+        prompt_messages: List[ChatCompletionMessageParam],
+        callback: Callable[[str], Awaitable[None]],
+    ) -> Coroutine[Any, Any, Completion]:
+        """Stream a response from the model's provider to callback"""
+        if model in OPENAI_MODELS:
+            return self._stream_openai_with_error_handling(
+                prompt_messages, model_name=model.value, index=index, callback=callback
+            )
+        if model in GEMINI_MODELS:
+            assert self.gemini_api_key is not None
+            return stream_gemini_response(
+                prompt_messages,
+                api_key=self.gemini_api_key,
+                callback=callback,
+                model=model,
+                thinking_callback=lambda x: self._process_thinking(x, index),
+                media=self.media,
+            )
+        assert self.anthropic_api_key is not None
+        return stream_claude_response(
+            prompt_messages,
+            api_key=self.anthropic_api_key,
+            callback=callback,
+            model_name=model.value,
+            thinking_callback=lambda x: self._process_thinking(x, index),
+            media=self.media,
+        )
+
+    async def _generate_with_edits(
+        self,
+        model: Llm,
+        index: int,
+        prompt_messages: List[ChatCompletionMessageParam],
+        previous_code: str,
+    ) -> Completion:
+        """Ask the model for search/replace edits to previous_code, sending the
+        edited code as they apply (at most every EDIT_SET_CODE_INTERVAL_SECONDS,
+        since each send is the whole document). If they don't apply, or break
+        the document, the whole document is regenerated."""
+        start_time = time.perf_counter()
+        edits = EditStream(previous_code)
+        edit_messages = with_edit_instructions(prompt_messages)
+        edit_completion: Completion | None = None
+        chunked_chars = 0
+        sent_code = previous_code
+        sent_at = float("-inf")
+
+        async def send_code() -> None:
+            nonlocal sent_code, sent_at
+            sent_code, sent_at = edits.code, time.perf_counter()
+            await self.send_message("setCode", sent_code, index)
+
+        async def process_edits(content: str) -> None:
+            nonlocal chunked_chars
+            self._count_streamed(content, index)
+            changed = edits.feed(content)
+            if edits.is_full_document:
+                # The model rewrote the page, so it's streamed as usual
+                unsent = edits.text[chunked_chars:]
+                chunked_chars = len(edits.text)
+                self._prefetch_images(unsent, index)
+                await self.send_message("chunk", unsent, index)
+            elif (
+                changed
+                and time.perf_counter() - sent_at >= EDIT_SET_CODE_INTERVAL_SECONDS
+            ):
+                await send_code()
+
+        try:
+            edit_completion = await self._stream_model(
+                model, index, edit_messages, process_edits
+            )
+            code = edits.finish()
+            if not edits.is_full_document and code != sent_code:
+                await send_code()
+        except EditApplyError as e:
+            print(f"[EDIT] Variant {index + 1}: {e}. Regenerating the whole page.")
+            EDIT_UPDATES_TOTAL.inc(model=model.value, result="fallback")
+            await self.send_message(
+                "status", "Edits didn't apply, regenerating the whole page...", index
+            )
+            # The regenerated code streams as chunks, appended to the code so far
+            await self.send_message("setCode", "", index)
+            completion = await self._stream_model(
+                model,
+                index,
+                prompt_messages,
+                lambda x: self._process_chunk(x, index),
+            )
+            completion["duration"] = time.perf_counter() - start_time
+            usage = completion.get("usage")
+            edit_usage = (
+                edit_completion.get("usage")
+                if edit_completion
+                # Stopped mid-stream, so the provider never reported usage
+                else {
+                    "input_tokens": count_input_tokens(
+                        model, edit_messages, self.media.image_size
+                    ),
+                    "output_tokens": estimate_tokens(len(edits.text)),
+                }
+            )
+            if usage is not None and edit_usage is not None:
+                completion["usage"] = {
+                    "input_tokens": usage["input_tokens"] + edit_usage["input_tokens"],
+                    "output_tokens": usage["output_tokens"]
+                    + edit_usage["output_tokens"],
+                }
+            return completion
+
+        assert edit_completion is not None
+        if edits.is_full_document:
+            EDIT_UPDATES_TOTAL.inc(model=model.value, result="full_document")
+        else:
+            EDIT_UPDATES_TOTAL.inc(model=model.value, result="applied")
+            self._record_edit_savings(index, model, edits, code)
+        return {**edit_completion, "code": code}
+
+    def _record_edit_savings(
+        self, index: int, model: Llm, edits: EditStream, code: str
+    ) -> None:
+        """Output tokens and time saved by the edits, against regenerating
+        the whole document"""
+        tokens_saved = max(
+            estimate_tokens(len(code)) - estimate_tokens(len(edits.text)), 0
+        )
+        seconds_saved = tokens_saved / MODEL_PROFILES[model].output_tokens_per_second
+        print(
+            f"[EDIT] Variant {index + 1} ({model.value}) applied {edits.blocks} "
+            f"edits: ~{tokens_saved:,} output tokens and ~{seconds_saved:.1f}s "
+            "saved against regenerating the page"
+        )
+        EDIT_UPDATE_OUTPUT_TOKENS_SAVED_TOTAL.inc(tokens_saved, model=model.value)
+        EDIT_UPDATE_SECONDS_SAVED_TOTAL.inc(seconds_saved, model=model.value)
+
+    async def _stream_gemini_video(
+        self, video_data_url: str, model: Llm, index: int
+    ) -> Completion:
+        """Stream a video generation from Gemini. The video is decoded, its
+        duration and keyframes extracted, and (if it's sent whole) uploaded
+        once for all variants."""
+        assert self.gemini_api_key is not None
+        video = await self.media.decode_async(video_data_url)
+        print(
+            f"Using Gemini for video generation (video size: {len(video.data)} bytes)"
+        )
+
+        duration, keyframes = await asyncio.gather(
+            self.media.video_duration(video_data_url),
+            self._video_keyframes(video_data_url),
+        )
+        video_handle = None
+        if not prefers_keyframes(duration, keyframes):
+            keyframes = None
+            if len(video.data) >= GEMINI_FILE_UPLOAD_MIN_BYTES:
+                video_handle = await self.media.upload(
+                    video_data_url, GeminiFileUploader(self.gemini_api_key)
+                )
+
+        return await stream_gemini_response_video(
+            video_bytes=video.data,
+            video_mime_type=video.mime_type or "video/mp4",
+            video_duration=duration,
+            keyframes=keyframes,
+            video_handle=video_handle,
+            system_prompt=GEMINI_VIDEO_PROMPT,
+            api_key=self.gemini_api_key,
+            callback=lambda x: self._process_chunk(x, index),
+            model=model,
+            thinking_callback=lambda x: self._process_thinking(x, index),
+        )
+
+    async def _video_keyframes(self, video_data_url: str) -> List[Keyframe] | None:
+        if not VIDEO_KEYFRAMES_ENABLED:
+            return None
+        return await self.media.video_keyframes(video_data_url)
+
     async def _process_chunk(self, content: str, variant_index: int):
         """Process streaming chunks"""
+        self._count_streamed(content, variant_index)
+        self._prefetch_images(content, variant_index)
         await self.send_message("chunk", content, variant_index)
 
+    def _prefetch_images(self, content: str, variant_index: int) -> None:
+        """Start generating images for placeholder <img> tags as soon as they
+        have streamed, so they're ready (or nearly) when the variant completes"""
+        if not IMAGE_PREFETCH_ENABLED or self.stack == "astro_blog":
+            return
+        settings = self._image_generation_settings()
+        if settings is None:
+            return
+
+        scanner = self.image_scanners.setdefault(
+            variant_index, PlaceholderImageScanner()
+        )
+        image_generation_model, api_key = settings
+        for alt in scanner.feed(content):
+            if alt not in self.image_cache:
+                prefetch_image(
+                    alt, api_key, self.openai_base_url, image_generation_model, self.images
+                )
+
     async def _process_thinking(self, content: str, variant_index: int):
         """Process thinking/reasoning content"""
+        self._count_streamed(content, variant_index)
         await self.send_message("thinking", content, variant_index)
 
+    def _count_streamed(self, content: str, variant_index: int) -> None:
+        self.streamed_chars[variant_index] = (
+            self.streamed_chars.get(variant_index, 0) + len(content)
+        )
+
+        now = time.perf_counter()
+        last_delta_at = self.last_delta_at.get(variant_index)
+        model = self._model_label(variant_index)
+        if last_delta_at is None:
+            VARIANT_TIME_TO_FIRST_TOKEN_SECONDS.observe(
+                now - self.started_at, model=model
+            )
+        else:
+            VARIANT_INTER_CHUNK_SECONDS.observe(now - last_delta_at, model=model)
+        self.last_delta_at[variant_index] = now
+
+    def _model_label(self, variant_index: int) -> str:
+        if variant_index < len(self.variant_models):
+            return self.variant_models[variant_index].value
+        return "unknown"
+
     async def _stream_openai_with_error_handling(
         self,
         prompt_messages: List[ChatCompletionMessageParam],
         model_name: str,
         index: int,
+        callback: Callable[[str], Awaitable[None]] | None = None,
     ) -> Completion:
         """Wrap OpenAI streaming with specific error handling"""
         try:
             assert self.openai_api_key is not None
             return await stream_openai_response(
-                prompt_messages,
+                # OpenAI only takes inline images
+                self.media.inline_media(prompt_messages),
                 api_key=self.openai_api_key,
                 base_url=self.openai_base_url,
-                callback=lambda x: self._process_chunk(x, index),
+                callback=callback or (lambda x: self._process_chunk(x, index)),
                 model_name=model_name,
             )
         except openai.AuthenticationError as e:
@@ -721,6 +1741,18 @@ class ParallelGenerationStage:
             await self.send_message("variantError", error_message, index)
             raise VariantErrorAlreadySent(e)
 
+    def _image_generation_settings(
+        self,
+    ) -> Tuple[Literal["dalle3", "flux"], str] | None:
+        """(image model, API key), or None if images shouldn't be generated"""
+        if not self.should_generate_images:
+            return None
+        if REPLICATE_API_KEY:
+            return "flux", REPLICATE_API_KEY
+        if self.openai_api_key:
+            return "dalle3", self.openai_api_key
+        return None
+
     async def _perform_image_generation(
         self,
         completion: str,
@@ -730,18 +1762,13 @@ class ParallelGenerationStage:
         if not self.should_generate_images:
             return completion
 
-        replicate_api_key = REPLICATE_API_KEY
-        if replicate_api_key:
-            image_generation_model = "flux"
-            api_key = replicate_api_key
-        else:
-            if not self.openai_api_key:
-                print(
-                    "No OpenAI API key and Replicate key found. Skipping image generation."
-                )
-                return completion
-            image_generation_model = "dalle3"
-            api_key = self.openai_api_key
+        settings = self._image_generation_settings()
+        if settings is None:
+            print(
+                "No OpenAI API key and Replicate key found. Skipping image generation."
+            )
+            return completion
+        image_generation_model, api_key = settings
 
         print("Generating images with model: ", image_generation_model)
 
@@ -751,6 +1778,50 @@ class ParallelGenerationStage:
             base_url=self.openai_base_url,
             image_cache=image_cache,
             model=image_generation_model,
+            coordinator=self.images,
+            asset_base_url=self.asset_base_url,
+        )
+
+    async def _record_usage(
+        self, index: int, model: Llm, completion: Completion
+    ) -> None:
+        """Record the usage reported by the provider, with the variant's
+        estimate, in the usage ledger"""
+        usage = completion.get("usage")
+        if usage is None:
+            # Replayed from the completion cache, or not reported by the provider
+            return
+        input_tokens, output_tokens = usage["input_tokens"], usage["output_tokens"]
+        cost = token_cost(model, input_tokens, output_tokens)
+        LLM_COST_USD_TOTAL.inc(cost, model=model.value)
+        LLM_TOKENS_TOTAL.inc(input_tokens, model=model.value, kind="input")
+        LLM_TOKENS_TOTAL.inc(output_tokens, model=model.value, kind="output")
+
+        estimate = self.estimates.get(index)
+        print(
+            f"[USAGE] Variant {index + 1} ({model.value}) actual: "
+            f"{input_tokens:,} in / {output_tokens:,} out tokens, ${cost:.4f}, "
+            f"{completion['duration']:.1f}s"
+            + (f" (estimated ${estimate.cost:.4f})" if estimate else "")
+        )
+        if estimate is None:
+            return
+        await record_usage(
+            {
+                "time": time.time(),
+                "model": model.value,
+                "input_mode": self.input_mode,
+                "generation_type": self.generation_type,
+                "counted_input_tokens": estimate.counted_input_tokens,
+                "estimated_input_tokens": estimate.input_tokens,
+                "estimated_output_tokens": estimate.output_tokens,
+                "estimated_cost": estimate.cost,
+                "estimated_seconds": estimate.seconds,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "cost": cost,
+                "seconds": completion["duration"],
+            }
         )
 
     async def _process_variant_completion(
@@ -767,19 +1838,41 @@ class ParallelGenerationStage:
 
             print(f"{model.value} completion took {completion['duration']:.2f} seconds")
             variant_completions[index] = completion["code"]
+            record_completion(
+                model, self.streamed_chars.get(index, 0), completion["duration"]
+            )
+            VARIANT_GENERATION_SECONDS.observe(completion["duration"], model=model.value)
+            VARIANT_OUTPUT_TOKENS.observe(
+                estimate_tokens(self.streamed_chars.get(index, 0)), model=model.value
+            )
+            await self._record_usage(index, model, completion)
 
             try:
                 # Process images for this variant (skip for astro_blog)
                 if self.stack == "astro_blog":
                     processed_html = completion["code"]
                 else:
+                    image_start = time.perf_counter()
                     processed_html = await self._perform_image_generation(
                         completion["code"],
                         image_cache,
                     )
+                    if self.should_generate_images:
+                        IMAGE_GENERATION_SECONDS.observe(
+                            time.perf_counter() - image_start
+                        )
                 # Extract HTML content
                 processed_html = extract_html_content(processed_html)
 
+                last_delta_at = self.last_delta_at.get(index)
+                if last_delta_at is not None:
+                    finalize_seconds = time.perf_counter() - last_delta_at
+                    VARIANT_FINALIZE_SECONDS.observe(finalize_seconds, model=model.value)
+                    print(
+                        f"[VARIANT {index + 1}] last token to setCode: "
+                        f"{finalize_seconds:.2f}s"
+                    )
+
                 # Send the complete variant back to the client
                 await self.send_message("setCode", processed_html, index)
                 await self.send_message(
@@ -787,6 +1880,9 @@ class ParallelGenerationStage:
                     "Variant generation complete",
                     index,
                 )
+                self.finished_variants += 1
+                if self.first_k and self.finished_variants >= self.first_k:
+                    self.first_k_reached.set()
             except Exception as inner_e:
                 # If websocket is closed or other error during post-processing
                 print(f"Post-processing error for variant {index + 1}: {inner_e}")
@@ -822,8 +1918,9 @@ class WebSocketSetupMiddleware(Middleware):
             await context.ws_comm.close()
 
 
-class ParameterExtractionMiddleware(Middleware):
-    """Handles parameter extraction and validation"""
+class GenerationSessionMiddleware(Middleware):
+    """Receives the request and either resumes an existing generation session
+    or starts a new one"""
 
     async def process(
         self, context: PipelineContext, next_func: Callable[[], Awaitable[None]]
@@ -831,7 +1928,54 @@ class ParameterExtractionMiddleware(Middleware):
         # Receive parameters
         assert context.ws_comm is not None
         context.params = await context.ws_comm.receive_params()
+        context.ws_comm.watch_for_disconnect()
+
+        resume_session_id = context.params.get("resumeSessionId")
+        if resume_session_id:
+            await self._resume(context, resume_session_id)
+            return  # The original connection's pipeline is still generating
+
+        context.session = create_session()
+        await context.session.attach(context.ws_comm)
+        await context.ws_comm.send_message("session", context.session.id, 0)
+
+        try:
+            await next_func()
+        finally:
+            context.session.finish()
+
+    async def _resume(self, context: PipelineContext, session_id: str) -> None:
+        assert context.ws_comm is not None
+        session = get_session(session_id)
+        if session is None or session.abandoned.is_set():
+            await context.ws_comm.throw_error(
+                "Generation session expired. Please generate again."
+            )
+            return
+
+        raw_offsets = cast(Dict[str, int], context.params.get("resumeOffsets", {}))
+        offsets = {int(index): int(offset) for index, offset in raw_offsets.items()}
+        print(f"Resuming generation session {session_id[:8]}")
+        await session.attach(context.ws_comm, offsets)
+
+        # Stay connected until the generation finishes or the client leaves again
+        finished = asyncio.create_task(session.finished.wait())
+        disconnected = asyncio.create_task(context.ws_comm.disconnected.wait())
+        try:
+            await asyncio.wait(
+                [finished, disconnected], return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            finished.cancel()
+            disconnected.cancel()
+
 
+class ParameterExtractionMiddleware(Middleware):
+    """Handles parameter extraction and validation"""
+
+    async def process(
+        self, context: PipelineContext, next_func: Callable[[], Awaitable[None]]
+    ) -> None:
         # Extract and validate
         param_extractor = ParameterExtractionStage(context.throw_error)
         context.extracted_params = await param_extractor.extract_and_validate(
@@ -902,6 +2046,59 @@ class PromptCreationMiddleware(Middleware):
         await next_func()
 
 
+class ModelSelectionMiddleware(Middleware):
+    """Selects the variant models"""
+
+    async def process(
+        self, context: PipelineContext, next_func: Callable[[], Awaitable[None]]
+    ) -> None:
+        if not SHOULD_MOCK_AI_RESPONSE:
+            assert context.extracted_params is not None
+            model_selector = ModelSelectionStage(context.throw_error)
+            try:
+                # Handles video mode internally
+                context.variant_models = await model_selector.select_models(
+                    generation_type=context.extracted_params.generation_type,
+                    input_mode=context.extracted_params.input_mode,
+                    openai_api_key=context.extracted_params.openai_api_key,
+                    anthropic_api_key=context.extracted_params.anthropic_api_key,
+                    gemini_api_key=GEMINI_API_KEY,
+                )
+            except Exception:
+                return  # Error already sent to the client
+
+        await next_func()
+
+
+class AdmissionControlMiddleware(Middleware):
+    """Sets up the request's provider stream slots. Generation queues for them
+    once the budget guards have decided which variants run, and frees each
+    variant's slot as soon as it's done."""
+
+    async def process(
+        self, context: PipelineContext, next_func: Callable[[], Awaitable[None]]
+    ) -> None:
+        if not context.variant_models:
+            await next_func()
+            return
+
+        assert context.extracted_params is not None
+        # Interactive edits are admitted ahead of fresh generations
+        priority = (
+            PRIORITY_UPDATE
+            if context.extracted_params.generation_type == "update"
+            else PRIORITY_CREATE
+        )
+        context.admission = VariantAdmission(
+            admission_controller, priority, context.cancel_event
+        )
+
+        try:
+            await next_func()
+        finally:
+            context.admission.release()
+
+
 class CodeGenerationMiddleware(Middleware):
     """Handles the main code generation logic"""
 
@@ -919,16 +2116,6 @@ class CodeGenerationMiddleware(Middleware):
             try:
                 assert context.extracted_params is not None
 
-                # Select models (handles video mode internally)
-                model_selector = ModelSelectionStage(context.throw_error)
-                context.variant_models = await model_selector.select_models(
-                    generation_type=context.extracted_params.generation_type,
-                    input_mode=context.extracted_params.input_mode,
-                    openai_api_key=context.extracted_params.openai_api_key,
-                    anthropic_api_key=context.extracted_params.anthropic_api_key,
-                    gemini_api_key=GEMINI_API_KEY,
-                )
-
                 # Generate code for all variants (handles video mode internally)
                 generation_stage = ParallelGenerationStage(
                     send_message=context.send_message,
@@ -941,14 +2128,30 @@ class CodeGenerationMiddleware(Middleware):
                     generation_type=context.extracted_params.generation_type,
                     prompt=context.extracted_params.prompt,
                     stack=context.extracted_params.stack,
+                    cancel_event=context.cancel_event,
+                    first_k=context.extracted_params.first_k,
+                    straggler_policy=context.extracted_params.straggler_policy,
+                    max_request_cost_usd=context.extracted_params.max_cost_usd,
+                    update_mode=context.extracted_params.update_mode,
+                    asset_base_url=asset_base_url(str(context.websocket.url)),
+                    admission=context.admission,
                 )
 
-                context.variant_completions = await generation_stage.process_variants(
-                    variant_models=context.variant_models,
-                    prompt_messages=context.prompt_messages,
-                    image_cache=context.image_cache,
-                    params=context.params,
-                )
+                try:
+                    context.variant_completions = (
+                        await generation_stage.process_variants(
+                            variant_models=context.variant_models,
+                            prompt_messages=context.prompt_messages,
+                            image_cache=context.image_cache,
+                            params=context.params,
+                        )
+                    )
+                finally:
+                    # Unmap uploaded media now rather than when it's collected
+                    generation_stage.media.close()
+
+                if not context.variant_completions and context.cancel_event.is_set():
+                    return  # Client left, possibly while waiting in the queue
 
                 # Check if all variants failed
                 if len(context.variant_completions) == 0:
@@ -994,10 +2197,13 @@ async def stream_code(websocket: WebSocket):
 
     # Configure the pipeline
     pipeline.use(WebSocketSetupMiddleware())
+    pipeline.use(GenerationSessionMiddleware())
     pipeline.use(ParameterExtractionMiddleware())
     pipeline.use(AttemptTrackingMiddleware())
     pipeline.use(StatusBroadcastMiddleware())
     pipeline.use(PromptCreationMiddleware())
+    pipeline.use(ModelSelectionMiddleware())
+    pipeline.use(AdmissionControlMiddleware())
     pipeline.use(CodeGenerationMiddleware())
     pipeline.use(PostProcessingMiddleware())
 
@@ -0,0 +1,69 @@
+import asyncio
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from pydantic import BaseModel
+
+from config import MEDIA_UPLOAD_MAX_BYTES
+from image_processing.media_registry import detect_mime_type
+from image_processing.media_store import media_ref, media_store
+
+router = APIRouter()
+
+# Uploads are written to disk in pieces of at least this size
+UPLOAD_WRITE_BYTES = 1024 * 1024
+
+
+class MediaUploadResponse(BaseModel):
+    mediaId: str
+    # What to put in a prompt's images in place of a data URL
+    ref: str
+    mimeType: str
+    size: int
+
+
+@router.post("/api/media")
+async def upload_media(request: Request) -> MediaUploadResponse:
+    """Store a raw screenshot or video from the request body.
+
+    The body is streamed to disk and hashed as it arrives, so it's never
+    base64 encoded or held in memory as a whole.
+    """
+    upload = media_store.begin_upload()
+    pending = bytearray()
+    mime_type: str | None = None
+    try:
+        async for chunk in request.stream():
+            if mime_type is None and chunk:
+                mime_type = detect_mime_type(chunk)
+                if mime_type is None:
+                    raise HTTPException(
+                        status_code=415, detail="Unsupported media type"
+                    )
+            if upload.size + len(pending) + len(chunk) > MEDIA_UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="Upload too large")
+            pending.extend(chunk)
+            if len(pending) >= UPLOAD_WRITE_BYTES:
+                await asyncio.to_thread(upload.write, bytes(pending))
+                pending.clear()
+        if pending:
+            await asyncio.to_thread(upload.write, bytes(pending))
+        if mime_type is None:
+            raise HTTPException(status_code=400, detail="Empty upload")
+        media_id = await asyncio.to_thread(upload.commit, mime_type)
+    except BaseException:
+        upload.abort()
+        raise
+
+    print(f"[MEDIA] Stored {mime_type} upload ({upload.size} bytes) as {media_id}")
+    return MediaUploadResponse(
+        mediaId=media_id, ref=media_ref(media_id), mimeType=mime_type, size=upload.size
+    )
+
+
+@router.head("/api/media/{media_id}")
+async def check_media(media_id: str) -> Response:
+    """Whether uploaded media is still stored, so clients can re-upload media
+    the store has evicted (or lost in a restart) instead of referencing it"""
+    if not await asyncio.to_thread(media_store.touch, media_id):
+        raise HTTPException(status_code=404, detail="Media not found")
+    return Response()
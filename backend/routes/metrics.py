@@ -0,0 +1,118 @@
+from typing import Dict, Iterable, Tuple
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from clients.registry import client_registry
+from codegen.completion_cache import completion_cache
+from image_generation.cache import image_generation_cache
+from metrics.cancellation import get_cancellation_stats
+from metrics.prometheus import collected_counter, gauge, render_metrics
+from scheduling.admission import admission_controller
+
+# Registers the pipeline and WebSocket metrics
+import metrics.latency  # noqa: F401
+
+
+router = APIRouter()
+
+Samples = Iterable[Tuple[Dict[str, str], float]]
+
+
+def _admission_in_use() -> Samples:
+    return [
+        ({"provider": provider}, count)
+        for provider, count in admission_controller.in_use.items()
+    ]
+
+
+def _admission_limit() -> Samples:
+    return [
+        ({"provider": provider}, limit)
+        for provider, limit in admission_controller.limits.items()
+    ]
+
+
+def _cancellation_stats() -> Samples:
+    stats = get_cancellation_stats()
+    return [
+        ({"stat": "cancelled_variants"}, stats.cancelled_variants),
+        ({"stat": "tokens_streamed"}, stats.tokens_streamed),
+        ({"stat": "tokens_saved"}, stats.tokens_saved),
+        ({"stat": "seconds_saved"}, stats.seconds_saved),
+    ]
+
+
+gauge("admission_streams_in_use", "Provider streams currently admitted", _admission_in_use)
+gauge("admission_stream_limit", "Maximum concurrent provider streams", _admission_limit)
+gauge(
+    "admission_queue_length",
+    "Requests waiting for provider stream slots",
+    lambda: [({}, admission_controller.queue_length)],
+)
+collected_counter(
+    "generation_cancellation_total",
+    "Totals for variants cancelled after the client disconnected",
+    _cancellation_stats,
+)
+
+# Hits and misses only grow, so they're counters that rate() works on; the
+# sizes of the pools and caches are gauges
+gauge("client_pool_clients", "Pooled provider clients", lambda: [({}, len(client_registry))])
+collected_counter(
+    "client_pool_hits_total",
+    "Provider client leases served by a pooled client",
+    lambda: [({}, client_registry.hits)],
+)
+collected_counter(
+    "client_pool_misses_total",
+    "Provider client leases that created a client",
+    lambda: [({}, client_registry.misses)],
+)
+
+gauge(
+    "completion_cache",
+    "Completion cache size",
+    lambda: [
+        ({"stat": "entries"}, completion_cache.stats.entries),
+        ({"stat": "bytes"}, completion_cache.stats.bytes),
+    ],
+)
+collected_counter(
+    "completion_cache_hits_total",
+    "Completion cache lookups that found a completion",
+    lambda: [({}, completion_cache.stats.hits)],
+)
+collected_counter(
+    "completion_cache_misses_total",
+    "Completion cache lookups that found none",
+    lambda: [({}, completion_cache.stats.misses)],
+)
+
+gauge(
+    "image_generation_cache_entries",
+    "Generated images in the cache",
+    lambda: [({}, image_generation_cache.stats.entries)],
+)
+collected_counter(
+    "image_generation_cache_hits_total",
+    "Generated image cache lookups that found an image",
+    lambda: [({}, image_generation_cache.stats.hits)],
+)
+collected_counter(
+    "image_generation_cache_misses_total",
+    "Generated image cache lookups that found none",
+    lambda: [({}, image_generation_cache.stats.misses)],
+)
+collected_counter(
+    "image_generation_cache_expired_total",
+    "Generated image cache entries found expired",
+    lambda: [({}, image_generation_cache.stats.expired)],
+)
+
+
+@router.get("/metrics")
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -8,6 +8,7 @@ from fastapi import APIRouter, Depends
 from fastapi.security import HTTPBasicCredentials
 from pydantic import BaseModel
 
+from image_generation.asset_store import asset_store
 from routes.portfolio import security, verify_admin
 
 router = APIRouter(prefix="/api/themes", tags=["themes"])
@@ -162,12 +163,21 @@ async def apply_to_portfolio(
         shutil.copy2(index_file, backup_dir / "index.html")
         backup_path = str(backup_dir)
 
-    index_file.write_text(request.code)
+    # Copy generated images next to the page so the portfolio doesn't
+    # depend on the backend to serve them
+    code, assets = asset_store.export(
+        request.code, PORTFOLIO_PUBLIC_DIR / "assets", "assets/"
+    )
+    index_file.write_text(code)
 
     # Log as a saved entry
-    _append_entry(request.theme_name, request.code, saved=True)
+    _append_entry(request.theme_name, code, saved=True)
 
-    return ApplyResponse(files_written=["public/index.html"], backup_path=backup_path)
+    return ApplyResponse(
+        files_written=["public/index.html"]
+        + [f"public/assets/{name}" for name in assets],
+        backup_path=backup_path,
+    )
 
 
 @router.get("/history", response_model=list[HistoryEntry])
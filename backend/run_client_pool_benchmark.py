@@ -0,0 +1,140 @@
+"""Compare time-to-first-token with a fresh client per call vs a pooled client.
+
+Runs a tiny streaming request against every provider with a key in .env.
+Usage: poetry run python run_client_pool_benchmark.py [runs]
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from anthropic import AsyncAnthropic
+from google import genai
+from openai import AsyncOpenAI
+
+from clients.registry import _close_client, client_registry
+from config import ANTHROPIC_API_KEY, GEMINI_API_KEY, OPENAI_API_KEY, OPENAI_BASE_URL
+
+PROMPT = "Reply with the single word: ok"
+
+# Takes a client, streams PROMPT and returns once the first token arrives
+FirstToken = Callable[[Any], Awaitable[None]]
+
+
+async def _openai_first_token(client: AsyncOpenAI) -> None:
+    stream = await client.chat.completions.create(
+        model="gpt-4.1-mini",
+        messages=[{"role": "user", "content": PROMPT}],
+        stream=True,
+        max_tokens=5,
+    )
+    async with stream:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                return
+
+
+async def _anthropic_first_token(client: AsyncAnthropic) -> None:
+    async with client.messages.stream(
+        model="claude-haiku-4-5-20251001",
+        max_tokens=5,
+        messages=[{"role": "user", "content": PROMPT}],
+    ) as stream:
+        async for _ in stream.text_stream:
+            return
+
+
+async def _gemini_first_token(client: genai.Client) -> None:
+    stream = await client.aio.models.generate_content_stream(
+        model="gemini-2.5-flash-lite", contents=PROMPT
+    )
+    try:
+        async for chunk in stream:
+            if chunk.text:
+                return
+    finally:
+        await stream.aclose()
+
+
+async def _time(first_token: FirstToken, client: Any) -> float:
+    start = time.perf_counter()
+    await first_token(client)
+    return time.perf_counter() - start
+
+
+async def benchmark(
+    provider: str,
+    runs: int,
+    first_token: FirstToken,
+    new_client: Callable[[], Any],
+    pooled: Callable[[], Any],
+) -> Dict[str, List[float]]:
+    results: Dict[str, List[float]] = {"fresh": [], "pooled": []}
+
+    for _ in range(runs):
+        client = new_client()
+        try:
+            results["fresh"].append(await _time(first_token, client))
+        finally:
+            await _close_client(provider, client)
+
+    for _ in range(runs):
+        async with pooled() as client:
+            results["pooled"].append(await _time(first_token, client))
+
+    return results
+
+
+def _report(provider: str, results: Dict[str, List[float]]) -> None:
+    fresh = statistics.median(results["fresh"])
+    pooled = statistics.median(results["pooled"])
+    print(
+        f"{provider:<10} fresh p50 {fresh * 1000:7.0f}ms   "
+        f"pooled p50 {pooled * 1000:7.0f}ms   "
+        f"saved {(fresh - pooled) * 1000:6.0f}ms"
+    )
+
+
+async def main(runs: int) -> None:
+    if OPENAI_API_KEY:
+        key, base_url = OPENAI_API_KEY, OPENAI_BASE_URL
+        results = await benchmark(
+            "openai",
+            runs,
+            _openai_first_token,
+            lambda: AsyncOpenAI(api_key=key, base_url=base_url),
+            lambda: client_registry.openai(key, base_url),
+        )
+        _report("openai", results)
+    if ANTHROPIC_API_KEY:
+        key = ANTHROPIC_API_KEY
+        results = await benchmark(
+            "anthropic",
+            runs,
+            _anthropic_first_token,
+            lambda: AsyncAnthropic(api_key=key),
+            lambda: client_registry.anthropic(key),
+        )
+        _report("anthropic", results)
+    if GEMINI_API_KEY:
+        key = GEMINI_API_KEY
+        results = await benchmark(
+            "gemini",
+            runs,
+            _gemini_first_token,
+            lambda: genai.Client(api_key=key),
+            lambda: client_registry.gemini(key),
+        )
+        _report("gemini", results)
+
+    await client_registry.close_all()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5))
@@ -4,11 +4,21 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import asyncio
+import sys
 from evals.runner import run_image_evals
+from llm import Llm
+
+# Usage: poetry run python run_evals.py [model] [--use-cache]
+# --use-cache replays results of earlier runs from the completion cache
+# instead of calling the model, so timings don't measure the model.
 
 
 async def main():
-    await run_image_evals()
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    model = args[0] if args else Llm.CLAUDE_4_5_SONNET_2025_09_29.value
+    await run_image_evals(
+        stack="astro_blog", model=model, use_cache="--use-cache" in sys.argv
+    )
 
 
 # async def text_main():
@@ -3,6 +3,8 @@ import os
 from typing import List, Optional, Literal
 from dotenv import load_dotenv
 import aiohttp
+from image_generation.asset_store import asset_name, asset_store
+from image_generation.cache import image_generation_cache
 from image_generation.core import process_tasks
 
 EVALS = [
@@ -39,6 +41,21 @@ REPLICATE_API_TOKEN: Optional[str] = os.getenv("REPLICATE_API_TOKEN")
 OUTPUT_DIR: str = "generated_images"
 
 
+async def read_image(session: aiohttp.ClientSession, image_url: str) -> tuple[bytes, str]:
+    """(bytes, file extension) of a generated image. Images kept in the asset
+    store have relative URLs, so they're read from the store; provider URLs
+    (when storing is disabled or failed) are downloaded."""
+    name = asset_name(image_url)
+    path = asset_store.path(name) if name is not None else None
+    if path is not None:
+        return path.read_bytes(), path.suffix
+    async with session.get(image_url) as response:
+        extension = {"image/jpeg": ".jpg", "image/webp": ".webp"}.get(
+            response.content_type, ".png"
+        )
+        return await response.read(), extension
+
+
 async def generate_and_save_images(
     prompts: List[str],
     model: Literal["dalle3", "flux"],
@@ -60,13 +77,13 @@ async def generate_and_save_images(
         for i, image_url in enumerate(results):
             if image_url:
                 # Get the image data
-                async with session.get(image_url) as response:
-                    image_data: bytes = await response.read()
+                image_data, extension = await read_image(session, image_url)
 
                 # Save the image with a filename based on the input eval
                 prefix = "replicate_" if model == "flux" else "dalle3_"
                 filename: str = (
-                    f"{prefix}{prompts[i][:50].replace(' ', '_').replace(':', '')}.png"
+                    f"{prefix}{prompts[i][:50].replace(' ', '_').replace(':', '')}"
+                    f"{extension}"
                 )
                 filepath: str = os.path.join(OUTPUT_DIR, filename)
                 with open(filepath, "wb") as f:
@@ -80,6 +97,12 @@ async def main() -> None:
     # await generate_and_save_images(EVALS, "dalle3", OPENAI_API_KEY)
     await generate_and_save_images(EVALS, "flux", REPLICATE_API_TOKEN)
 
+    stats = image_generation_cache.stats
+    print(
+        f"Image cache: {stats.hits} hits, {stats.misses} misses "
+        f"({stats.expired} expired), hit rate {stats.hit_rate:.0%}"
+    )
+
 
 if __name__ == "__main__":
     asyncio.run(main())
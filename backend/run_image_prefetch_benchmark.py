@@ -0,0 +1,106 @@
+"""Measure time from a variant's last streamed token to setCode with and
+without starting image generation while the completion streams.
+
+The model stream and image provider are simulated: the page is streamed at
+a fixed rate and each image takes a fixed time to generate.
+
+Usage: poetry run python run_image_prefetch_benchmark.py [image_seconds] [stream_seconds]
+"""
+
+import asyncio
+import sys
+import time
+from typing import Any, Coroutine, Dict, List
+
+import image_generation.cache as image_cache
+import image_generation.core as image_core
+import routes.generate_code as generate_code
+from llm import Completion, Llm
+from routes.generate_code import ParallelGenerationStage
+
+NUM_VARIANTS = 4
+CHUNK_CHARS = 40
+
+
+def make_page(num_images: int) -> str:
+    sections = [
+        f'<section><h2>Section {i}</h2><p>{"Lorem ipsum dolor sit amet. " * 20}</p>'
+        f'<img src="https://placehold.co/600x400" alt="Illustration {i}"></section>'
+        for i in range(num_images)
+    ]
+    # Pages usually go on after their last image
+    footer = "<footer>" + '<a href="#">Link</a> ' * 150 + "</footer>"
+    return f"<html><body>{''.join(sections)}{footer}</body></html>"
+
+
+async def run(prefetch: bool, image_seconds: float, stream_seconds: float) -> List[float]:
+    generate_code.IMAGE_PREFETCH_ENABLED = prefetch
+
+    async def fake_dalle(prompt: str, api_key: str, base_url: str | None) -> str:
+        await asyncio.sleep(image_seconds)
+        return f"https://example.com/{abs(hash(prompt))}.png"
+
+    image_core.generate_image_dalle = fake_dalle  # type: ignore
+
+    page = make_page(6)
+    chunks = [page[i : i + CHUNK_CHARS] for i in range(0, len(page), CHUNK_CHARS)]
+    last_token_at: Dict[int, float] = {}
+    finalize: List[float] = []
+
+    async def send_message(type: str, value: str, variant_index: int) -> None:
+        if type == "setCode":
+            finalize.append(time.perf_counter() - last_token_at[variant_index])
+
+    stage = ParallelGenerationStage(
+        send_message=send_message,  # type: ignore
+        openai_api_key="sk-simulated",
+        openai_base_url=None,
+        anthropic_api_key=None,
+        gemini_api_key=None,
+        should_generate_images=True,
+        input_mode="text",
+        generation_type="create",
+        prompt={"text": "", "images": []},
+        stack="html_tailwind",  # type: ignore
+    )
+
+    async def variant(index: int) -> Completion:
+        start = time.perf_counter()
+        for chunk in chunks:
+            await stage._process_chunk(chunk, index)
+            await asyncio.sleep(stream_seconds / len(chunks))
+        last_token_at[index] = time.perf_counter()
+        return {"duration": time.perf_counter() - start, "code": page}
+
+    def create_tasks(*_: Any) -> List[Coroutine[Any, Any, Completion]]:
+        return [variant(index) for index in range(NUM_VARIANTS)]
+
+    stage._create_generation_tasks = create_tasks  # type: ignore
+    await stage.process_variants([Llm.GPT_4_1_2025_04_14] * NUM_VARIANTS, [], {}, {})
+    return finalize
+
+
+async def main(image_seconds: float, stream_seconds: float) -> None:
+    # Simulated images must not come from (or go into) the real image cache
+    image_cache.IMAGE_CACHE_ENABLED = False
+    generate_code.REPLICATE_API_KEY = None
+
+    results = {
+        "after completion": await run(False, image_seconds, stream_seconds),
+        "while streaming": await run(True, image_seconds, stream_seconds),
+    }
+    print(
+        f"\nSimulated: {stream_seconds:.1f}s stream, {image_seconds:.1f}s per image, "
+        f"{NUM_VARIANTS} variants"
+    )
+    for mode, finalize in results.items():
+        print(
+            f"Images generated {mode:<17} last token -> setCode: "
+            f"mean {sum(finalize) / len(finalize):.2f}s, max {max(finalize):.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    image_seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    stream_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    asyncio.run(main(image_seconds, stream_seconds))
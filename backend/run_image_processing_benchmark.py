@@ -0,0 +1,151 @@
+"""Compare process_image against the previous fixed-step JPEG quality loop.
+
+Reports encode count, wall time and output size per image. Uses the PNG/JPEG
+screenshots in the given directory, or generates large synthetic full-page
+screenshots if none is given.
+
+Usage: poetry run python run_image_processing_benchmark.py [screenshot_dir]
+"""
+
+import base64
+import io
+import os
+import random
+import sys
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from PIL import Image, ImageDraw
+
+from image_processing.utils import (
+    CLAUDE_IMAGE_MAX_SIZE,
+    CLAUDE_MAX_IMAGE_DIMENSION,
+    process_image,
+)
+
+
+def legacy_process_image(image_data_url: str) -> tuple[str, str]:
+    """process_image before the predicted quality search and reduced-decode resizing"""
+    media_type = image_data_url.split(";")[0].split(":")[1]
+    base64_data = image_data_url.split(",")[1]
+    image_bytes = base64.b64decode(base64_data)
+
+    img = Image.open(io.BytesIO(image_bytes))
+    is_under_dimension_limit = (
+        img.width < CLAUDE_MAX_IMAGE_DIMENSION
+        and img.height < CLAUDE_MAX_IMAGE_DIMENSION
+    )
+    is_under_size_limit = len(base64_data) <= CLAUDE_IMAGE_MAX_SIZE
+    if is_under_dimension_limit and is_under_size_limit:
+        return (media_type, base64_data)
+
+    if not is_under_dimension_limit:
+        if img.width > img.height:
+            new_width = CLAUDE_MAX_IMAGE_DIMENSION
+            new_height = int((CLAUDE_MAX_IMAGE_DIMENSION / img.width) * img.height)
+        else:
+            new_height = CLAUDE_MAX_IMAGE_DIMENSION
+            new_width = int((CLAUDE_MAX_IMAGE_DIMENSION / img.height) * img.width)
+        img = img.resize((new_width, new_height), Image.DEFAULT_STRATEGY)
+
+    quality = 95
+    output = io.BytesIO()
+    img = img.convert("RGB")
+    img.save(output, format="JPEG", quality=quality)
+    while (
+        len(base64.b64encode(output.getvalue())) > CLAUDE_IMAGE_MAX_SIZE
+        and quality > 10
+    ):
+        output = io.BytesIO()
+        img.save(output, format="JPEG", quality=quality)
+        quality -= 5
+
+    return ("image/jpeg", base64.b64encode(output.getvalue()).decode("utf-8"))
+
+
+@contextmanager
+def count_jpeg_encodes() -> Iterator[List[int]]:
+    counter = [0]
+    original_save = Image.Image.save
+
+    def counting_save(self: Image.Image, fp, format=None, **params):  # type: ignore
+        if format == "JPEG":
+            counter[0] += 1
+        return original_save(self, fp, format, **params)
+
+    Image.Image.save = counting_save  # type: ignore
+    try:
+        yield counter
+    finally:
+        Image.Image.save = original_save  # type: ignore
+
+
+def synthetic_screenshot(width: int, height: int, seed: int) -> str:
+    """A noisy full-page screenshot as a PNG data URL, large enough to need
+    resizing and recompression"""
+    rng = random.Random(seed)
+    img = Image.effect_noise((width, height), 40).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for _ in range(height // 40):
+        x, y = rng.randrange(width), rng.randrange(height)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle((x, y, x + rng.randrange(50, 600), y + rng.randrange(20, 300)), fill=color)
+        draw.text((x + 5, y + 5), "Lorem ipsum dolor sit amet", fill=(0, 0, 0))
+    output = io.BytesIO()
+    img.save(output, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(output.getvalue()).decode()
+
+
+def load_corpus(directory: str | None) -> Dict[str, str]:
+    if directory is None:
+        return {
+            f"synthetic_{width}x{height}": synthetic_screenshot(width, height, seed)
+            for seed, (width, height) in enumerate(
+                [(1440, 6000), (1440, 9000), (1920, 12000), (2880, 16000)]
+            )
+        }
+
+    corpus: Dict[str, str] = {}
+    for name in sorted(os.listdir(directory)):
+        ext = name.lower().rsplit(".", 1)[-1]
+        if ext not in ("png", "jpg", "jpeg"):
+            continue
+        with open(os.path.join(directory, name), "rb") as f:
+            mime = "image/png" if ext == "png" else "image/jpeg"
+            corpus[name] = f"data:{mime};base64," + base64.b64encode(f.read()).decode()
+    return corpus
+
+
+def run(
+    process: Callable[[str], Tuple[str, str]], data_url: str
+) -> Tuple[int, float, int]:
+    with count_jpeg_encodes() as encodes:
+        start = time.perf_counter()
+        _, base64_data = process(data_url)
+        elapsed = time.perf_counter() - start
+    return encodes[0], elapsed, len(base64_data)
+
+
+def main(directory: str | None) -> None:
+    corpus = load_corpus(directory)
+    print(
+        f"{'image':<28} {'impl':<8} {'encodes':>7} {'time':>8} {'output':>10}"
+    )
+    totals = {"legacy": [0, 0.0], "current": [0, 0.0]}
+    for name, data_url in corpus.items():
+        for impl, process in (("legacy", legacy_process_image), ("current", process_image)):
+            encodes, elapsed, size = run(process, data_url)
+            totals[impl][0] += encodes
+            totals[impl][1] += elapsed
+            print(
+                f"{name:<28} {impl:<8} {encodes:>7} {elapsed:>7.2f}s {size / 1024 / 1024:>8.2f}MB"
+            )
+
+    print()
+    for impl, (encodes, elapsed) in totals.items():
+        print(f"{impl:<8} total: {encodes} encodes, {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
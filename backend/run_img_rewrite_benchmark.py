@@ -0,0 +1,113 @@
+"""Compare the img-tag rewriter in image_generation against the previous
+BeautifulSoup parse + prettify implementation on 100KB-1MB pages.
+
+Times create_alt_url_mapping and the placeholder replacement done by
+generate_images (without generating any images).
+
+Usage: poetry run python run_img_rewrite_benchmark.py
+"""
+
+import time
+from typing import Callable, Dict
+
+from bs4 import BeautifulSoup
+
+from image_generation.core import (
+    create_alt_url_mapping,
+    extract_dimensions,
+    replace_placeholder_images,
+)
+
+SIZES_KB = [100, 250, 500, 1000]
+REPEATS = 3
+
+
+def legacy_create_alt_url_mapping(code: str) -> Dict[str, str]:
+    soup = BeautifulSoup(code, "html.parser")
+    mapping: Dict[str, str] = {}
+    for image in soup.find_all("img"):
+        if not image["src"].startswith("https://placehold.co"):
+            mapping[image["alt"]] = image["src"]
+    return mapping
+
+
+def legacy_replace_placeholder_images(code: str, image_urls: Dict[str, str]) -> str:
+    soup = BeautifulSoup(code, "html.parser")
+    for img in soup.find_all("img"):
+        if not img["src"].startswith("https://placehold.co"):
+            continue
+        new_url = image_urls[img.get("alt")]
+        if new_url:
+            width, height = extract_dimensions(img["src"])
+            img["width"] = width
+            img["height"] = height
+            img["src"] = new_url
+    return soup.prettify()
+
+
+def make_page(size_kb: int) -> str:
+    """A single-file portfolio page with a placeholder image every few KB"""
+    links = "<li><a href='#'>Link</a></li>" * 10
+    section = 0
+    parts = ["<!DOCTYPE html><html><head><style>body { margin: 0 }</style></head><body>"]
+    length = len(parts[0])
+    while length < size_kb * 1024:
+        block = (
+            f'<section class="py-12 px-6"><h2 class="text-2xl">Project {section}</h2>'
+            f'<p class="text-gray-600">{"A short description of the project. " * 30}</p>'
+            f'<img src="https://placehold.co/600x400" alt="Screenshot of project {section % 40}">'
+            f'<img src="https://example.com/logo-{section}.png" alt="Logo {section}">'
+            f"<ul>{links}</ul></section>"
+        )
+        parts.append(block)
+        length += len(block)
+        section += 1
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def best_time(func: Callable[[], object]) -> float:
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main() -> None:
+    image_urls = {
+        f"Screenshot of project {i}": f"https://example.com/generated-{i}.png"
+        for i in range(40)
+    }
+    print(f"{'page':>7} {'step':<10} {'BeautifulSoup':>14} {'rewriter':>10} {'speedup':>8}")
+    for size_kb in SIZES_KB:
+        page = make_page(size_kb)
+        for step, legacy, current in (
+            (
+                "mapping",
+                lambda: legacy_create_alt_url_mapping(page),
+                lambda: create_alt_url_mapping(page),
+            ),
+            (
+                "replace",
+                lambda: legacy_replace_placeholder_images(page, image_urls),
+                lambda: replace_placeholder_images(page, image_urls),
+            ),
+        ):
+            legacy_time = best_time(legacy)
+            current_time = best_time(current)
+            print(
+                f"{size_kb:>5}KB {step:<10} {legacy_time * 1000:>12.1f}ms "
+                f"{current_time * 1000:>8.1f}ms {legacy_time / current_time:>7.1f}x"
+            )
+
+        rewritten = replace_placeholder_images(page, image_urls)
+        print(
+            f"{'':>7} output size: prettify {len(legacy_replace_placeholder_images(page, image_urls)) / 1024:.0f}KB, "
+            f"rewriter {len(rewritten) / 1024:.0f}KB (input {len(page) / 1024:.0f}KB)"
+        )
+
+
+if __name__ == "__main__":
+    main()
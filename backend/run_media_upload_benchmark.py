@@ -0,0 +1,97 @@
+"""Compare handling a video sent inline as a base64 data URL in the first
+WebSocket message against one uploaded to /api/media and referenced by id.
+
+Measures the time and peak Python heap to parse the generation message and
+get the video bytes ready for Gemini, per request.
+
+Usage: poetry run python run_media_upload_benchmark.py [video_file]
+"""
+
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Tuple
+
+from image_processing.media_registry import MediaRegistry, detect_mime_type
+from image_processing.media_store import MediaStore, media_ref
+
+# A synthetic MP4 of this size is used when no video file is given
+SYNTHETIC_VIDEO_BYTES = 40 * 1024 * 1024
+
+
+def load_video(path: str | None) -> Tuple[bytes, str]:
+    if path is None:
+        header = b"\x00\x00\x00\x20ftypisom"
+        return header + os.urandom(SYNTHETIC_VIDEO_BYTES - len(header)), "video/mp4"
+    with open(path, "rb") as f:
+        data = f.read()
+    return data, detect_mime_type(data) or "video/mp4"
+
+
+def generation_message(video_url: str) -> str:
+    return json.dumps(
+        {
+            "generationType": "create",
+            "inputMode": "video",
+            "generatedCodeConfig": "html_tailwind",
+            "prompt": {"text": "", "images": [video_url]},
+            "history": [],
+        }
+    )
+
+
+def measure(handle: Callable[[], int]) -> Tuple[float, int]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    handle()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def prepare_video(message: str, media: MediaRegistry) -> int:
+    """What the pipeline does before calling Gemini: parse the message,
+    then get the video bytes"""
+    params = json.loads(message)
+    video = media.decode(params["prompt"]["images"][0])
+    return len(bytes(video.data))
+
+
+def main(path: str | None) -> None:
+    data, mime_type = load_video(path)
+    print(f"Video: {len(data) / 1024 / 1024:.1f}MB {mime_type}\n")
+
+    inline_message = generation_message(
+        f"data:{mime_type};base64," + base64.b64encode(data).decode()
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = MediaStore(Path(directory), max_bytes=len(data) * 2)
+        start = time.perf_counter()
+        ref = media_ref(store.put(data, mime_type))
+        upload_time = time.perf_counter() - start
+        ref_message = generation_message(ref)
+
+        results = {
+            "inline": measure(lambda: prepare_video(inline_message, MediaRegistry(store))),
+            "upload": measure(lambda: prepare_video(ref_message, MediaRegistry(store))),
+        }
+
+    print(f"{'mode':<8} {'message':>10} {'time':>9} {'peak heap':>11}")
+    for mode, message in (("inline", inline_message), ("upload", ref_message)):
+        elapsed, peak = results[mode]
+        print(
+            f"{mode:<8} {len(message) / 1024 / 1024:>8.2f}MB {elapsed * 1000:>7.1f}ms "
+            f"{peak / 1024 / 1024:>9.1f}MB"
+        )
+    print(f"\nStoring the upload took {upload_time * 1000:.1f}ms (separate request)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
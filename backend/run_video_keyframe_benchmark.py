@@ -0,0 +1,104 @@
+"""Estimate the Gemini input tokens saved by sending a video's keyframes
+instead of the whole video at 10fps.
+
+With a video file, its keyframes are extracted with extract_keyframes
+(needs moviepy). Without one, a synthetic 60s screen recording is used: a
+UI that changes state every few seconds, with animated transitions.
+
+Usage: poetry run python run_video_keyframe_benchmark.py [video_file]
+"""
+
+import random
+import sys
+import time
+from typing import Iterator, List, Tuple
+
+from PIL import Image, ImageDraw
+
+from config import VIDEO_KEYFRAME_SAMPLE_FPS
+from llm import Llm
+from video.cost_estimation import (
+    MediaResolution,
+    format_detailed_input_estimate,
+    format_keyframe_savings,
+    get_video_duration_from_bytes,
+)
+from video.keyframes import encode_keyframe, extract_keyframes, select_keyframes
+
+# What stream_gemini_response_video sends the video at
+VIDEO_FPS = 10
+MODEL = Llm.GEMINI_3_FLASH_PREVIEW_HIGH
+DURATION_SECONDS = 60
+TRANSITION_SECONDS = 0.4
+
+
+def draw_screen(state: int) -> Image.Image:
+    rng = random.Random(state)
+    img = Image.new("RGB", (1280, 720), (248, 248, 250))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, 1280, 56), fill=(24, 24, 40))
+    draw.rectangle((0, 56, 220, 720), fill=(235, 235, 240))
+    for row in range(6):
+        y = 90 + row * 100
+        width = rng.randint(300, 900)
+        draw.rectangle((260, y, 260 + width, y + 70), fill=(rng.randint(80, 220), 120, 200))
+        draw.text((280, y + 25), f"Item {state}-{row}", fill="white")
+    # A modal in some states
+    if state % 4 == 3:
+        draw.rectangle((400, 200, 880, 520), fill="white", outline=(0, 0, 0))
+        draw.text((440, 240), "Are you sure?", fill="black")
+    return img
+
+
+def synthetic_recording() -> Iterator[Tuple[float, Image.Image]]:
+    """A 60s recording sampled like extract_keyframes samples a real one"""
+    rng = random.Random(0)
+    change_times: List[float] = []
+    t = 1.0
+    while t < DURATION_SECONDS:
+        change_times.append(t)
+        t += rng.uniform(1.5, 5)
+
+    state = 0
+    frame_count = int(DURATION_SECONDS * VIDEO_KEYFRAME_SAMPLE_FPS)
+    for i in range(frame_count):
+        timestamp = i / VIDEO_KEYFRAME_SAMPLE_FPS
+        while state < len(change_times) and change_times[state] + TRANSITION_SECONDS <= timestamp:
+            state += 1
+        frame = draw_screen(state)
+        if state < len(change_times) and change_times[state] <= timestamp:
+            # Mid-transition: blend towards the next state
+            progress = (timestamp - change_times[state]) / TRANSITION_SECONDS
+            frame = Image.blend(frame, draw_screen(state + 1), progress)
+        yield timestamp, frame
+
+
+def main() -> None:
+    start = time.perf_counter()
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "rb") as f:
+            video_bytes = f.read()
+        duration = get_video_duration_from_bytes(video_bytes)
+        keyframes = extract_keyframes(video_bytes)
+        if duration is None or keyframes is None:
+            print("Could not decode the video (is moviepy installed?)")
+            return
+    else:
+        duration = DURATION_SECONDS
+        keyframes = [
+            encode_keyframe(timestamp, frame)
+            for timestamp, frame in select_keyframes(synthetic_recording())
+        ]
+    elapsed = time.perf_counter() - start
+
+    print(f"Video: {duration:.1f}s, {len(keyframes)} keyframes in {elapsed:.2f}s")
+    print(f"Keyframe times: {', '.join(f'{k.timestamp:.1f}' for k in keyframes)}")
+    print(f"Keyframe JPEG bytes: {sum(len(k.data) for k in keyframes) / 1024:.0f}KB")
+    print()
+    print(format_detailed_input_estimate(duration, VIDEO_FPS, MediaResolution.HIGH, MODEL))
+    print()
+    print(format_keyframe_savings(duration, VIDEO_FPS, len(keyframes), MediaResolution.HIGH, MODEL))
+
+
+if __name__ == "__main__":
+    main()
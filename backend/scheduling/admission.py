@@ -0,0 +1,213 @@
+import asyncio
+import itertools
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from config import MAX_CONCURRENT_STREAMS_PER_PROVIDER
+
+# Lower values are admitted first
+PRIORITY_UPDATE = 0
+PRIORITY_CREATE = 1
+
+
+class AdmissionTicket:
+    """A request waiting for (or holding) provider stream slots"""
+
+    def __init__(self, demand: Dict[str, int], priority: int, seq: int):
+        self.demand = demand
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.perf_counter()
+        self.granted = False
+        # Set whenever the queue changes so the waiter can re-check its position
+        self.updated = asyncio.Event()
+
+    @property
+    def sort_key(self) -> tuple[int, int]:
+        return (self.priority, self.seq)
+
+
+class AdmissionController:
+    """Bounds concurrent provider streams across all code generation requests.
+
+    Waiting requests are ordered by priority, then FIFO. A request may only
+    overtake an earlier one if it doesn't need any provider the earlier one is
+    blocked on, so a busy provider can't hold up requests for an idle one and a
+    large request can't be starved by smaller ones behind it.
+    """
+
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = limits
+        self.in_use: Dict[str, int] = {provider: 0 for provider in limits}
+        self._waiting: List[AdmissionTicket] = []
+        self._seq = itertools.count()
+
+    @property
+    def queue_length(self) -> int:
+        return len(self._waiting)
+
+    def _clamp_demand(self, demand: Dict[str, int]) -> Dict[str, int]:
+        # A request asking for more than a provider's limit would never be admitted
+        return {
+            provider: min(count, self.limits.get(provider, count))
+            for provider, count in demand.items()
+            if count > 0
+        }
+
+    def _fits(self, demand: Dict[str, int]) -> bool:
+        return all(
+            self.in_use.get(provider, 0) + count <= self.limits.get(provider, count)
+            for provider, count in demand.items()
+        )
+
+    def _grant_waiting(self) -> None:
+        blocked_providers: set[str] = set()
+        for ticket in list(self._waiting):
+            if blocked_providers.intersection(ticket.demand):
+                blocked_providers.update(ticket.demand)
+                continue
+            if not self._fits(ticket.demand):
+                blocked_providers.update(ticket.demand)
+                continue
+
+            for provider, count in ticket.demand.items():
+                self.in_use[provider] = self.in_use.get(provider, 0) + count
+            ticket.granted = True
+            ticket.updated.set()
+            self._waiting.remove(ticket)
+
+        for ticket in self._waiting:
+            ticket.updated.set()
+
+    def position(self, ticket: AdmissionTicket) -> int:
+        """1-based position of a waiting ticket in the queue"""
+        return self._waiting.index(ticket) + 1
+
+    async def acquire(
+        self,
+        demand: Dict[str, int],
+        priority: int,
+        on_position: Callable[[int], Awaitable[None]] | None = None,
+        cancel_event: asyncio.Event | None = None,
+    ) -> AdmissionTicket | None:
+        """Wait for stream slots. Returns None if cancel_event fires first."""
+        ticket = AdmissionTicket(
+            self._clamp_demand(demand), priority, next(self._seq)
+        )
+        self._waiting.append(ticket)
+        self._waiting.sort(key=lambda t: t.sort_key)
+        self._grant_waiting()
+
+        last_position = None
+        try:
+            while not ticket.granted:
+                position = self.position(ticket)
+                if on_position and position != last_position:
+                    await on_position(position)
+                    last_position = position
+
+                ticket.updated.clear()
+                waiters = [asyncio.create_task(ticket.updated.wait())]
+                if cancel_event is not None:
+                    waiters.append(asyncio.create_task(cancel_event.wait()))
+                try:
+                    await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    for waiter in waiters:
+                        waiter.cancel()
+
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+        if not ticket.granted:
+            self._abandon(ticket)
+            return None
+
+        wait_time = time.perf_counter() - ticket.enqueued_at
+        if last_position is not None:
+            print(f"[ADMISSION] Admitted after waiting {wait_time:.2f}s in queue")
+        return ticket
+
+    def _abandon(self, ticket: AdmissionTicket) -> None:
+        if ticket.granted:
+            self.release(ticket)
+        elif ticket in self._waiting:
+            self._waiting.remove(ticket)
+            self._grant_waiting()
+
+    def release(self, ticket: AdmissionTicket) -> None:
+        if not ticket.granted:
+            return
+        for provider, count in ticket.demand.items():
+            self.in_use[provider] -= count
+        ticket.granted = False
+        self._grant_waiting()
+
+    def release_one(self, ticket: AdmissionTicket, provider: str) -> None:
+        """Give back one of the ticket's slots for provider"""
+        if not ticket.granted or ticket.demand.get(provider, 0) <= 0:
+            return
+        ticket.demand[provider] -= 1
+        self.in_use[provider] -= 1
+        self._grant_waiting()
+
+
+class VariantAdmission:
+    """Stream slots for one request's variants.
+
+    Slots are only requested for the variants that will actually stream, and
+    each is given back as soon as its variant finishes or is cancelled rather
+    than when the whole request ends.
+    """
+
+    def __init__(
+        self,
+        controller: AdmissionController,
+        priority: int,
+        cancel_event: asyncio.Event | None = None,
+    ):
+        self.controller = controller
+        self.priority = priority
+        self.cancel_event = cancel_event
+        self.ticket: AdmissionTicket | None = None
+        # Provider of each variant still holding a slot
+        self._providers: Dict[int, str] = {}
+
+    async def acquire(
+        self,
+        providers: Dict[int, str],
+        on_position: Callable[[int], Awaitable[None]] | None = None,
+    ) -> bool:
+        """Wait for a slot for each variant. Returns False if the request is
+        cancelled first."""
+        demand: Dict[str, int] = {}
+        for provider in providers.values():
+            demand[provider] = demand.get(provider, 0) + 1
+        self.ticket = await self.controller.acquire(
+            demand, self.priority, on_position, self.cancel_event
+        )
+        if self.ticket is None:
+            return False
+        self._providers = dict(providers)
+        return True
+
+    def release_variant(self, index: int) -> None:
+        provider = self._providers.pop(index, None)
+        if provider is None or self.ticket is None:
+            return
+        # Demand above the provider's limit was clamped, so the slot is only
+        # freed once fewer variants than slots are left streaming
+        remaining = sum(1 for p in self._providers.values() if p == provider)
+        if self.ticket.demand.get(provider, 0) > remaining:
+            self.controller.release_one(self.ticket, provider)
+
+    def release(self) -> None:
+        self._providers.clear()
+        if self.ticket is not None:
+            self.controller.release(self.ticket)
+
+
+admission_controller = AdmissionController(dict(MAX_CONCURRENT_STREAMS_PER_PROVIDER))
@@ -0,0 +1,44 @@
+import asyncio
+import functools
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+from config import MEDIA_WORKER_POOL, MEDIA_WORKER_POOL_SIZE
+
+T = TypeVar("T")
+
+_executor: Executor | None = None
+
+
+def _create_executor() -> Executor:
+    if MEDIA_WORKER_POOL == "process":
+        return ProcessPoolExecutor(max_workers=MEDIA_WORKER_POOL_SIZE)
+    if MEDIA_WORKER_POOL != "thread":
+        raise ValueError(f"Invalid media worker pool: {MEDIA_WORKER_POOL}")
+    return ThreadPoolExecutor(
+        max_workers=MEDIA_WORKER_POOL_SIZE, thread_name_prefix="media-worker"
+    )
+
+
+def get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        _executor = _create_executor()
+    return _executor
+
+
+async def run_in_worker(func: Callable[..., T], *args: object) -> T:
+    """Run CPU-bound media work in the worker pool.
+
+    With a process pool, func and its arguments must be picklable (i.e.
+    module-level functions).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args))
+
+
+def shutdown_worker_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,206 @@
+import asyncio
+from typing import Any, Coroutine, Dict, List
+
+import pytest
+
+from llm import Completion, Llm
+from routes.generate_code import ParallelGenerationStage
+from scheduling.admission import (
+    PRIORITY_CREATE,
+    PRIORITY_UPDATE,
+    AdmissionController,
+    VariantAdmission,
+)
+
+
+@pytest.mark.asyncio
+async def test_requests_within_limits_are_admitted_immediately():
+    controller = AdmissionController({"gemini": 4, "anthropic": 4})
+
+    ticket = await controller.acquire({"gemini": 3, "anthropic": 1}, PRIORITY_CREATE)
+
+    assert ticket is not None
+    assert controller.in_use == {"gemini": 3, "anthropic": 1}
+    controller.release(ticket)
+    assert controller.in_use == {"gemini": 0, "anthropic": 0}
+
+
+@pytest.mark.asyncio
+async def test_waiting_clients_get_queue_positions_and_updates_go_first():
+    controller = AdmissionController({"gemini": 2})
+    running = await controller.acquire({"gemini": 2}, PRIORITY_CREATE)
+    assert running is not None
+
+    admitted: List[str] = []
+    positions: List[int] = []
+
+    async def wait_for_slot(name: str, priority: int) -> None:
+        async def on_position(position: int) -> None:
+            if name == "create":
+                positions.append(position)
+
+        ticket = await controller.acquire({"gemini": 2}, priority, on_position)
+        assert ticket is not None
+        admitted.append(name)
+        controller.release(ticket)
+
+    create_waiter = asyncio.create_task(wait_for_slot("create", PRIORITY_CREATE))
+    await asyncio.sleep(0)
+    update_waiter = asyncio.create_task(wait_for_slot("update", PRIORITY_UPDATE))
+    await asyncio.sleep(0.01)
+
+    assert controller.queue_length == 2
+    controller.release(running)
+    await asyncio.wait_for(asyncio.gather(create_waiter, update_waiter), 1)
+
+    assert admitted == ["update", "create"]
+    # The create request was pushed back when the update request arrived
+    assert positions == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_idle_provider_is_not_blocked_by_busy_one():
+    controller = AdmissionController({"gemini": 1, "anthropic": 1})
+    running = await controller.acquire({"gemini": 1}, PRIORITY_CREATE)
+    assert running is not None
+
+    gemini_waiter = asyncio.create_task(
+        controller.acquire({"gemini": 1}, PRIORITY_CREATE)
+    )
+    await asyncio.sleep(0)
+    anthropic_ticket = await asyncio.wait_for(
+        controller.acquire({"anthropic": 1}, PRIORITY_CREATE), 1
+    )
+
+    assert anthropic_ticket is not None
+    assert not gemini_waiter.done()
+    controller.release(running)
+    assert await asyncio.wait_for(gemini_waiter, 1) is not None
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_the_queue():
+    controller = AdmissionController({"openai": 1})
+    running = await controller.acquire({"openai": 1}, PRIORITY_CREATE)
+    cancel_event = asyncio.Event()
+
+    waiter = asyncio.create_task(
+        controller.acquire({"openai": 1}, PRIORITY_CREATE, cancel_event=cancel_event)
+    )
+    await asyncio.sleep(0)
+    cancel_event.set()
+
+    assert await asyncio.wait_for(waiter, 1) is None
+    assert controller.queue_length == 0
+    assert running is not None
+    controller.release(running)
+    assert controller.in_use == {"openai": 0}
+
+
+@pytest.mark.asyncio
+async def test_demand_above_limit_is_clamped():
+    controller = AdmissionController({"gemini": 2})
+
+    ticket = await asyncio.wait_for(controller.acquire({"gemini": 4}, PRIORITY_CREATE), 1)
+
+    assert ticket is not None
+    assert controller.in_use == {"gemini": 2}
+
+
+@pytest.mark.asyncio
+async def test_variant_slots_are_freed_one_at_a_time():
+    controller = AdmissionController({"gemini": 2, "anthropic": 2})
+    admission = VariantAdmission(controller, PRIORITY_CREATE)
+
+    assert await admission.acquire({0: "gemini", 1: "gemini", 2: "gemini", 3: "anthropic"})
+    assert controller.in_use == {"gemini": 2, "anthropic": 1}
+
+    # Two gemini variants are still streaming in the two clamped slots
+    admission.release_variant(0)
+    assert controller.in_use == {"gemini": 2, "anthropic": 1}
+    admission.release_variant(3)
+    admission.release_variant(1)
+    assert controller.in_use == {"gemini": 1, "anthropic": 0}
+    admission.release()
+    assert controller.in_use == {"gemini": 0, "anthropic": 0}
+
+
+class TestVariantAdmissionInGeneration:
+    MODELS = [
+        Llm.GPT_4_1_2025_04_14,
+        Llm.CLAUDE_4_5_SONNET_2025_09_29,
+        Llm.CLAUDE_4_5_OPUS_2025_11_01,
+    ]
+
+    def make_stage(
+        self, admission: VariantAdmission, **kwargs: Any
+    ) -> ParallelGenerationStage:
+        async def send_message(type: str, value: str, variant_index: int) -> None:
+            pass
+
+        return ParallelGenerationStage(
+            send_message=send_message,  # type: ignore
+            openai_api_key=None,
+            openai_base_url=None,
+            anthropic_api_key=None,
+            gemini_api_key=None,
+            should_generate_images=False,
+            input_mode="text",
+            generation_type="create",
+            prompt={"text": "", "images": []},
+            stack="astro_blog",
+            cancel_event=asyncio.Event(),
+            admission=admission,
+            **kwargs,
+        )
+
+    @pytest.mark.asyncio
+    async def test_dropped_and_finished_variants_hold_no_slots(self):
+        controller = AdmissionController({"openai": 1, "anthropic": 2})
+        stage = self.make_stage(VariantAdmission(controller, PRIORITY_CREATE))
+        in_use: List[Dict[str, int]] = []
+
+        async def variant(index: int) -> Completion:
+            if index == 1:
+                # Give the first variant's slot time to be freed
+                await asyncio.sleep(0.01)
+                in_use.append(dict(controller.in_use))
+            return {"duration": 0, "code": f"<html>{index}</html>"}
+
+        def create_tasks(*_: Any) -> List[Coroutine[Any, Any, Completion]]:
+            return [variant(index) for index in range(len(self.MODELS))]
+
+        stage._create_generation_tasks = create_tasks  # type: ignore
+        stage._over_budget = lambda _: {2: "Over budget"}  # type: ignore
+
+        completions = await asyncio.wait_for(
+            stage.process_variants(self.MODELS, [], {}, {}), timeout=1
+        )
+
+        assert sorted(completions) == [0, 1]
+        assert in_use == [{"openai": 0, "anthropic": 1}]
+        assert controller.in_use == {"openai": 0, "anthropic": 0}
+
+    @pytest.mark.asyncio
+    async def test_cancelled_stragglers_free_their_slots(self):
+        controller = AdmissionController({"openai": 1, "anthropic": 2})
+        admission = VariantAdmission(controller, PRIORITY_CREATE)
+        stage = self.make_stage(admission, first_k=1, straggler_policy="cancel")
+
+        async def variant(index: int) -> Completion:
+            await asyncio.sleep(0 if index == 0 else 10)
+            return {"duration": 0, "code": f"<html>{index}</html>"}
+
+        def create_tasks(*_: Any) -> List[Coroutine[Any, Any, Completion]]:
+            return [variant(index) for index in range(len(self.MODELS))]
+
+        stage._create_generation_tasks = create_tasks  # type: ignore
+
+        completions = await asyncio.wait_for(
+            stage.process_variants(self.MODELS, [], {}, {}), timeout=1
+        )
+
+        assert sorted(completions) == [0]
+        # Freed before the request ends and the whole ticket is released
+        assert admission.ticket is not None and admission.ticket.granted
+        assert controller.in_use == {"openai": 0, "anthropic": 0}
@@ -0,0 +1,253 @@
+import io
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Iterator, Tuple
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import image_generation.asset_store as asset_store_module
+import routes.assets as assets_route
+import scheduling.worker_pool as worker_pool
+from clients.registry import ClientRegistry
+from image_generation.asset_store import (
+    AssetStore,
+    asset_base_url,
+    asset_url,
+    asset_url_for_width,
+    store_generated_image,
+)
+
+
+def png_bytes(
+    width: int = 1024, height: int = 768, color: Tuple[int, int, int] = (200, 80, 40)
+) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(output, format="PNG")
+    return output.getvalue()
+
+
+@pytest.fixture
+def store(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> AssetStore:
+    store = AssetStore(tmp_path / "assets", [320, 640])
+    monkeypatch.setattr(asset_store_module, "asset_store", store)
+    monkeypatch.setattr(assets_route, "asset_store", store)
+    return store
+
+
+class TestAssetStore:
+    def test_put_writes_original_and_webp_derivatives(self, store: AssetStore):
+        name = store.put(png_bytes())
+        content_hash = name.removesuffix(".webp")
+
+        assert sorted(p.name for p in store.directory.iterdir()) == sorted(
+            [
+                f"{content_hash}.png",
+                f"{content_hash}.webp",
+                f"{content_hash}-w320.webp",
+                f"{content_hash}-w640.webp",
+            ]
+        )
+        with Image.open(store.directory / f"{content_hash}-w320.webp") as img:
+            assert img.format == "WEBP"
+            assert img.size == (320, 240)
+
+    def test_small_images_are_not_scaled_up(self, store: AssetStore):
+        name = store.put(png_bytes(400, 300))
+
+        with Image.open(store.directory / name.replace(".webp", "-w640.webp")) as img:
+            assert img.size == (400, 300)
+
+    def test_same_content_is_stored_once(self, store: AssetStore):
+        assert store.put(png_bytes()) == store.put(png_bytes())
+        assert len(list(store.directory.iterdir())) == 4
+
+    def test_rejects_non_images(self, store: AssetStore):
+        with pytest.raises(ValueError):
+            store.put(b"<html></html>")
+
+    def test_path_rejects_invalid_names(self, store: AssetStore):
+        assert store.path("../config.py") is None
+        assert store.path("a" * 64 + ".html") is None
+        assert store.path("a" * 64 + "-w320.webp") is not None
+
+    def test_least_recently_used_images_are_evicted(self, store: AssetStore):
+        first = store.put(png_bytes(color=(1, 0, 0)))
+        image_bytes = sum(p.stat().st_size for p in store.directory.iterdir())
+        store.max_bytes = int(image_bytes * 2.5)
+        second = store.put(png_bytes(color=(2, 0, 0)))
+        os.utime(store.directory / first, (1, 1))
+        os.utime(store.directory / second, (2, 2))
+        # Using the first image makes the second the least recently used
+        assert store.touch(first)
+
+        third = store.put(png_bytes(color=(3, 0, 0)))
+
+        names = {p.name for p in store.directory.iterdir()}
+        assert first in names and third in names
+        assert not any(name.startswith(second.removesuffix(".webp")) for name in names)
+        assert not store.touch(second)
+
+    def test_export_copies_referenced_assets(self, store: AssetStore, tmp_path: Path):
+        name = store.put(png_bytes())
+        missing = "b" * 64 + ".webp"
+        code = (
+            f'<img src="{asset_url(name)}"><img src="{asset_url(name)}">'
+            f'<img src="{asset_url(missing)}"><img src="https://example.com/x.png">'
+        )
+
+        exported, copied = store.export(code, tmp_path / "public" / "assets", "assets/")
+
+        assert copied == [name]
+        assert (tmp_path / "public" / "assets" / name).exists()
+        assert exported == (
+            f'<img src="assets/{name}"><img src="assets/{name}">'
+            f'<img src="{asset_url(missing)}"><img src="https://example.com/x.png">'
+        )
+
+
+    def test_export_finds_assets_under_any_base_url(
+        self, store: AssetStore, tmp_path: Path
+    ):
+        name = store.put(png_bytes())
+        code = (
+            f'<img src="{asset_url(name, "http://localhost:7001")}">'
+            f"<img src='{asset_url(name)}'>"
+            f'<img src="https://example.com/x{asset_url(name)}">'
+        )
+
+        exported, _ = store.export(code, tmp_path / "public" / "assets", "assets/")
+
+        assert exported == (
+            f'<img src="assets/{name}"><img src=\'assets/{name}\'>'
+            f'<img src="https://example.com/x{asset_url(name)}">'
+        )
+
+
+class TestAssetUrlForWidth:
+    def test_picks_smallest_derivative_for_high_dpi(self):
+        url = asset_url("a" * 64 + ".webp")
+
+        assert asset_url_for_width(url, 100) == asset_url("a" * 64 + "-w320.webp")
+        assert asset_url_for_width(url, 300) == asset_url("a" * 64 + "-w640.webp")
+        # Nothing is big enough, so the full-size image is used
+        assert asset_url_for_width(url, 600) == url
+
+    def test_links_assets_under_the_request_base_url(self):
+        name = "a" * 64 + ".webp"
+        base = "https://portfolio.example.com"
+
+        assert asset_url_for_width(asset_url(name), 100, base) == asset_url(
+            "a" * 64 + "-w320.webp", base
+        )
+        # Assets in earlier code may be under an old base URL
+        old = asset_url(name, "http://localhost:7001")
+        assert asset_url_for_width(old, 600, base) == asset_url(name, base)
+
+    def test_base_url_is_the_request_origin_unless_configured(
+        self, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(asset_store_module, "ASSET_PUBLIC_BASE_URL", "")
+        assert asset_base_url("wss://example.com/generate-code") == "https://example.com"
+        assert asset_base_url("ws://127.0.0.1:7001/generate-code") == (
+            "http://127.0.0.1:7001"
+        )
+
+        monkeypatch.setattr(
+            asset_store_module, "ASSET_PUBLIC_BASE_URL", "https://cdn.example.com"
+        )
+        assert asset_base_url("ws://127.0.0.1:7001/generate-code") == (
+            "https://cdn.example.com"
+        )
+
+    def test_leaves_other_urls_alone(self):
+        assert asset_url_for_width("https://example.com/x.png", 100) == (
+            "https://example.com/x.png"
+        )
+
+
+class TestAssetRoute:
+    def test_serves_assets_with_immutable_cache_headers(self, store: AssetStore):
+        name = store.put(png_bytes())
+        app = FastAPI()
+        app.include_router(assets_route.router)
+        client = TestClient(app)
+
+        response = client.get(f"/assets/{name}")
+        assert response.status_code == 200
+        assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+        assert response.content == (store.directory / name).read_bytes()
+
+        assert client.get("/assets/" + "c" * 64 + ".webp").status_code == 404
+        assert client.get("/assets/index.html").status_code == 404
+
+
+class TestStoreGeneratedImage:
+    @pytest.fixture
+    def image_server(self) -> Iterator[str]:
+        body = png_bytes()
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                if self.path != "/image.png":
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(
+            target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        )
+        thread.start()
+        yield f"http://127.0.0.1:{server.server_port}"
+        server.shutdown()
+        server.server_close()
+
+    @pytest.fixture(autouse=True)
+    async def fresh_client_registry(self, monkeypatch: pytest.MonkeyPatch):
+        registry = ClientRegistry()
+        monkeypatch.setattr(asset_store_module, "client_registry", registry)
+        monkeypatch.setattr(asset_store_module, "ASSET_STORE_ENABLED", True)
+        yield
+        await registry.close_all()
+
+    @pytest.mark.asyncio
+    async def test_downloads_into_the_store(self, store: AssetStore, image_server: str):
+        url = await store_generated_image(f"{image_server}/image.png")
+
+        # Relative, so cached URLs don't depend on the public base URL
+        assert url.startswith("/assets/")
+        name = url.removeprefix(asset_url(""))
+        assert (store.directory / name).exists()
+
+    @pytest.mark.asyncio
+    async def test_stores_under_a_process_pool(
+        self, store: AssetStore, image_server: str, monkeypatch: pytest.MonkeyPatch
+    ):
+        executor = ProcessPoolExecutor(max_workers=1)
+        monkeypatch.setattr(worker_pool, "_executor", executor)
+        try:
+            url = await store_generated_image(f"{image_server}/image.png")
+        finally:
+            executor.shutdown()
+
+        assert url.startswith("/assets/")
+        assert (store.directory / url.removeprefix(asset_url(""))).exists()
+
+    @pytest.mark.asyncio
+    async def test_falls_back_to_provider_url(self, store: AssetStore, image_server: str):
+        url = f"{image_server}/expired.png"
+
+        assert await store_generated_image(url) == url
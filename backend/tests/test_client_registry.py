@@ -0,0 +1,136 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from clients.registry import ClientRegistry
+
+
+class FakeClient:
+    def __init__(self, name: str):
+        self.name = name
+        self.closed = False
+
+    async def close(self) -> None:
+        await asyncio.sleep(0)
+        self.closed = True
+
+
+class TestClientRegistry:
+    """Test sharing, eviction and closing of pooled provider clients."""
+
+    @pytest.mark.asyncio
+    async def test_same_key_reuses_client(self):
+        registry = ClientRegistry(max_clients=4, idle_seconds=60)
+
+        async with registry.lease(("openai", "key", None), lambda: FakeClient("a")) as first:
+            pass
+        async with registry.lease(("openai", "key", None), lambda: FakeClient("b")) as second:
+            pass
+
+        assert first is second
+        assert not first.closed
+        assert (registry.hits, registry.misses) == (1, 1)
+
+    @pytest.mark.asyncio
+    async def test_base_url_is_part_of_the_key(self):
+        registry = ClientRegistry(max_clients=4, idle_seconds=60)
+
+        async with registry.lease(("openai", "key", None), lambda: FakeClient("a")) as first:
+            pass
+        async with registry.lease(("openai", "key", "http://proxy"), lambda: FakeClient("b")) as second:
+            pass
+
+        assert first is not second
+        assert len(registry) == 2
+
+    @pytest.mark.asyncio
+    async def test_least_recently_used_client_is_evicted(self):
+        registry = ClientRegistry(max_clients=2, idle_seconds=60)
+        clients = {name: FakeClient(name) for name in "abc"}
+
+        for name in "abc":
+            async with registry.lease(("openai", name, None), lambda: clients[name]):
+                pass
+
+        assert clients["a"].closed
+        assert not clients["b"].closed and not clients["c"].closed
+        assert len(registry) == 2
+
+    @pytest.mark.asyncio
+    async def test_leased_client_is_never_closed(self):
+        registry = ClientRegistry(max_clients=1, idle_seconds=60)
+        busy = FakeClient("busy")
+        other = FakeClient("other")
+
+        async with registry.lease(("anthropic", "busy", None), lambda: busy):
+            async with registry.lease(("anthropic", "other", None), lambda: other):
+                pass
+            assert other.closed
+            assert not busy.closed
+
+        assert len(registry) == 1
+
+    @pytest.mark.asyncio
+    async def test_idle_client_is_closed(self):
+        registry = ClientRegistry(max_clients=4, idle_seconds=60)
+        idle = FakeClient("idle")
+        async with registry.lease(("openai", "idle", None), lambda: idle):
+            pass
+
+        registry.idle_seconds = -1
+        async with registry.lease(("openai", "other", None), lambda: FakeClient("other")):
+            assert idle.closed
+
+    @pytest.mark.asyncio
+    async def test_close_all(self):
+        registry = ClientRegistry(max_clients=4, idle_seconds=60)
+        client = FakeClient("a")
+        async with registry.lease(("openai", "key", None), lambda: client):
+            pass
+
+        await registry.close_all()
+        assert client.closed
+        assert len(registry) == 0
+
+    @pytest.mark.asyncio
+    async def test_concurrent_leases_share_one_client(self):
+        registry = ClientRegistry(max_clients=4, idle_seconds=60)
+        idle = FakeClient("idle")
+        async with registry.lease(("openai", "idle", None), lambda: idle):
+            pass
+        # Closing the idle client yields to the other lease
+        registry.idle_seconds = -1
+        registry.misses = 0
+        created: List[FakeClient] = []
+
+        def factory() -> FakeClient:
+            created.append(FakeClient(str(len(created))))
+            return created[-1]
+
+        async def lease() -> FakeClient:
+            async with registry.lease(("openai", "key", None), factory) as client:
+                await asyncio.sleep(0)
+                return client
+
+        first, second = await asyncio.gather(lease(), lease())
+
+        assert first is second
+        assert registry.misses == 1 and len(created) == 1
+        assert idle.closed
+
+    @pytest.mark.asyncio
+    async def test_overlapping_evictions_close_each_client_once(self):
+        registry = ClientRegistry(max_clients=4, idle_seconds=60)
+        for name in "abc":
+            async with registry.lease(("openai", name, None), lambda: FakeClient(name)):
+                pass
+        registry.idle_seconds = -1
+
+        async def lease(name: str) -> None:
+            async with registry.lease(("openai", name, None), lambda: FakeClient(name)):
+                await asyncio.sleep(0)
+
+        await asyncio.gather(lease("d"), lease("e"))
+
+        assert len(registry) == 0
@@ -0,0 +1,92 @@
+import os
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from codegen.completion_cache import (
+    CompletionCache,
+    completion_cache_key,
+    prompt_digest,
+    replay_completion,
+)
+from llm import Llm
+
+
+def make_messages(text: str):
+    return [
+        {"role": "system", "content": "You are a coding assistant"},
+        {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}},
+                {"type": "text", "text": text},
+            ],
+        },
+    ]
+
+
+class TestCompletionCacheKey:
+    def test_key_depends_on_prompt_model_and_attempt(self):
+        digest = prompt_digest(make_messages("build this"))  # type: ignore
+
+        assert digest == prompt_digest(make_messages("build this"))  # type: ignore
+        assert digest != prompt_digest(make_messages("build that"))  # type: ignore
+
+        key = completion_cache_key(digest, Llm.GPT_4_1_2025_04_14)
+        assert key == completion_cache_key(digest, Llm.GPT_4_1_2025_04_14, 0)
+        assert key != completion_cache_key(digest, Llm.CLAUDE_4_5_OPUS_2025_11_01)
+        assert key != completion_cache_key(digest, Llm.GPT_4_1_2025_04_14, 1)
+
+
+class TestCompletionCache:
+    def test_round_trip_and_hit_rate(self, tmp_path: Path):
+        cache = CompletionCache(tmp_path, max_bytes=1024 * 1024)
+
+        assert cache.get("a") is None
+        cache.put("a", Llm.GPT_4_1_2025_04_14, "<html></html>")
+        assert cache.get("a") == "<html></html>"
+
+        assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+        assert cache.stats.hit_rate == 0.5
+        assert cache.stats.entries == 1
+
+    def test_least_recently_used_entries_are_evicted(self, tmp_path: Path):
+        cache = CompletionCache(tmp_path, max_bytes=1024 * 1024)
+        for index, key in enumerate(["a", "b"]):
+            cache.put(key, Llm.GPT_4_1_2025_04_14, "x" * 50)
+            os.utime(tmp_path / f"{key}.json", (index, index))
+        # Room for two entries only
+        cache.max_bytes = cache.stats.bytes + 10
+
+        # Reading "a" makes "b" the least recently used entry
+        assert cache.get("a") is not None
+        cache.put("c", Llm.GPT_4_1_2025_04_14, "x" * 50)
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+        assert cache.stats.entries == 2
+
+    def test_existing_entries_are_found_after_restart(self, tmp_path: Path):
+        CompletionCache(tmp_path, max_bytes=1024).put(
+            "a", Llm.GPT_4_1_2025_04_14, "<html></html>"
+        )
+
+        cache = CompletionCache(tmp_path, max_bytes=1024)
+        assert cache.get("a") == "<html></html>"
+        assert cache.stats.entries == 1
+
+
+@pytest.mark.asyncio
+async def test_replay_streams_completion_in_chunks():
+    chunks: List[str] = []
+
+    async def callback(chunk: str) -> None:
+        chunks.append(chunk)
+
+    code = "x" * 1200
+    await replay_completion(code, callback, chars_per_second=1_000_000)
+
+    assert "".join(chunks) == code
+    assert len(chunks) == 3
@@ -0,0 +1,291 @@
+import asyncio
+from typing import Any, Awaitable, Callable, List, Tuple
+
+import pytest
+
+from codegen.edit_blocks import (
+    EditApplyError,
+    EditStream,
+    apply_edit_blocks,
+    find_anchor,
+    parse_edit_blocks,
+    validate_document,
+)
+from llm import Completion, Llm
+from prompts.edit_prompts import EDIT_BLOCK_INSTRUCTIONS, with_edit_instructions
+from routes.generate_code import ParallelGenerationStage
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+  <style>
+    header { color: red; }
+  </style>
+</head>
+<body>
+  <header>
+    <h1>Jane Doe</h1>
+  </header>
+  <section class="projects">
+    <h2>Projects</h2>
+  </section>
+  <section class="awards">
+    <h2>Awards</h2>
+  </section>
+</body>
+</html>"""
+
+
+def edit(search: str, replace: str) -> str:
+    return f"<<<<<<< SEARCH\n{search}\n=======\n{replace}\n>>>>>>> REPLACE\n"
+
+
+BLUE_HEADER = edit("    header { color: red; }", "    header { color: blue; }")
+
+
+class TestParseEditBlocks:
+    def test_blocks_are_parsed_in_order(self):
+        text = "Here you go:\n" + BLUE_HEADER + edit("<h1>Jane Doe</h1>", "")
+
+        blocks = parse_edit_blocks(text)
+
+        assert [(b.search, b.replace) for b in blocks] == [
+            ("    header { color: red; }", "    header { color: blue; }"),
+            ("<h1>Jane Doe</h1>", ""),
+        ]
+
+    def test_incomplete_blocks_are_ignored(self):
+        assert parse_edit_blocks(BLUE_HEADER[:-10]) == []
+
+
+class TestFindAnchor:
+    def test_exact_match(self):
+        start, end = find_anchor(PAGE, "<h1>Jane Doe</h1>")
+
+        assert PAGE[start:end] == "<h1>Jane Doe</h1>"
+
+    def test_indentation_is_ignored(self):
+        search = "<header>\n<h1>Jane Doe</h1>\n</header>"
+
+        start, end = find_anchor(PAGE, search)
+
+        assert PAGE[start:end] == "  <header>\n    <h1>Jane Doe</h1>\n  </header>"
+
+    def test_close_lines_are_matched(self):
+        search = '<section class="project">\n  <h2>Projects</h2>'
+
+        start, end = find_anchor(PAGE, search)
+
+        assert PAGE[start:end] == '  <section class="projects">\n    <h2>Projects</h2>'
+
+    def test_ambiguous_and_missing_searches_raise(self):
+        with pytest.raises(EditApplyError, match="matches 2 places"):
+            find_anchor(PAGE, "</section>")
+        with pytest.raises(EditApplyError, match="not found"):
+            find_anchor(PAGE, "<footer>Contact</footer>")
+        with pytest.raises(EditApplyError, match="Empty"):
+            find_anchor(PAGE, "\n")
+
+
+class TestApplyEditBlocks:
+    def test_blocks_apply_to_the_result_of_the_previous_ones(self):
+        text = edit("<h2>Awards</h2>", "<h2>Prizes</h2>") + edit(
+            "<h2>Prizes</h2>", "<h2>Honours</h2>"
+        )
+
+        patched = apply_edit_blocks(PAGE, parse_edit_blocks(text))
+
+        assert "<h2>Honours</h2>" in patched and "Awards" not in patched
+
+    def test_unbalanced_results_are_rejected(self):
+        patched = PAGE.replace("</body>", "")
+
+        with pytest.raises(EditApplyError, match="<body>"):
+            validate_document(PAGE, patched)
+        with pytest.raises(EditApplyError):
+            validate_document(PAGE, " ")
+        validate_document(PAGE, PAGE.replace("Awards", "Prizes"))
+
+
+class TestEditStream:
+    @pytest.mark.parametrize("chunk_size", [1, 7, 1000])
+    def test_edits_apply_as_they_complete(self, chunk_size: int):
+        text = BLUE_HEADER + edit("<h2>Awards</h2>", "<h2>Prizes</h2>")
+        edits = EditStream(PAGE)
+
+        changes = [
+            edits.feed(text[start : start + chunk_size])
+            for start in range(0, len(text), chunk_size)
+        ]
+
+        assert sum(changes) == (1 if chunk_size == 1000 else 2)
+        assert edits.blocks == 2
+        assert edits.finish() == PAGE.replace("red", "blue").replace("Awards", "Prizes")
+
+    def test_a_whole_document_is_taken_as_is(self):
+        edits = EditStream(PAGE)
+        edits.feed("```html\n" + PAGE.replace("Awards", "Prizes"))
+        edits.feed("\n```")
+
+        assert edits.is_full_document
+        assert edits.finish() == PAGE.replace("Awards", "Prizes")
+
+    def test_responses_without_edits_fail(self):
+        edits = EditStream(PAGE)
+        edits.feed("Sure, the header is now blue.")
+
+        with pytest.raises(EditApplyError):
+            edits.finish()
+
+
+class TestEditInstructions:
+    def test_instructions_are_appended_to_the_last_user_message(self):
+        messages: Any = [
+            {"role": "system", "content": "You are a web developer."},
+            {"role": "assistant", "content": PAGE},
+            {"role": "user", "content": [{"type": "text", "text": "Make it blue"}]},
+        ]
+
+        edited = with_edit_instructions(messages)
+
+        assert edited[:2] == messages[:2]
+        assert edited[2]["content"] == [
+            {"type": "text", "text": "Make it blue"},
+            {"type": "text", "text": EDIT_BLOCK_INSTRUCTIONS},
+        ]
+        assert len(messages[2]["content"]) == 1
+
+
+MESSAGES: Any = [
+    {"role": "system", "content": "You are a web developer."},
+    {"role": "user", "content": "Make a portfolio"},
+    {"role": "assistant", "content": PAGE},
+    {"role": "user", "content": "Make the header blue"},
+]
+
+
+def make_stage(
+    messages: List[Tuple[str, str, int]], responses: List[str]
+) -> Tuple[ParallelGenerationStage, List[Any]]:
+    async def send_message(type: str, value: str, variant_index: int) -> None:
+        messages.append((type, value, variant_index))
+
+    stage = ParallelGenerationStage(
+        send_message=send_message,  # type: ignore
+        openai_api_key=None,
+        openai_base_url=None,
+        anthropic_api_key=None,
+        gemini_api_key=None,
+        should_generate_images=False,
+        input_mode="image",
+        generation_type="update",
+        prompt={"text": "", "images": []},
+        cancel_event=asyncio.Event(),
+        update_mode="edit",
+    )
+    prompts: List[Any] = []
+
+    async def stream_model(
+        model: Llm,
+        index: int,
+        prompt_messages: Any,
+        callback: Callable[[str], Awaitable[None]],
+    ) -> Completion:
+        prompts.append(prompt_messages)
+        response = responses.pop(0)
+        for start in range(0, len(response), 16):
+            await callback(response[start : start + 16])
+        return {
+            "duration": 1.0,
+            "code": response,
+            "usage": {"input_tokens": 1000, "output_tokens": len(response) // 4},
+        }
+
+    stage._stream_model = stream_model  # type: ignore
+    return stage, prompts
+
+
+class TestEditModeGeneration:
+    @pytest.mark.asyncio
+    async def test_edits_are_applied_and_sent_as_code(self):
+        messages: List[Tuple[str, str, int]] = []
+        stage, prompts = make_stage(messages, [BLUE_HEADER])
+
+        completion = await stage._generate(Llm.GPT_4_1_2025_04_14, 0, MESSAGES)
+
+        assert completion["code"] == PAGE.replace("red", "blue")
+        assert messages == [("setCode", PAGE.replace("red", "blue"), 0)]
+        assert prompts == [with_edit_instructions(MESSAGES)]
+
+    @pytest.mark.asyncio
+    async def test_failed_edits_fall_back_to_full_regeneration(self):
+        messages: List[Tuple[str, str, int]] = []
+        regenerated = PAGE.replace("red", "blue")
+        broken = edit("<footer>Contact</footer>", "")
+        stage, prompts = make_stage(messages, [broken, regenerated])
+
+        completion = await stage._generate(Llm.GPT_4_1_2025_04_14, 0, MESSAGES)
+
+        assert completion["code"] == regenerated
+        assert prompts == [with_edit_instructions(MESSAGES), MESSAGES]
+        types = [type for type, _, _ in messages]
+        assert types[:2] == ["status", "setCode"] and messages[1][1] == ""
+        assert set(types[2:]) == {"chunk"}
+        assert "".join(value for _, value, _ in messages[2:]) == regenerated
+
+    @pytest.mark.asyncio
+    async def test_code_is_sent_at_most_once_per_interval(self):
+        messages: List[Tuple[str, str, int]] = []
+        blocks = BLUE_HEADER + edit("<h2>Awards</h2>", "<h2>Prizes</h2>")
+        stage, _ = make_stage(messages, [blocks + edit("Prizes", "Honours")])
+
+        completion = await stage._generate(Llm.GPT_4_1_2025_04_14, 0, MESSAGES)
+
+        final = PAGE.replace("red", "blue").replace("Awards", "Honours")
+        # The first edit is sent at once; the rest land within the interval
+        # and are sent together when the response ends
+        assert messages == [
+            ("setCode", PAGE.replace("red", "blue"), 0),
+            ("setCode", final, 0),
+        ]
+        assert completion["code"] == final
+
+    @pytest.mark.asyncio
+    async def test_edits_failing_mid_stream_still_count_their_usage(self):
+        messages: List[Tuple[str, str, int]] = []
+        broken = edit("<footer>Contact</footer>", "") + "x" * 400
+        stage, _ = make_stage(messages, [broken, PAGE])
+
+        completion = await stage._generate(Llm.GPT_4_1_2025_04_14, 0, MESSAGES)
+
+        usage = completion.get("usage")
+        assert usage is not None
+        # The regeneration's usage plus an estimate for the edit attempt,
+        # which raised before the provider reported any
+        assert usage["input_tokens"] > 1000
+        assert usage["output_tokens"] > len(PAGE) // 4
+
+    @pytest.mark.asyncio
+    async def test_invalid_edits_fall_back_and_usage_adds_up(self):
+        messages: List[Tuple[str, str, int]] = []
+        unbalanced = edit("</body>", "")
+        stage, _ = make_stage(messages, [unbalanced, PAGE])
+
+        completion = await stage._generate(Llm.GPT_4_1_2025_04_14, 0, MESSAGES)
+
+        assert completion["code"] == PAGE
+        assert completion.get("usage") == {
+            "input_tokens": 2000,
+            "output_tokens": len(unbalanced) // 4 + len(PAGE) // 4,
+        }
+
+    @pytest.mark.asyncio
+    async def test_full_mode_regenerates_the_document(self):
+        messages: List[Tuple[str, str, int]] = []
+        stage, prompts = make_stage(messages, [PAGE])
+        stage.update_mode = "full"
+
+        await stage._generate(Llm.GPT_4_1_2025_04_14, 0, MESSAGES)
+
+        assert prompts == [MESSAGES]
+        assert {type for type, _, _ in messages} == {"chunk"}
@@ -0,0 +1,93 @@
+import asyncio
+from typing import Any, Coroutine, List, Tuple
+
+import pytest
+
+from llm import Completion, Llm
+from routes.generate_code import ParallelGenerationStage
+
+MODELS = [Llm.GPT_4_1_2025_04_14, Llm.CLAUDE_4_5_SONNET_2025_09_29, Llm.CLAUDE_4_5_OPUS_2025_11_01]
+
+
+def make_stage(
+    messages: List[Tuple[str, str, int]], **kwargs: Any
+) -> ParallelGenerationStage:
+    async def send_message(type: str, value: str, variant_index: int) -> None:
+        messages.append((type, value, variant_index))
+
+    return ParallelGenerationStage(
+        send_message=send_message,  # type: ignore
+        openai_api_key=None,
+        openai_base_url=None,
+        anthropic_api_key=None,
+        gemini_api_key=None,
+        should_generate_images=False,
+        input_mode="text",
+        generation_type="create",
+        prompt={"text": "", "images": []},
+        stack="astro_blog",
+        cancel_event=asyncio.Event(),
+        **kwargs,
+    )
+
+
+def variants_with_delays(*delays: float):
+    async def variant(index: int, delay: float) -> Completion:
+        await asyncio.sleep(delay)
+        return {"duration": delay, "code": f"<html>{index}</html>"}
+
+    def create_tasks(*_: Any) -> List[Coroutine[Any, Any, Completion]]:
+        return [variant(index, delay) for index, delay in enumerate(delays)]
+
+    return create_tasks
+
+
+class TestFirstKVariants:
+    """Test completing a generation once K variants have finished."""
+
+    @pytest.mark.asyncio
+    async def test_stragglers_are_cancelled(self):
+        messages: List[Tuple[str, str, int]] = []
+        stage = make_stage(messages, first_k=2, straggler_policy="cancel")
+        stage._create_generation_tasks = variants_with_delays(0, 0.01, 10)  # type: ignore
+
+        completions = await asyncio.wait_for(
+            stage.process_variants(MODELS, [], {}, {}), timeout=1
+        )
+
+        assert sorted(completions) == [0, 1]
+        assert ("variantCancelled", "First 2 variants complete", 2) in messages
+        types = [type for type, _, _ in messages]
+        assert types.index("generationComplete") < types.index("variantCancelled")
+        assert not any(type == "setCode" and index == 2 for type, _, index in messages)
+
+    @pytest.mark.asyncio
+    async def test_stragglers_finishing_before_the_deadline_are_kept(self):
+        messages: List[Tuple[str, str, int]] = []
+        stage = make_stage(
+            messages,
+            first_k=1,
+            straggler_policy="deadline",
+            straggler_deadline_seconds=1,
+        )
+        stage._create_generation_tasks = variants_with_delays(0, 0.02, 10)  # type: ignore
+
+        completions = await asyncio.wait_for(
+            stage.process_variants(MODELS, [], {}, {}), timeout=2
+        )
+
+        assert sorted(completions) == [0, 1]
+        types = [type for type, _, _ in messages]
+        assert types.index("generationComplete") < types.index("variantCancelled")
+        assert ("variantCancelled", "First 1 variants complete", 2) in messages
+
+    @pytest.mark.asyncio
+    async def test_waits_for_all_variants_without_first_k(self):
+        messages: List[Tuple[str, str, int]] = []
+        stage = make_stage(messages)
+        stage._create_generation_tasks = variants_with_delays(0, 0.01, 0.02)  # type: ignore
+
+        completions = await stage.process_variants(MODELS, [], {}, {})
+
+        assert sorted(completions) == [0, 1, 2]
+        assert not any(type == "variantCancelled" for type, _, _ in messages)
@@ -0,0 +1,71 @@
+import asyncio
+from typing import Any, Coroutine, Dict, List
+
+import pytest
+
+from llm import Completion, Llm
+from metrics.cancellation import get_cancellation_stats
+from routes.generate_code import ParallelGenerationStage
+
+
+def make_stage(cancel_event: asyncio.Event) -> ParallelGenerationStage:
+    async def send_message(type: str, value: str, variant_index: int) -> None:
+        pass
+
+    return ParallelGenerationStage(
+        send_message=send_message,  # type: ignore
+        openai_api_key=None,
+        openai_base_url=None,
+        anthropic_api_key=None,
+        gemini_api_key=None,
+        should_generate_images=False,
+        input_mode="text",
+        generation_type="create",
+        prompt={"text": "", "images": []},
+        stack="astro_blog",
+        cancel_event=cancel_event,
+    )
+
+
+@pytest.mark.asyncio
+async def test_disconnect_cancels_in_flight_variants():
+    cancel_event = asyncio.Event()
+    stage = make_stage(cancel_event)
+    cancelled: List[int] = []
+
+    async def fast_variant() -> Completion:
+        await stage._process_chunk("<html></html>", 0)
+        return {"duration": 0.0, "code": "<html></html>"}
+
+    async def slow_variant() -> Completion:
+        try:
+            while True:
+                await stage._process_chunk("token ", 1)
+                await asyncio.sleep(0.01)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    def create_tasks(*_: Any) -> List[Coroutine[Any, Any, Completion]]:
+        return [fast_variant(), slow_variant()]
+
+    stage._create_generation_tasks = create_tasks  # type: ignore
+
+    async def disconnect_soon() -> None:
+        await asyncio.sleep(0.05)
+        cancel_event.set()
+
+    stats_before = get_cancellation_stats()
+    asyncio.create_task(disconnect_soon())
+    completions: Dict[int, str] = await asyncio.wait_for(
+        stage.process_variants(
+            [Llm.GPT_4_1_2025_04_14, Llm.CLAUDE_4_5_OPUS_2025_11_01], [], {}, {}
+        ),
+        timeout=1,
+    )
+
+    assert completions == {0: "<html></html>"}
+    assert cancelled == [1]
+    stats_after = get_cancellation_stats()
+    assert stats_after.cancelled_variants == stats_before.cancelled_variants + 1
+    assert stats_after.tokens_streamed > stats_before.tokens_streamed
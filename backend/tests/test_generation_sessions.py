@@ -0,0 +1,152 @@
+import asyncio
+from typing import List, Tuple
+
+import pytest
+
+from ws.sessions import GenerationSession, VariantReplayBuffer, create_session, get_session
+
+
+class FakeCommunicator:
+    """Stands in for WebSocketCommunicator and records sent messages."""
+
+    def __init__(self):
+        self.messages: List[Tuple[str, str, int]] = []
+        self.disconnected = asyncio.Event()
+
+    async def send_message(self, type: str, value: str, variantIndex: int) -> None:
+        self.messages.append((type, value, variantIndex))
+
+    async def throw_error(self, message: str) -> None:
+        self.messages.append(("error", message, 0))
+
+
+class TestVariantReplayBuffer:
+    def test_text_since_offset(self):
+        buffer = VariantReplayBuffer(max_bytes=1024)
+        for chunk in ["<html>", "<body>", "</body>"]:
+            buffer.append(chunk)
+
+        assert buffer.text_since(0) == "<html><body></body>"
+        assert buffer.text_since(8) == "ody></body>"
+        assert buffer.text_since(buffer.end_offset) == ""
+
+    def test_offsets_count_utf16_code_units(self):
+        buffer = VariantReplayBuffer(max_bytes=1024)
+        buffer.append("a😀")  # The emoji is two UTF-16 code units
+        buffer.append("b")
+
+        assert buffer.end_offset == 4
+        assert buffer.text_since(3) == "b"
+
+    def test_evicted_offsets_cannot_be_replayed(self):
+        buffer = VariantReplayBuffer(max_bytes=4)
+        for chunk in ["aaa", "bbb", "ccc"]:
+            buffer.append(chunk)
+
+        assert buffer.start_offset == 6
+        assert buffer.text_since(3) is None
+        assert buffer.text_since(7) == "cc"
+
+
+class TestGenerationSession:
+    @pytest.mark.asyncio
+    async def test_reconnected_client_gets_missed_output_then_live(self):
+        session = GenerationSession()
+        first = FakeCommunicator()
+        await session.attach(first)  # type: ignore
+
+        await session.send_message("variantCount", "2", 0)
+        await session.send_message("chunk", "<html>", 0)
+        await session.send_message("chunk", "<div>", 1)
+
+        first.disconnected.set()
+        await asyncio.sleep(0)
+        await session.send_message("chunk", "<body>", 0)
+        await session.send_message("setCode", "<div></div>", 1)
+
+        second = FakeCommunicator()
+        await session.attach(second, {0: 6, 1: 5})  # type: ignore
+        await session.send_message("chunk", "</body>", 0)
+
+        assert second.messages == [
+            ("variantCount", "2", 0),
+            ("chunk", "<body>", 0),
+            ("setCode", "<div></div>", 1),
+            ("chunk", "</body>", 0),
+        ]
+        assert not session.abandoned.is_set()
+        session.finish()
+
+    @pytest.mark.asyncio
+    async def test_session_is_abandoned_after_grace_period(self):
+        session = GenerationSession(resume_grace_seconds=0.01)
+        comm = FakeCommunicator()
+        await session.attach(comm)  # type: ignore
+
+        comm.disconnected.set()
+        await asyncio.wait_for(session.abandoned.wait(), 1)
+        session.finish()
+
+    @pytest.mark.asyncio
+    async def test_registry_lookup(self):
+        session = create_session()
+        assert get_session(session.id) is session
+        assert get_session("missing") is None
+        session.finish()
+
+    @pytest.mark.asyncio
+    async def test_gapped_variant_streams_again_after_set_code(self):
+        session = GenerationSession(replay_buffer_bytes=4)
+        first = FakeCommunicator()
+        await session.attach(first)  # type: ignore
+        for chunk in ["aaa", "bbb", "ccc"]:
+            await session.send_message("chunk", chunk, 0)
+        first.disconnected.set()
+        await asyncio.sleep(0)
+
+        second = FakeCommunicator()
+        await session.attach(second, {0: 1})  # type: ignore
+        await session.send_message("chunk", "withheld", 0)
+        await session.send_message("setCode", "<html></html>", 0)
+        await session.send_message("chunk", "<p>", 0)
+
+        assert [(type, value) for type, value, _ in second.messages[1:]] == [
+            ("setCode", "<html></html>"),
+            ("chunk", "<p>"),
+        ]
+        assert second.messages[0][0] == "status"
+        session.finish()
+
+    @pytest.mark.asyncio
+    async def test_resume_during_edit_fallback_replays_the_latest_code(self):
+        session = GenerationSession()
+        first = FakeCommunicator()
+        await session.attach(first)  # type: ignore
+        # Edits applied, then failed, then the page is regenerated
+        await session.send_message("setCode", "<html>v1</html>", 0)
+        await session.send_message("setCode", "<html>v2</html>", 0)
+        await session.send_message("status", "Regenerating...", 0)
+        await session.send_message("setCode", "", 0)
+        await session.send_message("chunk", "<html>", 0)
+        first.disconnected.set()
+        await asyncio.sleep(0)
+        await session.send_message("chunk", "<body>", 0)
+
+        second = FakeCommunicator()
+        await session.attach(second, {0: 6})  # type: ignore
+        await session.send_message("chunk", "</body></html>", 0)
+        await session.send_message("setCode", "<html><body></body></html>", 0)
+        await session.send_message("variantComplete", "done", 0)
+
+        assert second.messages == [
+            ("setCode", "", 0),
+            ("chunk", "<html><body>", 0),
+            ("chunk", "</body></html>", 0),
+            ("setCode", "<html><body></body></html>", 0),
+            ("variantComplete", "done", 0),
+        ]
+        buffer = session.buffers[0]
+        assert buffer.code == "<html><body></body></html>"
+        assert buffer.final_messages == [("variantComplete", "done")]
+        assert buffer.buffered_bytes == 0
+        session.finish()
@@ -0,0 +1,190 @@
+import asyncio
+from typing import Any, List
+
+import pytest
+
+import routes.generate_code as generate_code
+from llm import Llm
+from prompts import create_prompt
+from prompts.history_compaction import compact_history, fit_to_token_budget
+from routes.generate_code import ParallelGenerationStage
+from usage.estimate import count_input_tokens
+
+SCREENSHOT = "data:image/png;base64,screenshot"
+REFERENCE = "data:image/png;base64,reference"
+
+
+def page(title: str, sections: int, color: str = "red") -> str:
+    body = "\n".join(
+        f'<section class="p-8">\n<h2>Section {i}</h2>\n<p>{"Lorem ipsum " * 40}</p>\n</section>'
+        for i in range(sections)
+    )
+    return (
+        f"<html>\n<head><title>{title}</title></head>\n"
+        f'<body class="bg-{color}-500">\n<h1>{title}</h1>\n{body}\n</body>\n</html>'
+    )
+
+
+def user(text: str, *images: str) -> Any:
+    return {
+        "role": "user",
+        "content": [
+            *({"type": "image_url", "image_url": {"url": url}} for url in images),
+            {"type": "text", "text": text},
+        ],
+    }
+
+
+def image_urls(message: Any) -> List[str]:
+    content = message["content"]
+    if isinstance(content, str):
+        return []
+    return [part["image_url"]["url"] for part in content if part["type"] == "image_url"]
+
+
+V1 = page("Acme", 10)
+V2 = page("Acme", 10, color="blue")
+V3 = page("Acme", 11, color="blue")
+
+MESSAGES: List[Any] = [
+    {"role": "system", "content": "You are a web developer."},
+    user("Make this page", SCREENSHOT),
+    {"role": "assistant", "content": V1},
+    user("Make the background blue", SCREENSHOT),
+    {"role": "assistant", "content": V2},
+    user("Add a section", SCREENSHOT, REFERENCE),
+    {"role": "assistant", "content": V3},
+    user("Make the header bigger", REFERENCE),
+]
+
+
+class TestCompactHistory:
+    def test_only_the_latest_code_is_kept_verbatim(self):
+        compacted = compact_history(MESSAGES, summary_min_chars=1000)
+
+        assert compacted[6]["content"] == V3
+        first, second = compacted[2]["content"], compacted[4]["content"]
+        assert "earlier version" in first and "Title: Acme." in first
+        assert "Headings: Acme; Section 0" in first
+        assert "-<body class=\"bg-red-500\">" in second
+        assert "+<body class=\"bg-blue-500\">" in second
+        assert len(first) < 500 and len(second) < 500
+
+    def test_small_code_is_kept(self):
+        compacted = compact_history(MESSAGES, summary_min_chars=len(V3))
+
+        assert [m["content"] for m in compacted[2:7:2]] == [V1, V2, V3]
+
+    def test_images_are_sent_once(self):
+        compacted = compact_history(MESSAGES)
+
+        assert [image_urls(m) for m in compacted] == [
+            [],
+            [SCREENSHOT],
+            [],
+            [],
+            [],
+            [REFERENCE],
+            [],
+            [],
+        ]
+        # The instructions are kept
+        assert compacted[7]["content"][-1]["text"] == "Make the header bigger"
+
+    def test_compaction_is_deterministic_and_leaves_the_input_alone(self):
+        original = [dict(m) for m in MESSAGES]
+
+        assert compact_history(MESSAGES) == compact_history(MESSAGES)
+        assert MESSAGES == original
+
+
+class TestTokenBudget:
+    @staticmethod
+    def count(messages: List[Any]) -> int:
+        return count_input_tokens(Llm.CLAUDE_4_5_SONNET_2025_09_29, messages)
+
+    def test_prompts_within_budget_are_unchanged(self):
+        assert fit_to_token_budget(MESSAGES, 10**6, self.count) is MESSAGES
+
+    def test_older_images_are_dropped_first(self):
+        without_older_images = [
+            *MESSAGES[:3],
+            user("Make the background blue"),
+            MESSAGES[4],
+            user("Add a section"),
+            *MESSAGES[6:],
+        ]
+
+        fitted = fit_to_token_budget(
+            MESSAGES, self.count(without_older_images), self.count
+        )
+
+        assert fitted == without_older_images
+
+    def test_oldest_turns_are_dropped_next(self):
+        without_first_turn = [
+            *MESSAGES[:2],
+            MESSAGES[4],
+            user("Add a section"),
+            *MESSAGES[6:],
+        ]
+
+        fitted = fit_to_token_budget(
+            MESSAGES, self.count(without_first_turn), self.count
+        )
+
+        assert fitted == without_first_turn
+
+    def test_the_request_and_latest_code_are_always_kept(self):
+        fitted = fit_to_token_budget(MESSAGES, 1, self.count)
+
+        assert fitted == [*MESSAGES[:2], *MESSAGES[6:]]
+
+
+class TestUpdatePrompt:
+    @pytest.mark.asyncio
+    async def test_update_prompts_are_compacted(self):
+        history = [
+            {"text": V1, "images": []},
+            {"text": "Make the background blue", "images": [SCREENSHOT]},
+            {"text": V2, "images": []},
+            {"text": "Add a section", "images": [SCREENSHOT]},
+        ]
+
+        messages, _ = await create_prompt(
+            stack="astro_blog",
+            input_mode="image",
+            generation_type="update",
+            prompt={"text": "", "images": [SCREENSHOT]},
+            history=history,
+            is_imported_from_code=False,
+        )
+
+        assert messages[2]["content"] != V1
+        assert messages[4]["content"] == V2
+        assert [len(image_urls(m)) for m in messages] == [0, 1, 0, 0, 0, 0]
+
+
+class TestModelBudgets:
+    def test_each_model_gets_its_own_budget(self, monkeypatch: pytest.MonkeyPatch):
+        small = Llm.GPT_4_1_2025_04_14
+        large = Llm.CLAUDE_4_5_SONNET_2025_09_29
+        monkeypatch.setattr(generate_code, "HISTORY_TOKEN_BUDGET", 10**6)
+        monkeypatch.setattr(generate_code, "HISTORY_TOKEN_BUDGETS", {small.value: 100})
+        stage = ParallelGenerationStage(
+            send_message=None,  # type: ignore
+            openai_api_key=None,
+            openai_base_url=None,
+            anthropic_api_key=None,
+            gemini_api_key=None,
+            should_generate_images=False,
+            input_mode="image",
+            generation_type="update",
+            prompt={"text": "", "images": []},
+            cancel_event=asyncio.Event(),
+        )
+
+        assert stage._prompt_for(large, MESSAGES) is MESSAGES
+        fitted = stage._prompt_for(small, MESSAGES)
+        assert len(fitted) < len(MESSAGES)
+        assert stage._prompt_for(small, MESSAGES) is fitted
@@ -0,0 +1,255 @@
+import asyncio
+import os
+import time
+import weakref
+from pathlib import Path
+from typing import Dict, List
+
+import pytest
+
+import image_generation.asset_store as asset_store_module
+import image_generation.cache as cache_module
+import image_generation.coordinator as coordinator_module
+import image_generation.core as core
+from image_generation.cache import (
+    ImageGenerationCache,
+    image_cache_key,
+    normalize_alt_text,
+)
+from image_generation.coordinator import ImageGenerationCoordinator
+
+
+class TestImageCacheKey:
+    def test_alt_text_is_normalized(self):
+        assert normalize_alt_text("  Company   logo\n") == "company logo"
+        assert image_cache_key("dalle3", "Company logo", "1024x1024") == image_cache_key(
+            "dalle3", "company  LOGO ", "1024x1024"
+        )
+
+    def test_key_depends_on_model_and_dimensions(self):
+        key = image_cache_key("dalle3", "Company logo", "1024x1024")
+        assert key != image_cache_key("flux", "Company logo", "1024x1024")
+        assert key != image_cache_key("dalle3", "Company logo", "1792x1024")
+        assert key != image_cache_key("dalle3", "Team photo", "1024x1024")
+
+
+class TestImageGenerationCache:
+    def test_put_and_get(self, tmp_path: Path):
+        cache = ImageGenerationCache(tmp_path, max_entries=10, ttl_seconds=60)
+        key = image_cache_key("flux", "Company logo", "1:1")
+
+        assert cache.get(key) is None
+        cache.put(key, "flux", "Company logo", "https://example.com/logo.png")
+
+        assert cache.get(key) == "https://example.com/logo.png"
+        assert (cache.stats.hits, cache.stats.misses, cache.stats.entries) == (1, 1, 1)
+        # Persists across instances (and processes)
+        other = ImageGenerationCache(tmp_path, max_entries=10, ttl_seconds=60)
+        assert other.get(key) == "https://example.com/logo.png"
+
+    def test_expired_entries_are_misses(self, tmp_path: Path):
+        cache = ImageGenerationCache(tmp_path, max_entries=10, ttl_seconds=0.01)
+        cache.put("key", "flux", "Company logo", "https://example.com/logo.png")
+        time.sleep(0.02)
+
+        assert cache.get("key") is None
+        assert cache.stats.expired == 1
+        assert cache.stats.entries == 0
+        assert not (tmp_path / "key.json").exists()
+
+    def test_stored_assets_outlive_the_provider_url_ttl(self, tmp_path: Path):
+        cache = ImageGenerationCache(tmp_path, max_entries=10, ttl_seconds=0.01)
+        url = asset_store_module.asset_url("a" * 64 + ".webp")
+        cache.put("key", "flux", "Company logo", url)
+        time.sleep(0.02)
+
+        assert cache.get("key") == url
+
+        cache.asset_ttl_seconds = 0.01
+        assert cache.get("key") is None
+        assert cache.stats.expired == 1
+
+    def test_least_recently_used_entries_are_evicted(self, tmp_path: Path):
+        cache = ImageGenerationCache(tmp_path, max_entries=2, ttl_seconds=60)
+        cache.put("first", "flux", "a", "https://example.com/a.png")
+        cache.put("second", "flux", "b", "https://example.com/b.png")
+        past = time.time() - 60
+        os.utime(tmp_path / "second.json", (past, past))
+        assert cache.get("first") is not None
+
+        cache.put("third", "flux", "c", "https://example.com/c.png")
+
+        assert cache.get("second") is None
+        assert cache.get("first") is not None
+        assert cache.get("third") is not None
+        assert cache.stats.entries == 2
+
+
+class TestProcessTasksCache:
+    @pytest.mark.asyncio
+    async def test_repeated_prompts_skip_generation(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        cache = ImageGenerationCache(tmp_path, max_entries=10, ttl_seconds=60)
+        monkeypatch.setattr(cache_module, "image_generation_cache", cache)
+        monkeypatch.setattr(core, "image_generation_cache", cache)
+        monkeypatch.setattr(cache_module, "IMAGE_CACHE_ENABLED", True)
+        monkeypatch.setattr(asset_store_module, "ASSET_STORE_ENABLED", False)
+
+        generated: List[str] = []
+
+        async def fake_dalle(prompt: str, api_key: str, base_url: str | None):
+            generated.append(prompt)
+            return None if prompt == "Broken" else f"https://example.com/{len(generated)}.png"
+
+        monkeypatch.setattr(core, "generate_image_dalle", fake_dalle)
+
+        first = await core.process_tasks(["Company logo", "Broken"], "key", None, "dalle3")
+        second = await core.process_tasks(["company logo", "Broken"], "key", None, "dalle3")
+
+        assert first[0] == second[0]
+        assert first[1] is None and second[1] is None
+        # Failures aren't cached
+        assert generated == ["Company logo", "Broken", "Broken"]
+        assert cache.stats.hits == 1
+
+    @pytest.mark.asyncio
+    async def test_evicted_assets_are_generated_again(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        cache = ImageGenerationCache(tmp_path / "cache", max_entries=10, ttl_seconds=60)
+        monkeypatch.setattr(core, "image_generation_cache", cache)
+        monkeypatch.setattr(cache_module, "image_generation_cache", cache)
+        monkeypatch.setattr(cache_module, "IMAGE_CACHE_ENABLED", True)
+        store = asset_store_module.AssetStore(tmp_path / "assets", [])
+        monkeypatch.setattr(asset_store_module, "asset_store", store)
+        evicted = asset_store_module.asset_url("a" * 64 + ".webp")
+        await cache_module.cache_image(
+            image_cache_key("dalle3", "Company logo", core.DALLE_IMAGE_SIZE),
+            "dalle3",
+            "Company logo",
+            evicted,
+        )
+        monkeypatch.setattr(asset_store_module, "ASSET_STORE_ENABLED", False)
+
+        async def fake_dalle(prompt: str, api_key: str, base_url: str | None):
+            return "https://example.com/new.png"
+
+        monkeypatch.setattr(core, "generate_image_dalle", fake_dalle)
+
+        assert await core.process_tasks(["Company logo"], "key", None, "dalle3") == [
+            "https://example.com/new.png"
+        ]
+
+
+class TestImageGenerationCoordinator:
+    @pytest.fixture(autouse=True)
+    def disable_image_cache(self, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(cache_module, "IMAGE_CACHE_ENABLED", False)
+        monkeypatch.setattr(asset_store_module, "ASSET_STORE_ENABLED", False)
+
+    @pytest.mark.asyncio
+    async def test_variants_share_in_flight_generations(
+        self, monkeypatch: pytest.MonkeyPatch
+    ):
+        generated: List[str] = []
+
+        async def fake_dalle(prompt: str, api_key: str, base_url: str | None):
+            generated.append(prompt)
+            await asyncio.sleep(0.01)
+            return f"https://example.com/{prompt}.png"
+
+        monkeypatch.setattr(core, "generate_image_dalle", fake_dalle)
+        coordinator = ImageGenerationCoordinator()
+
+        results = await asyncio.gather(
+            *(
+                core.process_tasks(
+                    ["Company logo", "Team photo"], "key", None, "dalle3", coordinator
+                )
+                for _ in range(4)
+            )
+        )
+
+        assert sorted(generated) == ["Company logo", "Team photo"]
+        assert all(result == results[0] for result in results)
+        assert coordinator.requested == 8
+        assert coordinator.calls_saved == 6
+
+        # Later variants reuse finished generations too
+        await core.process_tasks(["Company logo"], "key", None, "dalle3", coordinator)
+        assert len(generated) == 2
+        assert coordinator.calls_saved == 7
+
+    @pytest.mark.asyncio
+    async def test_cancelled_variant_does_not_cancel_shared_generation(self):
+        coordinator = ImageGenerationCoordinator()
+        release = asyncio.Event()
+
+        async def generate():
+            await release.wait()
+            return "https://example.com/logo.png"
+
+        first = asyncio.create_task(coordinator.generate("logo", generate))
+        second = asyncio.create_task(coordinator.generate("logo", generate))
+        await asyncio.sleep(0)
+        first.cancel()
+        release.set()
+
+        assert await second == "https://example.com/logo.png"
+
+    @pytest.mark.asyncio
+    async def test_provider_calls_are_bounded(self, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(coordinator_module, "IMAGE_GENERATION_MAX_CONCURRENCY", 2)
+        monkeypatch.setattr(coordinator_module, "_global_slots", weakref.WeakKeyDictionary())
+        running = 0
+        max_running = 0
+
+        async def fake_dalle(prompt: str, api_key: str, base_url: str | None):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return f"https://example.com/{prompt}.png"
+
+        monkeypatch.setattr(core, "generate_image_dalle", fake_dalle)
+
+        results = await core.process_tasks(
+            [f"image {i}" for i in range(6)], "key", None, "dalle3"
+        )
+
+        assert all(results)
+        assert max_running == 2
+
+    @pytest.mark.asyncio
+    async def test_one_request_cannot_take_every_slot(
+        self, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(coordinator_module, "IMAGE_GENERATION_MAX_CONCURRENCY", 3)
+        monkeypatch.setattr(coordinator_module, "_global_slots", weakref.WeakKeyDictionary())
+        running: Dict[str, int] = {"large": 0, "small": 0}
+        max_running: Dict[str, int] = {"large": 0, "small": 0}
+
+        async def fake_dalle(prompt: str, api_key: str, base_url: str | None):
+            request = prompt.split()[0]
+            running[request] += 1
+            max_running[request] = max(max_running[request], running[request])
+            await asyncio.sleep(0.01)
+            running[request] -= 1
+            return f"https://example.com/{prompt}.png"
+
+        monkeypatch.setattr(core, "generate_image_dalle", fake_dalle)
+        large = ImageGenerationCoordinator(max_concurrency=2)
+        small = ImageGenerationCoordinator(max_concurrency=2)
+
+        await asyncio.gather(
+            core.process_tasks(
+                [f"large {i}" for i in range(8)], "key", None, "dalle3", large
+            ),
+            core.process_tasks(["small 0"], "key", None, "dalle3", small),
+        )
+
+        # The large page never holds more than its own slots, so the small
+        # one gets a global slot right away
+        assert max_running == {"large": 2, "small": 1}
@@ -0,0 +1,111 @@
+import asyncio
+from typing import Any, Coroutine, List, Tuple
+
+import pytest
+
+import image_generation.asset_store as asset_store_module
+import image_generation.cache as cache_module
+import image_generation.core as core
+import routes.generate_code as generate_code
+from image_generation.scanner import PlaceholderImageScanner
+from llm import Completion, Llm
+from routes.generate_code import ParallelGenerationStage
+
+PAGE = (
+    '<html><body><img src="https://example.com/real.png" alt="Real photo">'
+    '<img class="a>b" src="https://placehold.co/300x200" alt="Company logo">'
+    "<p>text</p><IMG ALT='Team &amp; friends' SRC='https://placehold.co/64x64'>"
+    '<img src="https://placehold.co/10x10" alt="Company logo"></body></html>'
+)
+
+
+def feed_in_chunks(text: str, size: int) -> List[str]:
+    scanner = PlaceholderImageScanner()
+    alts: List[str] = []
+    for start in range(0, len(text), size):
+        alts.extend(scanner.feed(text[start : start + size]))
+    return alts
+
+
+class TestPlaceholderImageScanner:
+    @pytest.mark.parametrize("chunk_size", [1, 3, 7, 50, len(PAGE)])
+    def test_finds_placeholder_images_across_chunks(self, chunk_size: int):
+        assert feed_in_chunks(PAGE, chunk_size) == ["Company logo", "Team & friends"]
+
+    def test_reports_tags_once_complete(self):
+        scanner = PlaceholderImageScanner()
+        assert scanner.feed('<img src="https://placehold.co/1x1" alt="Lo') == []
+        assert scanner.feed('go">') == ["Logo"]
+        assert scanner.feed("<p>more</p>") == []
+
+    def test_skips_malformed_tags(self):
+        scanner = PlaceholderImageScanner()
+        assert scanner.feed('<img alt="never closed ' + "x" * 10000) == []
+        assert scanner.feed('<img src="https://placehold.co/1x1" alt="Logo">') == [
+            "Logo"
+        ]
+
+
+class TestImagePrefetch:
+    @pytest.mark.asyncio
+    async def test_images_start_generating_while_streaming(
+        self, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(generate_code, "REPLICATE_API_KEY", None)
+        monkeypatch.setattr(generate_code, "IMAGE_PREFETCH_ENABLED", True)
+        monkeypatch.setattr(cache_module, "IMAGE_CACHE_ENABLED", False)
+        monkeypatch.setattr(asset_store_module, "ASSET_STORE_ENABLED", False)
+
+        generation_started = asyncio.Event()
+        generated: List[str] = []
+
+        async def fake_dalle(prompt: str, api_key: str, base_url: str | None):
+            generated.append(prompt)
+            generation_started.set()
+            return f"https://example.com/{len(generated)}.png"
+
+        monkeypatch.setattr(core, "generate_image_dalle", fake_dalle)
+
+        messages: List[Tuple[str, str, int]] = []
+
+        async def send_message(type: str, value: str, variant_index: int) -> None:
+            messages.append((type, value, variant_index))
+
+        stage = ParallelGenerationStage(
+            send_message=send_message,  # type: ignore
+            openai_api_key="key",
+            openai_base_url=None,
+            anthropic_api_key=None,
+            gemini_api_key=None,
+            should_generate_images=True,
+            input_mode="text",
+            generation_type="create",
+            prompt={"text": "", "images": []},
+            stack="html_tailwind",  # type: ignore
+            cancel_event=asyncio.Event(),
+        )
+
+        async def variant(index: int) -> Completion:
+            for start in range(0, len(PAGE), 20):
+                await stage._process_chunk(PAGE[start : start + 20], index)
+            # Both images are requested before the completion ends
+            await asyncio.wait_for(generation_started.wait(), timeout=1)
+            return {"duration": 0.1, "code": PAGE}
+
+        def create_tasks(*_: Any) -> List[Coroutine[Any, Any, Completion]]:
+            return [variant(0), variant(1)]
+
+        stage._create_generation_tasks = create_tasks  # type: ignore
+
+        await asyncio.wait_for(
+            stage.process_variants(
+                [Llm.GPT_4_1_2025_04_14, Llm.GPT_4_1_2025_04_14], [], {}, {}
+            ),
+            timeout=2,
+        )
+
+        assert sorted(generated) == ["Company logo", "Team & friends"]
+        assert stage.images.prefetched == 2
+        set_code = [value for type, value, _ in messages if type == "setCode"]
+        assert len(set_code) == 2
+        assert all("https://placehold.co" not in code for code in set_code)
@@ -0,0 +1,95 @@
+import base64
+import io
+import random
+
+from PIL import Image
+
+from image_processing import utils
+from image_processing.utils import (
+    MAX_JPEG_QUALITY,
+    MIN_JPEG_QUALITY,
+    base64_size,
+    compress_jpeg,
+    predict_jpeg_quality,
+    process_image,
+)
+
+
+def noisy_image(width: int, height: int) -> Image.Image:
+    return Image.effect_noise((width, height), 60).convert("RGB")
+
+
+def encoded_size(img: Image.Image, quality: int) -> int:
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=quality)
+    return base64_size(len(output.getvalue()))
+
+
+class TestBase64Size:
+    def test_matches_encoding(self) -> None:
+        rng = random.Random(0)
+        for n in [0, 1, 2, 3, 4, 5, 100, 1001]:
+            data = bytes(rng.randrange(256) for _ in range(n))
+            assert base64_size(n) == len(base64.b64encode(data))
+
+
+class TestCompressJpeg:
+    def test_returns_max_quality_when_it_fits(self) -> None:
+        img = noisy_image(64, 64)
+        output, quality, encodes = compress_jpeg(img, 10 * 1024 * 1024)
+        assert quality == MAX_JPEG_QUALITY
+        assert encodes == 1
+        assert base64_size(len(output)) == encoded_size(img, MAX_JPEG_QUALITY)
+
+    def test_finds_high_quality_that_fits(self) -> None:
+        img = noisy_image(400, 400)
+        max_size = (encoded_size(img, 60) + encoded_size(img, 70)) // 2
+
+        output, quality, encodes = compress_jpeg(img, max_size)
+
+        assert base64_size(len(output)) <= max_size
+        assert encoded_size(img, quality) == base64_size(len(output))
+        # Within the search tolerance of the best fitting quality
+        assert encoded_size(img, quality + utils.JPEG_QUALITY_TOLERANCE) > max_size
+        # Fewer encodes than stepping down by 5 from 95 to 65
+        assert encodes < 7
+
+    def test_falls_back_to_min_quality(self) -> None:
+        img = noisy_image(200, 200)
+        output, quality, _ = compress_jpeg(img, 100)
+        assert quality == MIN_JPEG_QUALITY
+        assert base64_size(len(output)) == encoded_size(img, MIN_JPEG_QUALITY)
+
+    def test_predicted_quality_decreases_with_limit(self) -> None:
+        size = 10_000_000
+        predictions = [
+            predict_jpeg_quality(MAX_JPEG_QUALITY, size, int(size * ratio))
+            for ratio in (0.9, 0.6, 0.3, 0.1)
+        ]
+        assert predictions == sorted(predictions, reverse=True)
+        assert all(MIN_JPEG_QUALITY <= q < MAX_JPEG_QUALITY for q in predictions)
+
+
+class TestProcessImage:
+    def test_small_image_is_returned_unchanged(self) -> None:
+        output = io.BytesIO()
+        noisy_image(32, 32).save(output, format="PNG")
+        base64_data = base64.b64encode(output.getvalue()).decode()
+
+        media_type, result = process_image(f"data:image/png;base64,{base64_data}")
+
+        assert media_type == "image/png"
+        assert result == base64_data
+
+    def test_tall_image_is_resized_within_limits(self) -> None:
+        output = io.BytesIO()
+        Image.new("RGB", (400, 9000), "white").save(output, format="PNG")
+        data_url = "data:image/png;base64," + base64.b64encode(output.getvalue()).decode()
+
+        media_type, result = process_image(data_url)
+
+        assert media_type == "image/jpeg"
+        img = Image.open(io.BytesIO(base64.b64decode(result)))
+        assert img.height == utils.CLAUDE_MAX_IMAGE_DIMENSION
+        assert img.width == int(utils.CLAUDE_MAX_IMAGE_DIMENSION / 9000 * 400)
+        assert len(result) <= utils.CLAUDE_IMAGE_MAX_SIZE
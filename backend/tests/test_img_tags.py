@@ -0,0 +1,89 @@
+from typing import Any, List
+
+import pytest
+
+import image_generation.core as core
+from image_generation.core import create_alt_url_mapping, replace_placeholder_images
+from image_generation.img_tags import find_img_tags, rewrite_img_tags
+
+PAGE = """<!DOCTYPE html>
+<html>
+  <head><script>const tpl = '<img src="https://placehold.co/1x1" alt="In script">';</script></head>
+  <body>
+    <!-- <img src="https://placehold.co/2x2" alt="In comment"> -->
+    <div   class="hero"><img src="https://placehold.co/300x200" alt="Hero &amp; team" class="w-full"></div>
+    <IMG SRC='https://placehold.co/64x64' ALT='Logo' width=10 />
+    <img src="https://example.com/photo.png" alt="Existing photo">
+    <img alt="No src">
+  </body>
+</html>
+"""
+
+
+class TestFindImgTags:
+    def test_finds_tags_outside_scripts_and_comments(self):
+        tags = list(find_img_tags(PAGE))
+
+        assert [tag.attributes.get("alt") for tag in tags] == [
+            "Hero & team",
+            "Logo",
+            "Existing photo",
+            "No src",
+        ]
+        assert all(PAGE[tag.start : tag.end] == tag.text for tag in tags)
+
+    def test_alt_url_mapping_skips_placeholders(self):
+        assert create_alt_url_mapping(PAGE) == {
+            "Existing photo": "https://example.com/photo.png"
+        }
+
+
+class TestReplacePlaceholderImages:
+    def test_only_touches_src_width_and_height(self):
+        result = replace_placeholder_images(
+            PAGE,
+            {
+                "Hero & team": "https://example.com/hero.png?a=1&b=2",
+                "Logo": "https://example.com/logo.png",
+            },
+        )
+
+        expected = PAGE.replace(
+            '<img src="https://placehold.co/300x200" alt="Hero &amp; team" class="w-full">',
+            '<img src="https://example.com/hero.png?a=1&amp;b=2" alt="Hero &amp; team" '
+            'class="w-full" width="300" height="200">',
+        ).replace(
+            "<IMG SRC='https://placehold.co/64x64' ALT='Logo' width=10 />",
+            '<IMG src="https://example.com/logo.png" ALT=\'Logo\' width="64" height="64" />',
+        )
+        assert result == expected
+
+    def test_failed_images_are_left_alone(self):
+        assert replace_placeholder_images(PAGE, {"Hero & team": None}) == PAGE
+
+    def test_unchanged_code_is_returned_as_is(self):
+        assert rewrite_img_tags(PAGE, lambda tag: None) is PAGE
+
+
+class TestGenerateImages:
+    @pytest.mark.asyncio
+    async def test_generates_each_placeholder_once(self, monkeypatch: pytest.MonkeyPatch):
+        requested: List[List[str]] = []
+
+        async def fake_process_tasks(prompts: List[str], *args: Any):
+            requested.append(prompts)
+            return [f"https://example.com/{i}.png" for i in range(len(prompts))]
+
+        monkeypatch.setattr(core, "process_tasks", fake_process_tasks)
+        code = PAGE + '<img src="https://placehold.co/64x64" alt="Logo">'
+
+        result = await core.generate_images(
+            code, "key", None, image_cache={"Logo": "https://example.com/cached.png"}
+        )
+
+        assert requested == [["Hero & team"]]
+        assert 'src="https://example.com/0.png"' in result
+        assert result.count('src="https://example.com/cached.png"') == 2
+        assert "https://placehold.co/300x200" not in result
+        # Placeholders in scripts and comments are left alone
+        assert "In script" in result and "https://placehold.co/1x1" in result
@@ -0,0 +1,138 @@
+import asyncio
+import base64
+from typing import Any, List
+
+import pytest
+
+import image_processing.media_registry as media_registry
+from image_processing.media_handles import (
+    LocalMediaUploader,
+    MediaHandle,
+    MediaHandleCache,
+)
+from image_processing.media_registry import MediaRegistry
+from models.gemini import convert_message_to_gemini_content
+
+VIDEO_BYTES = b"\0\0\0\x18ftypmp42" + b"\1" * 2000
+VIDEO_URL = "data:video/mp4;base64," + base64.b64encode(VIDEO_BYTES).decode()
+
+
+class SlowUploader(LocalMediaUploader):
+    async def upload(self, data: bytes, mime_type: str) -> MediaHandle:
+        await asyncio.sleep(0.05)
+        return await super().upload(data, mime_type)
+
+
+class FailingUploader(LocalMediaUploader):
+    def __init__(self):
+        super().__init__()
+        self.attempts = 0
+
+    async def upload(self, data: bytes, mime_type: str) -> MediaHandle:
+        self.attempts += 1
+        raise ConnectionError("upload failed")
+
+
+def video_message(url: str) -> Any:
+    return {
+        "role": "user",
+        "content": [
+            {"type": "image_url", "image_url": {"url": url}},
+            {"type": "text", "text": "make the button blue"},
+        ],
+    }
+
+
+@pytest.fixture
+def handles(monkeypatch: pytest.MonkeyPatch) -> MediaHandleCache:
+    cache = MediaHandleCache(expiry_margin_seconds=600)
+    monkeypatch.setattr(media_registry, "media_handles", cache)
+    return cache
+
+
+class TestMediaHandleCache:
+    @pytest.mark.asyncio
+    async def test_variants_share_one_upload(self, handles: MediaHandleCache):
+        uploader = SlowUploader()
+        registry = MediaRegistry()
+
+        results = await asyncio.gather(
+            registry.upload(VIDEO_URL, uploader), registry.upload(VIDEO_URL, uploader)
+        )
+
+        assert results[0] is not None and results[0] == results[1]
+        assert len(uploader.files) == 1
+        assert handles.uploads == 1 and handles.hits == 1
+
+    @pytest.mark.asyncio
+    async def test_later_requests_reuse_the_handle(self, handles: MediaHandleCache):
+        uploader = LocalMediaUploader()
+
+        first = await MediaRegistry().upload(VIDEO_URL, uploader)
+        second = await MediaRegistry().upload(VIDEO_URL, uploader)
+
+        assert first == second
+        assert len(uploader.files) == 1
+
+    @pytest.mark.asyncio
+    async def test_handles_near_expiry_are_uploaded_again(self, handles: MediaHandleCache):
+        # Files expire in 5 minutes, within the 10 minute margin
+        uploader = LocalMediaUploader(ttl_seconds=300)
+
+        await MediaRegistry().upload(VIDEO_URL, uploader)
+        await MediaRegistry().upload(VIDEO_URL, uploader)
+
+        assert len(uploader.files) == 2
+
+    @pytest.mark.asyncio
+    async def test_handles_are_per_uploader_key(self, handles: MediaHandleCache):
+        first, second = LocalMediaUploader(), LocalMediaUploader()
+        second.key = "other account"
+
+        await MediaRegistry().upload(VIDEO_URL, first)
+        await MediaRegistry().upload(VIDEO_URL, second)
+
+        assert len(first.files) == len(second.files) == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_uploads_fall_back_and_are_retried(
+        self, handles: MediaHandleCache
+    ):
+        uploader = FailingUploader()
+        registry = MediaRegistry()
+
+        assert await registry.upload(VIDEO_URL, uploader) is None
+        assert registry.uploaded(VIDEO_URL) is None
+        assert await registry.upload(VIDEO_URL, uploader) is None
+        assert uploader.attempts == 2
+
+
+class TestGeminiConversion:
+    @pytest.mark.asyncio
+    async def test_uploaded_videos_are_referenced_by_uri(
+        self, handles: MediaHandleCache
+    ):
+        uploader = LocalMediaUploader()
+        registry = MediaRegistry()
+        messages: List[Any] = [video_message(VIDEO_URL)]
+
+        await registry.prepare_gemini_images(messages, uploader, upload_min_bytes=1000)
+        content = convert_message_to_gemini_content(messages[0], registry)
+
+        file_parts = [part for part in content.parts if getattr(part, "file_data", None)]
+        assert len(file_parts) == 1
+        assert file_parts[0].file_data.file_uri == "local://files/0"
+        assert file_parts[0].file_data.mime_type == "video/mp4"
+        assert not any(getattr(part, "inline_data", None) for part in content.parts)
+
+    @pytest.mark.asyncio
+    async def test_small_videos_and_images_stay_inline(self, handles: MediaHandleCache):
+        uploader = LocalMediaUploader()
+        registry = MediaRegistry()
+        messages: List[Any] = [video_message(VIDEO_URL)]
+
+        await registry.prepare_gemini_images(messages, uploader, upload_min_bytes=10_000)
+        content = convert_message_to_gemini_content(messages[0], registry)
+
+        assert uploader.files == {}
+        assert any(getattr(part, "inline_data", None) for part in content.parts)
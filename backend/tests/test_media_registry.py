@@ -0,0 +1,153 @@
+import asyncio
+import base64
+import copy
+import io
+import time
+from typing import Any, List
+
+import pytest
+from PIL import Image
+
+import image_processing.media_registry as media_registry
+from image_processing.media_registry import MediaRegistry
+from models.claude import convert_openai_messages_to_claude
+from models.gemini import convert_message_to_gemini_content
+
+
+def make_data_url(mime_type: str = "image/png") -> str:
+    output = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(output, format="PNG")
+    return f"data:{mime_type};base64," + base64.b64encode(output.getvalue()).decode()
+
+
+def make_messages(data_url: str) -> List[Any]:
+    return [
+        {"role": "system", "content": "system prompt"},
+        {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": data_url, "detail": "high"}},
+                {"type": "text", "text": "build this"},
+            ],
+        },
+        {"role": "assistant", "content": "<html></html>"},
+        {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": data_url}},
+                {"type": "text", "text": "now make it blue"},
+            ],
+        },
+    ]
+
+
+class TestMediaRegistry:
+    """Test that request images are decoded once and shared by variants."""
+
+    def test_variants_share_decoded_images(self, monkeypatch: pytest.MonkeyPatch):
+        processed: List[str] = []
+        process_image_bytes = media_registry.process_image_bytes
+
+        def counting_process_image_bytes(*args: Any):
+            processed.append(args[0])
+            return process_image_bytes(*args)
+
+        monkeypatch.setattr(
+            media_registry, "process_image_bytes", counting_process_image_bytes
+        )
+
+        media = MediaRegistry()
+        messages = make_messages(make_data_url())
+
+        claude_results = [
+            convert_openai_messages_to_claude(messages, media) for _ in range(2)
+        ]
+        gemini_results = [
+            convert_message_to_gemini_content(messages[1], media) for _ in range(2)
+        ]
+
+        assert media.decode_count == 1
+        assert len(processed) == 1
+
+        # Variants reference the same encoded data instead of copies
+        first, second = (
+            result[1][0]["content"][0]["source"]["data"] for result in claude_results
+        )
+        assert first is second
+        first_bytes, second_bytes = (
+            content.parts[1].inline_data.data for content in gemini_results  # type: ignore
+        )
+        assert first_bytes is second_bytes
+
+    def test_claude_conversion_leaves_messages_untouched(self):
+        messages = make_messages(make_data_url())
+        original = copy.deepcopy(messages)
+
+        system_prompt, claude_messages = convert_openai_messages_to_claude(messages)
+
+        assert messages == original
+        assert system_prompt == "system prompt"
+        assert claude_messages[0]["content"][0] == {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": "image/png",
+                "data": messages[1]["content"][0]["image_url"]["url"].split(",")[1],
+            },
+        }
+        assert claude_messages[0]["content"][1] == {"type": "text", "text": "build this"}
+        assert claude_messages[1] == {"role": "assistant", "content": "<html></html>"}
+
+    def test_generic_mime_type_is_detected(self):
+        media = MediaRegistry()
+        image = media.gemini_image(make_data_url("application/octet-stream"))
+
+        assert image is not None
+        assert image[1] == "image/png"
+        assert media.gemini_image("data:application/octet-stream;base64,AAAA") is None
+
+
+class TestMediaWorkerPool:
+    """Test that image work runs off the event loop."""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_variants_process_each_image_once_off_the_loop(
+        self, monkeypatch: pytest.MonkeyPatch
+    ):
+        processed: List[str] = []
+        process_image_bytes = media_registry.process_image_bytes
+
+        def slow_process_image_bytes(*args: Any):
+            processed.append(args[0])
+            time.sleep(0.2)
+            return process_image_bytes(*args)
+
+        monkeypatch.setattr(
+            media_registry, "process_image_bytes", slow_process_image_bytes
+        )
+
+        ticks = 0
+
+        async def ticker() -> None:
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        media = MediaRegistry()
+        messages = make_messages(make_data_url())
+        ticker_task = asyncio.create_task(ticker())
+        try:
+            await asyncio.gather(
+                *(media.prepare_claude_images(messages) for _ in range(3))
+            )
+        finally:
+            ticker_task.cancel()
+
+        assert len(processed) == 1
+        assert media.decode_count == 1
+        # The loop kept running while the image was being processed
+        assert ticks >= 5
+        # Converters now read the prepared image from the cache
+        convert_openai_messages_to_claude(messages, media)
+        assert len(processed) == 1
@@ -0,0 +1,187 @@
+import base64
+import io
+import mmap
+import os
+import time
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import image_processing.media_registry as media_registry
+from image_processing.media_registry import MediaNotFoundError, MediaRegistry
+from image_processing.media_store import MediaStore, media_id_from_ref, media_ref
+from routes import media as media_route
+
+
+def png_bytes(color: str = "red") -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(output, format="PNG")
+    return output.getvalue()
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> MediaStore:
+    return MediaStore(tmp_path / "media", max_bytes=10 * 1024 * 1024)
+
+
+class TestMediaStore:
+    def test_put_and_open_memory_maps_content(self, store: MediaStore):
+        data = png_bytes()
+        media_id = store.put(data, "image/png")
+
+        stored = store.open(media_id)
+
+        assert stored is not None
+        assert isinstance(stored.data, mmap.mmap)
+        assert stored.data[:] == data
+        assert stored.mime_type == "image/png"
+        assert stored.size == len(data)
+        assert media_id in store
+
+    def test_identical_content_gets_the_same_id(self, store: MediaStore):
+        assert store.put(png_bytes(), "image/png") == store.put(png_bytes(), "image/png")
+        assert store.put(png_bytes("blue"), "image/png") != store.put(
+            png_bytes(), "image/png"
+        )
+
+    def test_unknown_and_invalid_ids(self, store: MediaStore):
+        assert store.open("0" * 64) is None
+        assert store.open("../../etc/passwd") is None
+        assert "../config" not in store
+        with pytest.raises(ValueError):
+            media_id_from_ref("media:../../config.py")
+
+    def test_least_recently_used_media_is_evicted(self, tmp_path: Path):
+        store = MediaStore(tmp_path / "media", max_bytes=2500)
+        first = store.put(b"a" * 1000, "video/mp4")
+        second = store.put(b"b" * 1000, "video/mp4")
+        # Make the first upload the most recently used
+        past = time.time() - 60
+        os.utime(store.directory / second, (past, past))
+        assert store.open(first) is not None
+
+        store.put(b"c" * 1000, "video/mp4")
+
+        assert first in store
+        assert second not in store
+
+
+class TestMediaRegistryReferences:
+    def test_reference_decodes_to_stored_bytes(self, store: MediaStore):
+        data = png_bytes()
+        ref = media_ref(store.put(data, "image/png"))
+        media = MediaRegistry(store)
+
+        decoded = media.decode(ref)
+
+        assert bytes(decoded.data) == data
+        assert decoded.mime_type == "image/png"
+        assert decoded.base64_data == base64.b64encode(data).decode()
+        assert media.decode(ref) is decoded
+        assert media.gemini_image(ref) == (data, "image/png")
+
+    def test_inline_media_replaces_references_with_data_urls(
+        self, store: MediaStore
+    ):
+        data = png_bytes()
+        ref = media_ref(store.put(data, "image/png"))
+        messages = [
+            {"role": "system", "content": "system prompt"},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "image_url", "image_url": {"url": ref, "detail": "high"}},
+                    {"type": "text", "text": "build this"},
+                ],
+            },
+        ]
+
+        inlined = MediaRegistry(store).inline_media(messages)  # type: ignore
+
+        assert inlined[0] is messages[0]
+        assert inlined[1]["content"][0]["image_url"] == {  # type: ignore
+            "url": "data:image/png;base64," + base64.b64encode(data).decode(),
+            "detail": "high",
+        }
+        # The original messages are untouched
+        assert messages[1]["content"][0]["image_url"]["url"] == ref  # type: ignore
+
+    @pytest.mark.asyncio
+    async def test_workers_open_the_stored_file_instead_of_a_copy(
+        self, store: MediaStore, monkeypatch: pytest.MonkeyPatch
+    ):
+        media_id = store.put(b"\x00" * 64, "video/mp4")
+        ref = media_ref(media_id)
+        sources: list[bytes | str] = []
+
+        def fake_extract_keyframes(video: bytes | str) -> None:
+            sources.append(video)
+            return None
+
+        monkeypatch.setattr(media_registry, "extract_keyframes", fake_extract_keyframes)
+        media = MediaRegistry(store)
+
+        await media.video_keyframes(ref)
+
+        assert sources == [str(store.directory / media_id)]
+        assert media.decode(ref).source == sources[0]
+
+    def test_close_unmaps_stored_media(self, store: MediaStore):
+        ref = media_ref(store.put(png_bytes(), "image/png"))
+        media = MediaRegistry(store)
+        data = media.decode(ref).data
+        assert media.image_size(ref) == (8, 8)
+
+        media.close()
+
+        assert isinstance(data, mmap.mmap) and data.closed
+        # A later lookup maps the file again
+        assert media.image_size(ref) is None
+        assert bytes(media.decode(ref).data) == png_bytes()
+
+    @pytest.mark.asyncio
+    async def test_missing_reference_raises(self, store: MediaStore):
+        with pytest.raises(MediaNotFoundError):
+            await MediaRegistry(store).decode_async(media_ref("0" * 64))
+
+
+class TestMediaUploadRoute:
+    @pytest.fixture
+    def client(self, store: MediaStore, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(media_route, "media_store", store)
+        app = FastAPI()
+        app.include_router(media_route.router)
+        return TestClient(app)
+
+    def test_upload_returns_reference(self, client: TestClient, store: MediaStore):
+        data = png_bytes()
+        response = client.post("/api/media", content=data)
+
+        assert response.status_code == 200
+        body = response.json()
+        assert body["mimeType"] == "image/png"
+        assert body["size"] == len(data)
+        assert body["ref"] == media_ref(body["mediaId"])
+        stored = store.open(body["mediaId"])
+        assert stored is not None and stored.data[:] == data
+
+    def test_check_reports_evicted_media(self, client: TestClient, store: MediaStore):
+        media_id = store.put(png_bytes(), "image/png")
+
+        assert client.head(f"/api/media/{media_id}").status_code == 200
+        assert client.head("/api/media/" + "0" * 64).status_code == 404
+        assert client.head("/api/media/..%2Fconfig").status_code == 404
+
+    def test_rejects_unknown_and_oversized_uploads(
+        self, client: TestClient, store: MediaStore, monkeypatch: pytest.MonkeyPatch
+    ):
+        assert client.post("/api/media", content=b"not media").status_code == 415
+        assert client.post("/api/media", content=b"").status_code == 400
+
+        monkeypatch.setattr(media_route, "MEDIA_UPLOAD_MAX_BYTES", 10)
+        assert client.post("/api/media", content=png_bytes()).status_code == 413
+        # Nothing is left behind by failed uploads
+        assert list(store.directory.iterdir()) == []
@@ -0,0 +1,76 @@
+import asyncio
+from typing import Awaitable, Callable
+
+import pytest
+
+from metrics.latency import PIPELINE_STAGE_SECONDS
+from metrics.prometheus import Counter, Histogram, render_metrics
+from routes.generate_code import Middleware, Pipeline, PipelineContext
+
+
+class TestPrometheusRendering:
+    """Test the in-process histograms and their text exposition."""
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("test_seconds", "Test", buckets=[0.1, 1.0])
+        for value in [0.05, 0.5, 0.7, 5.0]:
+            histogram.observe(value, stage="a")
+
+        lines = histogram.render()
+        assert 'test_seconds_bucket{stage="a",le="0.1"} 1' in lines
+        assert 'test_seconds_bucket{stage="a",le="1.0"} 3' in lines
+        assert 'test_seconds_bucket{stage="a",le="+Inf"} 4' in lines
+        assert 'test_seconds_count{stage="a"} 4' in lines
+        assert histogram.quantile(0.5, stage="a") == 1.0
+        assert histogram.quantile(0.95, stage="a") == float("inf")
+
+    def test_label_values_are_escaped(self):
+        counter = Counter("test_total", "Test")
+        counter.inc(model='say "hi"')
+        assert counter.render()[-1] == 'test_total{model="say \\"hi\\""} 1'
+
+    def test_hits_and_misses_are_exported_as_counters(self):
+        import routes.metrics  # noqa: F401
+
+        lines = render_metrics().splitlines()
+
+        for name in [
+            "client_pool_hits_total",
+            "completion_cache_misses_total",
+            "image_generation_cache_hits_total",
+        ]:
+            assert f"# TYPE {name} counter" in lines
+        assert "# TYPE client_pool_clients gauge" in lines
+        assert not any(line.startswith("completion_cache{stat=\"hits\"}") for line in lines)
+
+
+class SleepMiddleware(Middleware):
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    async def process(
+        self, context: PipelineContext, next_func: Callable[[], Awaitable[None]]
+    ) -> None:
+        await asyncio.sleep(self.seconds)
+        await next_func()
+
+
+class SlowStageMiddleware(SleepMiddleware):
+    pass
+
+
+class TestPipelineStageTiming:
+    """Test that each middleware is charged only for its own time."""
+
+    @pytest.mark.asyncio
+    async def test_downstream_time_is_excluded(self):
+        before_fast = PIPELINE_STAGE_SECONDS.count(stage="SleepMiddleware")
+
+        pipeline = Pipeline()
+        pipeline.use(SleepMiddleware(0))
+        pipeline.use(SlowStageMiddleware(0.05))
+        await pipeline.execute(None)  # type: ignore
+
+        assert PIPELINE_STAGE_SECONDS.count(stage="SleepMiddleware") == before_fast + 1
+        assert PIPELINE_STAGE_SECONDS.quantile(1.0, stage="SleepMiddleware") <= 0.025
+        assert PIPELINE_STAGE_SECONDS.quantile(1.0, stage="SlowStageMiddleware") >= 0.05
@@ -0,0 +1,175 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List
+
+import pytest
+
+import image_generation.replicate as replicate
+from clients.registry import ClientRegistry
+from image_generation.replicate import call_replicate, poll_delay
+
+
+class StubReplicate:
+    """A local stand-in for the Replicate predictions API.
+
+    The prompt picks the scenario: "ready" finishes within a "Prefer: wait"
+    create call, "slow:N" needs N polls, "fail" fails on the first poll and
+    "stuck" never finishes.
+    """
+
+    def __init__(self):
+        self.predictions: Dict[str, Dict[str, Any]] = {}
+        self.requests: List[Dict[str, Any]] = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def _view(self, prediction_id: str) -> Dict[str, Any]:
+        prediction = self.predictions[prediction_id]
+        scenario = prediction["scenario"]
+        status = "processing"
+        if prediction["canceled"]:
+            status = "canceled"
+        elif scenario == "ready" and prediction["waited"]:
+            status = "succeeded"
+        elif scenario.startswith("slow:") and prediction["polls"] >= int(scenario[5:]):
+            status = "succeeded"
+        elif scenario == "fail" and prediction["polls"] > 0:
+            status = "failed"
+        return {
+            "id": prediction_id,
+            "status": status,
+            "output": ["https://example.com/image.png"] if status == "succeeded" else None,
+            "error": "NSFW" if status == "failed" else None,
+            "urls": {
+                "get": f"{self.base_url}/predictions/{prediction_id}",
+                "cancel": f"{self.base_url}/predictions/{prediction_id}/cancel",
+            },
+        }
+
+    def _handler(self) -> type:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def _respond(self, body: Dict[str, Any], status: int = 200) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                stub.requests.append(
+                    {"method": "POST", "path": self.path, "prefer": self.headers.get("Prefer")}
+                )
+                if self.path.endswith("/cancel"):
+                    prediction_id = self.path.split("/")[-2]
+                    stub.predictions[prediction_id]["canceled"] = True
+                    self._respond(stub._view(prediction_id))
+                    return
+
+                prediction_id = f"p{len(stub.predictions)}"
+                stub.predictions[prediction_id] = {
+                    "scenario": body["input"]["prompt"],
+                    "polls": 0,
+                    "waited": self.headers.get("Prefer", "").startswith("wait"),
+                    "canceled": False,
+                }
+                self._respond(stub._view(prediction_id), status=201)
+
+            def do_GET(self) -> None:
+                stub.requests.append({"method": "GET", "path": self.path, "prefer": None})
+                prediction_id = self.path.split("/")[-1]
+                stub.predictions[prediction_id]["polls"] += 1
+                self._respond(stub._view(prediction_id))
+
+        return Handler
+
+    @property
+    def polls(self) -> int:
+        return sum(1 for request in self.requests if request["method"] == "GET")
+
+
+@pytest.fixture
+def stub() -> Iterator[StubReplicate]:
+    stub = StubReplicate()
+    thread = threading.Thread(
+        target=stub.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+    )
+    thread.start()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+@pytest.fixture(autouse=True)
+async def fresh_client_registry(monkeypatch: pytest.MonkeyPatch):
+    # Pooled clients are bound to the event loop they were first used on
+    registry = ClientRegistry()
+    monkeypatch.setattr(replicate, "client_registry", registry)
+    monkeypatch.setattr(replicate, "REPLICATE_POLL_INITIAL_SECONDS", 0.01)
+    monkeypatch.setattr(replicate, "REPLICATE_POLL_MAX_SECONDS", 0.05)
+    yield
+    await registry.close_all()
+
+
+class TestPollDelay:
+    def test_backs_off_exponentially_with_jitter_up_to_the_maximum(self):
+        for attempt in range(8):
+            expected = min(0.25 * 2**attempt, 2)
+            delays = [poll_delay(attempt, 0.25, 2) for _ in range(50)]
+            assert all(expected / 2 <= delay <= expected for delay in delays)
+        assert len(set(poll_delay(3, 0.25, 2) for _ in range(20))) > 1
+
+
+class TestCallReplicate:
+    @pytest.mark.asyncio
+    async def test_prefer_wait_skips_polling(self, stub: StubReplicate):
+        url = await call_replicate({"prompt": "ready"}, "token", base_url=stub.base_url)
+
+        assert url == "https://example.com/image.png"
+        assert stub.requests[0]["prefer"] == "wait=30"
+        assert stub.polls == 0
+
+    @pytest.mark.asyncio
+    async def test_polls_until_succeeded(self, stub: StubReplicate):
+        url = await call_replicate(
+            {"prompt": "slow:3"}, "token", prefer_wait_seconds=0, base_url=stub.base_url
+        )
+
+        assert url == "https://example.com/image.png"
+        assert stub.requests[0]["prefer"] is None
+        assert stub.polls == 3
+
+    @pytest.mark.asyncio
+    async def test_failed_prediction_raises(self, stub: StubReplicate):
+        with pytest.raises(ValueError, match="failed: NSFW"):
+            await call_replicate({"prompt": "fail"}, "token", base_url=stub.base_url)
+
+    @pytest.mark.asyncio
+    async def test_deadline_cancels_the_prediction(self, stub: StubReplicate):
+        with pytest.raises(TimeoutError):
+            await call_replicate(
+                {"prompt": "stuck"},
+                "token",
+                deadline_seconds=0.2,
+                base_url=stub.base_url,
+            )
+
+        assert stub.predictions["p0"]["canceled"]
+        # Backoff keeps the number of polls well below one per 10ms
+        assert 0 < stub.polls < 15
+
+    @pytest.mark.asyncio
+    async def test_requests_share_a_pooled_client(self, stub: StubReplicate):
+        for _ in range(3):
+            await call_replicate({"prompt": "slow:1"}, "token", base_url=stub.base_url)
+
+        assert replicate.client_registry.misses == 1
+        assert replicate.client_registry.hits == 2
@@ -0,0 +1,244 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Any, Coroutine, List, Tuple
+
+import pytest
+
+import usage.ledger as ledger_module
+from llm import Completion, Llm
+from routes.generate_code import ParallelGenerationStage
+from usage.estimate import (
+    Calibration,
+    claude_image_tokens,
+    count_input_tokens,
+    estimate_usage,
+    openai_image_tokens,
+    over_budget,
+)
+from usage.ledger import UsageLedger, UsageRecord
+from usage.pricing import MODEL_PROFILES, token_cost
+
+GPT = Llm.GPT_4_1_2025_04_14
+SONNET = Llm.CLAUDE_4_5_SONNET_2025_09_29
+OPUS = Llm.CLAUDE_4_5_OPUS_2025_11_01
+FLASH = Llm.GEMINI_3_FLASH_PREVIEW_MINIMAL
+
+IMAGE_URL = "data:image/png;base64,AAAA"
+
+
+def prompt(text: str) -> Any:
+    return [
+        {"role": "system", "content": "x" * 4000},
+        {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": IMAGE_URL}},
+                {"type": "text", "text": text},
+            ],
+        },
+    ]
+
+
+def usage_record(model: Llm, counted: int, actual: int, output: int) -> UsageRecord:
+    return {
+        "time": 0.0,
+        "model": model.value,
+        "input_mode": "image",
+        "generation_type": "create",
+        "counted_input_tokens": counted,
+        "estimated_input_tokens": counted,
+        "estimated_output_tokens": 1000,
+        "estimated_cost": 0.0,
+        "estimated_seconds": 10.0,
+        "input_tokens": actual,
+        "output_tokens": output,
+        "cost": token_cost(model, actual, output),
+        "seconds": 20.0,
+    }
+
+
+@pytest.fixture
+def ledger(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> UsageLedger:
+    usage_ledger = UsageLedger(tmp_path / "usage_ledger.jsonl")
+    monkeypatch.setattr(ledger_module, "usage_ledger", usage_ledger)
+    monkeypatch.setattr(ledger_module, "USAGE_LEDGER_ENABLED", True)
+    return usage_ledger
+
+
+class TestInputTokens:
+    def test_openai_images_are_counted_in_tiles(self):
+        # Scaled to 768x768: 4 tiles
+        assert openai_image_tokens(1024, 1024) == 85 + 170 * 4
+        # Scaled to 1365x768: 6 tiles
+        assert openai_image_tokens(2560, 1440) == 85 + 170 * 6
+
+    def test_claude_images_are_counted_by_pixels_up_to_a_cap(self):
+        assert claude_image_tokens(1000, 750) == 1000
+        assert claude_image_tokens(4000, 3000) == 1600
+
+    def test_prompt_tokens_depend_on_the_provider(self):
+        messages = prompt("make it blue")
+        size = lambda _: (1024, 1024)
+
+        gpt = count_input_tokens(GPT, messages, size)
+        sonnet = count_input_tokens(SONNET, messages, size)
+
+        text = 2 * 4 + 1000 + 3  # message overhead, system prompt, "make it blue"
+        assert gpt == text + 765
+        assert sonnet == text + 1399
+
+
+class TestEstimates:
+    def test_uncalibrated_estimates_use_the_model_profile(self):
+        profile = MODEL_PROFILES[OPUS]
+
+        estimate = estimate_usage(OPUS, 10_000)
+
+        assert estimate.output_tokens == profile.expected_output_tokens
+        assert estimate.cost == token_cost(OPUS, 10_000, profile.expected_output_tokens)
+        assert estimate.max_cost == token_cost(OPUS, 10_000, profile.max_output_tokens)
+        assert estimate.max_cost > estimate.cost
+        assert not estimate.calibrated
+
+    def test_calibration_scales_input_and_replaces_output(self):
+        calibration = Calibration(
+            samples=5, input_ratio=1.5, output_tokens=4000, seconds=42
+        )
+
+        estimate = estimate_usage(SONNET, 10_000, calibration)
+
+        assert estimate.input_tokens == 15_000
+        assert estimate.output_tokens == 4000
+        assert estimate.seconds == 42
+        assert estimate.calibrated
+
+
+class TestBudget:
+    def test_variants_over_the_per_variant_limit_are_dropped(self):
+        estimates = [estimate_usage(model, 10_000) for model in (FLASH, OPUS, GPT)]
+
+        dropped = over_budget(estimates, None, 0.2)
+
+        assert list(dropped) == [1]
+
+    def test_most_expensive_variants_are_dropped_to_fit_the_request_limit(self):
+        estimates = [estimate_usage(model, 10_000) for model in (OPUS, FLASH, SONNET)]
+        total = sum(estimate.cost for estimate in estimates)
+
+        dropped = over_budget(estimates, total - estimates[0].cost, None)
+
+        assert list(dropped) == [0]
+
+    def test_the_cheapest_variant_is_always_kept(self):
+        estimates = [estimate_usage(model, 10_000) for model in (OPUS, FLASH)]
+
+        dropped = over_budget(estimates, 0.0001, 0.0001)
+
+        assert list(dropped) == [0]
+
+
+class TestUsageLedger:
+    def test_calibration_needs_enough_samples(self, ledger: UsageLedger):
+        ledger.record(usage_record(SONNET, 1000, 1200, 5000))
+        ledger.record(usage_record(SONNET, 1000, 1200, 7000))
+        assert ledger.calibration(SONNET, "image", "create") is None
+
+        ledger.record(usage_record(SONNET, 1000, 1200, 9000))
+        calibration = ledger.calibration(SONNET, "image", "create")
+
+        assert calibration is not None
+        assert calibration.samples == 3
+        assert calibration.input_ratio == pytest.approx(1.2)
+        assert calibration.output_tokens == 7000
+        assert ledger.calibration(SONNET, "video", "create") is None
+        assert ledger.calibration(OPUS, "image", "create") is None
+
+    def test_records_persist_and_are_compacted(self, tmp_path: Path):
+        path = tmp_path / "usage_ledger.jsonl"
+        ledger = UsageLedger(path, max_records=10)
+        for output in range(11):
+            ledger.record(usage_record(GPT, 1000, 1000, output))
+
+        lines = path.read_text().splitlines()
+        assert len(lines) == 5
+        assert [json.loads(line)["output_tokens"] for line in lines] == [6, 7, 8, 9, 10]
+
+        reloaded = UsageLedger(path, max_records=10)
+        assert len(reloaded) == 5
+        calibration = reloaded.calibration(GPT, "image", "create")
+        assert calibration is not None and calibration.output_tokens == 8
+
+
+def make_stage(
+    messages: List[Tuple[str, str, int]], **kwargs: Any
+) -> ParallelGenerationStage:
+    async def send_message(type: str, value: str, variant_index: int) -> None:
+        messages.append((type, value, variant_index))
+
+    return ParallelGenerationStage(
+        send_message=send_message,  # type: ignore
+        openai_api_key=None,
+        openai_base_url=None,
+        anthropic_api_key=None,
+        gemini_api_key=None,
+        should_generate_images=False,
+        input_mode="image",
+        generation_type="create",
+        prompt={"text": "", "images": []},
+        stack="astro_blog",
+        cancel_event=asyncio.Event(),
+        **kwargs,
+    )
+
+
+def reporting_variants(models: List[Llm], started: List[int]):
+    async def variant(index: int) -> Completion:
+        started.append(index)
+        return {
+            "duration": 1.0,
+            "code": f"<html>{index}</html>",
+            "usage": {"input_tokens": 3000, "output_tokens": 2000},
+        }
+
+    def create_tasks(*_: Any) -> List[Coroutine[Any, Any, Completion]]:
+        return [variant(index) for index in range(len(models))]
+
+    return create_tasks
+
+
+class TestGenerationBudget:
+    @pytest.mark.asyncio
+    async def test_over_budget_variants_are_not_dispatched(self, ledger: UsageLedger):
+        models = [FLASH, OPUS, GPT]
+        messages: List[Tuple[str, str, int]] = []
+        started: List[int] = []
+        stage = make_stage(messages, max_variant_cost_usd=0.2)
+        stage._create_generation_tasks = reporting_variants(models, started)  # type: ignore
+
+        completions = await stage.process_variants(models, prompt("hi"), {}, {})
+
+        assert sorted(completions) == [0, 2]
+        assert sorted(started) == [0, 2]
+        cancelled = [
+            (value, index) for type, value, index in messages if type == "variantCancelled"
+        ]
+        assert len(cancelled) == 1 and cancelled[0][1] == 1
+        assert "per-variant limit" in cancelled[0][0]
+
+    @pytest.mark.asyncio
+    async def test_actual_usage_is_recorded_with_the_estimate(self, ledger: UsageLedger):
+        models = [SONNET, GPT]
+        stage = make_stage([])
+        stage._create_generation_tasks = reporting_variants(models, [])  # type: ignore
+
+        await stage.process_variants(models, prompt("hi"), {}, {})
+
+        assert len(ledger) == 2
+        records = [json.loads(line) for line in ledger.path.read_text().splitlines()]
+        by_model = {record["model"]: record for record in records}
+        sonnet = by_model[SONNET.value]
+        assert sonnet["input_tokens"] == 3000 and sonnet["output_tokens"] == 2000
+        assert sonnet["cost"] == token_cost(SONNET, 3000, 2000)
+        assert sonnet["counted_input_tokens"] == count_input_tokens(SONNET, prompt("hi"))
+        assert sonnet["estimated_cost"] == stage.estimates[0].cost
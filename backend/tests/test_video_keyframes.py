@@ -0,0 +1,112 @@
+import asyncio
+import base64
+from typing import Any, List, Tuple
+
+import pytest
+from PIL import Image, ImageDraw
+
+import image_processing.media_registry as media_registry
+from image_processing.media_registry import MediaRegistry
+from llm import Llm
+from video.cost_estimation import (
+    MediaResolution,
+    estimate_keyframe_input_tokens,
+    estimate_video_input_tokens,
+    format_keyframe_savings,
+)
+from video.keyframes import Keyframe, extract_keyframes, select_keyframes
+
+FPS = 5
+
+
+def screen(state: int, fade: float = 0.0) -> Image.Image:
+    """A 640x360 app screen in one of a few UI states; fade blends in the next"""
+    img = Image.new("RGB", (640, 360), "white")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, 640, 40), fill=(30, 30, 60))
+    draw.rectangle((40, 80, 40 + 120 * (state % 5), 200), fill=(200, 60, 60))
+    draw.text((60, 260), f"State {state}", fill="black")
+    if fade:
+        img = Image.blend(img, screen(state + 1), fade)
+    return img
+
+
+def recording(states: List[int], seconds_per_state: float = 3) -> List[Tuple[float, Image.Image]]:
+    """Frames of a screen recording that holds each state, with a half
+    second fade between states"""
+    frames: List[Tuple[float, Image.Image]] = []
+    t = 0.0
+    for i, state in enumerate(states):
+        for _ in range(int(seconds_per_state * FPS)):
+            frames.append((t, screen(state)))
+            t += 1 / FPS
+        if i + 1 < len(states):
+            for step in range(1, int(0.5 * FPS)):
+                frames.append((t, screen(state, fade=step / (0.5 * FPS))))
+                t += 1 / FPS
+    return frames
+
+
+class TestSelectKeyframes:
+    def test_keeps_one_settled_frame_per_ui_state(self):
+        frames = recording([0, 1, 2, 3])
+
+        selected = select_keyframes(frames, threshold=0.005, max_frames=40)
+
+        assert len(selected) == 4
+        # Each kept frame is a fully settled state, not part of a fade
+        for (_, frame), state in zip(selected, [0, 1, 2, 3]):
+            assert frame.tobytes() == screen(state).tobytes()
+
+    def test_changes_that_never_settle_are_still_sampled(self):
+        # Scrolling: every frame differs from the one before
+        frames = [(i / FPS, screen(i % 5)) for i in range(3 * FPS)]
+
+        selected = select_keyframes(frames, threshold=0.005, max_frames=40)
+
+        assert 2 <= len(selected) <= 4
+
+    def test_smallest_changes_are_dropped_over_max_frames(self):
+        frames = recording([0, 1, 2, 3, 4], seconds_per_state=1)
+
+        selected = select_keyframes(frames, threshold=0.005, max_frames=3)
+
+        assert len(selected) == 3
+        assert selected[0][0] == 0.0
+        assert [t for t, _ in selected] == sorted(t for t, _ in selected)
+
+    def test_undecodable_video_is_skipped(self):
+        assert extract_keyframes(b"not a video") is None
+
+
+class TestKeyframeEstimate:
+    def test_keyframes_use_far_fewer_tokens_than_the_video(self):
+        video_tokens = estimate_video_input_tokens(60, 10, MediaResolution.HIGH)
+        keyframe_tokens = estimate_keyframe_input_tokens(20, MediaResolution.HIGH)
+
+        assert video_tokens == 169_200
+        assert keyframe_tokens < video_tokens / 5
+        assert f"Saved: {video_tokens - keyframe_tokens:,} tokens" in format_keyframe_savings(
+            60, 10, 20, MediaResolution.HIGH, Llm.GEMINI_3_FLASH_PREVIEW_HIGH
+        )
+
+
+class TestVideoKeyframes:
+    @pytest.mark.asyncio
+    async def test_variants_share_one_extraction(self, monkeypatch: pytest.MonkeyPatch):
+        extracted: List[Any] = []
+
+        def fake_extract_keyframes(video_bytes: bytes) -> List[Keyframe]:
+            extracted.append(video_bytes)
+            return [Keyframe(0.0, b"jpeg")]
+
+        monkeypatch.setattr(media_registry, "extract_keyframes", fake_extract_keyframes)
+        data_url = "data:video/mp4;base64," + base64.b64encode(b"\0" * 64).decode()
+        registry = MediaRegistry()
+
+        results = await asyncio.gather(
+            registry.video_keyframes(data_url), registry.video_keyframes(data_url)
+        )
+
+        assert results[0] == results[1] == [Keyframe(0.0, b"jpeg")]
+        assert len(extracted) == 1
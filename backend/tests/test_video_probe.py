@@ -0,0 +1,128 @@
+import asyncio
+import base64
+import struct
+from pathlib import Path
+from typing import Any, List
+
+import pytest
+
+import image_processing.media_registry as media_registry
+from image_processing.media_registry import MediaRegistry
+import video.cost_estimation as cost_estimation
+from video.cost_estimation import get_video_duration_from_file
+from video.probe import probe_video_duration
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def large_box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4sQ", 1, box_type, 16 + len(payload)) + payload
+
+
+def mvhd(timescale: int, duration: int, version: int = 0) -> bytes:
+    if version == 0:
+        header = struct.pack(">B3xIIII", 0, 0, 0, timescale, duration)
+    else:
+        header = struct.pack(">B3xQQIQ", 1, 0, 0, timescale, duration)
+    return box(b"mvhd", header + b"\0" * 80)
+
+
+def make_mp4(movie_header: bytes, mdat_bytes: int = 1000, moov_first: bool = False) -> bytes:
+    ftyp = box(b"ftyp", b"isom\0\0\x02\0isomiso2mp41")
+    moov = box(b"moov", movie_header + box(b"trak", b"\0" * 40))
+    mdat = large_box(b"mdat", b"\0" * mdat_bytes)
+    return ftyp + (moov + mdat if moov_first else mdat + moov)
+
+
+def ebml_element(element_id: int, payload: bytes, unknown_size: bool = False) -> bytes:
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    if unknown_size:
+        return id_bytes + b"\x01\xff\xff\xff\xff\xff\xff\xff" + payload
+    # 8-byte size, as written by most muxers for the Segment
+    size = (1 << 56) | len(payload)
+    return id_bytes + size.to_bytes(8, "big") + payload
+
+
+def make_webm(duration_ticks: float, timecode_scale: int | None = None, float_size: int = 8) -> bytes:
+    header = ebml_element(0x1A45DFA3, ebml_element(0x4282, b"webm"))
+    info = b""
+    if timecode_scale is not None:
+        info += ebml_element(0x2AD7B1, timecode_scale.to_bytes(3, "big"))
+    info += ebml_element(0x4489, struct.pack(">f" if float_size == 4 else ">d", duration_ticks))
+    segment = ebml_element(0x114D9B74, b"\0" * 20) + ebml_element(0x1549A966, info)
+    return header + ebml_element(0x18538067, segment + b"\x1f\x43\xb6\x75", unknown_size=True)
+
+
+class TestProbeVideoDuration:
+    def test_mp4_movie_header(self):
+        assert probe_video_duration(make_mp4(mvhd(1000, 12_345))) == 12.345
+
+    def test_mp4_version_1_header_with_moov_first(self):
+        video = make_mp4(mvhd(90_000, 90_000 * 95, version=1), moov_first=True)
+
+        assert probe_video_duration(video) == 95
+
+    def test_large_mdat_is_skipped_not_read(self):
+        video = make_mp4(mvhd(600, 6000), mdat_bytes=20_000_000)
+
+        assert probe_video_duration(memoryview(video)) == 10
+
+    def test_webm_duration_uses_timecode_scale(self):
+        assert probe_video_duration(make_webm(8_500.0)) == 8.5
+        assert probe_video_duration(make_webm(850.0, timecode_scale=10_000_000)) == 8.5
+        assert probe_video_duration(make_webm(8_500.0, float_size=4)) == 8.5
+
+    def test_unknown_or_truncated_containers(self):
+        assert probe_video_duration(b"not a video at all") is None
+        assert probe_video_duration(make_mp4(b"")) is None
+        assert probe_video_duration(make_mp4(mvhd(1000, 5000))[:40]) is None
+        assert probe_video_duration(make_webm(1000.0)[:30]) is None
+
+
+class TestVideoDuration:
+    def test_file_headers_are_probed_before_opening_with_moviepy(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        opened: List[str] = []
+
+        def fake_moviepy(path: str) -> float | None:
+            opened.append(path)
+            return 2.5
+
+        monkeypatch.setattr(
+            cost_estimation, "_get_video_file_duration_with_moviepy", fake_moviepy
+        )
+        mp4 = tmp_path / "video.mp4"
+        mp4.write_bytes(make_mp4(mvhd(1000, 4000)))
+        avi = tmp_path / "video.avi"
+        avi.write_bytes(b"RIFF" + b"\0" * 60)
+
+        assert get_video_duration_from_file(str(mp4)) == 4.0
+        assert opened == []
+        assert get_video_duration_from_file(str(avi)) == 2.5
+        assert opened == [str(avi)]
+
+    @pytest.mark.asyncio
+    async def test_variants_share_one_probe(self, monkeypatch: pytest.MonkeyPatch):
+        probed: List[Any] = []
+
+        def counting_probe(data: Any) -> float | None:
+            probed.append(data)
+            return probe_video_duration(data)
+
+        monkeypatch.setattr(media_registry, "probe_video_duration", counting_probe)
+        data_url = "data:video/mp4;base64," + base64.b64encode(
+            make_mp4(mvhd(1000, 4000))
+        ).decode()
+        registry = MediaRegistry()
+
+        durations = await asyncio.gather(
+            registry.video_duration(data_url), registry.video_duration(data_url)
+        )
+
+        assert durations == [4.0, 4.0]
+        assert len(probed) == 1
+        assert await registry.video_duration(data_url) == 4.0
+        assert len(probed) == 1
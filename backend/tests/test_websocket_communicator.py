@@ -0,0 +1,212 @@
+import asyncio
+from typing import Any, Dict, List
+
+import pytest
+
+from routes.generate_code import WebSocketCommunicator
+
+
+class FakeWebSocket:
+    """Records frames instead of sending them over the network."""
+
+    def __init__(self, send_delay: float = 0):
+        self.frames: List[Dict[str, Any]] = []
+        self.closed = False
+        self.send_delay = send_delay
+
+    async def send_json(self, data: Dict[str, Any]) -> None:
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        self.frames.append(data)
+
+    async def close(self, code: int = 1000) -> None:
+        self.closed = True
+
+
+class TestWebSocketBatching:
+    """Test coalescing of chunk/thinking deltas into batched frames."""
+
+    @pytest.mark.asyncio
+    async def test_chunks_are_coalesced_per_variant(self):
+        websocket = FakeWebSocket()
+        comm = WebSocketCommunicator(websocket, batch_window_ms=10_000)  # type: ignore
+
+        for token in ["<ht", "ml>", "<body>"]:
+            await comm.send_message("chunk", token, 0)
+        await comm.send_message("chunk", "<div>", 1)
+        assert websocket.frames == []
+
+        await comm.close()
+        assert websocket.frames == [
+            {"type": "chunk", "value": "<html><body>", "variantIndex": 0},
+            {"type": "chunk", "value": "<div>", "variantIndex": 1},
+        ]
+        assert comm.messages_sent == 4
+        assert comm.frames_sent == 2
+        assert comm.frame_reduction_ratio == 2.0
+
+    @pytest.mark.asyncio
+    async def test_set_code_flushes_pending_chunks_first(self):
+        websocket = FakeWebSocket()
+        comm = WebSocketCommunicator(websocket, batch_window_ms=10_000)  # type: ignore
+
+        await comm.send_message("thinking", "hmm", 0)
+        await comm.send_message("chunk", "<html>", 0)
+        await comm.send_message("setCode", "<html></html>", 0)
+        await comm.send_message("variantComplete", "done", 0)
+        await comm.close()
+
+        assert [frame["type"] for frame in websocket.frames] == [
+            "thinking",
+            "chunk",
+            "setCode",
+            "variantComplete",
+        ]
+
+    @pytest.mark.asyncio
+    async def test_window_elapsing_flushes_buffer(self):
+        websocket = FakeWebSocket()
+        comm = WebSocketCommunicator(websocket, batch_window_ms=5)  # type: ignore
+
+        await comm.send_message("chunk", "a", 0)
+        await comm.send_message("chunk", "b", 0)
+        await asyncio.sleep(0.05)
+
+        assert websocket.frames == [{"type": "chunk", "value": "ab", "variantIndex": 0}]
+        await comm.close()
+
+    @pytest.mark.asyncio
+    async def test_byte_threshold_flushes_immediately(self):
+        websocket = FakeWebSocket()
+        comm = WebSocketCommunicator(  # type: ignore
+            websocket, batch_window_ms=10_000, batch_max_bytes=4
+        )
+
+        await comm.send_message("chunk", "ab", 0)
+        assert comm.queue_depth == 0
+        await comm.send_message("chunk", "cd", 0)
+        assert comm.queue_depth == 1
+        await comm.close()
+        assert websocket.frames == [
+            {"type": "chunk", "value": "abcd", "variantIndex": 0}
+        ]
+
+    @pytest.mark.asyncio
+    async def test_batching_disabled_sends_every_delta(self):
+        websocket = FakeWebSocket()
+        comm = WebSocketCommunicator(websocket, batch_window_ms=0)  # type: ignore
+
+        await comm.send_message("chunk", "a", 0)
+        await comm.send_message("chunk", "b", 0)
+        await comm.close()
+
+        assert len(websocket.frames) == 2
+
+
+class TestWebSocketSendQueue:
+    """Test the bounded send queue and its overflow policies."""
+
+    @pytest.mark.asyncio
+    async def test_slow_client_does_not_block_merged_deltas(self):
+        websocket = FakeWebSocket(send_delay=0.05)
+        comm = WebSocketCommunicator(  # type: ignore
+            websocket, batch_window_ms=0, queue_size=1, overflow_policy="merge"
+        )
+
+        # The first delta occupies the queue; later ones are merged, not awaited
+        for token in ["a", "b", "c", "d"]:
+            await asyncio.wait_for(comm.send_message("chunk", token, 0), 0.01)
+        await comm.close()
+
+        assert "".join(frame["value"] for frame in websocket.frames) == "abcd"
+        assert comm.frames_sent < 4
+
+    @pytest.mark.asyncio
+    async def test_drop_thinking_policy_drops_thinking_when_full(self):
+        websocket = FakeWebSocket(send_delay=0.05)
+        comm = WebSocketCommunicator(  # type: ignore
+            websocket, batch_window_ms=0, queue_size=1, overflow_policy="drop_thinking"
+        )
+
+        await comm.send_message("chunk", "a", 0)
+        await comm.send_message("thinking", "dropped", 0)
+        await comm.close()
+
+        assert comm.dropped_messages == 1
+        assert [frame["type"] for frame in websocket.frames] == ["chunk"]
+
+    @pytest.mark.asyncio
+    async def test_abort_policy_closes_connection(self):
+        websocket = FakeWebSocket(send_delay=0.05)
+        comm = WebSocketCommunicator(  # type: ignore
+            websocket, batch_window_ms=0, queue_size=1, overflow_policy="abort"
+        )
+
+        await comm.send_message("status", "one", 0)
+        await comm.send_message("status", "two", 0)
+
+        assert comm.is_closed
+        assert websocket.closed
+
+    @pytest.mark.asyncio
+    async def test_control_messages_wait_for_room(self):
+        websocket = FakeWebSocket(send_delay=0.02)
+        comm = WebSocketCommunicator(  # type: ignore
+            websocket, batch_window_ms=0, queue_size=1, overflow_policy="merge"
+        )
+
+        for i in range(3):
+            await comm.send_message("status", str(i), 0)
+        await comm.close()
+
+        assert [frame["value"] for frame in websocket.frames] == ["0", "1", "2"]
+        assert comm.send_blocked_seconds > 0
+        assert comm.max_queue_depth == 1
+
+    def test_invalid_policy_is_rejected(self):
+        with pytest.raises(ValueError, match="Invalid send queue overflow policy"):
+            WebSocketCommunicator(FakeWebSocket(), overflow_policy="bogus")  # type: ignore
+
+
+class TestWebSocketDisconnect:
+    """Test detection of the client closing the socket."""
+
+    @pytest.mark.asyncio
+    async def test_client_disconnect_sets_event(self):
+        class DisconnectingWebSocket(FakeWebSocket):
+            async def receive(self) -> Dict[str, Any]:
+                await asyncio.sleep(0.01)
+                return {"type": "websocket.disconnect", "code": 1001}
+
+        websocket = DisconnectingWebSocket()
+        comm = WebSocketCommunicator(websocket)  # type: ignore
+        comm.watch_for_disconnect()
+
+        await asyncio.wait_for(comm.disconnected.wait(), 1)
+        assert comm.is_closed
+
+        # Later messages are skipped instead of raising
+        await comm.send_message("setCode", "<html></html>", 0)
+        await comm.close()
+        assert websocket.frames == []
+
+    @pytest.mark.asyncio
+    async def test_failed_send_releases_blocked_producers(self):
+        class FailingWebSocket(FakeWebSocket):
+            async def send_json(self, data: Dict[str, Any]) -> None:
+                await asyncio.sleep(0.01)
+                raise RuntimeError('Cannot call "send" once a close message has been sent.')
+
+        websocket = FailingWebSocket()
+        comm = WebSocketCommunicator(  # type: ignore
+            websocket, batch_window_ms=0, queue_size=1, overflow_policy="merge"
+        )
+
+        # The queue fills while the first send fails; none of these may hang
+        for i in range(4):
+            await asyncio.wait_for(comm.send_message("status", str(i), 0), 1)
+        await asyncio.wait_for(comm.close(), 1)
+
+        assert comm.disconnected.is_set()
+        assert comm.is_closed
+        assert websocket.frames == []
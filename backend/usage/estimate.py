@@ -0,0 +1,187 @@
+import math
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Tuple, cast
+
+from openai.types.chat import ChatCompletionMessageParam
+
+from llm import MODEL_PROVIDER, Llm
+from metrics.cancellation import CHARS_PER_TOKEN
+from usage.pricing import MODEL_PROFILES, token_cost
+
+# Role and separator tokens each message adds
+MESSAGE_OVERHEAD_TOKENS = 4
+# Images whose size can't be read (e.g. not decoded yet) are assumed to be
+# a typical screenshot
+DEFAULT_IMAGE_SIZE = (1440, 900)
+
+# Claude scales images down to fit 1568px, then charges width * height / 750
+# https://docs.anthropic.com/en/docs/build-with-claude/vision#evaluate-image-size
+CLAUDE_MAX_IMAGE_SIDE = 1568
+CLAUDE_PIXELS_PER_TOKEN = 750
+CLAUDE_MAX_IMAGE_TOKENS = 1600
+# OpenAI (high detail) fits images in 2048x2048, scales the short side down
+# to 768, then charges per 512px tile
+# https://platform.openai.com/docs/guides/images-vision#calculating-costs
+OPENAI_MAX_IMAGE_SIDE = 2048
+OPENAI_SHORT_SIDE = 768
+OPENAI_TILE_SIDE = 512
+OPENAI_TILE_TOKENS = 170
+OPENAI_IMAGE_BASE_TOKENS = 85
+# Gemini 3 charges a fixed amount per image by media resolution; prompt
+# images are sent at ULTRA_HIGH
+GEMINI_ULTRA_HIGH_IMAGE_TOKENS = 2240
+
+ImageSize = Callable[[str], Tuple[int, int] | None]
+
+
+@dataclass
+class Calibration:
+    """A model's recent actual usage, from the usage ledger"""
+
+    samples: int
+    # Actual input tokens per counted input token
+    input_ratio: float
+    # Average actual output tokens (including thinking) and duration
+    output_tokens: float
+    seconds: float
+
+
+@dataclass
+class UsageEstimate:
+    model: Llm
+    # Input tokens as counted from the prompt, before calibration
+    counted_input_tokens: int
+    input_tokens: int
+    output_tokens: int
+    cost: float
+    # Cost if the model uses all of its max output tokens
+    max_cost: float
+    seconds: float
+    calibrated: bool = False
+
+
+def text_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def claude_image_tokens(width: int, height: int) -> int:
+    scale = min(1.0, CLAUDE_MAX_IMAGE_SIDE / max(width, height))
+    tokens = (width * scale) * (height * scale) / CLAUDE_PIXELS_PER_TOKEN
+    return min(CLAUDE_MAX_IMAGE_TOKENS, math.ceil(tokens))
+
+
+def openai_image_tokens(width: int, height: int) -> int:
+    scale = min(1.0, OPENAI_MAX_IMAGE_SIDE / max(width, height))
+    scaled_width, scaled_height = width * scale, height * scale
+    scale = min(1.0, OPENAI_SHORT_SIDE / min(scaled_width, scaled_height))
+    tiles = math.ceil(scaled_width * scale / OPENAI_TILE_SIDE) * math.ceil(
+        scaled_height * scale / OPENAI_TILE_SIDE
+    )
+    return OPENAI_IMAGE_BASE_TOKENS + OPENAI_TILE_TOKENS * tiles
+
+
+def image_tokens(model: Llm, width: int, height: int) -> int:
+    """Input tokens for an image of the given size, as the model's provider counts them"""
+    provider = MODEL_PROVIDER[model]
+    if provider == "anthropic":
+        return claude_image_tokens(width, height)
+    if provider == "openai":
+        return openai_image_tokens(width, height)
+    return GEMINI_ULTRA_HIGH_IMAGE_TOKENS
+
+
+def count_input_tokens(
+    model: Llm,
+    messages: List[ChatCompletionMessageParam],
+    image_size: ImageSize = lambda _: None,
+) -> int:
+    """Input tokens of an OpenAI-style prompt for model. image_size gives
+    the (width, height) of an image URL, if it's known."""
+    tokens = 0
+    for message in messages:
+        tokens += MESSAGE_OVERHEAD_TOKENS
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += text_tokens(content)
+            continue
+        for part in cast(List[Dict[str, Any]], content or []):
+            if part.get("type") == "text":
+                tokens += text_tokens(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                width, height = image_size(part["image_url"]["url"]) or DEFAULT_IMAGE_SIZE
+                tokens += image_tokens(model, width, height)
+    return tokens
+
+
+def estimate_usage(
+    model: Llm, counted_input_tokens: int, calibration: Calibration | None = None
+) -> UsageEstimate:
+    """Expected tokens, cost and time of a generation with counted_input_tokens
+    of input, from the model's profile or, once there's enough history, its
+    calibration"""
+    profile = MODEL_PROFILES[model]
+    if calibration is None:
+        input_tokens = counted_input_tokens
+        output_tokens = profile.expected_output_tokens
+        seconds = (
+            profile.time_to_first_token_seconds
+            + output_tokens / profile.output_tokens_per_second
+        )
+    else:
+        input_tokens = round(counted_input_tokens * calibration.input_ratio)
+        output_tokens = round(calibration.output_tokens)
+        seconds = calibration.seconds
+    output_tokens = min(output_tokens, profile.max_output_tokens)
+
+    return UsageEstimate(
+        model=model,
+        counted_input_tokens=counted_input_tokens,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        cost=token_cost(model, input_tokens, output_tokens),
+        max_cost=token_cost(model, input_tokens, profile.max_output_tokens),
+        seconds=seconds,
+        calibrated=calibration is not None,
+    )
+
+
+def over_budget(
+    estimates: List[UsageEstimate],
+    max_request_cost: float | None,
+    max_variant_cost: float | None,
+) -> Dict[int, str]:
+    """Indexes of the variants to drop to stay within budget, with the reason.
+
+    Variants estimated to cost more than max_variant_cost are dropped first,
+    then the most expensive remaining ones until the total is within
+    max_request_cost. The cheapest variant is always kept, so a request
+    still produces something when every estimate is over budget.
+    """
+    if not estimates:
+        return {}
+    cheapest = min(range(len(estimates)), key=lambda i: estimates[i].cost)
+    dropped: Dict[int, str] = {}
+
+    if max_variant_cost:
+        for index, estimate in enumerate(estimates):
+            if index != cheapest and estimate.cost > max_variant_cost:
+                dropped[index] = (
+                    f"Estimated cost ${estimate.cost:.2f} is over the "
+                    f"${max_variant_cost:.2f} per-variant limit"
+                )
+
+    if max_request_cost:
+        kept = [i for i in range(len(estimates)) if i not in dropped]
+        total = sum(estimates[i].cost for i in kept)
+        for index in sorted(kept, key=lambda i: estimates[i].cost, reverse=True):
+            if total <= max_request_cost:
+                break
+            if index == cheapest:
+                continue
+            total -= estimates[index].cost
+            dropped[index] = (
+                f"Request estimate is over the ${max_request_cost:.2f} limit "
+                f"(this variant: ${estimates[index].cost:.2f})"
+            )
+
+    return dropped
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Tuple, TypedDict
+
+from config import USAGE_LEDGER_ENABLED, USAGE_LEDGER_MAX_RECORDS, USAGE_LEDGER_PATH
+from llm import Llm
+from usage.estimate import Calibration
+
+# Estimates are calibrated from a model's most recent records, once it has
+# at least CALIBRATION_MIN_SAMPLES for the input mode and generation type
+CALIBRATION_WINDOW = 50
+CALIBRATION_MIN_SAMPLES = 3
+
+
+class UsageRecord(TypedDict):
+    time: float
+    model: str
+    input_mode: str
+    generation_type: str
+    # Pre-flight estimate
+    counted_input_tokens: int
+    estimated_input_tokens: int
+    estimated_output_tokens: int
+    estimated_cost: float
+    estimated_seconds: float
+    # As reported by the provider (output includes thinking)
+    input_tokens: int
+    output_tokens: int
+    cost: float
+    seconds: float
+
+
+class UsageLedger:
+    """Estimated and actual usage of each variant, appended to a JSONL file.
+
+    The most recent records per (model, input mode, generation type) are
+    kept in memory to calibrate estimates. Once the file has more than
+    max_records records it's rewritten with the newest half.
+    """
+
+    def __init__(self, path: Path, max_records: int = USAGE_LEDGER_MAX_RECORDS):
+        self.path = path
+        self.max_records = max_records
+        self._lock = threading.Lock()
+        self._recent: Dict[Tuple[str, str, str], Deque[UsageRecord]] | None = None
+        self._records = 0
+
+    def _read(self) -> List[UsageRecord]:
+        records: List[UsageRecord] = []
+        try:
+            with self.path.open() as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue  # A partial line from an interrupted write
+        except OSError:
+            pass
+        return records
+
+    def _load(self) -> Dict[Tuple[str, str, str], Deque[UsageRecord]]:
+        if self._recent is None:
+            self._recent = {}
+            records = self._read()
+            self._records = len(records)
+            for record in records:
+                self._remember(record)
+        return self._recent
+
+    def _remember(self, record: UsageRecord) -> None:
+        assert self._recent is not None
+        key = (record["model"], record["input_mode"], record["generation_type"])
+        self._recent.setdefault(key, deque(maxlen=CALIBRATION_WINDOW)).append(record)
+
+    def _compact(self) -> None:
+        keep = self._read()[-(self.max_records // 2) :]
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text("".join(json.dumps(record) + "\n" for record in keep))
+        tmp_path.replace(self.path)
+        self._records = len(keep)
+
+    def record(self, record: UsageRecord) -> None:
+        with self._lock:
+            self._load()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a") as f:
+                f.write(json.dumps(record) + "\n")
+            self._records += 1
+            self._remember(record)
+            if self._records > self.max_records:
+                self._compact()
+
+    def calibration(
+        self, model: Llm, input_mode: str, generation_type: str
+    ) -> Calibration | None:
+        with self._lock:
+            records = self._load().get((model.value, input_mode, generation_type))
+            if not records or len(records) < CALIBRATION_MIN_SAMPLES:
+                return None
+            counted = sum(r["counted_input_tokens"] for r in records)
+            return Calibration(
+                samples=len(records),
+                input_ratio=(
+                    sum(r["input_tokens"] for r in records) / counted if counted else 1.0
+                ),
+                output_tokens=sum(r["output_tokens"] for r in records) / len(records),
+                seconds=sum(r["seconds"] for r in records) / len(records),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._load()
+            return self._records
+
+
+usage_ledger = UsageLedger(Path(USAGE_LEDGER_PATH))
+
+
+def get_calibration(
+    model: Llm, input_mode: str, generation_type: str
+) -> Calibration | None:
+    if not USAGE_LEDGER_ENABLED:
+        return None
+    return usage_ledger.calibration(model, input_mode, generation_type)
+
+
+async def record_usage(record: UsageRecord) -> None:
+    if not USAGE_LEDGER_ENABLED:
+        return
+    try:
+        await asyncio.to_thread(usage_ledger.record, record)
+    except OSError as e:
+        print(f"[USAGE] Failed to record usage: {e}")
@@ -0,0 +1,108 @@
+from dataclasses import dataclass
+from typing import Dict
+
+from llm import Llm
+
+
+@dataclass(frozen=True)
+class ModelProfile:
+    """Pricing and throughput of a model, as we call it"""
+
+    # USD per million tokens. Thinking tokens are billed as output.
+    input_per_million: float
+    output_per_million: float
+    # max_tokens (or equivalent) we request, including any thinking budget
+    max_output_tokens: int
+    # Typical output, including thinking, of a generation; replaced by the
+    # ledger's average once it has enough samples for the model
+    expected_output_tokens: int
+    # Typical streaming rate and time to first streamed token (thinking
+    # models think before streaming code)
+    output_tokens_per_second: float
+    time_to_first_token_seconds: float
+
+
+# Every Llm must have a profile (checked below), so new models can't be
+# dispatched without cost accounting.
+# https://openai.com/api/pricing
+# https://www.anthropic.com/pricing#api
+# https://ai.google.dev/gemini-api/docs/pricing
+MODEL_PROFILES: Dict[Llm, ModelProfile] = {
+    Llm.GPT_4_1_2025_04_14: ModelProfile(
+        input_per_million=2.00,
+        output_per_million=8.00,
+        max_output_tokens=20000,
+        expected_output_tokens=6000,
+        output_tokens_per_second=80,
+        time_to_first_token_seconds=1.0,
+    ),
+    Llm.GPT_5_2_2025_12_11: ModelProfile(
+        input_per_million=1.75,
+        output_per_million=14.00,
+        max_output_tokens=32000,
+        expected_output_tokens=12000,
+        output_tokens_per_second=60,
+        time_to_first_token_seconds=15.0,
+    ),
+    Llm.CLAUDE_4_5_SONNET_2025_09_29: ModelProfile(
+        input_per_million=3.00,
+        output_per_million=15.00,
+        max_output_tokens=30000,
+        expected_output_tokens=12000,
+        output_tokens_per_second=70,
+        time_to_first_token_seconds=10.0,
+    ),
+    Llm.CLAUDE_4_5_OPUS_2025_11_01: ModelProfile(
+        input_per_million=5.00,
+        output_per_million=25.00,
+        max_output_tokens=30000,
+        expected_output_tokens=14000,
+        output_tokens_per_second=50,
+        time_to_first_token_seconds=15.0,
+    ),
+    Llm.GEMINI_3_FLASH_PREVIEW_HIGH: ModelProfile(
+        input_per_million=0.50,
+        output_per_million=3.00,
+        max_output_tokens=50000,
+        expected_output_tokens=14000,
+        output_tokens_per_second=150,
+        time_to_first_token_seconds=8.0,
+    ),
+    Llm.GEMINI_3_FLASH_PREVIEW_MINIMAL: ModelProfile(
+        input_per_million=0.50,
+        output_per_million=3.00,
+        max_output_tokens=50000,
+        expected_output_tokens=8000,
+        output_tokens_per_second=150,
+        time_to_first_token_seconds=2.0,
+    ),
+    Llm.GEMINI_3_PRO_PREVIEW_HIGH: ModelProfile(
+        input_per_million=2.00,  # prompts <= 200k tokens
+        output_per_million=12.00,
+        max_output_tokens=50000,
+        expected_output_tokens=16000,
+        output_tokens_per_second=80,
+        time_to_first_token_seconds=20.0,
+    ),
+    Llm.GEMINI_3_PRO_PREVIEW_LOW: ModelProfile(
+        input_per_million=2.00,
+        output_per_million=12.00,
+        max_output_tokens=50000,
+        expected_output_tokens=10000,
+        output_tokens_per_second=80,
+        time_to_first_token_seconds=8.0,
+    ),
+}
+
+_missing = set(Llm) - set(MODEL_PROFILES)
+if _missing:
+    raise RuntimeError(f"No pricing profile for {sorted(m.value for m in _missing)}")
+
+
+def token_cost(model: Llm, input_tokens: int, output_tokens: int) -> float:
+    """Cost in USD of a call to model"""
+    profile = MODEL_PROFILES[model]
+    return (
+        input_tokens * profile.input_per_million
+        + output_tokens * profile.output_per_million
+    ) / 1_000_000
@@ -7,7 +7,9 @@ from video.cost_estimation import (
     estimate_video_input_tokens,
     format_cost_estimate,
     get_video_duration_from_bytes,
+    get_video_duration_from_file,
 )
+from video.probe import probe_video_duration
 from video.utils import (
     extract_tag_content,
     get_video_bytes_and_mime_type,
@@ -23,6 +25,8 @@ __all__ = [
     "estimate_video_input_tokens",
     "format_cost_estimate",
     "get_video_duration_from_bytes",
+    "get_video_duration_from_file",
+    "probe_video_duration",
     # Video utilities
     "extract_tag_content",
     "get_video_bytes_and_mime_type",
@@ -1,7 +1,10 @@
+import mmap
 from dataclasses import dataclass
 from enum import Enum
 from typing import Tuple
 from llm import Llm
+from usage.pricing import MODEL_PROFILES, token_cost
+from video.probe import probe_video_duration
 
 
 class MediaResolution(Enum):
@@ -34,31 +37,17 @@ VIDEO_TOKENS_PER_FRAME = {
     MediaResolution.HIGH: 280,
 }
 
-# Prompt overhead (system prompt + user text)
-PROMPT_TOKENS_ESTIMATE = 1200
-
-# Pricing per million tokens (USD)
-# https://ai.google.dev/gemini-api/docs/pricing
-GEMINI_PRICING = {
-    # Gemini 3 Flash Preview
-    "gemini-3-flash-preview": {
-        "input_per_million": 0.50,  # text/image/video
-        "output_per_million": 3.00,  # including thinking tokens
-    },
-    # Gemini 3 Pro Preview
-    "gemini-3-pro-preview": {
-        "input_per_million": 2.00,  # prompts <= 200k tokens
-        "output_per_million": 12.00,  # including thinking tokens
-    },
+# Gemini 3 image token counts, for videos sent as keyframe images
+IMAGE_TOKENS_PER_KEYFRAME = {
+    MediaResolution.LOW: 280,
+    MediaResolution.MEDIUM: 560,
+    MediaResolution.HIGH: 1120,
 }
+# The timestamp label sent with each keyframe
+KEYFRAME_LABEL_TOKENS = 8
 
-
-def get_model_api_name(model: Llm) -> str:
-    if model in [Llm.GEMINI_3_FLASH_PREVIEW_HIGH, Llm.GEMINI_3_FLASH_PREVIEW_MINIMAL]:
-        return "gemini-3-flash-preview"
-    elif model in [Llm.GEMINI_3_PRO_PREVIEW_HIGH, Llm.GEMINI_3_PRO_PREVIEW_LOW]:
-        return "gemini-3-pro-preview"
-    return model.value
+# Prompt overhead (system prompt + user text)
+PROMPT_TOKENS_ESTIMATE = 1200
 
 
 def estimate_video_input_tokens(
@@ -77,6 +66,14 @@ def estimate_video_input_tokens(
     return total_tokens
 
 
+def estimate_keyframe_input_tokens(
+    keyframe_count: int,
+    media_resolution: MediaResolution = MediaResolution.HIGH,
+) -> int:
+    tokens_per_keyframe = IMAGE_TOKENS_PER_KEYFRAME[media_resolution] + KEYFRAME_LABEL_TOKENS
+    return keyframe_count * tokens_per_keyframe + PROMPT_TOKENS_ESTIMATE
+
+
 def estimate_output_tokens(
     max_output_tokens: int = 50000,
     thinking_level: str = "high",
@@ -104,17 +101,14 @@ def calculate_cost(
     output_tokens: int,
     model: Llm,
 ) -> CostEstimate:
-    model_name = get_model_api_name(model)
-    pricing = GEMINI_PRICING.get(model_name, GEMINI_PRICING["gemini-3-flash-preview"])
-
-    input_cost = (input_tokens / 1_000_000) * pricing["input_per_million"]
-    output_cost = (output_tokens / 1_000_000) * pricing["output_per_million"]
-    total_cost = input_cost + output_cost
+    profile = MODEL_PROFILES[model]
+    input_cost = (input_tokens / 1_000_000) * profile.input_per_million
+    output_cost = (output_tokens / 1_000_000) * profile.output_per_million
 
     return CostEstimate(
         input_cost=input_cost,
         output_cost=output_cost,
-        total_cost=total_cost,
+        total_cost=token_cost(model, input_tokens, output_tokens),
         input_tokens=input_tokens,
         output_tokens=output_tokens,
     )
@@ -166,9 +160,8 @@ def format_detailed_input_estimate(
     frame_tokens = int(total_frames * tokens_per_frame)
     total_input_tokens = frame_tokens + PROMPT_TOKENS_ESTIMATE
 
-    model_name = get_model_api_name(model)
-    pricing = GEMINI_PRICING.get(model_name, GEMINI_PRICING["gemini-3-flash-preview"])
-    input_cost = (total_input_tokens / 1_000_000) * pricing["input_per_million"]
+    input_per_million = MODEL_PROFILES[model].input_per_million
+    input_cost = (total_input_tokens / 1_000_000) * input_per_million
 
     return (
         f"Input Token Calculation:\n"
@@ -176,29 +169,87 @@ def format_detailed_input_estimate(
         f"  Frame tokens: {total_frames:.1f} × {tokens_per_frame} tokens/frame = {frame_tokens:,} tokens\n"
         f"  Prompt overhead: {PROMPT_TOKENS_ESTIMATE:,} tokens\n"
         f"  Total input: {total_input_tokens:,} tokens\n"
-        f"  Cost: {total_input_tokens:,} ÷ 1M × ${pricing['input_per_million']:.2f} = ${input_cost:.4f}"
+        f"  Cost: {total_input_tokens:,} ÷ 1M × ${input_per_million:.2f} = ${input_cost:.4f}"
+    )
+
+
+def format_keyframe_savings(
+    video_duration_seconds: float,
+    fps: float,
+    keyframe_count: int,
+    media_resolution: MediaResolution,
+    model: Llm,
+) -> str:
+    video_tokens = estimate_video_input_tokens(video_duration_seconds, fps, media_resolution)
+    keyframe_tokens = estimate_keyframe_input_tokens(keyframe_count, media_resolution)
+    tokens_per_keyframe = IMAGE_TOKENS_PER_KEYFRAME[media_resolution] + KEYFRAME_LABEL_TOKENS
+
+    saved_tokens = video_tokens - keyframe_tokens
+    saved_cost = (saved_tokens / 1_000_000) * MODEL_PROFILES[model].input_per_million
+    saved_pct = saved_tokens / video_tokens * 100 if video_tokens else 0.0
+
+    return (
+        f"Keyframe Input Calculation:\n"
+        f"  Keyframes: {keyframe_count} × {tokens_per_keyframe} tokens/keyframe = {keyframe_count * tokens_per_keyframe:,} tokens\n"
+        f"  Prompt overhead: {PROMPT_TOKENS_ESTIMATE:,} tokens\n"
+        f"  Total input: {keyframe_tokens:,} tokens (video at {fps} fps: {video_tokens:,} tokens)\n"
+        f"  Saved: {saved_tokens:,} tokens ({saved_pct:.1f}%, ${saved_cost:.4f})"
     )
 
 
 def get_video_duration_from_bytes(video_bytes: bytes) -> float | None:
+    """Read the duration from the container headers, falling back to
+    opening the video with moviepy (ffmpeg) for other containers"""
+    duration = probe_video_duration(video_bytes)
+    if duration is not None:
+        return duration
+    return _get_video_duration_with_moviepy(video_bytes)
+
+
+def get_video_duration_from_file(path: str) -> float | None:
+    """get_video_duration_from_bytes for a video on disk (e.g. an uploaded
+    one). The headers are probed through a memory map, and moviepy opens the
+    file in place instead of a temporary copy."""
+    try:
+        with open(path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            duration = probe_video_duration(data)
+    except (OSError, ValueError) as e:
+        print(f"Error probing video duration: {e}")
+        duration = None
+    if duration is not None:
+        return duration
+    return _get_video_file_duration_with_moviepy(path)
+
+
+def _get_video_file_duration_with_moviepy(path: str) -> float | None:
     try:
-        import tempfile
-        import os
         from moviepy.editor import VideoFileClip
 
-        # Write bytes to a temporary file
+        clip = VideoFileClip(path)
+        duration = clip.duration
+        clip.close()
+        return duration
+    except Exception as e:
+        print(f"Error getting video duration: {e}")
+        return None
+
+
+def _get_video_duration_with_moviepy(video_bytes: bytes) -> float | None:
+    import tempfile
+    import os
+
+    # Write bytes to a temporary file
+    try:
         with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as tmp_file:
             tmp_file.write(video_bytes)
             tmp_path = tmp_file.name
-
-        try:
-            clip = VideoFileClip(tmp_path)
-            duration = clip.duration
-            clip.close()
-            return duration
-        finally:
-            os.unlink(tmp_path)
-
     except Exception as e:
         print(f"Error getting video duration: {e}")
         return None
+
+    try:
+        return _get_video_file_duration_with_moviepy(tmp_path)
+    finally:
+        os.unlink(tmp_path)
@@ -0,0 +1,158 @@
+import io
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Tuple
+
+from PIL import Image, ImageChops
+
+from config import (
+    VIDEO_KEYFRAME_CHANGE_THRESHOLD,
+    VIDEO_KEYFRAME_MAX_FRAMES,
+    VIDEO_KEYFRAME_SAMPLE_FPS,
+)
+
+# Frames are compared as small grayscale thumbnails of this width
+FINGERPRINT_WIDTH = 192
+# A thumbnail pixel counts as changed if it differs by more than this
+PIXEL_CHANGE_LEVEL = 16
+# A change is kept once the screen stops changing, or after this long if
+# it never does (e.g. while scrolling)
+MAX_SETTLE_SECONDS = 1.0
+KEYFRAME_MAX_SIDE = 1920
+KEYFRAME_JPEG_QUALITY = 85
+
+
+@dataclass
+class Keyframe:
+    """A frame where the UI settled into a new state"""
+
+    timestamp: float
+    data: bytes
+    mime_type: str = "image/jpeg"
+
+
+def fingerprint(frame: Image.Image) -> Image.Image:
+    height = max(1, round(frame.height * FINGERPRINT_WIDTH / frame.width))
+    return frame.convert("L").resize((FINGERPRINT_WIDTH, height), Image.Resampling.BILINEAR)
+
+
+def changed_fraction(a: Image.Image, b: Image.Image) -> float:
+    """Fraction of fingerprint pixels that differ noticeably between a and b"""
+    difference = ImageChops.difference(a, b).point(
+        lambda v: 255 if v > PIXEL_CHANGE_LEVEL else 0
+    )
+    histogram = difference.histogram()
+    return histogram[255] / (a.width * a.height)
+
+
+def _keep(
+    kept: List[Tuple[float, Image.Image, float]],
+    frame: Tuple[float, Image.Image, float],
+    max_frames: int,
+) -> None:
+    """Append frame, dropping the smallest change (never the first frame)
+    once there are more than max_frames, so long videos stay bounded"""
+    kept.append(frame)
+    if len(kept) > max_frames:
+        smallest = min(range(1, len(kept)), key=lambda i: kept[i][2])
+        del kept[smallest]
+
+
+def select_keyframes(
+    frames: Iterable[Tuple[float, Image.Image]],
+    threshold: float = VIDEO_KEYFRAME_CHANGE_THRESHOLD,
+    max_frames: int = VIDEO_KEYFRAME_MAX_FRAMES,
+) -> List[Tuple[float, Image.Image]]:
+    """The (timestamp, frame) pairs where the screen changed and then settled.
+
+    The first frame is always kept. A later frame is kept when it differs
+    from the last kept frame by at least threshold and from the frame
+    before it by less (so transitions and animations aren't captured half
+    way), or when a change hasn't settled within MAX_SETTLE_SECONDS. If
+    there are more than max_frames, the ones with the smallest changes
+    are dropped.
+    """
+    kept: List[Tuple[float, Image.Image, float]] = []  # (time, frame, change)
+    kept_print: Image.Image | None = None
+    previous_print: Image.Image | None = None
+    change_started: float | None = None
+    last: Tuple[float, Image.Image, Image.Image] | None = None
+
+    for timestamp, frame in frames:
+        frame_print = fingerprint(frame)
+        last = (timestamp, frame, frame_print)
+        if kept_print is None or previous_print is None:
+            kept.append((timestamp, frame, 1.0))
+            kept_print = previous_print = frame_print
+            continue
+
+        change = changed_fraction(frame_print, kept_print)
+        if change < threshold:
+            change_started = None
+        else:
+            if change_started is None:
+                change_started = timestamp
+            settled = changed_fraction(frame_print, previous_print) < threshold
+            if settled or timestamp - change_started >= MAX_SETTLE_SECONDS:
+                _keep(kept, (timestamp, frame, change), max_frames)
+                kept_print = frame_print
+                change_started = None
+        previous_print = frame_print
+
+    # The end state, if the video stops in the middle of a change
+    if last is not None and kept_print is not None and last[0] != kept[-1][0]:
+        change = changed_fraction(last[2], kept_print)
+        if change >= threshold:
+            _keep(kept, (last[0], last[1], change), max_frames)
+
+    return [(timestamp, frame) for timestamp, frame, _ in kept]
+
+
+def _decode_file_frames(path: str, fps: float) -> Iterator[Tuple[float, Image.Image]]:
+    from moviepy.editor import VideoFileClip
+
+    clip = VideoFileClip(path, audio=False)
+    try:
+        for timestamp, frame in clip.iter_frames(fps=fps, with_times=True):
+            yield timestamp, Image.fromarray(frame)
+    finally:
+        clip.close()
+
+
+def _decode_frames(video: bytes | str, fps: float) -> Iterator[Tuple[float, Image.Image]]:
+    if isinstance(video, str):
+        yield from _decode_file_frames(video, fps)
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as tmp_file:
+        tmp_file.write(video)
+        tmp_path = tmp_file.name
+    try:
+        yield from _decode_file_frames(tmp_path, fps)
+    finally:
+        os.unlink(tmp_path)
+
+
+def encode_keyframe(timestamp: float, frame: Image.Image) -> Keyframe:
+    frame = frame.convert("RGB")
+    frame.thumbnail((KEYFRAME_MAX_SIDE, KEYFRAME_MAX_SIDE))
+    output = io.BytesIO()
+    frame.save(output, format="JPEG", quality=KEYFRAME_JPEG_QUALITY)
+    return Keyframe(timestamp, output.getvalue())
+
+
+def extract_keyframes(
+    video: bytes | str, sample_fps: float = VIDEO_KEYFRAME_SAMPLE_FPS
+) -> List[Keyframe] | None:
+    """Decode a video (its bytes, or the path of a video file) and return the
+    frames where its UI changes, as JPEGs. None if the video can't be
+    decoded. Runs in the media worker pool."""
+    try:
+        selected = select_keyframes(_decode_frames(video, sample_fps))
+    except Exception as e:
+        print(f"Error extracting video keyframes: {e}")
+        return None
+    if not selected:
+        return None
+    return [encode_keyframe(timestamp, frame) for timestamp, frame in selected]
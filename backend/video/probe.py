@@ -0,0 +1,144 @@
+import mmap
+import struct
+from typing import Iterator, Tuple
+
+# Anything readable by slicing, including an mmap of an uploaded video
+Buffer = bytes | bytearray | memoryview | mmap.mmap
+
+MP4_CONTAINER_BOXES = {b"moov"}
+# Big enough for any real mvhd; the box is ~108 bytes
+MVHD_MAX_BYTES = 4096
+
+EBML_MAGIC = b"\x1a\x45\xdf\xa3"
+MATROSKA_SEGMENT = 0x18538067
+MATROSKA_INFO = 0x1549A966
+MATROSKA_TIMECODE_SCALE = 0x2AD7B1
+MATROSKA_DURATION = 0x4489
+MATROSKA_DEFAULT_TIMECODE_SCALE = 1_000_000  # nanoseconds per tick
+
+
+def _mp4_boxes(data: Buffer, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """(type, payload start, box end) for each box in data[start:end]"""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack(">I4s", data[offset : offset + 8])
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            (size,) = struct.unpack(">Q", data[offset + 8 : offset + 16])
+            header = 16
+        elif size == 0:
+            # Extends to the end of the file
+            size = end - offset
+        if size < header:
+            return
+        yield box_type, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _mp4_duration(data: Buffer) -> float | None:
+    """Duration from the movie header (moov/mvhd) of an MP4 or MOV file.
+
+    Only box headers are read while walking the file, so a large mdat
+    before the moov box is skipped over rather than scanned.
+    """
+    for box_type, start, end in _mp4_boxes(data, 0, len(data)):
+        if box_type not in MP4_CONTAINER_BOXES:
+            continue
+        for child_type, child_start, child_end in _mp4_boxes(data, start, end):
+            if child_type != b"mvhd":
+                continue
+            mvhd = bytes(data[child_start : min(child_end, child_start + MVHD_MAX_BYTES)])
+            version = mvhd[0] if mvhd else None
+            if version == 0 and len(mvhd) >= 20:
+                timescale, duration = struct.unpack(">II", mvhd[12:20])
+            elif version == 1 and len(mvhd) >= 32:
+                timescale, duration = struct.unpack(">IQ", mvhd[20:32])
+            else:
+                return None
+            if timescale == 0:
+                return None
+            return duration / timescale
+    return None
+
+
+def _read_vint(data: Buffer, offset: int, keep_marker: bool) -> Tuple[int, int] | None:
+    """(value, length) of the EBML variable-size integer at offset. Element
+    IDs keep their length marker bit; sizes don't. A size with all value
+    bits set ("unknown size") is returned as -1."""
+    if offset >= len(data):
+        return None
+    first = data[offset]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8 or offset + length > len(data):
+        return None
+    value = first if keep_marker else first & (mask - 1)
+    for byte in data[offset + 1 : offset + length]:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return -1, length
+    return value, length
+
+
+def _ebml_elements(
+    data: Buffer, start: int, end: int
+) -> Iterator[Tuple[int, int, int]]:
+    """(element ID, payload start, payload end) for each element in data[start:end]"""
+    offset = start
+    while offset < end:
+        element_id = _read_vint(data, offset, keep_marker=True)
+        if element_id is None:
+            return
+        size = _read_vint(data, offset + element_id[1], keep_marker=False)
+        if size is None:
+            return
+        payload_start = offset + element_id[1] + size[1]
+        payload_end = end if size[0] == -1 else min(payload_start + size[0], end)
+        yield element_id[0], payload_start, payload_end
+        offset = payload_end
+
+
+def _webm_duration(data: Buffer) -> float | None:
+    """Duration from the Segment Info of a WebM or Matroska file"""
+    for element_id, start, end in _ebml_elements(data, 0, len(data)):
+        if element_id != MATROSKA_SEGMENT:
+            continue
+        for child_id, child_start, child_end in _ebml_elements(data, start, end):
+            if child_id != MATROSKA_INFO:
+                continue
+            timecode_scale = MATROSKA_DEFAULT_TIMECODE_SCALE
+            duration = None
+            for info_id, info_start, info_end in _ebml_elements(
+                data, child_start, child_end
+            ):
+                payload = bytes(data[info_start:info_end])
+                if info_id == MATROSKA_TIMECODE_SCALE and payload:
+                    timecode_scale = int.from_bytes(payload, "big")
+                elif info_id == MATROSKA_DURATION and len(payload) in (4, 8):
+                    (duration,) = struct.unpack(
+                        ">f" if len(payload) == 4 else ">d", payload
+                    )
+            if duration is None:
+                return None
+            return duration * timecode_scale / 1e9
+        return None
+    return None
+
+
+def probe_video_duration(data: Buffer) -> float | None:
+    """Duration in seconds read from the container headers of an MP4, MOV or
+    WebM video, without decoding it. None if the container isn't recognized
+    or doesn't record a duration."""
+    try:
+        if data[:4] == EBML_MAGIC:
+            return _webm_duration(data)
+        if data[4:8] in (b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip"):
+            return _mp4_duration(data)
+    except (struct.error, IndexError, ValueError):
+        return None
+    return None
@@ -0,0 +1,252 @@
+import asyncio
+import time
+import uuid
+from collections import deque
+from typing import TYPE_CHECKING, Any, Deque, Dict, List, Tuple
+
+from config import (
+    GENERATION_SESSION_TTL_SECONDS,
+    SESSION_REPLAY_BUFFER_BYTES,
+    SESSION_RESUME_GRACE_SECONDS,
+)
+
+if TYPE_CHECKING:
+    from routes.generate_code import MessageType, WebSocketCommunicator
+
+# Messages that end a variant. They are always kept so a resumed client ends up
+# with the same final state.
+FINAL_MESSAGE_TYPES = {"variantComplete", "variantError"}
+
+
+def utf16_length(text: str) -> int:
+    """Length of text as counted by JavaScript's String.length"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def utf16_slice(text: str, start: int) -> str:
+    """text[start:] where start is a UTF-16 code unit offset"""
+    return text.encode("utf-16-le")[start * 2 :].decode("utf-16-le")
+
+
+class VariantReplayBuffer:
+    """Ring buffer of the chunk text streamed for one variant.
+
+    Offsets are UTF-16 code units of chunk text, i.e. how long the client's
+    accumulated code for the variant is. A setCode replaces the client's
+    code, so only the latest one is kept and offsets restart after it.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.chunks: Deque[Tuple[int, str]] = deque()  # (start offset, text)
+        self.start_offset = 0
+        self.end_offset = 0
+        self.buffered_bytes = 0
+        self.final_messages: List[Tuple["MessageType", str]] = []
+        self.code: str | None = None
+
+    def append(self, text: str) -> None:
+        self.chunks.append((self.end_offset, text))
+        self.end_offset += utf16_length(text)
+        self.buffered_bytes += len(text.encode("utf-8"))
+
+        # Evict the oldest chunks, but always keep the latest one
+        while self.buffered_bytes > self.max_bytes and len(self.chunks) > 1:
+            _, evicted = self.chunks.popleft()
+            self.buffered_bytes -= len(evicted.encode("utf-8"))
+            self.start_offset = self.chunks[0][0]
+
+    def set_code(self, code: str) -> None:
+        """Replace everything buffered with code"""
+        self.chunks.clear()
+        self.start_offset = self.end_offset = 0
+        self.buffered_bytes = 0
+        self.code = code
+
+    def text_since(self, offset: int) -> str | None:
+        """Chunk text after offset, or None if it was already evicted"""
+        if offset < self.start_offset:
+            return None
+
+        parts: List[str] = []
+        for chunk_start, text in self.chunks:
+            chunk_end = chunk_start + utf16_length(text)
+            if chunk_end <= offset:
+                continue
+            if chunk_start < offset:
+                text = utf16_slice(text, offset - chunk_start)
+            parts.append(text)
+        return "".join(parts)
+
+
+class GenerationSession:
+    """Output of one generation, kept so clients can reconnect mid-stream.
+
+    Messages go through the session, which records them and forwards them to
+    the currently attached connection (if any).
+    """
+
+    def __init__(
+        self,
+        replay_buffer_bytes: int = SESSION_REPLAY_BUFFER_BYTES,
+        resume_grace_seconds: float = SESSION_RESUME_GRACE_SECONDS,
+    ):
+        self.id = uuid.uuid4().hex
+        self.replay_buffer_bytes = replay_buffer_bytes
+        self.resume_grace_seconds = resume_grace_seconds
+        self.buffers: Dict[int, VariantReplayBuffer] = {}
+        self.variant_count: str | None = None
+        self.finished_at: float | None = None
+
+        # Set once the generation is done (successfully or not)
+        self.finished = asyncio.Event()
+        # Set when the client went away and didn't come back in time
+        self.abandoned = asyncio.Event()
+
+        self.sink: "WebSocketCommunicator | None" = None
+        # Variants whose replay was incomplete for the current sink. Their
+        # chunks are withheld until setCode replaces the code.
+        self._gapped_variants: set[int] = set()
+        self._lock = asyncio.Lock()
+        self._sink_watcher: asyncio.Task[None] | None = None
+        self._grace_task: asyncio.Task[None] | None = None
+
+    def _buffer(self, variant_index: int) -> VariantReplayBuffer:
+        if variant_index not in self.buffers:
+            self.buffers[variant_index] = VariantReplayBuffer(self.replay_buffer_bytes)
+        return self.buffers[variant_index]
+
+    async def send_message(
+        self, type: "MessageType", value: str, variantIndex: int
+    ) -> None:
+        """Record a message and forward it to the attached client"""
+        async with self._lock:
+            if type == "chunk":
+                self._buffer(variantIndex).append(value)
+            elif type == "setCode":
+                self._buffer(variantIndex).set_code(value)
+            elif type in FINAL_MESSAGE_TYPES:
+                self._buffer(variantIndex).final_messages.append((type, value))
+            elif type == "variantCount":
+                self.variant_count = value
+
+            if self.sink is None:
+                return
+            if type == "chunk" and variantIndex in self._gapped_variants:
+                return
+            await self.sink.send_message(type, value, variantIndex)
+            if type == "setCode":
+                # The client's code is whole again, so later chunks apply to it
+                self._gapped_variants.discard(variantIndex)
+
+    async def throw_error(self, message: str) -> None:
+        if self.sink is not None:
+            await self.sink.throw_error(message)
+
+    async def attach(
+        self,
+        ws_comm: "WebSocketCommunicator",
+        offsets: Dict[int, int] | None = None,
+    ) -> None:
+        """Make ws_comm the live connection, replaying what it missed first.
+
+        offsets maps variant index to how much chunk text the client already
+        has. A fresh connection passes no offsets.
+        """
+        async with self._lock:
+            if offsets is not None:
+                await self._replay(ws_comm, offsets)
+            self.sink = ws_comm
+
+        if self._grace_task is not None:
+            self._grace_task.cancel()
+            self._grace_task = None
+        if self._sink_watcher is not None:
+            self._sink_watcher.cancel()
+        self._sink_watcher = asyncio.create_task(self._watch_sink(ws_comm))
+
+    async def _replay(
+        self, ws_comm: "WebSocketCommunicator", offsets: Dict[int, int]
+    ) -> None:
+        self._gapped_variants = set()
+        if self.variant_count is not None:
+            await ws_comm.send_message("variantCount", self.variant_count, 0)
+
+        for variant_index, buffer in sorted(self.buffers.items()):
+            offset = offsets.get(variant_index, 0)
+            if buffer.code is not None:
+                # The client may not have seen the latest setCode, so it's
+                # resent with everything streamed after it
+                await ws_comm.send_message("setCode", buffer.code, variant_index)
+                offset = 0
+            missed = buffer.text_since(offset)
+            if missed is None:
+                self._gapped_variants.add(variant_index)
+                await ws_comm.send_message(
+                    "status",
+                    "Reconnected. Code will appear when generation completes...",
+                    variant_index,
+                )
+            elif missed:
+                await ws_comm.send_message("chunk", missed, variant_index)
+
+            for type, value in buffer.final_messages:
+                await ws_comm.send_message(type, value, variant_index)
+
+        print(f"[SESSION {self.id[:8]}] Replayed output to reconnected client")
+
+    async def _watch_sink(self, ws_comm: "WebSocketCommunicator") -> None:
+        await ws_comm.disconnected.wait()
+        if self.sink is ws_comm and not self.finished.is_set():
+            self.sink = None
+            print(
+                f"[SESSION {self.id[:8]}] Client disconnected, waiting "
+                f"{self.resume_grace_seconds:.0f}s for it to resume"
+            )
+            self._grace_task = asyncio.create_task(self._abandon_after_grace())
+
+    async def _abandon_after_grace(self) -> None:
+        await asyncio.sleep(self.resume_grace_seconds)
+        if self.sink is None:
+            print(f"[SESSION {self.id[:8]}] Not resumed, cancelling generation")
+            self.abandoned.set()
+
+    def finish(self) -> None:
+        self.finished_at = time.monotonic()
+        self.finished.set()
+        if self._grace_task is not None:
+            self._grace_task.cancel()
+            self._grace_task = None
+        if self._sink_watcher is not None:
+            self._sink_watcher.cancel()
+            self._sink_watcher = None
+
+    def is_expired(self, now: float, ttl: float) -> bool:
+        if self.abandoned.is_set():
+            return True
+        return self.finished_at is not None and now - self.finished_at > ttl
+
+
+_sessions: Dict[str, GenerationSession] = {}
+
+
+def _purge_expired_sessions(ttl: float = GENERATION_SESSION_TTL_SECONDS) -> None:
+    now = time.monotonic()
+    for session_id in [
+        session_id
+        for session_id, session in _sessions.items()
+        if session.is_expired(now, ttl)
+    ]:
+        del _sessions[session_id]
+
+
+def create_session(**kwargs: Any) -> GenerationSession:
+    _purge_expired_sessions()
+    session = GenerationSession(**kwargs)
+    _sessions[session.id] = session
+    return session
+
+
+def get_session(session_id: str) -> GenerationSession | None:
+    _purge_expired_sessions()
+    return _sessions.get(session_id)
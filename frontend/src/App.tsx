@@ -83,11 +83,14 @@ function App() {
       codeGenerationModel: CodeGenerationModel.CLAUDE_4_5_SONNET_2025_09_29,
       // Only relevant for hosted version
       isTermOfServiceAccepted: false,
+      firstK: null,
+      stragglerPolicy: null,
     },
     "setting"
   );
 
   const wsRef = useRef<WebSocket>(null);
+  const uploadAbortRef = useRef<AbortController>(null);
   const [sidebarCollapsed, setSidebarCollapsed] = useState(false);
   const [currentPortfolioHtml, setCurrentPortfolioHtml] = useState("");
   const [isPortfolioFullscreen, setIsPortfolioFullscreen] = useState(true);
@@ -193,6 +196,8 @@ function App() {
 
   // Used when the user cancels the code generation
   const cancelCodeGeneration = () => {
+    // Still uploading media: the socket isn't open yet
+    uploadAbortRef.current?.abort();
     wsRef.current?.close?.(USER_CLOSE_WEB_SOCKET_CODE);
   };
 
@@ -269,7 +274,7 @@ function App() {
     addCommit(commit);
     setHead(commit.hash);
 
-    generateCode(wsRef, updatedParams, {
+    generateCode(wsRef, uploadAbortRef, updatedParams, {
       onChange: (token, variantIndex) => {
         appendCommitCode(commit.hash, variantIndex, token);
       },
@@ -286,6 +291,10 @@ function App() {
         console.error(`Error in variant ${variantIndex}:`, error);
         updateVariantStatus(commit.hash, variantIndex, "error", error);
       },
+      onVariantCancelled: (variantIndex, reason) => {
+        console.log(`Variant ${variantIndex} cancelled: ${reason}`);
+        updateVariantStatus(commit.hash, variantIndex, "cancelled");
+      },
       onVariantCount: (count) => {
         console.log(`Backend is using ${count} variants`);
         resizeVariants(commit.hash, count);
@@ -9,7 +9,7 @@ import {
   DialogTrigger,
 } from "@/components/ui/dialog";
 import { FaCog } from "react-icons/fa";
-import { EditorTheme, Settings } from "../../types";
+import { EditorTheme, Settings, StragglerPolicy } from "../../types";
 import { Switch } from "../ui/switch";
 import { Label } from "../ui/label";
 import { Input } from "../ui/input";
@@ -26,6 +26,14 @@ import {
   AccordionTrigger,
 } from "../ui/accordion";
 
+const FIRST_K_OPTIONS = [1, 2, 3];
+
+const STRAGGLER_POLICY_LABELS: Record<StragglerPolicy | "default", string> = {
+  default: "Server default",
+  cancel: "Are cancelled",
+  deadline: "Keep streaming until a deadline",
+};
+
 interface Props {
   settings: Settings;
   setSettings: React.Dispatch<React.SetStateAction<Settings>>;
@@ -175,6 +183,80 @@ function SettingsDialog({ settings, setSettings }: Props) {
             </AccordionItem>
           </Accordion>
 
+          <Accordion type="single" collapsible className="w-full">
+            <AccordionItem value="item-1">
+              <AccordionTrigger>Variants</AccordionTrigger>
+              <AccordionContent className="space-y-4 flex flex-col">
+                <div className="flex items-center justify-between">
+                  <Label htmlFor="first-k">
+                    <div>Finish the generation after</div>
+                  </Label>
+                  <Select
+                    name="first-k"
+                    value={String(settings.firstK ?? "all")}
+                    onValueChange={(value) =>
+                      setSettings((s) => ({
+                        ...s,
+                        firstK: value === "all" ? null : parseInt(value),
+                      }))
+                    }
+                  >
+                    <SelectTrigger className="w-[180px]">
+                      {settings.firstK
+                        ? `The first ${settings.firstK} variant${
+                            settings.firstK > 1 ? "s" : ""
+                          }`
+                        : "All variants"}
+                    </SelectTrigger>
+                    <SelectContent>
+                      <SelectItem value="all">All variants</SelectItem>
+                      {FIRST_K_OPTIONS.map((k) => (
+                        <SelectItem key={k} value={String(k)}>
+                          The first {k} variant{k > 1 ? "s" : ""}
+                        </SelectItem>
+                      ))}
+                    </SelectContent>
+                  </Select>
+                </div>
+                {settings.firstK && (
+                  <div className="flex items-center justify-between">
+                    <Label htmlFor="straggler-policy">
+                      <div>Then, the other variants</div>
+                    </Label>
+                    <Select
+                      name="straggler-policy"
+                      value={settings.stragglerPolicy ?? "default"}
+                      onValueChange={(value) =>
+                        setSettings((s) => ({
+                          ...s,
+                          stragglerPolicy:
+                            value === "default"
+                              ? null
+                              : (value as StragglerPolicy),
+                        }))
+                      }
+                    >
+                      <SelectTrigger className="w-[180px]">
+                        {STRAGGLER_POLICY_LABELS[
+                          settings.stragglerPolicy ?? "default"
+                        ]}
+                      </SelectTrigger>
+                      <SelectContent>
+                        {Object.entries(STRAGGLER_POLICY_LABELS).map(
+                          ([value, label]) => (
+                            <SelectItem key={value} value={value}>
+                              {label}
+                            </SelectItem>
+                          )
+                        )}
+                      </SelectContent>
+                    </Select>
+                  </div>
+                )}
+              </AccordionContent>
+            </AccordionItem>
+          </Accordion>
+
           <Accordion type="single" collapsible className="w-full">
             <AccordionItem value="item-1">
               <AccordionTrigger>Theme Settings</AccordionTrigger>
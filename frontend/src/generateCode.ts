@@ -5,12 +5,19 @@ import {
   USER_CLOSE_WEB_SOCKET_CODE,
 } from "./constants";
 import { FullGenerationSettings } from "./types";
+import { uploadGenerationMedia } from "./lib/uploadMedia";
 
 const ERROR_MESSAGE =
   "Error generating code. Check the Developer Console AND the backend logs for details. Feel free to open a Github issue.";
 
 const CANCEL_MESSAGE = "Code generation cancelled";
 
+// Close code for connections that dropped without a close frame
+// (proxy timeouts, laptop sleeping, network changes)
+const ABNORMAL_CLOSURE_CODE = 1006;
+const MAX_RESUME_ATTEMPTS = 3;
+const RESUME_DELAY_MS = 1000;
+
 type WebSocketResponse = {
   type:
     | "chunk"
@@ -20,7 +27,10 @@ type WebSocketResponse = {
     | "variantComplete"
     | "variantError"
     | "variantCount"
-    | "thinking";
+    | "thinking"
+    | "session"
+    | "variantCancelled"
+    | "generationComplete";
   value: string;
   variantIndex: number;
 };
@@ -31,6 +41,7 @@ interface CodeGenerationCallbacks {
   onStatusUpdate: (status: string, variantIndex: number) => void;
   onVariantComplete: (variantIndex: number) => void;
   onVariantError: (variantIndex: number, error: string) => void;
+  onVariantCancelled: (variantIndex: number, reason: string) => void;
   onVariantCount: (count: number) => void;
   onThinking: (content: string, variantIndex: number) => void;
   onCancel: () => void;
@@ -39,31 +50,85 @@ interface CodeGenerationCallbacks {
 
 export function generateCode(
   wsRef: React.MutableRefObject<WebSocket | null>,
+  uploadAbortRef: React.MutableRefObject<AbortController | null>,
   params: FullGenerationSettings,
   callbacks: CodeGenerationCallbacks
 ) {
   const wsUrl = `${WS_BACKEND_URL}/generate-code`;
-  console.log("Connecting to backend @ ", wsUrl);
 
-  const ws = new WebSocket(wsUrl);
-  wsRef.current = ws;
+  // Used to resume the generation if the connection drops mid-stream
+  let sessionId: string | null = null;
+  const receivedLengths: Record<number, number> = {};
+  let resumeAttempts = 0;
 
-  ws.addEventListener("open", () => {
-    ws.send(JSON.stringify(params));
-  });
+  function connect(payload: object) {
+    console.log("Connecting to backend @ ", wsUrl);
+
+    const ws = new WebSocket(wsUrl);
+    wsRef.current = ws;
+
+    ws.addEventListener("open", () => {
+      ws.send(JSON.stringify(payload));
+    });
+
+    ws.addEventListener("message", (event: MessageEvent) =>
+      handleMessage(event)
+    );
+
+    ws.addEventListener("close", (event) => {
+      if (
+        event.code === ABNORMAL_CLOSURE_CODE &&
+        sessionId &&
+        resumeAttempts < MAX_RESUME_ATTEMPTS
+      ) {
+        resumeAttempts += 1;
+        console.warn(
+          `Connection lost, resuming generation (attempt ${resumeAttempts})`
+        );
+        setTimeout(
+          () =>
+            connect({
+              resumeSessionId: sessionId,
+              resumeOffsets: receivedLengths,
+            }),
+          RESUME_DELAY_MS
+        );
+        return;
+      }
+      handleClose(event);
+    });
+
+    ws.addEventListener("error", (error) => {
+      console.error("WebSocket error", error);
+      if (!sessionId) {
+        toast.error(ERROR_MESSAGE);
+      }
+    });
+  }
 
-  ws.addEventListener("message", async (event: MessageEvent) => {
+  function handleMessage(event: MessageEvent) {
     const response = JSON.parse(event.data) as WebSocketResponse;
-    if (response.type === "chunk") {
+    if (response.type === "session") {
+      sessionId = response.value;
+    } else if (response.type === "chunk") {
+      receivedLengths[response.variantIndex] =
+        (receivedLengths[response.variantIndex] || 0) + response.value.length;
       callbacks.onChange(response.value, response.variantIndex);
     } else if (response.type === "status") {
       callbacks.onStatusUpdate(response.value, response.variantIndex);
     } else if (response.type === "setCode") {
+      // The code is replaced, and the server counts chunks again from here
+      receivedLengths[response.variantIndex] = 0;
       callbacks.onSetCode(response.value, response.variantIndex);
     } else if (response.type === "variantComplete") {
       callbacks.onVariantComplete(response.variantIndex);
     } else if (response.type === "variantError") {
       callbacks.onVariantError(response.variantIndex, response.value);
+    } else if (response.type === "variantCancelled") {
+      callbacks.onVariantCancelled(response.variantIndex, response.value);
+    } else if (response.type === "generationComplete") {
+      // Enough variants are done; the rest keep streaming until their deadline
+      callbacks.onComplete();
     } else if (response.type === "variantCount") {
       callbacks.onVariantCount(parseInt(response.value));
     } else if (response.type === "thinking") {
@@ -72,9 +137,9 @@ export function generateCode(
       console.error("Error generating code", response.value);
       toast.error(response.value);
     }
-  });
+  }
 
-  ws.addEventListener("close", (event) => {
+  function handleClose(event: CloseEvent) {
     console.log("Connection closed", event.code, event.reason);
     if (event.code === USER_CLOSE_WEB_SOCKET_CODE) {
       toast.success(CANCEL_MESSAGE);
@@ -89,10 +154,22 @@ export function generateCode(
     } else {
       callbacks.onComplete();
     }
-  });
+  }
 
-  ws.addEventListener("error", (error) => {
-    console.error("WebSocket error", error);
-    toast.error(ERROR_MESSAGE);
+  // Large screenshots and videos go through the upload endpoint rather than
+  // inline in the first WebSocket message. There's no socket to close yet,
+  // so cancelling during the upload aborts it through uploadAbortRef.
+  const uploadController = new AbortController();
+  uploadAbortRef.current = uploadController;
+  uploadGenerationMedia(params, uploadController.signal).then((payload) => {
+    if (uploadAbortRef.current === uploadController) {
+      uploadAbortRef.current = null;
+    }
+    if (uploadController.signal.aborted) {
+      toast.success(CANCEL_MESSAGE);
+      callbacks.onCancel();
+      return;
+    }
+    connect(payload);
   });
 }
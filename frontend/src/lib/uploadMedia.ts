@@ -0,0 +1,97 @@
+import { HTTP_BACKEND_URL } from "../config";
+import { FullGenerationSettings, PromptContent } from "../types";
+
+// Data URLs smaller than this are sent inline; larger ones are uploaded once
+// and referenced as "media:<id>" so the generation request stays small
+const UPLOAD_THRESHOLD_CHARS = 256 * 1024;
+
+// Keeps uploads across generations (e.g. update turns re-sending history)
+const uploadedRefs = new Map<string, Promise<string>>();
+
+async function uploadDataUrl(
+  dataUrl: string,
+  signal?: AbortSignal
+): Promise<string> {
+  const blob = await (await fetch(dataUrl, { signal })).blob();
+  const response = await fetch(`${HTTP_BACKEND_URL}/api/media`, {
+    method: "POST",
+    headers: { "Content-Type": "application/octet-stream" },
+    body: blob,
+    signal,
+  });
+  if (!response.ok) {
+    throw new Error(`Media upload failed: ${response.status}`);
+  }
+  const { ref } = (await response.json()) as { ref: string };
+  return ref;
+}
+
+// Whether the server still has uploaded media; it evicts the least recently
+// used uploads and loses them when the backend restarts
+async function isStored(ref: string, signal?: AbortSignal): Promise<boolean> {
+  const mediaId = ref.slice(ref.indexOf(":") + 1);
+  const response = await fetch(`${HTTP_BACKEND_URL}/api/media/${mediaId}`, {
+    method: "HEAD",
+    signal,
+  });
+  return response.ok;
+}
+
+async function toMediaRef(url: string, signal?: AbortSignal): Promise<string> {
+  if (!url.startsWith("data:") || url.length < UPLOAD_THRESHOLD_CHARS) {
+    return url;
+  }
+  const cached = uploadedRefs.get(url);
+  if (cached) {
+    const cachedRef = await cached.catch(() => null);
+    if (cachedRef && (await isStored(cachedRef, signal))) {
+      return cachedRef;
+    }
+    // Forgotten by the server: upload it again
+    if (uploadedRefs.get(url) === cached) {
+      uploadedRefs.delete(url);
+    }
+  }
+  let ref = uploadedRefs.get(url);
+  if (!ref) {
+    ref = uploadDataUrl(url, signal);
+    uploadedRefs.set(url, ref);
+    // Let a failed upload be retried next time
+    ref.catch(() => uploadedRefs.delete(url));
+  }
+  return ref;
+}
+
+async function uploadPromptMedia(
+  prompt: PromptContent,
+  signal?: AbortSignal
+): Promise<PromptContent> {
+  const images = await Promise.all(
+    prompt.images.map((url) => toMediaRef(url, signal))
+  );
+  return { ...prompt, images };
+}
+
+// Replace large screenshot and video data URLs in the generation params with
+// references to uploaded media. Falls back to the inline data URLs if the
+// upload fails. Aborting signal stops the uploads; callers should check it
+// before using the result.
+export async function uploadGenerationMedia(
+  params: FullGenerationSettings,
+  signal?: AbortSignal
+): Promise<FullGenerationSettings> {
+  try {
+    const [prompt, history] = await Promise.all([
+      uploadPromptMedia(params.prompt, signal),
+      params.history
+        ? Promise.all(
+            params.history.map((item) => uploadPromptMedia(item, signal))
+          )
+        : undefined,
+    ]);
+    return { ...params, prompt, history };
+  } catch (error) {
+    console.warn("Media upload failed, sending media inline", error);
+    return params;
+  }
+}
@@ -224,6 +224,8 @@ class App {
       codeGenerationModel: this.model,
       isTermOfServiceAccepted: true,
       accessCode: null,
+      firstK: null,
+      stragglerPolicy: null,
     };
 
     await this.page.evaluate((nextSetting) => {
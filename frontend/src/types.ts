@@ -17,8 +17,16 @@ export interface Settings {
   // Only relevant for hosted version
   isTermOfServiceAccepted: boolean;
   anthropicApiKey: string | null; // Added property for anthropic API key
+  // Complete the generation once this many variants are done (null waits
+  // for all of them)
+  firstK: number | null;
+  // What happens to the remaining variants then (null uses the backend's
+  // configured policy)
+  stragglerPolicy: StragglerPolicy | null;
 }
 
+export type StragglerPolicy = "cancel" | "deadline";
+
 export enum AppState {
   INITIAL = "INITIAL",
   CODING = "CODING",
@@ -33,7 +41,7 @@ export enum ScreenRecorderState {
 
 export interface PromptContent {
   text: string;
-  images: string[]; // Array of data URLs
+  images: string[]; // Array of data URLs or uploaded "media:<id>" references
 }
 
 export interface CodeGenerationParams {